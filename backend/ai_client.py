@@ -0,0 +1,500 @@
+import os
+import time
+import random
+import asyncio
+import logging
+import threading
+import email.utils
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import httpx
+import openai
+from openai import OpenAI, AsyncOpenAI
+import metrics
+import rate_limit
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# ==================== LỖI ====================
+
+class AIServiceError(Exception):
+    """Gọi OpenAI thất bại (sau khi đã retry nếu lỗi tạm thời)
+
+    reason: busy (vượt giới hạn đồng thời/rate limit cục bộ), rate_limited
+    (429 từ OpenAI), timeout, upstream (5xx/lỗi mạng) hoặc rejected (4xx
+    không retry được). status, message và retry_after dùng cho response trả
+    về trình duyệt.
+    """
+
+    MESSAGES = {
+        "busy": "AI service đang quá tải, vui lòng thử lại sau",
+        "rate_limited": "AI service đang quá tải, vui lòng thử lại sau",
+        "timeout": "AI service phản hồi quá chậm, vui lòng thử lại",
+        "upstream": "Lỗi kết nối đến AI service",
+        "rejected": "AI service từ chối yêu cầu"
+    }
+    STATUS = {"busy": 503, "rate_limited": 503, "timeout": 504, "upstream": 502, "rejected": 502}
+
+    def __init__(self, reason, detail="", retry_after=None):
+        super().__init__(f"{reason}: {detail}" if detail else reason)
+        self.reason = reason
+        self.status = self.STATUS[reason]
+        self.message = self.MESSAGES[reason]
+        self.retry_after = retry_after
+
+    def headers(self):
+        return {"Retry-After": str(max(1, round(self.retry_after)))} if self.retry_after else {}
+
+def retry_after_seconds(response):
+    """Đọc retry-after-ms / Retry-After (số giây hoặc HTTP-date) từ response, None nếu không có"""
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        value = headers.get("retry-after")
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+# ==================== CHÍNH SÁCH RETRY ====================
+
+class RetryPolicy:
+    """Thời gian chờ, số lần retry và hedging cho mỗi lượt gọi OpenAI
+
+    timeout: tối đa cho một lần gửi (cũng là thời gian chờ tối đa giữa hai
+    chunk khi stream). deadline: tổng thời gian của cả lượt gọi kể cả retry;
+    không retry nếu lần chờ tiếp theo vượt deadline. hedge_after > 0: lượt
+    gọi không stream chưa xong sau hedge_after giây thì gửi thêm một request
+    giống hệt và lấy kết quả về trước.
+    """
+
+    def __init__(self, max_retries=3, backoff_base=0.5, backoff_max=20.0, timeout=60.0, deadline=90.0,
+                 connect_timeout=5.0, hedge_after=0.0):
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.deadline = deadline
+        self.connect_timeout = connect_timeout
+        self.hedge_after = hedge_after
+
+    @classmethod
+    def from_env(cls):
+        """Tạo từ biến môi trường OPENAI_*"""
+        return cls(
+            max_retries=int(os.getenv("OPENAI_MAX_RETRIES", "3")),
+            backoff_base=float(os.getenv("OPENAI_BACKOFF_BASE_MS", "500")) / 1000,
+            backoff_max=float(os.getenv("OPENAI_BACKOFF_MAX", "20")),
+            timeout=float(os.getenv("OPENAI_TIMEOUT", "60")),
+            deadline=float(os.getenv("OPENAI_DEADLINE", "90")),
+            connect_timeout=float(os.getenv("OPENAI_CONNECT_TIMEOUT", "5")),
+            hedge_after=float(os.getenv("OPENAI_HEDGE_AFTER_MS", "0")) / 1000
+        )
+
+    def backoff(self, attempt):
+        """Exponential backoff với full jitter"""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def classify(self, error):
+        """(có retry được không, reason, retry_after) của một lỗi khi gọi OpenAI"""
+        if isinstance(error, AIServiceError):
+            return False, error.reason, error.retry_after
+        if isinstance(error, openai.RateLimitError):
+            if getattr(error, "code", None) == "insufficient_quota":
+                return False, "rejected", None
+            return True, "rate_limited", retry_after_seconds(error.response)
+        if isinstance(error, openai.APITimeoutError):
+            return True, "timeout", None
+        if isinstance(error, openai.APIConnectionError):
+            return True, "upstream", None
+        if isinstance(error, openai.APIStatusError):
+            if error.status_code in (408, 409) or error.status_code >= 500:
+                return True, "upstream", retry_after_seconds(error.response)
+            return False, "rejected", None
+        return False, "upstream", None
+
+def http_timeout(policy, seconds):
+    return httpx.Timeout(seconds, connect=min(policy.connect_timeout, seconds))
+
+def pool_limits(max_concurrency):
+    """Connection pool keep-alive: mặc định mỗi slot đồng thời có sẵn một connection"""
+    size = int(os.getenv("OPENAI_POOL_SIZE", str(max_concurrency)))
+    return httpx.Limits(max_connections=size, max_keepalive_connections=size,
+                        keepalive_expiry=float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", "30")))
+
+_shared_bucket = None
+_shared_bucket_lock = threading.Lock()
+
+def shared_bucket():
+    """Token bucket theo OPENAI_RPM (request/phút, 0 = không giới hạn), dùng chung trong tiến trình"""
+    global _shared_bucket
+    rpm = float(os.getenv("OPENAI_RPM", "0"))
+    if rpm <= 0:
+        return None
+    with _shared_bucket_lock:
+        if _shared_bucket is None:
+            burst = float(os.getenv("OPENAI_RPM_BURST", str(max(1.0, rpm / 10))))
+            _shared_bucket = rate_limit.TokenBucket(rpm / 60, burst)
+        return _shared_bucket
+
+# ==================== CLIENT ====================
+
+class _ResilientBase:
+    def __init__(self, client, policy, max_concurrency, bucket):
+        self.client = client
+        self.policy = policy
+        self.max_concurrency = max_concurrency
+        self.bucket = bucket
+        self._stats_lock = threading.Lock()
+        self._stats = {"calls": 0, "succeeded": 0, "failed": 0, "retries": 0, "hedged": 0, "hedge_won": 0,
+                       "busy": 0}
+
+    def _count(self, key, amount=1):
+        with self._stats_lock:
+            self._stats[key] += amount
+
+    def _succeeded(self):
+        self._count("succeeded")
+        metrics.OPENAI_CALLS.inc(outcome="ok")
+
+    def _retry_delay(self, error, attempt, deadline):
+        """Số giây chờ trước lần thử tiếp theo; raise AIServiceError nếu không retry nữa"""
+        retryable, reason, retry_after = self.policy.classify(error)
+        delay = retry_after if retry_after is not None else self.policy.backoff(attempt)
+        if retryable and attempt < self.policy.max_retries and time.monotonic() + delay < deadline:
+            self._count("retries")
+            metrics.OPENAI_RETRIES.inc(reason=reason)
+            logging.warning(f"Lỗi OpenAI ({reason}: {error}), thử lại lần {attempt + 1} sau {delay:.2f}s")
+            return delay
+        self._count("busy" if reason == "busy" else "failed")
+        metrics.OPENAI_CALLS.inc(outcome=reason)
+        if isinstance(error, AIServiceError):
+            raise error
+        raise AIServiceError(reason, str(error), retry_after or (delay if retryable else None)) from error
+
+    def _timeout(self, deadline):
+        seconds = min(self.policy.timeout, deadline - time.monotonic())
+        if seconds <= 0:
+            raise AIServiceError("timeout", f"quá deadline {self.policy.deadline}s")
+        return http_timeout(self.policy, seconds)
+
+    def _busy(self, detail):
+        return AIServiceError("busy", detail, retry_after=1)
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats.update(max_concurrency=self.max_concurrency, hedge_after=self.policy.hedge_after,
+                     deadline=self.policy.deadline, max_retries=self.policy.max_retries)
+        if self.bucket:
+            stats["rate_limit_tokens"] = round(self.bucket.available(), 2)
+        return stats
+
+class ResilientOpenAI(_ResilientBase):
+    """Bọc OpenAI client: pool keep-alive, deadline, retry theo Retry-After, giới hạn đồng thời và hedging
+
+    create(**kwargs) nhận đúng tham số của client.chat.completions.create
+    và raise AIServiceError khi thất bại. Mỗi request (kể cả hedge) giữ một
+    slot trong suốt thời gian chạy; với stream=True, slot được trả khi stream
+    được đọc hết hoặc close().
+    """
+
+    def __init__(self, client, policy=None, max_concurrency=32, bucket=None):
+        super().__init__(client, policy or RetryPolicy(), max_concurrency, bucket)
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._hedge_pool = None
+        self._hedge_pool_lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        policy = RetryPolicy.from_env()
+        max_concurrency = int(os.getenv("OPENAI_MAX_CONCURRENCY", "32"))
+        client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0,
+                        timeout=http_timeout(policy, policy.timeout),
+                        http_client=openai.DefaultHttpxClient(limits=pool_limits(max_concurrency)))
+        return cls(client, policy, max_concurrency, shared_bucket())
+
+    # ---------- slot ----------
+
+    def _acquire(self, deadline):
+        """Chờ token rate limit và một slot đồng thời, không quá deadline"""
+        remaining = max(0.0, deadline - time.monotonic())
+        if self.bucket:
+            delay = self.bucket.reserve(remaining)
+            if delay is None:
+                raise self._busy("vượt OPENAI_RPM")
+            time.sleep(delay)
+            remaining = max(0.0, remaining - delay)
+        if not self._slots.acquire(timeout=remaining):
+            raise self._busy(f"đủ {self.max_concurrency} request OpenAI đồng thời")
+        metrics.OPENAI_IN_FLIGHT.inc()
+
+    def _try_acquire(self):
+        """Lấy slot cho hedge nếu có ngay (không chờ)"""
+        if not self._slots.acquire(blocking=False):
+            return False
+        if self.bucket and not self.bucket.try_acquire():
+            self._slots.release()
+            return False
+        metrics.OPENAI_IN_FLIGHT.inc()
+        return True
+
+    def _release(self):
+        metrics.OPENAI_IN_FLIGHT.dec()
+        self._slots.release()
+
+    # ---------- gọi ----------
+
+    def create(self, **kwargs):
+        """Như client.chat.completions.create, có retry, deadline, giới hạn đồng thời và hedging"""
+        self._count("calls")
+        deadline = time.monotonic() + self.policy.deadline
+        attempt = 0
+        while True:
+            try:
+                if kwargs.get("stream"):
+                    result = self._stream(kwargs, deadline)
+                elif self.policy.hedge_after > 0:
+                    result = self._hedged(kwargs, deadline)
+                else:
+                    result = self._single(kwargs, deadline)
+                self._succeeded()
+                return result
+            except Exception as e:
+                time.sleep(self._retry_delay(e, attempt, deadline))
+                attempt += 1
+
+    def _single(self, kwargs, deadline, acquired=False):
+        if not acquired:
+            self._acquire(deadline)
+        try:
+            return self.client.chat.completions.create(timeout=self._timeout(deadline), **kwargs)
+        finally:
+            self._release()
+
+    def _stream(self, kwargs, deadline):
+        self._acquire(deadline)
+        try:
+            stream = self.client.chat.completions.create(timeout=self._timeout(deadline), **kwargs)
+        except BaseException:
+            self._release()
+            raise
+        return GuardedStream(stream, self._release)
+
+    def _hedged(self, kwargs, deadline):
+        """Gửi request; nếu sau hedge_after giây chưa xong thì gửi thêm bản thứ hai, lấy bản về trước
+
+        Request thua vẫn chạy nốt ở background (client đồng bộ không hủy được
+        giữa chừng) nhưng bị giới hạn bởi timeout và vẫn giữ slot tới khi xong.
+        """
+        pool = self._hedge_executor()
+        primary = pool.submit(self._single, kwargs, deadline)
+        done, _ = wait([primary], timeout=min(self.policy.hedge_after, max(0.0, deadline - time.monotonic())))
+        if done:
+            return primary.result()
+
+        futures = {primary: "primary"}
+        if self._try_acquire():
+            self._count("hedged")
+            metrics.OPENAI_HEDGES.inc(result="sent")
+            futures[pool.submit(self._single, kwargs, deadline, True)] = "hedge"
+
+        error = None
+        while futures:
+            done, _ = wait(list(futures), timeout=max(0.0, deadline - time.monotonic()),
+                           return_when=FIRST_COMPLETED)
+            if not done:
+                raise AIServiceError("timeout", f"quá deadline {self.policy.deadline}s")
+            for future in done:
+                kind = futures.pop(future)
+                if future.exception() is None:
+                    if kind == "hedge":
+                        self._count("hedge_won")
+                        metrics.OPENAI_HEDGES.inc(result="won")
+                    return future.result()
+                if kind == "primary" or error is None:
+                    error = future.exception()
+        raise error
+
+    def _hedge_executor(self):
+        with self._hedge_pool_lock:
+            if self._hedge_pool is None:
+                self._hedge_pool = ThreadPoolExecutor(max_workers=self.max_concurrency + 1,
+                                                      thread_name_prefix="openai-hedge")
+            return self._hedge_pool
+
+class AsyncResilientOpenAI(_ResilientBase):
+    """Phiên bản async của ResilientOpenAI cho chế độ ASGI (AsyncOpenAI)
+
+    Hedge thua bị hủy ngay (đóng request HTTP) thay vì chạy nốt.
+    """
+
+    def __init__(self, client, policy=None, max_concurrency=32, bucket=None):
+        super().__init__(client, policy or RetryPolicy(), max_concurrency, bucket)
+        self._slots = asyncio.Semaphore(max_concurrency)
+
+    @classmethod
+    def from_env(cls):
+        policy = RetryPolicy.from_env()
+        max_concurrency = int(os.getenv("OPENAI_MAX_CONCURRENCY", "32"))
+        client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), max_retries=0,
+                             timeout=http_timeout(policy, policy.timeout),
+                             http_client=openai.DefaultAsyncHttpxClient(limits=pool_limits(max_concurrency)))
+        return cls(client, policy, max_concurrency, shared_bucket())
+
+    # ---------- slot ----------
+
+    async def _acquire(self, deadline):
+        remaining = max(0.0, deadline - time.monotonic())
+        if self.bucket:
+            delay = self.bucket.reserve(remaining)
+            if delay is None:
+                raise self._busy("vượt OPENAI_RPM")
+            await asyncio.sleep(delay)
+            remaining = max(0.0, remaining - delay)
+        if self._slots.locked():
+            try:
+                await asyncio.wait_for(self._slots.acquire(), timeout=remaining or 0.001)
+            except asyncio.TimeoutError:
+                raise self._busy(f"đủ {self.max_concurrency} request OpenAI đồng thời") from None
+        else:
+            await self._slots.acquire()
+        metrics.OPENAI_IN_FLIGHT.inc()
+
+    async def _try_acquire(self):
+        if self._slots.locked() or (self.bucket and not self.bucket.try_acquire()):
+            return False
+        await self._slots.acquire()
+        metrics.OPENAI_IN_FLIGHT.inc()
+        return True
+
+    def _release(self):
+        metrics.OPENAI_IN_FLIGHT.dec()
+        self._slots.release()
+
+    # ---------- gọi ----------
+
+    async def create(self, **kwargs):
+        self._count("calls")
+        deadline = time.monotonic() + self.policy.deadline
+        attempt = 0
+        while True:
+            try:
+                if kwargs.get("stream"):
+                    result = await self._stream(kwargs, deadline)
+                elif self.policy.hedge_after > 0:
+                    result = await self._hedged(kwargs, deadline)
+                else:
+                    result = await self._single(kwargs, deadline)
+                self._succeeded()
+                return result
+            except Exception as e:
+                await asyncio.sleep(self._retry_delay(e, attempt, deadline))
+                attempt += 1
+
+    async def _single(self, kwargs, deadline, acquired=False):
+        if not acquired:
+            await self._acquire(deadline)
+        try:
+            return await self.client.chat.completions.create(timeout=self._timeout(deadline), **kwargs)
+        finally:
+            self._release()
+
+    async def _stream(self, kwargs, deadline):
+        await self._acquire(deadline)
+        try:
+            stream = await self.client.chat.completions.create(timeout=self._timeout(deadline), **kwargs)
+        except BaseException:
+            self._release()
+            raise
+        return AsyncGuardedStream(stream, self._release)
+
+    async def _hedged(self, kwargs, deadline):
+        primary = asyncio.ensure_future(self._single(kwargs, deadline))
+        tasks = {primary: "primary"}
+        try:
+            done, _ = await asyncio.wait({primary},
+                                         timeout=min(self.policy.hedge_after, max(0.0, deadline - time.monotonic())))
+            if not done and await self._try_acquire():
+                self._count("hedged")
+                metrics.OPENAI_HEDGES.inc(result="sent")
+                tasks[asyncio.ensure_future(self._single(kwargs, deadline, True))] = "hedge"
+
+            error = None
+            while tasks:
+                done, _ = await asyncio.wait(set(tasks), timeout=max(0.0, deadline - time.monotonic()),
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    raise AIServiceError("timeout", f"quá deadline {self.policy.deadline}s")
+                for task in done:
+                    kind = tasks.pop(task)
+                    if task.exception() is None:
+                        if kind == "hedge":
+                            self._count("hedge_won")
+                            metrics.OPENAI_HEDGES.inc(result="won")
+                        return task.result()
+                    if kind == "primary" or error is None:
+                        error = task.exception()
+            raise error
+        finally:
+            # Hủy request còn đang chạy (bên thua hoặc khi chính lượt gọi bị hủy)
+            for task in tasks:
+                task.cancel()
+
+# ==================== STREAM ====================
+
+class GuardedStream:
+    """Stream của OpenAI kèm slot đồng thời: trả slot khi đọc hết hoặc close() (idempotent)"""
+
+    def __init__(self, stream, release):
+        self._stream = stream
+        self._release = release
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def __iter__(self):
+        try:
+            for chunk in self._stream:
+                yield chunk
+        finally:
+            self.close()
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        try:
+            self._stream.close()
+        finally:
+            self._release()
+
+class AsyncGuardedStream:
+    """Phiên bản async của GuardedStream"""
+
+    def __init__(self, stream, release):
+        self._stream = stream
+        self._release = release
+        self._closed = False
+
+    async def __aiter__(self):
+        try:
+            async for chunk in self._stream:
+                yield chunk
+        finally:
+            await self.close()
+
+    async def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            await self._stream.close()
+        finally:
+            self._release()
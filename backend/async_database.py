@@ -0,0 +1,422 @@
+import os
+import logging
+from datetime import datetime
+import aiomysql
+import database
+import metrics
+from dotenv import load_dotenv
+
+load_dotenv()
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Connection pool bất đồng bộ, tương đương database.db_pool cho chế độ ASGI.
+# Pool được tạo trong event loop của server (xem async_main.py).
+db_pool = None
+
+timed_query = metrics.timed(metrics.DB_QUERY_SECONDS)
+
+async def init_pool():
+    """Khởi tạo aiomysql connection pool"""
+    global db_pool
+    try:
+        db_config = {
+            # minsize 0: không mở connection lúc khởi động, uvicorn bind port ngay
+            "minsize": 0,
+            "maxsize": int(os.getenv("ASYNC_DB_POOL_SIZE", "20")),
+            "host": os.getenv("DB_HOST", "localhost"),
+            "port": int(os.getenv("DB_PORT", "3306")),
+            "user": os.getenv("DB_USER", "root"),
+            "password": os.getenv("DB_PASSWORD", ""),
+            "db": os.getenv("DB_NAME", "codemate_db"),
+            "charset": "utf8mb4",
+            # Mỗi câu lệnh tự commit: connection trả về pool không còn transaction mở (aiomysql
+            # đóng connection đang trong transaction khi release) và không đọc snapshot cũ;
+            # các thao tác ghi nhiều câu lệnh tự mở transaction bằng conn.begin()
+            "autocommit": True
+        }
+
+        unix_socket = os.getenv("DB_SOCKET")
+        if unix_socket:
+            db_config["unix_socket"] = unix_socket
+
+        db_pool = await aiomysql.create_pool(**db_config)
+        logging.info("Khởi tạo aiomysql connection pool thành công.")
+    except aiomysql.Error as err:
+        logging.error(f"Lỗi khi khởi tạo aiomysql connection pool: {err}")
+        db_pool = None
+
+async def close_pool():
+    """Đóng connection pool khi server dừng"""
+    global db_pool
+    if db_pool:
+        db_pool.close()
+        await db_pool.wait_closed()
+        db_pool = None
+
+def get_pool():
+    """Lấy connection pool"""
+    if not db_pool:
+        raise Exception("Connection pool không khả dụng")
+    return db_pool
+
+# ==================== USER MANAGEMENT ====================
+
+@timed_query
+async def get_user_by_id(user_id):
+    """Lấy thông tin user theo ID (dùng chung database.user_cache)"""
+    user = database.user_cache.get(user_id)
+    if user is not None:
+        return dict(user)
+
+    try:
+        async with get_pool().acquire() as conn:
+            async with conn.cursor(aiomysql.DictCursor) as cursor:
+                query = """
+                    SELECT id, email, full_name, avatar_url, auth_provider, google_id, created_at, last_login
+                    FROM users WHERE id = %s
+                """
+                await cursor.execute(query, (user_id,))
+                user = await cursor.fetchone()
+                if user:
+                    database.user_cache.set(user_id, user)
+                    return dict(user)
+                return None
+    except aiomysql.Error as err:
+        logging.error(f"Lỗi lấy user: {err}")
+        return None
+
+# ==================== CONVERSATION MANAGEMENT ====================
+
+@timed_query
+async def create_conversation(user_id, title="Cuộc hội thoại mới"):
+    """Tạo cuộc hội thoại mới"""
+    try:
+        async with get_pool().acquire() as conn:
+            async with conn.cursor() as cursor:
+                query = "INSERT INTO conversations (user_id, title) VALUES (%s, %s)"
+                await cursor.execute(query, (user_id, title))
+                await conn.commit()
+
+                conversation_id = cursor.lastrowid
+                database.ownership_cache.set(conversation_id, user_id)
+                logging.info(f"Tạo conversation {conversation_id} cho user {user_id}")
+                return conversation_id
+    except aiomysql.Error as err:
+        logging.error(f"Lỗi tạo conversation: {err}")
+        return None
+
+@timed_query
+async def get_conversation_owner(conversation_id):
+    """user_id sở hữu conversation (dùng chung database.ownership_cache), None nếu không tồn tại"""
+    owner = database.ownership_cache.get(conversation_id)
+    if owner is not None:
+        return owner
+
+    try:
+        async with get_pool().acquire() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute("SELECT user_id FROM conversations WHERE id = %s", (conversation_id,))
+                row = await cursor.fetchone()
+                if not row:
+                    return None
+                database.ownership_cache.set(conversation_id, row[0])
+                return row[0]
+    except aiomysql.Error as err:
+        logging.error(f"Lỗi lấy chủ sở hữu conversation: {err}")
+        return None
+
+async def user_owns_conversation(conversation_id, user_id):
+    """Conversation có thuộc user không"""
+    return await get_conversation_owner(conversation_id) == user_id
+
+@timed_query
+async def get_user_conversations(user_id, before=None, limit=30):
+    """Lấy một trang conversations của user (xem database.get_user_conversations)"""
+    try:
+        async with get_pool().acquire() as conn:
+            async with conn.cursor(aiomysql.DictCursor) as cursor:
+                if before:
+                    updated_at, conversation_id = database.decode_cursor(before)
+                    query = """
+                        SELECT id, title, created_at, updated_at, first_message
+                        FROM conversations
+                        WHERE user_id = %s
+                          AND (updated_at < %s OR (updated_at = %s AND id < %s))
+                        ORDER BY updated_at DESC, id DESC
+                        LIMIT %s
+                    """
+                    await cursor.execute(query, (user_id, updated_at, updated_at, conversation_id, limit + 1))
+                else:
+                    query = """
+                        SELECT id, title, created_at, updated_at, first_message
+                        FROM conversations
+                        WHERE user_id = %s
+                        ORDER BY updated_at DESC, id DESC
+                        LIMIT %s
+                    """
+                    await cursor.execute(query, (user_id, limit + 1))
+                conversations = list(await cursor.fetchall())
+
+                has_more = len(conversations) > limit
+                logging.info(f"Lấy {min(len(conversations), limit)} conversations cho user {user_id}")
+                return conversations[:limit], has_more
+    except aiomysql.Error as err:
+        logging.error(f"Lỗi lấy conversations: {err}")
+        return [], False
+
+@timed_query
+async def get_conversations_version(user_id):
+    """Phiên bản danh sách conversations của user (xem database.get_conversations_version)"""
+    try:
+        async with get_pool().acquire() as conn:
+            async with conn.cursor() as cursor:
+                query = """
+                    SELECT COUNT(*), MAX(updated_at), COALESCE(MAX(id), 0)
+                    FROM conversations
+                    WHERE user_id = %s
+                """
+                await cursor.execute(query, (user_id,))
+                count, updated_at, max_id = await cursor.fetchone()
+                return {"count": count, "updated_at": updated_at, "max_id": max_id}
+    except aiomysql.Error as err:
+        logging.error(f"Lỗi lấy phiên bản conversations: {err}")
+        return None
+
+@timed_query
+async def get_conversations_since(user_id, since=None, limit=100):
+    """Các conversations có updated_at >= since (xem database.get_conversations_since)"""
+    try:
+        async with get_pool().acquire() as conn:
+            async with conn.cursor(aiomysql.DictCursor) as cursor:
+                query = """
+                    SELECT id, title, created_at, updated_at, first_message
+                    FROM conversations
+                    WHERE user_id = %s AND updated_at >= %s
+                    ORDER BY updated_at DESC, id DESC
+                    LIMIT %s
+                """
+                await cursor.execute(query, (user_id, since or datetime.min, limit + 1))
+                conversations = list(await cursor.fetchall())
+
+                has_more = len(conversations) > limit
+                return conversations[:limit], has_more
+    except aiomysql.Error as err:
+        logging.error(f"Lỗi lấy conversations thay đổi: {err}")
+        return [], False
+
+@timed_query
+async def get_conversation_messages(conversation_id):
+    """Lấy tất cả messages trong conversation"""
+    try:
+        async with get_pool().acquire() as conn:
+            async with conn.cursor(aiomysql.DictCursor) as cursor:
+                query = """
+                    SELECT id, role, content, created_at
+                    FROM messages
+                    WHERE conversation_id = %s
+                    ORDER BY created_at ASC
+                """
+                await cursor.execute(query, (conversation_id,))
+                messages = await cursor.fetchall()
+
+                logging.info(f"Lấy {len(messages)} messages từ conversation {conversation_id}")
+                return messages
+    except aiomysql.Error as err:
+        logging.error(f"Lỗi lấy messages: {err}")
+        return []
+
+@timed_query
+async def get_messages_page(conversation_id, before=None, limit=50):
+    """Lấy một trang messages cũ hơn cursor before (xem database.get_messages_page)"""
+    try:
+        async with get_pool().acquire() as conn:
+            async with conn.cursor(aiomysql.DictCursor) as cursor:
+                if before:
+                    created_at, message_id = database.decode_cursor(before)
+                    query = """
+                        SELECT id, role, content, created_at
+                        FROM messages
+                        WHERE conversation_id = %s
+                          AND (created_at < %s OR (created_at = %s AND id < %s))
+                        ORDER BY created_at DESC, id DESC
+                        LIMIT %s
+                    """
+                    await cursor.execute(query, (conversation_id, created_at, created_at, message_id, limit + 1))
+                else:
+                    query = """
+                        SELECT id, role, content, created_at
+                        FROM messages
+                        WHERE conversation_id = %s
+                        ORDER BY created_at DESC, id DESC
+                        LIMIT %s
+                    """
+                    await cursor.execute(query, (conversation_id, limit + 1))
+                messages = list(await cursor.fetchall())
+
+                has_more = len(messages) > limit
+                messages = messages[:limit]
+                messages.reverse()
+                return messages, has_more
+    except aiomysql.Error as err:
+        logging.error(f"Lỗi lấy trang messages: {err}")
+        return [], False
+
+@timed_query
+async def get_messages_version(conversation_id):
+    """Phiên bản messages của conversation: (count, max_id) (xem database.get_messages_version)"""
+    try:
+        async with get_pool().acquire() as conn:
+            async with conn.cursor() as cursor:
+                query = """
+                    SELECT COUNT(*), COALESCE(MAX(id), 0)
+                    FROM messages
+                    WHERE conversation_id = %s
+                """
+                await cursor.execute(query, (conversation_id,))
+                count, max_id = await cursor.fetchone()
+                return count, max_id
+    except aiomysql.Error as err:
+        logging.error(f"Lỗi lấy phiên bản messages: {err}")
+        return None
+
+@timed_query
+async def get_messages_since(conversation_id, after_id, limit=50):
+    """Các messages có id lớn hơn after_id theo thứ tự tăng dần, trả về (messages, has_more)"""
+    try:
+        async with get_pool().acquire() as conn:
+            async with conn.cursor(aiomysql.DictCursor) as cursor:
+                query = """
+                    SELECT id, role, content, created_at
+                    FROM messages
+                    WHERE conversation_id = %s AND id > %s
+                    ORDER BY id ASC
+                    LIMIT %s
+                """
+                await cursor.execute(query, (conversation_id, after_id, limit + 1))
+                messages = list(await cursor.fetchall())
+
+                has_more = len(messages) > limit
+                return messages[:limit], has_more
+    except aiomysql.Error as err:
+        logging.error(f"Lỗi lấy messages mới: {err}")
+        return [], False
+
+@timed_query
+async def get_messages_after(conversation_id, after_id=0):
+    """Lấy các messages có id lớn hơn after_id (dùng để nạp lịch sử tăng dần)"""
+    try:
+        async with get_pool().acquire() as conn:
+            async with conn.cursor(aiomysql.DictCursor) as cursor:
+                query = """
+                    SELECT id, role, content
+                    FROM messages
+                    WHERE conversation_id = %s AND id > %s
+                    ORDER BY id ASC
+                """
+                await cursor.execute(query, (conversation_id, after_id))
+                return await cursor.fetchall()
+    except aiomysql.Error as err:
+        logging.error(f"Lỗi lấy messages mới: {err}")
+        return []
+
+@timed_query
+async def get_conversation_summary(conversation_id):
+    """Lấy bản tóm tắt lịch sử (summary, last_message_id) của conversation, None nếu chưa có"""
+    try:
+        async with get_pool().acquire() as conn:
+            async with conn.cursor(aiomysql.DictCursor) as cursor:
+                query = "SELECT summary, last_message_id FROM conversation_summaries WHERE conversation_id = %s"
+                await cursor.execute(query, (conversation_id,))
+                return await cursor.fetchone()
+    except aiomysql.Error as err:
+        logging.error(f"Lỗi lấy tóm tắt conversation: {err}")
+        return None
+
+@timed_query
+async def save_conversation_summary(conversation_id, summary, last_message_id):
+    """Lưu bản tóm tắt các messages có id <= last_message_id"""
+    try:
+        async with get_pool().acquire() as conn:
+            async with conn.cursor() as cursor:
+                query = """
+                    INSERT INTO conversation_summaries (conversation_id, summary, last_message_id)
+                    VALUES (%s, %s, %s)
+                    ON DUPLICATE KEY UPDATE summary = VALUES(summary), last_message_id = VALUES(last_message_id)
+                """
+                await cursor.execute(query, (conversation_id, summary, last_message_id))
+                await conn.commit()
+                return True
+    except aiomysql.Error as err:
+        logging.error(f"Lỗi lưu tóm tắt conversation: {err}")
+        return False
+
+@timed_query
+async def save_message(conversation_id, role, content):
+    """Lưu message vào conversation"""
+    try:
+        async with get_pool().acquire() as conn:
+            await conn.begin()
+            async with conn.cursor() as cursor:
+                query = "INSERT INTO messages (conversation_id, role, content) VALUES (%s, %s, %s)"
+                await cursor.execute(query, (conversation_id, role, content))
+                message_id = cursor.lastrowid
+
+                # Cập nhật updated_at của conversation (và preview nếu đây là message đầu tiên của user)
+                if role == 'user':
+                    update_query = """
+                        UPDATE conversations
+                        SET updated_at = CURRENT_TIMESTAMP(6), first_message = COALESCE(first_message, %s)
+                        WHERE id = %s
+                    """
+                    await cursor.execute(update_query, (content[:database.PREVIEW_LENGTH], conversation_id))
+                else:
+                    update_query = "UPDATE conversations SET updated_at = CURRENT_TIMESTAMP(6) WHERE id = %s"
+                    await cursor.execute(update_query, (conversation_id,))
+                await conn.commit()
+
+                logging.info(f"Lưu message vào conversation {conversation_id}")
+                return message_id
+    except aiomysql.Error as err:
+        logging.error(f"Lỗi lưu message: {err}")
+        return None
+
+@timed_query
+async def save_turns(turns):
+    """Lưu các lượt chat trong một transaction (xem database.save_turns)"""
+    try:
+        async with get_pool().acquire() as conn:
+            try:
+                await conn.begin()
+                async with conn.cursor() as cursor:
+                    values = []
+                    previews = {}
+                    for conversation_id, user_input, ai_response in turns:
+                        values.extend((conversation_id, 'user', user_input,
+                                       conversation_id, 'assistant', ai_response))
+                        previews.setdefault(conversation_id, user_input[:database.PREVIEW_LENGTH])
+
+                    placeholders = ", ".join(["(%s, %s, %s)"] * (2 * len(turns)))
+                    await cursor.execute(
+                        f"INSERT INTO messages (conversation_id, role, content) VALUES {placeholders}", values)
+
+                    update_query = """
+                        UPDATE conversations
+                        SET updated_at = CURRENT_TIMESTAMP(6), first_message = COALESCE(first_message, %s)
+                        WHERE id = %s
+                    """
+                    await cursor.executemany(update_query, [(preview, conversation_id)
+                                                            for conversation_id, preview in previews.items()])
+                    await conn.commit()
+            except aiomysql.Error:
+                await conn.rollback()
+                raise
+
+            logging.info(f"Lưu {len(turns)} lượt chat vào {len(previews)} conversation")
+            return True
+    except aiomysql.Error as err:
+        logging.error(f"Lỗi lưu lượt chat: {err}")
+        return False
+
+async def save_turn(conversation_id, user_input, ai_response):
+    """Lưu câu hỏi và câu trả lời của một lượt chat trong một transaction"""
+    return await save_turns([(conversation_id, user_input, ai_response)])
@@ -0,0 +1,628 @@
+"""Chế độ phục vụ ASGI (asyncio) cho CodeMate.
+
+Các route chat và conversations được viết lại dạng async (Starlette +
+AsyncOpenAI + aiomysql) để các lời gọi OpenAI/MySQL chậm không giữ worker
+thread. Mọi route khác (auth, static files, ...) được chuyển tiếp nguyên vẹn
+sang Flask app trong nlp_main qua WsgiToAsgi.
+
+Chạy: SERVER_MODE=asgi python nlp_main.py
+hoặc: uvicorn async_main:application --host 0.0.0.0 --port 5000
+"""
+import os
+import time
+import asyncio
+import logging
+from contextlib import asynccontextmanager, nullcontext
+from functools import wraps
+import anyio
+from asgiref.wsgi import WsgiToAsgi
+from starlette.applications import Starlette
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.middleware import Middleware
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Match, Mount, Route
+import nlp_main
+import async_database
+import audio
+import transcription
+import metrics
+import ai_client
+import rate_limit
+import http_cache
+import single_flight
+
+# Async OpenAI Client
+try:
+    async_client = ai_client.AsyncResilientOpenAI.from_env()
+    logging.info("Khởi tạo AsyncOpenAI client thành công.")
+except Exception as e:
+    logging.error(f"Lỗi khi khởi tạo AsyncOpenAI client: {e}")
+    async_client = None
+
+# Cookie session do Flask ký, đọc lại bằng chính serializer của Flask
+session_serializer = nlp_main.app.session_interface.get_signing_serializer(nlp_main.app)
+
+def json_response(data, status_code=200, headers=None):
+    """Trả JSON với cùng định dạng như flask.jsonify (kể cả datetime)"""
+    return Response(nlp_main.app.json.dumps(data), status_code=status_code,
+                    media_type="application/json", headers=headers)
+
+def not_modified(request, etag):
+    """304 nếu If-None-Match khớp etag, ngược lại None (xem nlp_main.not_modified)"""
+    if etag and http_cache.etag_matches(request.headers.get('if-none-match'), etag):
+        return Response(status_code=304, headers=http_cache.cache_headers(etag))
+    return None
+
+def get_session(request):
+    """Giải mã cookie session của Flask"""
+    cookie = request.cookies.get(nlp_main.app.config["SESSION_COOKIE_NAME"])
+    if not cookie or not session_serializer:
+        return {}
+    try:
+        max_age = int(nlp_main.app.permanent_session_lifetime.total_seconds())
+        return session_serializer.loads(cookie, max_age=max_age)
+    except Exception:
+        return {}
+
+# ==================== MIDDLEWARE ====================
+
+def login_required(f=None, *, admit=None):
+    """Decorator để kiểm tra đăng nhập (phiên bản async, xem nlp_main.login_required)"""
+    if f is None:
+        return lambda f: login_required(f, admit=admit)
+    @wraps(f)
+    async def decorated_function(request):
+        request.state.session = get_session(request)
+        if 'user_id' not in request.state.session:
+            return json_response({"error": "Unauthorized", "message": "Vui lòng đăng nhập"}, 401)
+        if admit:
+            await admission_call("admit", request.state.session['user_id'], admit)
+        return await f(request)
+    return decorated_function
+
+async def handle_rate_limited(request, e):
+    logging.info(f"Từ chối request {request.url.path}: {e}")
+    return json_response({"error": "Bạn đã gửi quá nhiều yêu cầu, vui lòng thử lại sau", "budget": e.budget,
+                          "retry_after": e.retry_after}, 429, {"Retry-After": str(e.retry_after)})
+
+async def handle_stage_busy(request, e):
+    logging.warning(f"Từ chối request {request.url.path}: {e}")
+    return json_response({"error": "Hệ thống đang quá tải, vui lòng thử lại sau"}, 503,
+                         {"Retry-After": str(e.retry_after)})
+
+async def admission_call(method, *args):
+    """Gọi nlp_main.admission ngoài event loop (backend redis là I/O chặn); bỏ qua nếu tắt"""
+    if not nlp_main.admission:
+        return None
+    return await asyncio.to_thread(getattr(nlp_main.admission, method), *args)
+
+@asynccontextmanager
+async def admission_stage(name):
+    """Giữ một slot của bước nặng `name` (ném StageBusy nếu đã đủ)"""
+    lease = await admission_call("acquire", name)
+    try:
+        yield
+    finally:
+        with anyio.CancelScope(shield=True):
+            await admission_call("release", name, lease)
+
+async def charge_usage(user_id, usage):
+    if usage:
+        await admission_call("charge", user_id, "tokens", usage.total_tokens or 0)
+
+class RequestMetricsMiddleware:
+    """Gắn trace id cho mọi request và đo các route async
+
+    Request rơi xuống Flask (Mount) được Flask tự đo trong nlp_main; trace id
+    được ghi vào header của request để Flask dùng lại đúng id đó.
+    """
+
+    def __init__(self, app, routes):
+        self.app = app
+        self.routes = routes
+
+    def _route(self, scope):
+        for route in self.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return route.path if isinstance(route, Route) else None
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        route = self._route(scope)
+        trace = None
+        if metrics.TRACE_HEADER:
+            trace = metrics.start_trace(Headers(scope=scope).get(metrics.TRACE_HEADER))
+            header = metrics.TRACE_HEADER.lower().encode("latin-1")
+            scope = dict(scope, headers=[(k, v) for k, v in scope["headers"] if k != header] +
+                         [(header, trace[0].encode("latin-1"))])
+        status = 500
+
+        async def send_with_trace(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if trace:
+                    headers = MutableHeaders(scope=message)
+                    if metrics.TRACE_HEADER not in headers:
+                        headers.append(metrics.TRACE_HEADER, trace[0])
+            await send(message)
+
+        if route:
+            metrics.HTTP_IN_FLIGHT.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_trace)
+        finally:
+            if route:
+                metrics.HTTP_IN_FLIGHT.dec()
+                metrics.HTTP_REQUESTS.inc(method=scope["method"], route=route, status=status)
+                metrics.HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start, route=route)
+            if trace:
+                metrics.end_trace(trace[1])
+
+def closing_wsgi(wsgi_app):
+    """asgiref không gọi close() của iterable WSGI (PEP 3333): tự đóng khi lặp xong
+
+    Thiếu close(), các callback call_on_close của Flask (ghi số liệu request) không chạy.
+    """
+    def app(environ, start_response):
+        result = wsgi_app(environ, start_response)
+        try:
+            # Không dùng yield from: nó đã tự gọi close() khi generator bị đóng giữa chừng
+            for chunk in result:
+                yield chunk
+        finally:
+            if hasattr(result, "close"):
+                result.close()
+    return app
+
+def collect_async_pool_metrics():
+    """Gauge của aiomysql pool (chỉ có trong chế độ ASGI)"""
+    pool = async_database.db_pool
+    if pool is None:
+        return
+    metrics.DB_POOL_CONNECTIONS.set(pool.size, pool="aiomysql", state="open")
+    metrics.DB_POOL_CONNECTIONS.set(pool.freesize, pool="aiomysql", state="idle")
+    metrics.DB_POOL_CONNECTIONS.set(pool.size - pool.freesize, pool="aiomysql", state="checked_out")
+
+metrics.register_collector(collect_async_pool_metrics)
+
+async def require_conversation_owner(request, conversation_id):
+    """Trả về response 404 nếu conversation không thuộc user đang đăng nhập, ngược lại None"""
+    if not await async_database.user_owns_conversation(conversation_id, request.state.session.get('user_id')):
+        return json_response({"error": "Không tìm thấy conversation"}, 404)
+    return None
+
+# ==================== ROUTES - CONVERSATIONS ====================
+
+@login_required
+async def get_conversations(request):
+    """Lấy một trang conversations của user, hỗ trợ ?since= và ETag (xem nlp_main.get_conversations)"""
+    user_id = request.state.session.get('user_id')
+    token = request.query_params.get('since')
+    try:
+        before, limit = nlp_main.parse_page_args(request.query_params, nlp_main.CONVERSATION_PAGE_SIZE,
+                                                 nlp_main.CONVERSATION_PAGE_MAX)
+        since = http_cache.decode_sync_token(token) if token else None
+    except ValueError as e:
+        return json_response({"error": str(e)}, 400)
+
+    version = await async_database.get_conversations_version(user_id)
+    etag = None
+    if version:
+        etag = http_cache.make_etag(user_id, version["count"], version["updated_at"], version["max_id"],
+                                    before, limit, token)
+        response = not_modified(request, etag)
+        if response:
+            return response
+
+    page = None
+    if since and version:
+        changed, has_more = await async_database.get_conversations_since(user_id, since["updated_at"],
+                                                                         nlp_main.CONVERSATION_PAGE_MAX)
+        page = nlp_main.conversations_delta(since, version, changed, has_more)
+    if page is None:
+        conversations, has_more = await async_database.get_user_conversations(user_id, None if since else before,
+                                                                              limit)
+        page = nlp_main.conversations_page(conversations, has_more, version)
+        if since:
+            page["reset"] = True
+
+    payload, headers = http_cache.compress_body(nlp_main.dumps_compact(page), request.headers.get('accept-encoding'))
+    if etag:
+        headers.update(http_cache.cache_headers(etag))
+    return Response(payload, media_type="application/json", headers=headers)
+
+@login_required
+async def create_new_conversation(request):
+    """Tạo conversation mới"""
+    user_id = request.state.session.get('user_id')
+    data = await request.json()
+    title = data.get('title', 'Cuộc hội thoại mới')
+
+    conversation_id = await async_database.create_conversation(user_id, title)
+
+    if conversation_id:
+        return json_response({"conversation_id": conversation_id, "title": title}, 201)
+    else:
+        return json_response({"error": "Lỗi khi tạo conversation"}, 500)
+
+@login_required
+async def get_conversation(request):
+    """Lấy một trang messages của conversation (xem nlp_main.get_conversation)"""
+    conversation_id = request.path_params['conversation_id']
+    error = await require_conversation_owner(request, conversation_id)
+    if error:
+        return error
+
+    try:
+        before, limit = nlp_main.parse_page_args(request.query_params)
+        since = nlp_main.parse_since_id(request.query_params)
+    except ValueError as e:
+        return json_response({"error": str(e)}, 400)
+
+    version = await async_database.get_messages_version(conversation_id)
+    etag = http_cache.make_etag(conversation_id, *version, before, limit, since) if version else None
+    response = not_modified(request, etag)
+    if response:
+        return response
+
+    if since is not None:
+        messages, has_more = await async_database.get_messages_since(conversation_id, since, limit)
+    else:
+        messages, has_more = await async_database.get_messages_page(conversation_id, before, limit)
+    body, headers = http_cache.compress_stream(
+        nlp_main.iter_messages_page(messages, has_more, nlp_main.dumps_compact, delta=since is not None),
+        nlp_main.messages_size_hint(messages), request.headers.get('accept-encoding'))
+    if etag:
+        headers.update(http_cache.cache_headers(etag))
+    return StreamingResponse(body, media_type="application/json", headers=headers)
+
+# ==================== ROUTES - CHAT ====================
+
+async def extract_user_input(form, user_id):
+    """Lấy đầu vào của user từ form (phiên bản async của nlp_main.extract_user_input)"""
+    if 'audioFile' in form:
+        audio_file = form['audioFile']
+        if not audio_file.filename:
+            return None, json_response({"error": "Tệp không có tên"}, 400)
+        await admission_call("admit", user_id, nlp_main.AUDIO_COST)
+
+        # Đọc thẳng vào bộ nhớ (không ghi tệp tạm), có giới hạn kích thước
+        audio_bytes = bytearray()
+        with metrics.stage("upload"):
+            while chunk := await audio_file.read(audio.READ_CHUNK_SIZE):
+                audio_bytes.extend(chunk)
+                if len(audio_bytes) > audio.MAX_AUDIO_BYTES:
+                    return None, json_response({"error": f"Tệp âm thanh vượt quá {audio.MAX_AUDIO_BYTES // (1024 * 1024)} MB"}, 413)
+        logging.info(f"Đã nhận tệp âm thanh: {audio_file.filename} ({len(audio_bytes)} bytes)")
+
+        service = nlp_main.transcription_service
+        try:
+            # Chờ kết quả từ worker process mà không chặn event loop
+            with metrics.stage("transcription"):
+                async with admission_stage("transcription"):
+                    future = service.submit(bytes(audio_bytes))
+                    result = await asyncio.wait_for(asyncio.wrap_future(future), service.timeout)
+            user_input = result["text"]
+            await admission_call("charge", user_id, "audio_seconds", result["audio_duration"])
+            if result["route"] == transcription.ROUTE_EMPTY:
+                return None, json_response({"error": "Không phát hiện giọng nói trong tệp âm thanh"}, 400)
+            logging.info(f"Phiên mã thành công: '{user_input}'")
+        except transcription.TranscriptionQueueFull as e:
+            logging.warning(f"Từ chối phiên mã, hàng đợi đầy (Retry-After {e.retry_after}s)")
+            return None, json_response({"error": "Hệ thống đang bận xử lý âm thanh, vui lòng thử lại sau"}, 503,
+                                       {"Retry-After": str(e.retry_after)})
+        except audio.AudioTooLarge as e:
+            return None, json_response({"error": str(e)}, 413)
+        except rate_limit.StageBusy:
+            raise
+        except Exception as e:
+            logging.error(f"Lỗi khi phiên mã: {e}")
+            return None, json_response({"error": "Lỗi xử lý âm thanh"}, 500)
+
+    elif 'text' in form:
+        user_input = form['text']
+        logging.info(f"Đã nhận yêu cầu văn bản: '{user_input}'")
+    else:
+        return None, json_response({"error": "Yêu cầu phải chứa 'audioFile' hoặc 'text'"}, 400)
+
+    if not user_input:
+        return None, json_response({"error": "Đầu vào rỗng sau khi xử lý"}, 400)
+
+    return user_input, None
+
+def sse_response(events):
+    return StreamingResponse(events, media_type='text/event-stream', headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"
+    })
+
+def use_response_cache(request, form):
+    """Request có dùng response cache không (xem nlp_main.use_response_cache)"""
+    chat_cache = nlp_main.chat_cache
+    if not chat_cache:
+        return False
+    opted_out = form.get('no_cache') in ('1', 'true') or \
+        'no-cache' in request.headers.get('Cache-Control', '')
+    if opted_out:
+        chat_cache.record_bypass()
+    return not opted_out
+
+async def persist_turn(conversation_id, user_input, ai_response):
+    """Lưu một lượt chat (xem nlp_main.persist_turn)"""
+    turn_writer = nlp_main.turn_writer
+    with metrics.stage("save"):
+        if turn_writer and turn_writer.submit(conversation_id, user_input, ai_response):
+            return
+        await async_database.save_turn(conversation_id, user_input, ai_response)
+
+async def cache_get(user_input, context):
+    with metrics.stage("cache_lookup"):
+        return await asyncio.to_thread(nlp_main.chat_cache.get, user_input, nlp_main.SYSTEM_PROMPT, nlp_main.MODEL_NAME,
+                                   context)
+
+async def cache_set(user_input, ai_response, context):
+    await asyncio.to_thread(nlp_main.chat_cache.set, user_input, nlp_main.SYSTEM_PROMPT, nlp_main.MODEL_NAME,
+                            ai_response, context)
+
+@login_required(admit=nlp_main.CHAT_COST)
+async def handle_chat(request):
+    """Endpoint xử lý chat"""
+    form = await request.form()
+    conversation_id = form.get('conversation_id') or request.query_params.get('conversation_id')
+    if not conversation_id:
+        return json_response({"error": "conversation_id là bắt buộc"}, 400)
+
+    conversation_id = int(conversation_id)
+    error = await require_conversation_owner(request, conversation_id)
+    if error:
+        return error
+
+    user_id = request.state.session['user_id']
+    user_input, error = await extract_user_input(form, user_id)
+    if error:
+        return error
+
+    if not async_client:
+        return json_response({"error": "OpenAI client không khả dụng"}, 500)
+
+    with metrics.stage("context"):
+        messages = await nlp_main.context_builder.abuild(conversation_id, nlp_main.SYSTEM_PROMPT, user_input,
+                                                         async_client)
+    context = messages[1:-1]
+
+    use_cache = use_response_cache(request, form)
+    ai_response = await cache_get(user_input, context) if use_cache else None
+    cached = ai_response is not None
+
+    if not cached:
+        # Request trùng prompt đang gọi OpenAI thì chờ kết quả của nó thay vì gọi lại
+        flight, leader = await join_flight(messages)
+        try:
+            if leader:
+                logging.info(f"Gửi yêu cầu đến OpenAI ({len(messages)} messages)...")
+                with flight.leading() if flight else nullcontext():
+                    with metrics.stage("openai"):
+                        async with admission_stage("openai"):
+                            completion = await async_client.create(
+                                model=nlp_main.MODEL_NAME,
+                                messages=messages
+                            )
+                    metrics.record_usage(nlp_main.MODEL_NAME, completion.usage)
+                    await charge_usage(user_id, completion.usage)
+                    ai_response = completion.choices[0].message.content
+                    if flight:
+                        flight.publish(ai_response)
+                        flight.finish()
+            else:
+                logging.info("Chờ phản hồi của request trùng prompt đang gọi OpenAI...")
+                with metrics.stage("coalesced"):
+                    ai_response = await flight.aresult(nlp_main.coalescer.wait_timeout)
+        except ai_client.AIServiceError as e:
+            logging.error(f"Lỗi khi gọi OpenAI API: {e}")
+            return json_response({"error": e.message}, e.status, e.headers())
+
+        if use_cache and leader:
+            await cache_set(user_input, ai_response, context)
+
+    # Lưu messages vào database
+    await persist_turn(conversation_id, user_input, ai_response)
+
+    return json_response({
+        "user_input": user_input,
+        "ai_response": ai_response,
+        "cached": cached
+    })
+
+@login_required(admit=nlp_main.CHAT_COST)
+async def handle_chat_stream(request):
+    """Endpoint chat dạng streaming (Server-Sent Events)"""
+    form = await request.form()
+    conversation_id = form.get('conversation_id') or request.query_params.get('conversation_id')
+    if not conversation_id:
+        return json_response({"error": "conversation_id là bắt buộc"}, 400)
+
+    conversation_id = int(conversation_id)
+    error = await require_conversation_owner(request, conversation_id)
+    if error:
+        return error
+
+    user_id = request.state.session['user_id']
+    user_input, error = await extract_user_input(form, user_id)
+    if error:
+        return error
+
+    if not async_client:
+        return json_response({"error": "OpenAI client không khả dụng"}, 500)
+
+    with metrics.stage("context"):
+        messages = await nlp_main.context_builder.abuild(conversation_id, nlp_main.SYSTEM_PROMPT, user_input,
+                                                         async_client)
+    context = messages[1:-1]
+
+    use_cache = use_response_cache(request, form)
+    cached_response = await cache_get(user_input, context) if use_cache else None
+    if cached_response is not None:
+        await persist_turn(conversation_id, user_input, cached_response)
+        return sse_response(iter([
+            nlp_main.sse_event("user_input", {"user_input": user_input}),
+            nlp_main.sse_event("delta", {"content": cached_response}),
+            nlp_main.sse_event("done", {"ai_response": cached_response, "cached": True})
+        ]))
+
+    # Request trùng prompt đang stream từ OpenAI: nhận cùng luồng token thay vì gọi lại
+    flight, leader = await join_flight(messages)
+    if not leader:
+        logging.info(f"Nhận chung stream với request trùng prompt (conversation {conversation_id})")
+        return sse_response(follow_flight(flight, conversation_id, user_input, nlp_main.coalescer.wait_timeout))
+
+    # Slot OpenAI được giữ tới khi stream kết thúc (trả lại trong pump_stream)
+    try:
+        lease = await admission_call("acquire", "openai")
+    except BaseException as e:
+        if flight:
+            flight.fail(e)
+        raise
+    try:
+        logging.info(f"Gửi yêu cầu streaming đến OpenAI ({len(messages)} messages)...")
+        openai_start = time.perf_counter()
+        stream = await async_client.create(
+            model=nlp_main.MODEL_NAME,
+            messages=messages,
+            stream=True,
+            # Chunk cuối mang usage (choices rỗng) để đếm token
+            stream_options={"include_usage": True}
+        )
+    except BaseException as e:
+        # Mọi lỗi (kể cả CancelledError khi client ngắt kết nối) phải trả slot và báo cho các request
+        # đang chờ cùng flight, nếu không slot bị giữ vĩnh viễn và follower treo tới timeout
+        logging.error(f"Lỗi khi gọi OpenAI API: {e!r}")
+        if flight:
+            flight.fail(e)
+        await asyncio.shield(admission_call("release", "openai", lease))
+        if isinstance(e, ai_client.AIServiceError):
+            return json_response({"error": e.message}, e.status, e.headers())
+        raise
+
+    # Leader cũng đọc phản hồi qua flight (flight riêng nếu tắt gộp request)
+    flight = flight or single_flight.Flight()
+    flight.attach()
+    start_background(pump_stream(flight, stream, lease, openai_start, user_id,
+                                 (user_input, context) if use_cache else None))
+    return sse_response(follow_flight(flight, conversation_id, user_input))
+
+# ==================== SINGLE FLIGHT ====================
+
+# Giữ tham chiếu tới task nền để không bị thu gom khi đang chạy
+background_tasks = set()
+
+def start_background(coro):
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+async def join_flight(messages):
+    """(flight, leader) cho lời gọi OpenAI với messages; (None, True) nếu tắt gộp request"""
+    if not nlp_main.coalescer:
+        return None, True
+    return await nlp_main.coalescer.ajoin(single_flight.flight_key(nlp_main.MODEL_NAME, messages))
+
+async def pump_stream(flight, stream, lease, openai_start, user_id, cache_entry):
+    """Đọc stream OpenAI của leader vào flight trong một task riêng
+
+    Client của leader ngắt kết nối không làm dừng stream khi còn request trùng
+    prompt đang nhận chung; không còn ai nhận thì đóng stream để khỏi tốn token.
+    cache_entry: (user_input, context) để lưu response cache, None nếu không dùng.
+    """
+    try:
+        async for chunk in stream:
+            metrics.record_usage(nlp_main.MODEL_NAME, chunk.usage)
+            await charge_usage(user_id, chunk.usage)
+            if not flight.subscribers:
+                logging.info("Mọi client đã ngắt kết nối, dừng stream từ OpenAI")
+                break
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                if not flight.chunks:
+                    metrics.CHAT_STAGE_SECONDS.observe(time.perf_counter() - openai_start,
+                                                       stage="openai_first_token")
+                flight.publish(delta)
+        else:
+            flight.finish()
+            if cache_entry:
+                await cache_set(cache_entry[0], flight.text, cache_entry[1])
+    except Exception as e:
+        logging.error(f"Lỗi trong khi streaming từ OpenAI: {e}")
+        flight.fail(e)
+    finally:
+        with anyio.CancelScope(shield=True):
+            if not flight.done:
+                flight.fail(ai_client.AIServiceError("upstream", "stream của leader bị dừng"))
+            await stream.close()
+            await admission_call("release", "openai", lease)
+            metrics.CHAT_STAGE_SECONDS.observe(time.perf_counter() - openai_start, stage="openai")
+
+async def follow_flight(flight, conversation_id, user_input, timeout=None):
+    """SSE từ các đoạn phản hồi của flight (xem nlp_main.follow_flight); lưu lượt chat của request này"""
+    chunks = []
+    deltas = flight.afollow(timeout)
+    try:
+        yield nlp_main.sse_event("user_input", {"user_input": user_input})
+        async for delta in deltas:
+            chunks.append(delta)
+            yield nlp_main.sse_event("delta", {"content": delta})
+        yield nlp_main.sse_event("done", {"ai_response": "".join(chunks)})
+    except (GeneratorExit, asyncio.CancelledError):
+        logging.info(f"Client ngắt kết nối khỏi stream của conversation {conversation_id}")
+        raise
+    except Exception as e:
+        logging.error(f"Lỗi trong khi streaming từ OpenAI: {e}")
+        yield nlp_main.sse_event("error", {"error": getattr(e, "message", "Lỗi kết nối đến AI service")})
+    finally:
+        # Shield để việc lưu không bị hủy theo request khi client ngắt kết nối
+        with anyio.CancelScope(shield=True):
+            await deltas.aclose()
+            flight.detach()
+            ai_response = "".join(chunks)
+            if ai_response:
+                await persist_turn(conversation_id, user_input, ai_response)
+
+# ==================== APPLICATION ====================
+
+@asynccontextmanager
+async def lifespan(app):
+    await async_database.init_pool()
+    nlp_main.warmup.start()
+    yield
+    # Xả hàng đợi write-behind trước khi đóng pool
+    if nlp_main.turn_writer:
+        await asyncio.to_thread(nlp_main.turn_writer.close)
+    await async_database.close_pool()
+
+# Route async đứng trước; mọi request còn lại rơi xuống Flask app
+routes = [
+    Route('/api/conversations', get_conversations, methods=['GET']),
+    Route('/api/conversations', create_new_conversation, methods=['POST']),
+    Route('/api/conversations/{conversation_id:int}', get_conversation, methods=['GET']),
+    Route('/api/chat', handle_chat, methods=['POST']),
+    Route('/api/chat/stream', handle_chat_stream, methods=['POST']),
+    Mount('/', app=WsgiToAsgi(closing_wsgi(nlp_main.app))),
+]
+
+application = Starlette(routes=routes, lifespan=lifespan,
+                        middleware=[Middleware(RequestMetricsMiddleware, routes=routes)],
+                        exception_handlers={rate_limit.RateLimited: handle_rate_limited,
+                                            rate_limit.StageBusy: handle_stage_busy})
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(application, host="0.0.0.0", port=int(os.getenv("PORT", "5000")))
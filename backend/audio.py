@@ -0,0 +1,75 @@
+import io
+import os
+import logging
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+SAMPLE_RATE = 16000
+# Giới hạn cứng cho mỗi tệp âm thanh tải lên
+MAX_AUDIO_BYTES = int(os.getenv("AUDIO_MAX_BYTES", str(10 * 1024 * 1024)))
+MAX_AUDIO_SECONDS = float(os.getenv("AUDIO_MAX_SECONDS", "120"))
+
+READ_CHUNK_SIZE = 64 * 1024
+
+class AudioTooLarge(Exception):
+    """Tệp âm thanh vượt quá giới hạn kích thước hoặc thời lượng"""
+
+def read_upload(stream, max_bytes=MAX_AUDIO_BYTES):
+    """Đọc tệp tải lên vào bộ nhớ, dừng ngay khi vượt quá max_bytes"""
+    buffer = io.BytesIO()
+    while True:
+        chunk = stream.read(READ_CHUNK_SIZE)
+        if not chunk:
+            break
+        buffer.write(chunk)
+        if buffer.tell() > max_bytes:
+            raise AudioTooLarge(f"Tệp âm thanh vượt quá {max_bytes // (1024 * 1024)} MB")
+    return buffer.getvalue()
+
+def iter_pcm(source, max_seconds=MAX_AUDIO_SECONDS, allow_truncated=False, options=None):
+    """Giải mã dần file-like âm thanh, trả về từng mảng float32 mono 16 kHz
+
+    Thời lượng được kiểm tra từ header của container trước khi giải mã (nếu
+    có), và được kiểm tra lại trong lúc giải mã cho các định dạng không ghi
+    thời lượng (ví dụ webm của MediaRecorder).
+
+    allow_truncated=True dùng cho bản ghi đang dở (chưa nhận hết các chunk):
+    lỗi ở phần cuối bị cắt ngang được bỏ qua, trả về phần đã giải mã được.
+    options: tùy chọn của demuxer (ví dụ probesize nhỏ khi đọc một luồng đang ghi).
+    """
+    import av
+    import numpy as np
+
+    max_samples = int(max_seconds * SAMPLE_RATE)
+    resampler = av.audio.resampler.AudioResampler(format="s16", layout="mono", rate=SAMPLE_RATE)
+    total_samples = 0
+
+    def convert(frames):
+        nonlocal total_samples
+        for frame in frames:
+            samples = frame.to_ndarray().reshape(-1)
+            total_samples += len(samples)
+            if total_samples > max_samples:
+                raise AudioTooLarge(f"Âm thanh dài hơn {int(max_seconds)} giây")
+            yield samples.astype(np.float32) / 32768.0
+
+    with av.open(source, mode="r", metadata_errors="ignore", options=options or {}) as container:
+        if container.duration and container.duration / av.time_base > max_seconds:
+            raise AudioTooLarge(f"Âm thanh dài hơn {int(max_seconds)} giây")
+        try:
+            for frame in container.decode(audio=0):
+                yield from convert(resampler.resample(frame))
+        except av.error.FFmpegError:
+            if not allow_truncated:
+                raise
+        # Xả phần còn lại trong bộ đệm của resampler
+        yield from convert(resampler.resample(None))
+
+def decode_pcm(data, max_seconds=MAX_AUDIO_SECONDS, allow_truncated=False):
+    """Giải mã bytes âm thanh thành mảng float32 mono 16 kHz ngay trong bộ nhớ (xem iter_pcm)"""
+    import numpy as np
+
+    chunks = list(iter_pcm(io.BytesIO(data), max_seconds, allow_truncated))
+    if not chunks:
+        return np.zeros(0, dtype=np.float32)
+    return np.concatenate(chunks)
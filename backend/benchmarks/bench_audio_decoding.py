@@ -0,0 +1,68 @@
+"""Đo độ trễ tiết kiệm được khi giải mã âm thanh trong bộ nhớ.
+
+So sánh cho mỗi clip:
+  - temp-file: ghi bytes ra temp_audio/, giải mã lại từ đĩa (như Whisper đọc
+    tệp trước đây), rồi xóa tệp
+  - in-memory: audio.decode_pcm(bytes) trực tiếp
+
+Chạy từ thư mục backend/:
+    python benchmarks/bench_audio_decoding.py --clips-dir ./samples --iterations 20
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import audio
+from bench_utils import summarize
+from faster_whisper.audio import decode_audio
+
+def decode_via_temp_file(data, name):
+    temp_dir = "temp_audio"
+    os.makedirs(temp_dir, exist_ok=True)
+    temp_path = os.path.join(temp_dir, f"{int(time.time())}_{name}")
+    with open(temp_path, "wb") as f:
+        f.write(data)
+    try:
+        return decode_audio(temp_path, sampling_rate=audio.SAMPLE_RATE)
+    finally:
+        os.remove(temp_path)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clips-dir", required=True)
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--output", help="Ghi kết quả JSON ra file")
+    args = parser.parse_args()
+
+    clips = [(os.path.basename(p), open(p, "rb").read()) for p in sorted(glob.glob(os.path.join(args.clips_dir, "*")))]
+    if not clips:
+        parser.error(f"Không tìm thấy clip trong {args.clips_dir}")
+
+    timings = {"temp_file": [], "in_memory": []}
+    for _ in range(args.iterations):
+        for name, data in clips:
+            start = time.perf_counter()
+            decode_via_temp_file(data, name)
+            timings["temp_file"].append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            audio.decode_pcm(data)
+            timings["in_memory"].append(time.perf_counter() - start)
+
+    results = {mode: summarize(values) for mode, values in timings.items()}
+    saved = results["temp_file"]["p50_ms"] - results["in_memory"]["p50_ms"]
+    for mode, summary in results.items():
+        print(f"{mode:>10}: p50 {summary['p50_ms']} ms, p95 {summary['p95_ms']} ms")
+    print(f"Tiết kiệm (p50): {saved:.2f} ms mỗi request")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
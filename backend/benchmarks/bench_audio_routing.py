@@ -0,0 +1,149 @@
+"""Benchmark tiền xử lý âm thanh (VAD) và định tuyến mô hình: real-time factor so với word error rate.
+
+Mỗi clip trong --clips-dir cần một file transcript chuẩn cùng tên đuôi .txt
+(ví dụ lenh_01.webm + lenh_01.txt). Nên có cả lệnh ngắn (vài giây) lẫn
+đoạn nói dài có khoảng lặng, như khi người dùng ghi âm trên trình duyệt.
+
+Mỗi policy chạy trực tiếp hàm worker của transcription.py trong tiến trình
+hiện tại (như bench_whisper_batching.py) trên toàn bộ clip:
+
+  baseline          không VAD, mọi clip dùng mô hình chính, beam 5 (hành vi cũ)
+  vad               VAD bỏ khoảng lặng, mô hình chính, beam 5
+  vad-greedy-short  như vad, clip <= --short-seconds giây tiếng nói decode greedy
+  vad-small-short   như vad-greedy-short nhưng clip ngắn dùng --short-model
+  greedy-all        VAD, mọi clip decode greedy (cận dưới của thời gian xử lý)
+
+In RTF (thời gian xử lý / thời lượng âm thanh), WER tổng và theo clip
+ngắn/dài, độ trễ p50/p95 và số clip mỗi nhánh. Chạy từ thư mục backend/:
+    python benchmarks/bench_audio_routing.py --clips-dir ./samples/vi
+    python benchmarks/bench_audio_routing.py --clips-dir ./samples/vi --short-model ./models/whisper-small-vi-ct2
+"""
+import argparse
+import glob
+import json
+import os
+import re
+import sys
+import time
+import unicodedata
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import transcription
+from bench_utils import summarize
+
+AUDIO_EXTENSIONS = (".wav", ".mp3", ".m4a", ".ogg", ".webm", ".flac")
+
+def make_policies(args):
+    policies = {
+        "baseline": transcription.RoutingPolicy(vad=False, min_speech_seconds=0, short_seconds=0, beam_size=5),
+        "vad": transcription.RoutingPolicy(short_seconds=0, beam_size=5),
+        "vad-greedy-short": transcription.RoutingPolicy(short_seconds=args.short_seconds, short_beam_size=1),
+        "greedy-all": transcription.RoutingPolicy(short_seconds=float("inf"), short_beam_size=1)
+    }
+    if args.short_model:
+        policies["vad-small-short"] = transcription.RoutingPolicy(short_seconds=args.short_seconds,
+                                                                  short_model_path=args.short_model,
+                                                                  short_beam_size=1)
+    return policies
+
+def normalize_words(text):
+    """Chuẩn hóa để tính WER: Unicode NFC, chữ thường, bỏ dấu câu"""
+    text = unicodedata.normalize("NFC", text).lower()
+    return re.sub(r"[^\w\s]", " ", text).split()
+
+def edit_distance(reference, hypothesis):
+    """Khoảng cách Levenshtein theo từ"""
+    previous = list(range(len(hypothesis) + 1))
+    for i, ref_word in enumerate(reference, 1):
+        current = [i]
+        for j, hyp_word in enumerate(hypothesis, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ref_word != hyp_word)))
+        previous = current
+    return previous[-1]
+
+def wer(items):
+    words = sum(len(item["reference"]) for item in items)
+    errors = sum(edit_distance(item["reference"], normalize_words(item["text"])) for item in items)
+    return round(errors / words, 4) if words else 0.0
+
+def load_clips(clips_dir):
+    clips = []
+    for path in sorted(glob.glob(os.path.join(clips_dir, "*"))):
+        if not path.lower().endswith(AUDIO_EXTENSIONS):
+            continue
+        reference_path = os.path.splitext(path)[0] + ".txt"
+        if not os.path.exists(reference_path):
+            print(f"Bỏ qua {os.path.basename(path)}: thiếu {os.path.basename(reference_path)}")
+            continue
+        with open(path, "rb") as f, open(reference_path, encoding="utf-8") as ref:
+            clips.append({"name": os.path.basename(path), "data": f.read(),
+                          "reference": normalize_words(ref.read())})
+    return clips
+
+def run_policy(policy, clips, short_seconds):
+    transcription._worker_policy = policy
+    items = []
+    for clip in clips:
+        # Job nhận bytes của tệp như khi tải lên qua /api/chat
+        result = transcription._transcribe_job(clip["data"], time.time())
+        items.append({**result, "name": clip["name"], "reference": clip["reference"]})
+
+    audio_seconds = sum(item["audio_duration"] for item in items)
+    processing = sum(item["processing_time"] for item in items)
+    short = [item for item in items if item["audio_duration"] <= short_seconds]
+    long = [item for item in items if item["audio_duration"] > short_seconds]
+    return {
+        "rtf": round(processing / audio_seconds, 4) if audio_seconds else 0.0,
+        "wer": wer(items),
+        "wer_short": wer(short),
+        "wer_long": wer(long),
+        "latency": summarize([item["processing_time"] for item in items]),
+        "latency_short": summarize([item["processing_time"] for item in short]),
+        "speech_ratio": round(sum(item["speech_duration"] for item in items) / audio_seconds, 3) if audio_seconds else 0.0,
+        "routes": dict(Counter(item["route"] for item in items)),
+        "clips": [{"name": item["name"], "route": item["route"], "audio_duration": round(item["audio_duration"], 2),
+                   "processing_time": round(item["processing_time"], 3), "text": item["text"]} for item in items]
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clips-dir", required=True, help="Thư mục clip tiếng Việt kèm transcript .txt")
+    parser.add_argument("--policies", help="Danh sách policy cần chạy (mặc định: tất cả)")
+    parser.add_argument("--short-seconds", type=float, default=8.0, help="Ngưỡng clip ngắn (giây tiếng nói)")
+    parser.add_argument("--model", default=transcription.MODEL_PATH)
+    parser.add_argument("--short-model", help="Mô hình nhỏ hơn (CTranslate2) cho policy vad-small-short")
+    parser.add_argument("--cpu-threads", type=int, default=0)
+    parser.add_argument("--output", help="Ghi kết quả JSON ra file")
+    args = parser.parse_args()
+
+    clips = load_clips(args.clips_dir)
+    if not clips:
+        parser.error(f"Không tìm thấy clip âm thanh kèm transcript trong {args.clips_dir}")
+
+    policies = make_policies(args)
+    selected = args.policies.split(",") if args.policies else list(policies)
+    # Tải mô hình một lần (kèm mô hình nhỏ nếu có); policy chỉ đổi cách chọn mô hình/beam
+    transcription._init_worker(args.model, args.cpu_threads, 1,
+                               transcription.RoutingPolicy(short_model_path=args.short_model))
+    if transcription._worker_model is None:
+        sys.exit("Không tải được mô hình Whisper")
+    # Khởi động (warm-up) cả hai nhánh để loại thời gian khởi tạo lần đầu khỏi kết quả
+    for policy in (policies["vad"], policies.get("vad-small-short", policies["vad-greedy-short"])):
+        run_policy(policy, clips[:1], args.short_seconds)
+
+    results = {}
+    for name in selected:
+        results[name] = run_policy(policies[name], clips, args.short_seconds)
+        result = results[name]
+        print(f"{name:<17} RTF {result['rtf']:>7}  WER {result['wer']:>6} (ngắn {result['wer_short']:>6}, "
+              f"dài {result['wer_long']:>6})  p50 {result['latency']['p50_ms']:>8} ms  "
+              f"p95 {result['latency']['p95_ms']:>8} ms  tiếng nói {result['speech_ratio']:>5}  {result['routes']}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+"""Benchmark truy vấn danh sách conversations ở sidebar trên MySQL thật.
+
+Tạo một user tạm với N conversations (mỗi conversation vài messages), rồi so sánh:
+  - legacy: truy vấn cũ, subquery tương quan lấy message đầu tiên cho mỗi
+    dòng và trả về toàn bộ danh sách
+  - page: database.get_user_conversations (preview lưu sẵn + covering index),
+    trang đầu và một trang ở giữa danh sách (keyset cursor)
+
+Cần schema mới (database.sql hoặc migrations/001_conversation_preview.sql) và
+các biến DB_* như khi chạy server. Chạy từ thư mục backend/:
+    python benchmarks/bench_conversation_list.py --conversations 10000 --rounds 20
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+from bench_utils import summarize
+
+LEGACY_QUERY = """
+    SELECT c.id, c.title, c.created_at, c.updated_at,
+           (SELECT content FROM messages
+            WHERE conversation_id = c.id AND role = 'user'
+            ORDER BY created_at ASC LIMIT 1) as first_message
+    FROM conversations c
+    WHERE c.user_id = %s
+    ORDER BY c.updated_at DESC
+"""
+
+PAGE_QUERY = """
+    SELECT id, title, created_at, updated_at, first_message
+    FROM conversations
+    WHERE user_id = %s
+    ORDER BY updated_at DESC, id DESC
+    LIMIT %s
+"""
+
+def seed(conversations, messages_per_conversation, batch_size=1000):
+    """Tạo user tạm và dữ liệu mẫu; trả về user_id"""
+    conn = database.get_connection()
+    cursor = conn.cursor()
+    try:
+        email = f"bench-{int(time.time())}@codemate.local"
+        cursor.execute("INSERT INTO users (email, full_name) VALUES (%s, %s)", (email, "Benchmark"))
+        user_id = cursor.lastrowid
+
+        now = int(time.time())
+        for start in range(0, conversations, batch_size):
+            count = min(batch_size, conversations - start)
+            rows = []
+            for i in range(start, start + count):
+                first = f"Câu hỏi đầu tiên của cuộc hội thoại {i}: làm sao tối ưu truy vấn MySQL?"
+                updated = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(now - (conversations - i) * 60))
+                rows.append((user_id, f"Hội thoại {i}", first[:database.PREVIEW_LENGTH], updated, updated))
+            cursor.executemany(
+                "INSERT INTO conversations (user_id, title, first_message, created_at, updated_at) "
+                "VALUES (%s, %s, %s, %s, %s)", rows)
+            first_id = cursor.lastrowid
+
+            messages = []
+            for offset, row in enumerate(rows):
+                for m in range(messages_per_conversation):
+                    role = "user" if m % 2 == 0 else "assistant"
+                    content = row[2] if m == 0 else f"Nội dung message {m} " + "x" * 500
+                    messages.append((first_id + offset, role, content))
+            cursor.executemany("INSERT INTO messages (conversation_id, role, content) VALUES (%s, %s, %s)",
+                               messages)
+            conn.commit()
+            print(f"  đã tạo {start + count}/{conversations} conversations", end="\r")
+        print()
+        return user_id
+    finally:
+        cursor.close()
+        conn.close()
+
+def cleanup(user_id):
+    conn = database.get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("DELETE FROM users WHERE id = %s", (user_id,))
+        conn.commit()
+    finally:
+        cursor.close()
+        conn.close()
+
+def explain(query, params):
+    conn = database.get_connection()
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.execute("EXPLAIN " + query, params)
+        return [(row["table"], row["key"], row["rows"], row["Extra"]) for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+        conn.close()
+
+def time_legacy(user_id):
+    conn = database.get_connection()
+    cursor = conn.cursor(dictionary=True)
+    try:
+        start = time.perf_counter()
+        cursor.execute(LEGACY_QUERY, (user_id,))
+        rows = cursor.fetchall()
+        return time.perf_counter() - start, len(rows)
+    finally:
+        cursor.close()
+        conn.close()
+
+def time_page(user_id, before, limit):
+    start = time.perf_counter()
+    rows, _ = database.get_user_conversations(user_id, before, limit)
+    return time.perf_counter() - start, len(rows)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--conversations", type=int, default=10000)
+    parser.add_argument("--messages", type=int, default=4, help="Số messages mỗi conversation")
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--limit", type=int, default=30, help="Kích thước trang")
+    parser.add_argument("--user-id", type=int, help="Dùng user đã seed sẵn thay vì tạo mới")
+    parser.add_argument("--keep", action="store_true", help="Không xóa dữ liệu mẫu sau khi chạy")
+    parser.add_argument("--output", help="Ghi kết quả JSON ra file")
+    args = parser.parse_args()
+
+    user_id = args.user_id
+    if not user_id:
+        print(f"Seed {args.conversations} conversations x {args.messages} messages...")
+        user_id = seed(args.conversations, args.messages)
+
+    try:
+        # Cursor của trang ở giữa danh sách để đo chi phí trang sâu
+        rows, _ = database.get_user_conversations(user_id, None, args.conversations // 2)
+        middle_cursor = database.encode_cursor(rows[-1], "updated_at") if rows else None
+
+        cases = {
+            "legacy_full_list": lambda: time_legacy(user_id),
+            "page_first": lambda: time_page(user_id, None, args.limit),
+            "page_middle": lambda: time_page(user_id, middle_cursor, args.limit)
+        }
+        results = {}
+        for name, run in cases.items():
+            run()  # warm-up (buffer pool)
+            latencies = []
+            for _ in range(args.rounds):
+                elapsed, count = run()
+                latencies.append(elapsed)
+            results[name] = {**summarize(latencies), "rows": count}
+            print(f"{name:<18} rows {count:>6}  p50 {results[name]['p50_ms']:>9} ms  "
+                  f"p95 {results[name]['p95_ms']:>9} ms")
+
+        results["explain"] = {
+            "legacy": explain(LEGACY_QUERY, (user_id,)),
+            "page": explain(PAGE_QUERY, (user_id, args.limit + 1))
+        }
+        for name, plan in results["explain"].items():
+            print(f"EXPLAIN {name}: {plan}")
+
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(results, f, indent=2, default=str)
+    finally:
+        if not args.user_id and not args.keep:
+            cleanup(user_id)
+
+if __name__ == "__main__":
+    main()
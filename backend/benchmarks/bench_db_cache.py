@@ -0,0 +1,144 @@
+"""Benchmark cache đọc xuyên của database.py (thông tin user và quyền sở hữu conversation).
+
+Đo get_user_by_id (mỗi lần tải trang gọi /api/auth/me) và
+user_owns_conversation (mọi route conversation/chat) với từng backend:
+  - off: luôn truy vấn MySQL
+  - memory: cache.TTLCache trong tiến trình
+  - redis: cache.RedisCache; Redis thật theo REDIS_URL, hoặc --fake-redis để
+    dùng stand-in trong bộ nhớ (không cần server Redis)
+
+Với backend redis, script còn kiểm tra invalidation giữa hai worker dùng
+chung một Redis: worker A cập nhật user Google / xóa conversation, worker B
+không được đọc lại dữ liệu cũ.
+
+Cần MySQL với schema hiện tại và các biến DB_*. Chạy từ thư mục backend/:
+    python benchmarks/bench_db_cache.py --lookups 2000 --fake-redis
+"""
+import argparse
+import fnmatch
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cache
+import database
+from bench_utils import summarize
+
+class FakeRedis:
+    """Stand-in tối thiểu cho redis.Redis (get/set với ex/delete/scan_iter) trong bộ nhớ"""
+
+    def __init__(self):
+        self.data = {}
+
+    def _alive(self, key):
+        item = self.data.get(key)
+        if item and item[1] is not None and item[1] < time.monotonic():
+            del self.data[key]
+            return None
+        return item
+
+    def get(self, key):
+        item = self._alive(key)
+        return item[0] if item else None
+
+    def set(self, key, value, ex=None):
+        self.data[key] = (value, time.monotonic() + ex if ex else None)
+        return True
+
+    def delete(self, *keys):
+        return sum(1 for key in keys if self.data.pop(key, None) is not None)
+
+    def scan_iter(self, match="*"):
+        return [key for key in list(self.data) if fnmatch.fnmatch(key, match)]
+
+def make_caches(backend, client, ttl):
+    if backend == "off":
+        return cache.NullCache(), cache.NullCache()
+    if backend == "memory":
+        return cache.TTLCache(10000, ttl), cache.TTLCache(100000, ttl)
+    return (cache.RedisCache(client, "codemate:user", ttl),
+            cache.RedisCache(client, "codemate:conversation-owner", ttl))
+
+def measure(fn, lookups):
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(lookups):
+        t = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - t)
+    return summarize(latencies, time.perf_counter() - start)
+
+def check_invalidation(client, ttl, user, conversation_id):
+    """Worker A (module database) ghi, worker B (cache riêng, cùng Redis) đọc"""
+    problems = []
+    worker_b_users, worker_b_owners = make_caches("redis", client, ttl)
+
+    database.get_user_by_id(user["id"])
+    database.user_owns_conversation(conversation_id, user["id"])
+    if worker_b_users.get(user["id"]) is None or worker_b_owners.get(conversation_id) is None:
+        problems.append("worker B không thấy dữ liệu worker A đã cache")
+
+    database.get_or_create_google_user(user["google_id"], user["email"], "Tên mới", None)
+    if worker_b_users.get(user["id"]) is not None:
+        problems.append("worker B vẫn đọc được user cũ sau khi cập nhật")
+
+    database.delete_conversation(conversation_id, user["id"])
+    if worker_b_owners.get(conversation_id) is not None:
+        problems.append("worker B vẫn thấy quyền sở hữu của conversation đã xóa")
+    return problems
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--lookups", type=int, default=2000)
+    parser.add_argument("--backends", default="off,memory,redis")
+    parser.add_argument("--fake-redis", action="store_true", help="Dùng Redis stand-in trong bộ nhớ")
+    parser.add_argument("--output", help="Ghi kết quả JSON ra file")
+    args = parser.parse_args()
+
+    client = FakeRedis() if args.fake_redis else None
+    google_id = f"bench-{int(time.time())}"
+    user = database.get_or_create_google_user(google_id, f"{google_id}@codemate.local", "Benchmark", None)
+    if not user:
+        sys.exit("Không tạo được user mẫu (kiểm tra kết nối MySQL)")
+    conversation_id = database.create_conversation(user["id"], "Benchmark cache")
+
+    results = {}
+    failed = False
+    try:
+        for backend in args.backends.split(","):
+            if backend == "redis" and client is None:
+                client = cache.get_redis_client()
+            database.user_cache, database.ownership_cache = make_caches(backend, client, database.DB_CACHE_TTL)
+            results[backend] = {
+                "get_user_by_id": measure(lambda: database.get_user_by_id(user["id"]), args.lookups),
+                "user_owns_conversation": measure(
+                    lambda: database.user_owns_conversation(conversation_id, user["id"]), args.lookups)
+            }
+            for name, summary in results[backend].items():
+                print(f"{backend:<7} {name:<23} p50 {summary['p50_ms']:>8} ms  p95 {summary['p95_ms']:>8} ms  "
+                      f"{summary['throughput_rps']:>10} lookups/s")
+
+        if "redis" in results:
+            database.user_cache, database.ownership_cache = make_caches("redis", client, database.DB_CACHE_TTL)
+            problems = check_invalidation(client, database.DB_CACHE_TTL, user, conversation_id)
+            results["invalidation_problems"] = problems
+            print("Invalidation giữa các worker:", "OK" if not problems else problems)
+            failed = bool(problems)
+
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(results, f, indent=2)
+    finally:
+        conn = database.get_connection()
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM users WHERE id = %s", (user["id"],))
+        conn.commit()
+        cursor.close()
+        conn.close()
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""Kiểm tra đồng thời cho connection_pool.ConnectionPool.
+
+Nhiều thread cùng mượn connection, giữ một lúc (giả lập truy vấn) rồi trả
+lại. Mặc định dùng connection giả lập trong bộ nhớ (không cần MySQL) có độ
+trễ khi mở connection, và một phần connection "chết" khi rảnh để đi qua nhánh
+ping/reconnect; --mysql dùng MySQL thật theo các biến DB_* (truy vấn SELECT SLEEP).
+
+Chạy hai cấu hình để so sánh:
+  - fail-fast: size cố định, không overflow, không chờ (giống MySQLConnectionPool cũ)
+  - pool: DB_POOL_* hoặc tham số dòng lệnh (chờ có giới hạn + overflow)
+
+Sau mỗi lần chạy, script kiểm tra các bất biến (không vượt quá size + overflow
+connection đang mở, không rò connection, số timeout khớp với số lỗi) và trả
+về exit code 1 nếu có vi phạm.
+
+Chạy từ thư mục backend/:
+    python benchmarks/bench_db_pool.py --threads 50 --iterations 20 --hold-ms 20
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import connection_pool
+from bench_utils import summarize
+
+class FakeConnection:
+    """Connection giả lập: đếm số connection đang mở, có thể "chết" khi rảnh"""
+
+    lock = threading.Lock()
+    live = 0
+    peak = 0
+
+    def __init__(self, connect_ms, dead_ratio):
+        time.sleep(connect_ms / 1000)
+        self.dead_ratio = dead_ratio
+        self.closed = False
+        self.in_transaction = False
+        with FakeConnection.lock:
+            FakeConnection.live += 1
+            FakeConnection.peak = max(FakeConnection.peak, FakeConnection.live)
+
+    def query(self, hold_ms):
+        self.in_transaction = True
+        time.sleep(hold_ms / 1000)
+
+    def ping(self, reconnect=False):
+        if random.random() < self.dead_ratio:
+            raise ConnectionError("Lost connection")
+
+    def rollback(self):
+        self.in_transaction = False
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            with FakeConnection.lock:
+                FakeConnection.live -= 1
+
+    @classmethod
+    def reset(cls):
+        cls.live = 0
+        cls.peak = 0
+
+def make_pool(args, size, max_overflow, timeout):
+    if args.mysql:
+        import mysql.connector
+        import database
+        return connection_pool.ConnectionPool(lambda: mysql.connector.connect(**database.db_config),
+                                              size=size, max_overflow=max_overflow, timeout=timeout,
+                                              ping_after=args.ping_after)
+    FakeConnection.reset()
+    return connection_pool.ConnectionPool(lambda: FakeConnection(args.connect_ms, args.dead_ratio),
+                                          size=size, max_overflow=max_overflow, timeout=timeout,
+                                          ping_after=args.ping_after)
+
+def run_query(conn, args):
+    if args.mysql:
+        cursor = conn.cursor()
+        cursor.execute("SELECT SLEEP(%s)", (args.hold_ms / 1000,))
+        cursor.fetchall()
+        cursor.close()
+    else:
+        conn.query(args.hold_ms)
+
+def run(args, size, max_overflow, timeout):
+    pool = make_pool(args, size, max_overflow, timeout)
+    latencies = []
+    errors = {"timeouts": 0, "other": 0}
+    lock = threading.Lock()
+    barrier = threading.Barrier(args.threads)
+
+    def worker():
+        barrier.wait()
+        for _ in range(args.iterations):
+            start = time.perf_counter()
+            try:
+                conn = pool.get_connection()
+            except connection_pool.PoolTimeout:
+                with lock:
+                    errors["timeouts"] += 1
+                continue
+            except Exception:
+                with lock:
+                    errors["other"] += 1
+                continue
+            try:
+                run_query(conn, args)
+            finally:
+                conn.close()
+            with lock:
+                latencies.append(time.perf_counter() - start)
+            time.sleep(random.uniform(0, args.think_ms / 1000))
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(args.threads)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    stats = pool.stats()
+    violations = []
+    if stats["checked_out"] != 0:
+        violations.append(f"còn {stats['checked_out']} connection chưa trả")
+    if stats["open"] != stats["idle"] or stats["idle"] > size:
+        violations.append(f"open={stats['open']} idle={stats['idle']} không khớp")
+    if stats["timeouts"] != errors["timeouts"]:
+        violations.append(f"timeouts của pool ({stats['timeouts']}) khác số lỗi ({errors['timeouts']})")
+    if len(latencies) + errors["timeouts"] + errors["other"] != args.threads * args.iterations:
+        violations.append("số request hoàn thành không khớp")
+    if not args.mysql:
+        if FakeConnection.peak > size + max_overflow:
+            violations.append(f"mở tới {FakeConnection.peak} connection (> {size + max_overflow})")
+        if FakeConnection.live != stats["open"]:
+            violations.append(f"{FakeConnection.live} connection thật đang mở, pool ghi nhận {stats['open']}")
+    pool.close()
+
+    return {
+        "config": {"size": size, "max_overflow": max_overflow, "timeout": timeout},
+        "latency": summarize(latencies, elapsed),
+        "errors": errors,
+        "pool": stats,
+        "peak_open": FakeConnection.peak if not args.mysql else None,
+        "violations": violations
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, default=50)
+    parser.add_argument("--iterations", type=int, default=20, help="Số lần mượn connection mỗi thread")
+    parser.add_argument("--hold-ms", type=float, default=20, help="Thời gian giữ connection (truy vấn)")
+    parser.add_argument("--think-ms", type=float, default=10, help="Nghỉ ngẫu nhiên giữa hai request")
+    parser.add_argument("--connect-ms", type=float, default=5, help="Độ trễ mở connection giả lập")
+    parser.add_argument("--dead-ratio", type=float, default=0.05, help="Tỉ lệ connection giả lập chết khi rảnh")
+    parser.add_argument("--size", type=int, default=int(os.getenv("DB_POOL_SIZE", "5")))
+    parser.add_argument("--max-overflow", type=int, default=int(os.getenv("DB_POOL_MAX_OVERFLOW", "5")))
+    parser.add_argument("--timeout", type=float, default=float(os.getenv("DB_POOL_TIMEOUT", "10")))
+    parser.add_argument("--ping-after", type=float, default=0.0,
+                        help="Ping connection đã rảnh quá bao nhiêu giây (0 = mọi lần, để đi qua nhánh reconnect)")
+    parser.add_argument("--mysql", action="store_true", help="Dùng MySQL thật theo DB_* thay vì giả lập")
+    parser.add_argument("--output", help="Ghi kết quả JSON ra file")
+    args = parser.parse_args()
+
+    results = {
+        "fail-fast": run(args, args.size, 0, 0),
+        "pool": run(args, args.size, args.max_overflow, args.timeout)
+    }
+    failed = False
+    for name, result in results.items():
+        latency = result["latency"]
+        print(f"{name:<10} ok {latency['count']:>5}  timeouts {result['errors']['timeouts']:>5}  "
+              f"p50 {latency['p50_ms']:>8} ms  p95 {latency['p95_ms']:>8} ms  "
+              f"peak open {result['peak_open']}  reconnects {result['pool']['reconnects']}")
+        print(f"           wait histogram {result['pool']['wait_histogram']}")
+        for violation in result["violations"]:
+            failed = True
+            print(f"           VI PHẠM: {violation}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
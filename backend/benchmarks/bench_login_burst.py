@@ -0,0 +1,155 @@
+"""Đo ảnh hưởng của một đợt đăng nhập đồng thời lên endpoint chat.
+
+Mỗi cấu hình được khởi chạy trong tiến trình con (WSGI, trỏ tới mock OpenAI):
+  - inline: PASSWORD_HASH_WORKERS=0, bcrypt chạy trên thread của waitress
+  - pool: bcrypt chạy trong process pool (PASSWORD_HASH_WORKERS=--hash-workers)
+
+Trước tiên đo latency /api/chat khi server rảnh, sau đó bắn --logins lần
+đăng nhập (--login-concurrency luồng) trong khi các luồng chat vẫn chạy, và
+báo cáo số đăng nhập/giây cùng latency chat trong đợt đăng nhập.
+
+Yêu cầu: MySQL đã khởi tạo theo database.sql (cấu hình qua .env như khi chạy app).
+
+Chạy từ thư mục backend/:
+    python benchmarks/bench_login_burst.py --logins 100 --login-concurrency 20 --rounds 12
+"""
+import argparse
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import mock_openai
+from bench_utils import AppSession, start_app, stop_app, summarize
+
+PASSWORD = "bench-password"
+
+def chat_loop(base_url, cookie_jar, conversation_id, stop, latencies, lock):
+    """Gửi chat liên tục tới khi stop được set"""
+    session = AppSession(base_url, cookie_jar)
+    i = 0
+    while not stop.is_set():
+        start = time.perf_counter()
+        status, _, _ = session.request("POST", "/api/chat", data={
+            "text": f"Câu hỏi benchmark số {i}",
+            "conversation_id": conversation_id,
+            "no_cache": "1"
+        })
+        if status == 200:
+            with lock:
+                latencies.append(time.perf_counter() - start)
+        i += 1
+
+def measure_chat(base_url, cookie_jar, conversation_ids, seconds, action=None):
+    """Chạy các luồng chat trong `seconds` giây (hoặc tới khi action() xong)"""
+    latencies = []
+    lock = threading.Lock()
+    stop = threading.Event()
+    threads = [threading.Thread(target=chat_loop, args=(base_url, cookie_jar, cid, stop, latencies, lock))
+               for cid in conversation_ids]
+    for t in threads:
+        t.start()
+    result = None
+    try:
+        if action:
+            result = action()
+        else:
+            time.sleep(seconds)
+    finally:
+        stop.set()
+        for t in threads:
+            t.join()
+    return summarize(latencies), result
+
+def run_config(name, hash_workers, args, emails):
+    proc = start_app(args.port, {
+        "SERVER_MODE": "wsgi",
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{args.mock_port}/v1",
+        "OPENAI_API_KEY": "sk-benchmark",
+        "RESPONSE_CACHE_BACKEND": "off",
+        "BCRYPT_ROUNDS": str(args.rounds),
+        "PASSWORD_HASH_WORKERS": str(hash_workers)
+    })
+    try:
+        base_url = f"http://127.0.0.1:{args.port}"
+        admin = AppSession(base_url)
+        admin.login("bench-login-burst@codemate.ai", PASSWORD)
+        conversation_ids = [admin.create_conversation() for _ in range(args.chat_concurrency)]
+
+        # Tài khoản cho đợt đăng nhập; đăng ký không nằm trong phần đo
+        for email in emails:
+            AppSession(base_url).request("POST", "/api/auth/register",
+                                         json_body={"email": email, "password": PASSWORD})
+
+        baseline, _ = measure_chat(base_url, admin.cookie_jar, conversation_ids, args.baseline_seconds)
+
+        login_latencies = []
+        errors = 0
+        lock = threading.Lock()
+
+        def login(email):
+            nonlocal errors
+            start = time.perf_counter()
+            status, _, _ = AppSession(base_url).request("POST", "/api/auth/login",
+                                                        json_body={"email": email, "password": PASSWORD})
+            with lock:
+                if status == 200:
+                    login_latencies.append(time.perf_counter() - start)
+                else:
+                    errors += 1
+
+        def burst():
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=args.login_concurrency) as pool:
+                list(pool.map(login, (emails[i % len(emails)] for i in range(args.logins))))
+            return time.perf_counter() - start
+
+        during, elapsed = measure_chat(base_url, admin.cookie_jar, conversation_ids, 0, burst)
+        return {
+            "config": name,
+            "hash_workers": hash_workers,
+            "login": {**summarize(login_latencies, elapsed), "errors": errors},
+            "chat_idle": baseline,
+            "chat_during_burst": during
+        }
+    finally:
+        stop_app(proc)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--logins", type=int, default=100)
+    parser.add_argument("--login-concurrency", type=int, default=20)
+    parser.add_argument("--users", type=int, default=20, help="Số tài khoản dùng cho đợt đăng nhập")
+    parser.add_argument("--rounds", type=int, default=12, help="BCRYPT_ROUNDS của server")
+    parser.add_argument("--hash-workers", type=int, default=2)
+    parser.add_argument("--chat-concurrency", type=int, default=4)
+    parser.add_argument("--baseline-seconds", type=float, default=5)
+    parser.add_argument("--latency", type=float, default=0.2, help="Độ trễ của mock OpenAI (giây)")
+    parser.add_argument("--port", type=int, default=5055)
+    parser.add_argument("--mock-port", type=int, default=8055)
+    parser.add_argument("--output", help="Ghi kết quả JSON ra file")
+    args = parser.parse_args()
+
+    run_id = int(time.time())
+    emails = [f"bench-login-{run_id}-{i}@codemate.ai" for i in range(args.users)]
+    mock = mock_openai.start_in_background(port=args.mock_port, latency=args.latency)
+    try:
+        results = [run_config("inline", 0, args, emails),
+                   run_config("pool", args.hash_workers, args, emails)]
+    finally:
+        mock.shutdown()
+
+    for result in results:
+        login = result["login"]
+        idle = result["chat_idle"]
+        during = result["chat_during_burst"]
+        print(f"[{result['config']}] login: {login.get('throughput_rps', 0)} req/s, p99 {login['p99_ms']} ms, "
+              f"lỗi {login['errors']} | chat p50 {idle['p50_ms']} -> {during['p50_ms']} ms, "
+              f"p99 {idle['p99_ms']} -> {during['p99_ms']} ms")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+"""Kiểm tra ai_client (retry, Retry-After, deadline, giới hạn đồng thời, hedging) với mock OpenAI tiêm lỗi.
+
+Mỗi kịch bản khởi động mock_openai với một kiểu lỗi, gọi trực tiếp
+ResilientOpenAI / AsyncResilientOpenAI (không cần MySQL hay server) với
+--calls lượt gọi ở độ đồng thời --concurrency, rồi so kết quả với kỳ vọng:
+
+  baseline          không lỗi: mọi lượt gọi thành công, không retry
+  errors-no-retry   20% 503 + 5% ngắt kết nối, tắt retry: ~25% thất bại
+  errors-retry      cùng tỉ lệ lỗi, bật retry: gần như không thất bại
+  rate-limit        30% trả 429 Retry-After 0.5s: thành công, p95 >= 0.5s
+  slow-tail         5% request chậm 2s, không hedging: p99 ~ 2s
+  slow-tail-hedge   như trên, hedge sau 200 ms: p99 < 1s
+  async-hedge       như trên với AsyncResilientOpenAI
+  deadline          mọi request chậm 5s, deadline 1s: thất bại (timeout) trong ~1s
+  concurrency       giới hạn 4 request đồng thời: mock không bao giờ thấy quá 4
+  stream-retry      30% 503 khi mở stream: vẫn đọc đủ token
+
+In bảng kết quả, ghi JSON (--output) và trả exit code 1 nếu có kỳ vọng
+không đạt. Chạy từ thư mục backend/:
+    python benchmarks/bench_openai_resilience.py
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from openai import OpenAI, AsyncOpenAI
+
+import ai_client
+import mock_openai
+from bench_utils import summarize
+
+MESSAGES = [{"role": "user", "content": "Xin chào"}]
+
+SCENARIOS = {
+    "baseline": {
+        "mock": {},
+        "policy": {},
+        "expect": lambda r: r["failed"] == 0 and r["client"]["retries"] == 0
+    },
+    "errors-no-retry": {
+        "mock": {"error_rate": 0.2, "drop_rate": 0.05},
+        "policy": {"max_retries": 0},
+        "expect": lambda r: 0.1 < r["failed"] / r["calls"] < 0.4
+    },
+    "errors-retry": {
+        "mock": {"error_rate": 0.2, "drop_rate": 0.05},
+        "policy": {"max_retries": 4, "backoff_base": 0.05},
+        "expect": lambda r: r["failed"] / r["calls"] <= 0.01 and r["client"]["retries"] > 0
+    },
+    "rate-limit": {
+        "mock": {"rate_limit_rate": 0.3, "retry_after": 0.5},
+        "policy": {"max_retries": 4},
+        "expect": lambda r: r["failed"] / r["calls"] <= 0.01 and r["latency"]["p95_ms"] >= 500
+    },
+    "slow-tail": {
+        "mock": {"slow_rate": 0.05, "slow_latency": 2.0},
+        "policy": {},
+        "expect": lambda r: r["failed"] == 0 and r["latency"]["p99_ms"] >= 1900
+    },
+    "slow-tail-hedge": {
+        "mock": {"slow_rate": 0.05, "slow_latency": 2.0},
+        "policy": {"hedge_after": 0.2},
+        "expect": lambda r: r["failed"] == 0 and r["latency"]["p99_ms"] < 1000 and r["client"]["hedge_won"] > 0
+    },
+    "async-hedge": {
+        "mock": {"slow_rate": 0.05, "slow_latency": 2.0},
+        "policy": {"hedge_after": 0.2},
+        "async": True,
+        "expect": lambda r: r["failed"] == 0 and r["latency"]["p99_ms"] < 1000 and r["client"]["hedge_won"] > 0
+    },
+    "deadline": {
+        "mock": {"slow_rate": 1.0, "slow_latency": 5.0},
+        "policy": {"timeout": 0.5, "deadline": 1.0, "backoff_base": 0.05},
+        "calls": 8,
+        "expect": lambda r: r["reasons"] == {"timeout": r["calls"]} and r["latency"]["max_ms"] < 1500
+    },
+    "concurrency": {
+        "mock": {"latency": 0.2},
+        "policy": {"deadline": 30},
+        "max_concurrency": 4,
+        "expect": lambda r: r["failed"] == 0 and r["mock"].get("max_in_flight", 0) <= 4
+    },
+    "stream-retry": {
+        "mock": {"error_rate": 0.3},
+        "policy": {"max_retries": 5, "backoff_base": 0.05},
+        "stream": True,
+        "expect": lambda r: r["failed"] / r["calls"] <= 0.01 and r["client"]["retries"] > 0
+    }
+}
+
+def make_client(scenario, base_url):
+    policy = ai_client.RetryPolicy(**{"timeout": 10, "deadline": 20, **scenario["policy"]})
+    max_concurrency = scenario.get("max_concurrency", 64)
+    if scenario.get("async"):
+        client = AsyncOpenAI(api_key="sk-benchmark", base_url=base_url, max_retries=0)
+        return ai_client.AsyncResilientOpenAI(client, policy, max_concurrency)
+    client = OpenAI(api_key="sk-benchmark", base_url=base_url, max_retries=0)
+    return ai_client.ResilientOpenAI(client, policy, max_concurrency)
+
+def call_sync(wrapper, stream):
+    start = time.perf_counter()
+    try:
+        if stream:
+            chunks = sum(1 for chunk in wrapper.create(model="gpt-4o", messages=MESSAGES, stream=True)
+                         if chunk.choices and chunk.choices[0].delta.content)
+            if chunks == 0:
+                return time.perf_counter() - start, "empty_stream"
+        else:
+            wrapper.create(model="gpt-4o", messages=MESSAGES)
+        return time.perf_counter() - start, None
+    except ai_client.AIServiceError as e:
+        return time.perf_counter() - start, e.reason
+
+async def call_async(wrapper):
+    start = time.perf_counter()
+    try:
+        await wrapper.create(model="gpt-4o", messages=MESSAGES)
+        return time.perf_counter() - start, None
+    except ai_client.AIServiceError as e:
+        return time.perf_counter() - start, e.reason
+
+def run_scenario(name, scenario, args):
+    mock_options = {"latency": args.latency, "tokens": 10, "token_interval": 0.001, "seed": args.seed,
+                    **scenario["mock"]}
+    mock = mock_openai.start_in_background(port=args.mock_port, **mock_options)
+    calls = scenario.get("calls", args.calls)
+    try:
+        wrapper = make_client(scenario, f"http://127.0.0.1:{args.mock_port}/v1")
+        start = time.perf_counter()
+        if scenario.get("async"):
+            async def run_all():
+                semaphore = asyncio.Semaphore(args.concurrency)
+
+                async def one():
+                    async with semaphore:
+                        return await call_async(wrapper)
+                return await asyncio.gather(*(one() for _ in range(calls)))
+            outcomes = asyncio.run(run_all())
+        else:
+            with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+                outcomes = list(pool.map(lambda _: call_sync(wrapper, scenario.get("stream")), range(calls)))
+        elapsed = time.perf_counter() - start
+        mock_stats = mock_openai.request_stats(mock)
+    finally:
+        mock.shutdown()
+        mock.server_close()
+
+    reasons = Counter(reason for _, reason in outcomes if reason)
+    result = {
+        "scenario": name,
+        "calls": calls,
+        "failed": sum(reasons.values()),
+        "reasons": dict(reasons),
+        "latency": summarize([latency for latency, _ in outcomes], elapsed),
+        "client": wrapper.stats(),
+        "mock": mock_stats
+    }
+    result["passed"] = bool(scenario["expect"](result))
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--calls", type=int, default=200, help="Số lượt gọi mỗi kịch bản")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--latency", type=float, default=0.05, help="Độ trễ bình thường của mock (giây)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--mock-port", type=int, default=8056)
+    parser.add_argument("--output", help="Ghi kết quả JSON ra file")
+    args = parser.parse_args()
+
+    results = []
+    for name in args.scenarios.split(","):
+        result = run_scenario(name.strip(), SCENARIOS[name.strip()], args)
+        results.append(result)
+        latency = result["latency"]
+        print(f"{'PASS' if result['passed'] else 'FAIL'} {result['scenario']:<16} "
+              f"lỗi {result['failed']:>3}/{result['calls']:<4} p50 {latency['p50_ms']:>8} ms  "
+              f"p99 {latency['p99_ms']:>8} ms  retry {result['client']['retries']:>3}  "
+              f"hedge {result['client']['hedged']}/{result['client']['hedge_won']}  {result['reasons'] or ''}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if not all(result["passed"] for result in results):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
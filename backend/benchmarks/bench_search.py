@@ -0,0 +1,125 @@
+"""Benchmark tìm kiếm lịch sử chat (/api/search) trên dữ liệu đã seed.
+
+Dùng manifest của seed_data.py (1M messages: --users 100 --conversations 500
+--messages 20) và đo đúng đường đi của route: tách từ, truy vấn FULLTEXT
+(database.search_messages) và dựng snippet, cho từng nhóm câu tìm kiếm:
+  - rare: một mã lỗi ERRxxxxx (khớp rất ít messages)
+  - topic: tên một công nghệ (khớp vài phần trăm messages)
+  - common: cụm từ có trong hầu hết câu trả lời (trường hợp xấu nhất)
+  - multi: nhiều từ cùng lúc
+  - deep: trang thứ 5 của truy vấn topic (offset)
+Mỗi lần đo chọn ngẫu nhiên một user trong manifest; in p50/p95/p99, số kết
+quả trung bình và EXPLAIN của truy vấn.
+
+Cần schema có ft_messages_content (database.sql hoặc
+migrations/002_message_search.sql). Chạy từ thư mục backend/:
+    python benchmarks/seed_data.py --users 100 --conversations 500 --messages 20
+    python benchmarks/bench_search.py --rounds 200
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+import search
+from bench_utils import summarize
+from seed_data import TOPICS
+
+def run_search(user_id, query, limit, offset=0):
+    """Giống route /api/search, trả về (thời gian, số kết quả; None nếu lỗi/quá SEARCH_TIMEOUT_MS)"""
+    start = time.perf_counter()
+    words = search.terms(query)
+    messages, _ = database.search_messages(user_id, search.boolean_query(words), limit, offset)
+    if messages is None:
+        return time.perf_counter() - start, None
+    for message in messages:
+        search.snippet(message["content"], words)
+    return time.perf_counter() - start, len(messages)
+
+def rare_code(user_id):
+    """Một mã lỗi có thật trong dữ liệu của user"""
+    conn = database.get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            SELECT m.content FROM messages m JOIN conversations c ON c.id = m.conversation_id
+            WHERE c.user_id = %s AND m.role = 'user' AND m.content LIKE '%%ERR%%' LIMIT 1
+        """, (user_id,))
+        row = cursor.fetchone()
+        return row[0].split("ERR", 1)[1][:5] if row else "00000"
+    finally:
+        cursor.close()
+        conn.close()
+
+def explain(user_id, query, limit):
+    conn = database.get_connection()
+    cursor = conn.cursor(dictionary=True)
+    try:
+        match_query = search.boolean_query(search.terms(query))
+        cursor.execute("""
+            EXPLAIN SELECT m.id, MATCH(m.content) AGAINST (%s IN BOOLEAN MODE) AS score
+            FROM messages m JOIN conversations c ON c.id = m.conversation_id
+            WHERE MATCH(m.content) AGAINST (%s IN BOOLEAN MODE) AND c.user_id = %s
+            ORDER BY score DESC, m.id DESC LIMIT %s
+        """, (match_query, match_query, user_id, limit + 1))
+        return [(row["table"], row["type"], row["key"], row["rows"], row["Extra"]) for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+        conn.close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--manifest", default="benchmarks/seed_manifest.json", help="Manifest của seed_data.py")
+    parser.add_argument("--rounds", type=int, default=200, help="Số lần đo mỗi nhóm câu tìm kiếm")
+    parser.add_argument("--limit", type=int, default=20, help="Kích thước trang")
+    parser.add_argument("--random-seed", type=int, default=7)
+    parser.add_argument("--output", help="Ghi kết quả JSON ra file")
+    args = parser.parse_args()
+
+    with open(args.manifest) as f:
+        users = [user["user_id"] for user in json.load(f)["users"]]
+    rng = random.Random(args.random_seed)
+    codes = {user_id: rare_code(user_id) for user_id in users}
+
+    cases = {
+        "rare": lambda user_id: (f"ERR{codes[user_id]}", 0),
+        "topic": lambda user_id: (rng.choice(TOPICS), 0),
+        "common": lambda user_id: ("tối ưu", 0),
+        "multi": lambda user_id: (f"truy vấn {rng.choice(TOPICS)} chậm", 0),
+        "deep": lambda user_id: (rng.choice(TOPICS), 4 * args.limit)
+    }
+    results = {}
+    for name, make in cases.items():
+        run_search(users[0], *make(users[0]))  # warm-up (buffer pool, FTS cache)
+        latencies = []
+        hits = 0
+        failed = 0
+        for _ in range(args.rounds):
+            user_id = rng.choice(users)
+            query, offset = make(user_id)
+            elapsed, count = run_search(user_id, query, args.limit, offset)
+            if count is None:
+                failed += 1
+                continue
+            latencies.append(elapsed)
+            hits += count
+        results[name] = {**summarize(latencies), "avg_results": round(hits / max(1, len(latencies)), 1),
+                         "failed": failed}
+        print(f"{name:<8} p50 {results[name]['p50_ms']:>8} ms  p95 {results[name]['p95_ms']:>8} ms  "
+              f"p99 {results[name]['p99_ms']:>8} ms  kết quả TB {results[name]['avg_results']}  "
+              f"lỗi/quá giờ {failed}")
+
+    results["explain"] = explain(users[0], "tối ưu", args.limit)
+    print(f"EXPLAIN: {results['explain']}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2, default=str)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""So sánh chế độ WSGI (Flask + waitress) và ASGI (async_main) dưới tải chat đồng thời.
+
+Mỗi chế độ được khởi chạy trong tiến trình con, trỏ tới mock OpenAI cục bộ.
+Trong lúc N chat chạy song song, một luồng khác liên tục gọi
+GET /api/conversations để đo mức độ server bị "đứng".
+
+Yêu cầu: MySQL đã khởi tạo theo database.sql (cấu hình qua .env như khi chạy app).
+
+Chạy từ thư mục backend/:
+    python benchmarks/bench_server_modes.py --concurrency 50 --requests 200 --latency 2
+"""
+import argparse
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import mock_openai
+from bench_utils import AppSession, start_app, stop_app, summarize
+
+def run_mode(mode, args):
+    proc = start_app(args.port, {
+        "SERVER_MODE": mode,
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{args.mock_port}/v1",
+        "OPENAI_API_KEY": "sk-benchmark"
+    })
+    try:
+        base_url = f"http://127.0.0.1:{args.port}"
+        admin = AppSession(base_url)
+        admin.login("bench-server-modes@codemate.ai")
+        conversation_ids = [admin.create_conversation() for _ in range(args.concurrency)]
+
+        chat_latencies = []
+        list_latencies = []
+        errors = 0
+        lock = threading.Lock()
+        stop = threading.Event()
+
+        def chat(i):
+            nonlocal errors
+            session = AppSession(base_url, admin.cookie_jar)
+            start = time.perf_counter()
+            status, _, _ = session.request("POST", "/api/chat", data={
+                "text": f"Câu hỏi benchmark số {i}",
+                "conversation_id": conversation_ids[i % len(conversation_ids)]
+            })
+            elapsed = time.perf_counter() - start
+            with lock:
+                if status == 200:
+                    chat_latencies.append(elapsed)
+                else:
+                    errors += 1
+
+        def poll_listing():
+            session = AppSession(base_url, admin.cookie_jar)
+            while not stop.is_set():
+                start = time.perf_counter()
+                session.request("GET", "/api/conversations")
+                list_latencies.append(time.perf_counter() - start)
+                time.sleep(0.1)
+
+        poller = threading.Thread(target=poll_listing, daemon=True)
+        poller.start()
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            list(pool.map(chat, range(args.requests)))
+        elapsed = time.perf_counter() - start
+        stop.set()
+        poller.join()
+
+        return {
+            "mode": mode,
+            "chat": summarize(chat_latencies, elapsed),
+            "listing_during_load": summarize(list_latencies),
+            "errors": errors
+        }
+    finally:
+        stop_app(proc)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modes", default="wsgi,asgi")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=2.0, help="Độ trễ của mock OpenAI (giây)")
+    parser.add_argument("--port", type=int, default=5055)
+    parser.add_argument("--mock-port", type=int, default=8055)
+    parser.add_argument("--output", help="Ghi kết quả JSON ra file")
+    args = parser.parse_args()
+
+    mock = mock_openai.start_in_background(port=args.mock_port, latency=args.latency)
+    try:
+        results = [run_mode(mode.strip(), args) for mode in args.modes.split(",")]
+    finally:
+        mock.shutdown()
+
+    for result in results:
+        chat = result["chat"]
+        listing = result["listing_during_load"]
+        print(f"[{result['mode']}] chat: {chat.get('throughput_rps', 0)} req/s, "
+              f"p50 {chat['p50_ms']} ms, p99 {chat['p99_ms']} ms, lỗi {result['errors']} | "
+              f"listing p99 {listing['p99_ms']} ms")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
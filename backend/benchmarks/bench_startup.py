@@ -0,0 +1,141 @@
+"""Đo thời gian khởi động backend: bind port, /healthz, /readyz và request audio đầu tiên.
+
+Mỗi cấu hình được khởi chạy nguội trong tiến trình con và đo (tính từ lúc
+spawn tiến trình):
+  - bind: port bắt đầu nhận kết nối TCP
+  - healthz: /healthz trả 200 (server thực sự phục vụ request)
+  - ready: /readyz trả 200 (MySQL kết nối được, warm-up đã xong)
+  - first_audio: (tùy chọn, --audio) latency của request /api/chat có audio
+    đầu tiên gửi ngay sau khi healthz trả 200
+  - rss_mb: tổng RSS của cả cây tiến trình sau khi ready (chỉ trên Linux)
+
+Cấu hình mặc định: waitress với WARMUP_MODE=lazy/background và gunicorn
+(gunicorn.conf.py) có/không --preload. Để có số liệu "trước", chạy script
+này trên một checkout cũ (chưa có /healthz, /readyz): các mốc khi đó đều quy
+về lúc bind port.
+
+Chạy từ thư mục backend/:
+    python benchmarks/bench_startup.py --runs 3 --audio samples/hello.wav
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import mock_openai
+from bench_utils import BACKEND_DIR, AppSession, stop_app, tree_rss_mb
+
+CONFIGS = {
+    "waitress-lazy": ([sys.executable, "nlp_main.py"], {"WARMUP_MODE": "lazy"}),
+    "waitress-background": ([sys.executable, "nlp_main.py"], {"WARMUP_MODE": "background"}),
+    "gunicorn": (["gunicorn", "-c", "gunicorn.conf.py", "nlp_main:app"], {"GUNICORN_PRELOAD": "0"}),
+    "gunicorn-preload": (["gunicorn", "-c", "gunicorn.conf.py", "nlp_main:app"], {"GUNICORN_PRELOAD": "1"})
+}
+
+def post_audio(session, path, conversation_id):
+    """Gửi file audio tới /api/chat dạng multipart (trường audioFile)"""
+    with open(path, "rb") as f:
+        content = f.read()
+    status, _, _ = session.post_file("/api/chat", "audioFile", os.path.basename(path), content,
+                                     data={"conversation_id": conversation_id})
+    return status
+
+def wait_until(check, deadline):
+    while time.perf_counter() < deadline:
+        try:
+            if check():
+                return True
+        except OSError:
+            pass
+        time.sleep(0.05)
+    return False
+
+def run_once(name, args):
+    command, extra_env = CONFIGS[name]
+    env = dict(os.environ)
+    env.update(extra_env)
+    env.update({
+        "PORT": str(args.port),
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{args.mock_port}/v1",
+        "OPENAI_API_KEY": "sk-benchmark"
+    })
+    base_url = f"http://127.0.0.1:{args.port}"
+    session = AppSession(base_url)
+
+    start = time.perf_counter()
+    proc = subprocess.Popen(command, cwd=BACKEND_DIR, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = start + args.timeout
+    result = {"config": name}
+    try:
+        def bound():
+            with socket.create_connection(("127.0.0.1", args.port), timeout=0.5):
+                return True
+
+        if not wait_until(bound, deadline):
+            raise RuntimeError(f"{name}: không bind được port sau {args.timeout}s")
+        result["bind_s"] = round(time.perf_counter() - start, 2)
+
+        # Checkout cũ không có /healthz (404): coi như đã phục vụ từ lúc bind
+        wait_until(lambda: session.request("GET", "/healthz", timeout=5)[0] in (200, 404), deadline)
+        result["healthz_s"] = round(time.perf_counter() - start, 2)
+
+        if args.audio:
+            session.login("bench-startup@codemate.ai")
+            conversation_id = session.create_conversation()
+            audio_start = time.perf_counter()
+            result["first_audio_status"] = post_audio(session, args.audio, conversation_id)
+            result["first_audio_s"] = round(time.perf_counter() - audio_start, 2)
+
+        readiness = {}
+
+        def ready():
+            status, _, body = session.request("GET", "/readyz", timeout=15)
+            if status == 200:
+                readiness.update(json.loads(body))
+            return status in (200, 404)
+
+        if wait_until(ready, deadline):
+            result["ready_s"] = round(time.perf_counter() - start, 2)
+            result["components"] = readiness.get("components", {})
+        else:
+            result["ready_s"] = None
+        result["rss_mb"] = tree_rss_mb(proc.pid)
+        return result
+    finally:
+        stop_app(proc)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--configs", default=",".join(CONFIGS))
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--audio", help="File audio cho request đầu tiên (cần MySQL để đăng nhập)")
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument("--port", type=int, default=5055)
+    parser.add_argument("--mock-port", type=int, default=8055)
+    parser.add_argument("--output", help="Ghi kết quả JSON ra file")
+    args = parser.parse_args()
+
+    mock = mock_openai.start_in_background(port=args.mock_port, latency=0.1)
+    results = []
+    try:
+        for name in args.configs.split(","):
+            for run in range(args.runs):
+                result = run_once(name.strip(), args)
+                result["run"] = run
+                results.append(result)
+                print(f"[{result['config']} #{run}] bind {result['bind_s']}s, healthz {result['healthz_s']}s, "
+                      f"ready {result['ready_s']}s, first audio {result.get('first_audio_s', '-')}s, "
+                      f"RSS {result['rss_mb']} MB")
+    finally:
+        mock.shutdown()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
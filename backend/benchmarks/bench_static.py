@@ -0,0 +1,161 @@
+"""Benchmark phục vụ file tĩnh: STATIC_ASSETS=off (send_from_directory) so với bản build (static_assets.py).
+
+Mỗi chế độ khởi chạy backend trong tiến trình con, rồi --concurrency "trình
+duyệt" mô phỏng tải trang / (HTML + CSS/JS/ảnh được tham chiếu), có HTTP
+cache giống trình duyệt (giữ ETag/Last-Modified, bỏ qua file còn hạn
+max-age/immutable):
+  - cold: trình duyệt mới, cache rỗng
+  - warm: tải lại trang với cache từ lần trước
+In số request, số byte truyền đi, độ trễ mỗi lần tải trang và CPU của
+server cho mỗi 1000 lần tải. Không cần MySQL hay OpenAI.
+
+Chạy từ thư mục backend/:
+    python benchmarks/bench_static.py --loads 500 --concurrency 8
+"""
+import argparse
+import gzip
+import http.client
+import json
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from bench_utils import start_app, stop_app, summarize, tree_usage
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+ACCEPT_ENCODING = "gzip, deflate, br" if brotli else "gzip, deflate"
+_REFERENCE = re.compile(r'(?:href|src)="(/?[^"#?:]+)"')
+
+class Browser:
+    """HTTP client một connection keep-alive với cache tối giản như trình duyệt"""
+
+    def __init__(self, port):
+        self.conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        self.cache = {}
+
+    def get(self, path):
+        """Trả về (body đã giải nén, số request, số byte body nhận được)"""
+        cached = self.cache.get(path)
+        if cached and cached["expires"] > time.time():
+            return cached["body"], 0, 0
+
+        headers = {"Accept-Encoding": ACCEPT_ENCODING}
+        if cached and cached["etag"]:
+            headers["If-None-Match"] = cached["etag"]
+        elif cached and cached["last_modified"]:
+            headers["If-Modified-Since"] = cached["last_modified"]
+        self.conn.request("GET", path, headers=headers)
+        response = self.conn.getresponse()
+        raw = response.read()
+        if response.status == 304:
+            return cached["body"], 1, len(raw)
+        if response.status != 200:
+            raise RuntimeError(f"GET {path}: {response.status}")
+
+        encoding = response.getheader("Content-Encoding")
+        body = gzip.decompress(raw) if encoding == "gzip" else brotli.decompress(raw) if encoding == "br" else raw
+        cache_control = response.getheader("Cache-Control") or ""
+        max_age = re.search(r"max-age=(\d+)", cache_control)
+        self.cache[path] = {
+            "body": body,
+            "etag": response.getheader("ETag"),
+            "last_modified": response.getheader("Last-Modified"),
+            "expires": time.time() + int(max_age.group(1)) if max_age and "no-cache" not in cache_control else 0
+        }
+        return body, 1, len(raw)
+
+    def load_page(self, path="/"):
+        """Tải trang và mọi file tĩnh cục bộ nó tham chiếu: (số request, số byte)"""
+        html, requests, received = self.get(path)
+        for reference in dict.fromkeys(_REFERENCE.findall(html.decode("utf-8", "replace"))):
+            _, count, size = self.get(reference if reference.startswith("/") else "/" + reference)
+            requests += count
+            received += size
+        return requests, received
+
+def measure(port, loads, concurrency, warm, pid):
+    lock = threading.Lock()
+    latencies, requests, received = [], 0, 0
+    local = threading.local()
+
+    def one(_):
+        nonlocal requests, received
+        if warm:
+            if not hasattr(local, "browser"):
+                local.browser = Browser(port)
+                local.browser.load_page()
+            browser = local.browser
+        else:
+            browser = Browser(port)
+        start = time.perf_counter()
+        count, size = browser.load_page()
+        elapsed = time.perf_counter() - start
+        if not warm:
+            browser.conn.close()
+        with lock:
+            latencies.append(elapsed)
+            requests += count
+            received += size
+
+    cpu_before = tree_usage(pid)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(loads)))
+    elapsed = time.perf_counter() - start
+    cpu_after = tree_usage(pid)
+
+    result = summarize(latencies, elapsed)
+    result.update({
+        "requests_per_load": round(requests / loads, 2),
+        "kb_per_load": round(received / loads / 1024, 1)
+    })
+    if cpu_before and cpu_after:
+        # Gồm cả các lần tải khởi động cache của warm (mỗi thread một lần)
+        result["server_cpu_ms_per_1000_loads"] = round((cpu_after[1] - cpu_before[1]) * 1000 / loads * 1000, 1)
+    return result
+
+def run_mode(mode, args):
+    proc = start_app(args.port, {
+        "STATIC_ASSETS": mode,
+        "OPENAI_API_KEY": "sk-benchmark",
+        "WARMUP_MODE": "lazy",
+        "RATE_LIMIT_BACKEND": "off"
+    })
+    try:
+        results = {}
+        for phase in ("cold", "warm"):
+            measure(args.port, args.concurrency, args.concurrency, phase == "warm", proc.pid)
+            results[phase] = measure(args.port, args.loads, args.concurrency, phase == "warm", proc.pid)
+        return results
+    finally:
+        stop_app(proc)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modes", default="off,build", help="Các giá trị STATIC_ASSETS cần so sánh")
+    parser.add_argument("--loads", type=int, default=500, help="Số lần tải trang mỗi pha")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--port", type=int, default=5061)
+    parser.add_argument("--output", help="Ghi kết quả JSON ra file")
+    args = parser.parse_args()
+
+    results = {}
+    for mode in args.modes.split(","):
+        results[mode] = run_mode(mode, args)
+        for phase, result in results[mode].items():
+            print(f"{mode:<6} {phase:<5} req/trang {result['requests_per_load']:>5}  "
+                  f"KB/trang {result['kb_per_load']:>8}  p50 {result['p50_ms']:>8} ms  "
+                  f"p95 {result['p95_ms']:>8} ms  trang/s {result['throughput_rps']:>8}  "
+                  f"CPU server ms/1000 trang {result.get('server_cpu_ms_per_1000_loads', '-')}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
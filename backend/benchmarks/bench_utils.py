@@ -0,0 +1,217 @@
+"""Tiện ích dùng chung cho các script benchmark."""
+import http.cookiejar
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def percentile(values, p):
+    """Percentile theo nearest-rank (p trong khoảng 0-100)"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(p / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+def summarize(latencies, elapsed=None):
+    """Tóm tắt danh sách độ trễ (giây) thành dict p50/p95/p99 (ms)"""
+    summary = {
+        "count": len(latencies),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "max_ms": round(max(latencies) * 1000, 2) if latencies else 0.0
+    }
+    if elapsed:
+        summary["throughput_rps"] = round(len(latencies) / elapsed, 2)
+    return summary
+
+def wait_for_port(host, port, timeout=300):
+    """Chờ tới khi có tiến trình lắng nghe trên host:port"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection((host, port), timeout=1):
+                return True
+        except OSError:
+            time.sleep(0.5)
+    return False
+
+def start_app(port, extra_env=None, entry="nlp_main.py", log_path=None):
+    """Khởi chạy backend trong tiến trình con và chờ tới khi bind port (log ra log_path nếu có)"""
+    env = dict(os.environ)
+    env["PORT"] = str(port)
+    env.update(extra_env or {})
+    log = open(log_path, "ab") if log_path else subprocess.DEVNULL
+    try:
+        proc = subprocess.Popen([sys.executable, entry], cwd=BACKEND_DIR, env=env,
+                                stdout=log, stderr=subprocess.STDOUT if log_path else subprocess.DEVNULL)
+    finally:
+        if log_path:
+            log.close()
+    if not wait_for_port("127.0.0.1", port):
+        proc.kill()
+        raise RuntimeError(f"Backend không khởi động được trên port {port}")
+    return proc
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def environment_info():
+    """Thông tin môi trường ghi kèm kết quả để so sánh giữa các lần chạy"""
+    return {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z")
+    }
+
+def process_tree(pid):
+    """pid và mọi tiến trình con (đọc từ /proc, chỉ trên Linux)"""
+    children = {}
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+                children.setdefault(ppid, []).append(int(entry))
+            except (OSError, IndexError, ValueError):
+                continue
+    pids, stack = [], [pid]
+    while stack:
+        current = stack.pop()
+        pids.append(current)
+        stack.extend(children.get(current, []))
+    return pids
+
+def tree_usage(pid):
+    """(RSS MB, CPU giây user+system) của pid và mọi tiến trình con; None nếu không có /proc"""
+    if not os.path.isdir("/proc"):
+        return None
+    ticks = os.sysconf("SC_CLK_TCK")
+    rss_kb, cpu_ticks = 0, 0
+    for current in process_tree(pid):
+        try:
+            with open(f"/proc/{current}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            cpu_ticks += int(fields[11]) + int(fields[12])
+            with open(f"/proc/{current}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        rss_kb += int(line.split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+    return round(rss_kb / 1024, 1), cpu_ticks / ticks
+
+def tree_rss_mb(pid):
+    """Tổng RSS (MB) của pid và mọi tiến trình con"""
+    usage = tree_usage(pid)
+    return usage[0] if usage else None
+
+class ResourceSampler:
+    """Lấy mẫu RSS và CPU của cây tiến trình server trong một thread nền"""
+
+    def __init__(self, pid, interval=0.5):
+        self.pid = pid
+        self.interval = interval
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+
+    def _loop(self):
+        while True:
+            usage = tree_usage(self.pid)
+            if usage:
+                self.samples.append((time.perf_counter(),) + usage)
+            if self._stop.wait(self.interval):
+                return
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Dừng lấy mẫu, trả về tóm tắt: RSS lớn nhất/trung bình, CPU trung bình (số core)"""
+        self._stop.set()
+        self._thread.join()
+        if len(self.samples) < 2:
+            return {}
+        (t0, _, cpu0), (t1, _, cpu1) = self.samples[0], self.samples[-1]
+        rss = [sample[1] for sample in self.samples]
+        return {
+            "rss_max_mb": max(rss),
+            "rss_avg_mb": round(sum(rss) / len(rss), 1),
+            "cpu_cores_avg": round((cpu1 - cpu0) / (t1 - t0), 2) if t1 > t0 else 0.0
+        }
+
+def stop_app(proc):
+    proc.terminate()
+    try:
+        proc.wait(timeout=15)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+
+class AppSession:
+    """HTTP client nhỏ giữ cookie session của backend"""
+
+    def __init__(self, base_url, cookie_jar=None):
+        self.base_url = base_url.rstrip("/")
+        self.cookie_jar = cookie_jar if cookie_jar is not None else http.cookiejar.CookieJar()
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(self.cookie_jar))
+
+    def request(self, method, path, data=None, json_body=None, headers=None, timeout=300, raw_body=None):
+        """Gửi request, trả về (status, headers, body bytes)"""
+        headers = dict(headers or {})
+        body = raw_body
+        if json_body is not None:
+            body = json.dumps(json_body).encode("utf-8")
+            headers["Content-Type"] = "application/json"
+        elif data is not None:
+            body = urllib.parse.urlencode(data).encode("utf-8")
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+        req = urllib.request.Request(self.base_url + path, data=body, headers=headers, method=method)
+        try:
+            with self.opener.open(req, timeout=timeout) as resp:
+                return resp.status, dict(resp.headers), resp.read()
+        except urllib.error.HTTPError as e:
+            return e.code, dict(e.headers), e.read()
+
+    def post_file(self, path, field, filename, content, data=None, timeout=300):
+        """Gửi multipart/form-data gồm các trường data và một tệp, trả về như request()"""
+        boundary = uuid.uuid4().hex
+        body = b""
+        for name, value in (data or {}).items():
+            body += (f"--{boundary}\r\nContent-Disposition: form-data; name=\"{name}\"\r\n\r\n"
+                     f"{value}\r\n").encode("utf-8")
+        body += (f"--{boundary}\r\nContent-Disposition: form-data; name=\"{field}\"; "
+                 f"filename=\"{filename}\"\r\nContent-Type: application/octet-stream\r\n\r\n").encode("utf-8")
+        body += content + f"\r\n--{boundary}--\r\n".encode("utf-8")
+        return self.request("POST", path, headers={
+            "Content-Type": f"multipart/form-data; boundary={boundary}"
+        }, raw_body=body, timeout=timeout)
+
+    def login(self, email, password="bench-password"):
+        """Đăng ký (nếu chưa có) rồi đăng nhập user benchmark"""
+        self.request("POST", "/api/auth/register", json_body={"email": email, "password": password})
+        status, _, body = self.request("POST", "/api/auth/login", json_body={"email": email, "password": password})
+        if status != 200:
+            raise RuntimeError(f"Đăng nhập thất bại ({status}): {body[:200]!r}")
+
+    def create_conversation(self):
+        _, _, body = self.request("POST", "/api/conversations", json_body={"title": "Benchmark"})
+        return json.loads(body)["conversation_id"]
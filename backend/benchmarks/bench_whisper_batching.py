@@ -0,0 +1,70 @@
+"""Benchmark phiên mã theo batch: clips/giây và độ trễ ở batch size 1-16.
+
+Chạy trực tiếp hàm worker của transcription.py trong tiến trình hiện tại (một
+mô hình), nên kết quả phản ánh thông lượng của một worker process.
+
+Chạy từ thư mục backend/:
+    python benchmarks/bench_whisper_batching.py --clips-dir ./samples --rounds 3
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import transcription
+from bench_utils import summarize
+
+AUDIO_EXTENSIONS = (".wav", ".mp3", ".m4a", ".ogg", ".webm", ".flac")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clips-dir", required=True, help="Thư mục chứa các clip ngắn (<= 30s)")
+    parser.add_argument("--batch-sizes", default="1,2,4,8,16")
+    parser.add_argument("--rounds", type=int, default=3, help="Số batch chạy cho mỗi batch size")
+    parser.add_argument("--model", default=transcription.MODEL_PATH)
+    parser.add_argument("--cpu-threads", type=int, default=0)
+    parser.add_argument("--output", help="Ghi kết quả JSON ra file")
+    args = parser.parse_args()
+
+    clips = sorted(p for p in glob.glob(os.path.join(args.clips_dir, "*")) if p.lower().endswith(AUDIO_EXTENSIONS))
+    if not clips:
+        parser.error(f"Không tìm thấy clip âm thanh trong {args.clips_dir}")
+
+    # Job nhận bytes của tệp như khi tải lên qua /api/chat
+    clips = [open(path, "rb").read() for path in clips]
+
+    transcription._init_worker(args.model, args.cpu_threads, 1)
+    # Khởi động (warm-up) để loại thời gian khởi tạo lần đầu khỏi kết quả
+    transcription._transcribe_batch_job(clips[:1], [time.time()])
+
+    results = []
+    for batch_size in (int(b) for b in args.batch_sizes.split(",")):
+        latencies = []
+        total_clips = 0
+        total_time = 0.0
+        for round_index in range(args.rounds):
+            batch = [clips[(round_index * batch_size + i) % len(clips)] for i in range(batch_size)]
+            start = time.perf_counter()
+            transcription._transcribe_batch_job(batch, [time.time()] * batch_size)
+            elapsed = time.perf_counter() - start
+            # Mọi clip trong batch nhận kết quả cùng lúc
+            latencies.extend([elapsed] * batch_size)
+            total_clips += batch_size
+            total_time += elapsed
+
+        summary = summarize(latencies)
+        summary.update({"batch_size": batch_size, "clips_per_sec": round(total_clips / total_time, 2)})
+        results.append(summary)
+        print(f"batch {batch_size:>2}: {summary['clips_per_sec']:>6} clips/s, "
+              f"latency p50 {summary['p50_ms']} ms, p95 {summary['p95_ms']} ms")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+"""Mock server tương thích OpenAI Chat Completions dùng cho benchmark.
+
+Trả lời POST /v1/chat/completions sau một độ trễ cấu hình được, hỗ trợ cả
+stream=True (SSE). Trỏ app vào server này bằng biến môi trường
+OPENAI_BASE_URL=http://127.0.0.1:<port>/v1
+
+Có thể tiêm lỗi theo tỉ lệ để kiểm tra retry/hedging của ai_client: 429 kèm
+Retry-After, 503, ngắt kết nối không trả lời, hoặc phản hồi chậm bất thường.
+
+Chạy độc lập: python benchmarks/mock_openai.py --port 8055 --latency 2 --error-rate 0.1
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class MockOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Header và body được ghi riêng: tắt Nagle để không cộng thêm ~40 ms delayed ACK vào mỗi phản hồi
+    disable_nagle_algorithm = True
+
+    # Được ghi đè bởi make_server
+    latency = 1.0
+    tokens = 50
+    token_interval = 0.02
+    # Tỉ lệ request bị tiêm lỗi (tổng không quá 1)
+    faults = {"rate_limit": 0.0, "error": 0.0, "drop": 0.0, "slow": 0.0}
+    retry_after = 1.0
+    slow_latency = 5.0
+    rng = random.Random()
+    # Số request theo kết quả (ok, rate_limit, error, drop, slow) và số request đồng thời
+    stats = {}
+    lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _pick_fault(self):
+        with self.lock:
+            roll = self.rng.random()
+            fault = None
+            for name, rate in self.faults.items():
+                if roll < rate:
+                    fault = name
+                    break
+                roll -= rate
+            key = fault or "ok"
+            self.stats[key] = self.stats.get(key, 0) + 1
+            return fault
+
+    def _send_json(self, status, payload, headers=None):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        with self.lock:
+            self.stats["in_flight"] = self.stats.get("in_flight", 0) + 1
+            self.stats["max_in_flight"] = max(self.stats.get("max_in_flight", 0), self.stats["in_flight"])
+        try:
+            self._handle()
+        except (BrokenPipeError, ConnectionResetError):
+            # Client đã hủy request (hedge thua, quá deadline)
+            self.close_connection = True
+        finally:
+            with self.lock:
+                self.stats["in_flight"] -= 1
+
+    def _handle(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        if not self.path.endswith("/chat/completions"):
+            self.send_error(404)
+            return
+
+        fault = self._pick_fault()
+        if fault == "rate_limit":
+            self._send_json(429, {"error": {"message": "Rate limit reached", "type": "requests",
+                                            "code": "rate_limit_exceeded"}},
+                            {"Retry-After": f"{self.retry_after:g}"})
+            return
+        if fault == "error":
+            time.sleep(min(self.latency, 0.1))
+            self._send_json(503, {"error": {"message": "The server is overloaded", "type": "server_error",
+                                            "code": None}})
+            return
+        if fault == "drop":
+            # Đóng kết nối không trả lời gì (client thấy lỗi kết nối)
+            self.close_connection = True
+            return
+        latency = self.slow_latency if fault == "slow" else self.latency
+
+        model = body.get("model", "gpt-4o")
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        words = [f"tok{i} " for i in range(self.tokens)]
+
+        if body.get("stream"):
+            include_usage = (body.get("stream_options") or {}).get("include_usage", False)
+            # Độ trễ tới token đầu tiên, sau đó mỗi token cách nhau token_interval
+            self._stream(completion_id, model, words, include_usage,
+                         latency if fault == "slow" else min(self.latency, 0.5))
+            return
+
+        time.sleep(latency)
+        payload = json.dumps({
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": "".join(words)},
+                "finish_reason": "stop"
+            }],
+            "usage": {"prompt_tokens": 100, "completion_tokens": self.tokens, "total_tokens": 100 + self.tokens}
+        }).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _stream(self, completion_id, model, words, include_usage=False, first_token_delay=0.5):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        time.sleep(first_token_delay)
+        for word in words:
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "delta": {"content": word}, "finish_reason": None}]
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+            time.sleep(self.token_interval)
+        if include_usage:
+            # Như API thật: chunk cuối có choices rỗng và usage của cả lượt
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [],
+                "usage": {"prompt_tokens": 100, "completion_tokens": len(words), "total_tokens": 100 + len(words)}
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+def make_server(host="127.0.0.1", port=8055, latency=1.0, tokens=50, token_interval=0.02,
+                rate_limit_rate=0.0, error_rate=0.0, drop_rate=0.0, slow_rate=0.0, slow_latency=5.0,
+                retry_after=1.0, seed=None):
+    """Tạo mock server (chưa chạy) với cấu hình độ trễ và tỉ lệ lỗi cho trước
+
+    Số request theo kết quả đọc qua request_stats(server).
+    """
+    handler = type("ConfiguredMockOpenAIHandler", (MockOpenAIHandler,), {
+        "latency": latency,
+        "tokens": tokens,
+        "token_interval": token_interval,
+        "faults": {"rate_limit": rate_limit_rate, "error": error_rate, "drop": drop_rate, "slow": slow_rate},
+        "retry_after": retry_after,
+        "slow_latency": slow_latency,
+        "rng": random.Random(seed),
+        "stats": {},
+        "lock": threading.Lock()
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+def request_stats(server):
+    """Số request mock đã nhận theo kết quả (ok, rate_limit, error, drop, slow) và max_in_flight"""
+    handler = server.RequestHandlerClass
+    with handler.lock:
+        return dict(handler.stats)
+
+def start_in_background(**kwargs):
+    """Chạy mock server trong một daemon thread, trả về server để shutdown()"""
+    server = make_server(**kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mock OpenAI Chat Completions server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8055)
+    parser.add_argument("--latency", type=float, default=1.0, help="Độ trễ mỗi completion (giây)")
+    parser.add_argument("--tokens", type=int, default=50, help="Số token mỗi phản hồi")
+    parser.add_argument("--token-interval", type=float, default=0.02, help="Khoảng cách giữa các token khi stream (giây)")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Tỉ lệ request trả 429 + Retry-After")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Giá trị Retry-After của 429 (giây)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Tỉ lệ request trả 503")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="Tỉ lệ request bị ngắt kết nối")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="Tỉ lệ request chậm bất thường")
+    parser.add_argument("--slow-latency", type=float, default=5.0, help="Độ trễ của request chậm (giây)")
+    parser.add_argument("--seed", type=int, help="Seed cho việc chọn request bị lỗi")
+    args = parser.parse_args()
+
+    server = make_server(args.host, args.port, args.latency, args.tokens, args.token_interval,
+                         rate_limit_rate=args.rate_limit_rate, error_rate=args.error_rate,
+                         drop_rate=args.drop_rate, slow_rate=args.slow_rate, slow_latency=args.slow_latency,
+                         retry_after=args.retry_after, seed=args.seed)
+    print(f"Mock OpenAI đang chạy tại http://{args.host}:{args.port}/v1")
+    server.serve_forever()
@@ -0,0 +1,412 @@
+"""Benchmark tải end-to-end: chat văn bản/stream/audio và duyệt danh sách với độ đồng thời cấu hình được.
+
+Với mỗi chế độ server (--modes), script:
+  1. khởi động mock OpenAI cục bộ (độ trễ, số token và tốc độ stream cấu hình
+     được) và backend trong tiến trình con, trỏ tới mock đó và mô hình
+     Whisper nhỏ (--whisper-model, mặc định "tiny")
+  2. chờ /readyz (warm-up xong), đăng nhập các user đã seed bằng seed_data.py
+  3. chạy --concurrency user ảo theo vòng kín: mỗi user chọn ngẫu nhiên một
+     thao tác theo tỉ lệ --mix, gửi request, chờ --think-time rồi lặp lại;
+     --warmup giây đầu không tính
+  4. trong --duration giây đo: throughput, p50/p95/p99 theo thao tác, mã lỗi,
+     thời gian tới token đầu của stream, RSS/CPU của cả cây tiến trình
+     server và thời gian từng bước lấy từ /metrics
+
+Thao tác (--mix, tên=trọng số):
+  text     POST /api/chat với câu hỏi văn bản
+  stream   POST /api/chat/stream, đọc hết SSE (ghi thêm ttft = tới delta đầu)
+  audio    POST /api/chat với tệp --audio (mặc định một clip tổng hợp; clip
+           không có tiếng nói có thể bị phiên mã rỗng -> 400, vẫn được tính
+           là hoàn thành vì đã qua bước phiên mã)
+  list     GET /api/conversations, đôi khi thêm trang thứ hai
+  history  GET /api/conversations/<id> của một conversation đã seed
+  search   GET /api/search với một từ khóa thường gặp
+
+Kết quả JSON (--output) gồm môi trường (commit, Python, CPU), cấu hình và
+số liệu mỗi chế độ; --compare so với một file kết quả cũ và trả exit code 1
+nếu p95 tăng hoặc throughput giảm quá --threshold phần trăm.
+
+Yêu cầu: MySQL đã seed (benchmarks/docker-compose.yml + seed_data.py).
+Chạy từ thư mục backend/:
+    python benchmarks/seed_data.py
+    python benchmarks/run_load.py --modes wsgi,asgi --concurrency 32 --duration 60 --output results.json
+    python benchmarks/run_load.py --compare results.json
+"""
+import argparse
+import json
+import math
+import os
+import random
+import struct
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import wave
+from collections import Counter
+
+import mock_openai
+from bench_utils import (AppSession, ResourceSampler, environment_info, start_app, stop_app, summarize,
+                         wait_for_port)
+
+OPERATIONS = ("text", "stream", "audio", "list", "history", "search")
+
+SEARCH_TERMS = ["MySQL", "Python", "truy vấn", "JavaScript", "thuật toán", "lỗi"]
+
+QUESTIONS = [
+    "Giải thích độ phức tạp của thuật toán sắp xếp nổi bọt",
+    "Viết hàm kiểm tra số nguyên tố bằng Python",
+    "Tại sao truy vấn SQL này chạy chậm khi bảng có nhiều dòng?",
+    "Cách xử lý lỗi khi gọi API bằng fetch trong JavaScript?",
+    "Khác nhau giữa process và thread là gì?"
+]
+
+def parse_mix(text):
+    weights = {}
+    for item in text.split(","):
+        name, _, weight = item.partition("=")
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise ValueError(f"Thao tác không hợp lệ: {name} (hợp lệ: {', '.join(OPERATIONS)})")
+        weights[name] = float(weight or 1)
+    return weights
+
+def synthetic_clip(seconds=3.0, rate=16000):
+    """Clip WAV 16 kHz mono gồm các đoạn âm có bao biên độ như tiếng nói (không phải lời nói thật)"""
+    frames = bytearray()
+    for i in range(int(seconds * rate)):
+        t = i / rate
+        envelope = max(0.0, math.sin(math.pi * t * 3)) ** 2
+        sample = envelope * (0.5 * math.sin(2 * math.pi * 220 * t) + 0.3 * math.sin(2 * math.pi * 660 * t))
+        frames += struct.pack("<h", int(sample * 12000))
+    path = os.path.join(tempfile.gettempdir(), "codemate_bench_clip.wav")
+    with wave.open(path, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(rate)
+        f.writeframes(bytes(frames))
+    return path
+
+# ==================== METRICS ====================
+
+def scrape_stages(session):
+    """Tổng sum/count của histogram thời gian từng bước chat và truy vấn DB từ /metrics"""
+    status, _, body = session.request("GET", "/metrics", timeout=30)
+    totals = {}
+    if status != 200:
+        return totals
+    for line in body.decode("utf-8").splitlines():
+        for prefix, group, label in (("codemate_chat_stage_duration_seconds", "stage", 'stage="'),
+                                     ("codemate_db_query_duration_seconds", "db", 'function="')):
+            for suffix in ("_sum", "_count"):
+                if line.startswith(prefix + suffix + "{"):
+                    name = line.split(label, 1)[1].split('"', 1)[0]
+                    value = float(line.rsplit(" ", 1)[1])
+                    entry = totals.setdefault(group, {}).setdefault(name, {"_sum": 0.0, "_count": 0.0})
+                    entry[suffix] += value
+    return totals
+
+def stage_delta(before, after):
+    """Số lần và thời gian trung bình (ms) của mỗi bước trong cửa sổ đo"""
+    result = {}
+    for group, names in after.items():
+        for name, entry in names.items():
+            old = before.get(group, {}).get(name, {"_sum": 0.0, "_count": 0.0})
+            count = entry["_count"] - old["_count"]
+            if count > 0:
+                result.setdefault(group, {})[name] = {
+                    "count": int(count),
+                    "avg_ms": round((entry["_sum"] - old["_sum"]) / count * 1000, 2)
+                }
+    return result
+
+# ==================== WORKLOAD ====================
+
+class VirtualUser:
+    """Một client đăng nhập sẵn, thực hiện các thao tác trên dữ liệu đã seed"""
+
+    def __init__(self, base_url, user, password, audio, rng):
+        self.session = AppSession(base_url)
+        self.user = user
+        self.password = password
+        self.audio = audio
+        self.rng = rng
+        self.counter = 0
+
+    def login(self):
+        status, _, body = self.session.request("POST", "/api/auth/login", json_body={
+            "email": self.user["email"], "password": self.password
+        })
+        if status != 200:
+            raise RuntimeError(f"Đăng nhập {self.user['email']} thất bại ({status}): {body[:200]!r}")
+
+    def conversation_id(self):
+        return self.rng.choice(self.user["conversation_ids"])
+
+    def question(self):
+        # Thêm số thứ tự để không trùng cache phản hồi khi cache bật
+        self.counter += 1
+        return f"{self.rng.choice(QUESTIONS)} (#{self.counter})"
+
+    def run(self, op):
+        """Thực hiện một thao tác, trả về (status, thông tin thêm)"""
+        if op == "text":
+            status, _, _ = self.session.request("POST", "/api/chat", data={
+                "text": self.question(), "conversation_id": self.conversation_id()
+            })
+            return status, {}
+        if op == "stream":
+            return self.stream()
+        if op == "audio":
+            status, _, _ = self.session.post_file("/api/chat", "audioFile", "clip.wav", self.audio,
+                                                  data={"conversation_id": self.conversation_id()})
+            return status, {}
+        if op == "list":
+            status, _, body = self.session.request("GET", "/api/conversations?limit=30")
+            if status == 200 and self.rng.random() < 0.3:
+                next_before = json.loads(body).get("next_before")
+                if next_before:
+                    query = urllib.parse.urlencode({"limit": 30, "before": next_before})
+                    status, _, _ = self.session.request("GET", f"/api/conversations?{query}")
+            return status, {}
+        if op == "history":
+            status, _, _ = self.session.request("GET", f"/api/conversations/{self.conversation_id()}?limit=50")
+            return status, {}
+        if op == "search":
+            query = urllib.parse.urlencode({"q": self.rng.choice(SEARCH_TERMS)})
+            status, _, _ = self.session.request("GET", f"/api/search?{query}")
+            return status, {}
+        raise ValueError(op)
+
+    def stream(self):
+        """Đọc SSE tới hết, ghi thời gian tới sự kiện delta đầu tiên"""
+        body = urllib.parse.urlencode({"text": self.question(), "conversation_id": self.conversation_id()})
+        req = urllib.request.Request(self.session.base_url + "/api/chat/stream", data=body.encode("utf-8"),
+                                     headers={"Content-Type": "application/x-www-form-urlencoded"},
+                                     method="POST")
+        start = time.perf_counter()
+        info = {}
+        try:
+            with self.session.opener.open(req, timeout=300) as resp:
+                for line in resp:
+                    if "ttft" not in info and line.startswith(b"event: delta"):
+                        info["ttft"] = time.perf_counter() - start
+                    elif line.startswith(b"event: error"):
+                        return 502, info
+                return resp.status, info
+        except urllib.error.HTTPError as e:
+            e.read()
+            return e.code, info
+
+def run_workload(base_url, manifest, audio, args, weights, on_measure_start):
+    """Chạy user ảo trong warm-up + duration, trả về số liệu của cửa sổ đo"""
+    ops = list(weights)
+    op_weights = list(weights.values())
+    users = []
+    for i in range(args.concurrency):
+        user = VirtualUser(base_url, manifest["users"][i % len(manifest["users"])], manifest["password"],
+                           audio, random.Random(args.random_seed + i))
+        user.login()
+        users.append(user)
+
+    lock = threading.Lock()
+    latencies = {op: [] for op in ops}
+    ttft = []
+    statuses = {op: Counter() for op in ops}
+    measuring = threading.Event()
+    stop = threading.Event()
+
+    def loop(user):
+        while not stop.is_set():
+            op = user.rng.choices(ops, weights=op_weights)[0]
+            start = time.perf_counter()
+            try:
+                status, info = user.run(op)
+            except Exception as e:
+                status, info = type(e).__name__, {}
+            elapsed = time.perf_counter() - start
+            if measuring.is_set() and not stop.is_set():
+                completed = status == 200 or (op == "audio" and status == 400)
+                with lock:
+                    statuses[op][str(status)] += 1
+                    if completed:
+                        latencies[op].append(elapsed)
+                        if "ttft" in info:
+                            ttft.append(info["ttft"])
+            if args.think_time:
+                stop.wait(user.rng.expovariate(1 / args.think_time))
+
+    threads = [threading.Thread(target=loop, args=(user,), daemon=True) for user in users]
+    for t in threads:
+        t.start()
+    time.sleep(args.warmup)
+    on_measure_start()
+    measuring.set()
+    start = time.perf_counter()
+    time.sleep(args.duration)
+    elapsed = time.perf_counter() - start
+    stop.set()
+    for t in threads:
+        t.join(timeout=330)
+
+    operations = {}
+    all_latencies = []
+    errors = 0
+    for op in ops:
+        all_latencies.extend(latencies[op])
+        failed = sum(n for status, n in statuses[op].items()
+                     if status != "200" and not (op == "audio" and status == "400"))
+        errors += failed
+        operations[op] = {**summarize(latencies[op], elapsed), "statuses": dict(statuses[op]), "errors": failed}
+    if ttft:
+        operations["stream"]["ttft"] = summarize(ttft)
+    return {"elapsed_s": round(elapsed, 2), "total": {**summarize(all_latencies, elapsed), "errors": errors},
+            "operations": operations}
+
+def run_mode(mode, manifest, audio, args, weights):
+    env = {
+        "SERVER_MODE": mode,
+        "OPENAI_BASE_URL": f"http://127.0.0.1:{args.mock_port}/v1",
+        "OPENAI_API_KEY": "sk-benchmark",
+        "WHISPER_MODEL_PATH": args.whisper_model,
+        "RESPONSE_CACHE_BACKEND": "memory" if args.cache else "off",
+        "WARMUP_MODE": "background"
+    }
+    for item in args.env:
+        key, _, value = item.partition("=")
+        env[key] = value
+    log_path = f"{args.log_dir}/server-{mode}.log" if args.log_dir else None
+    proc = start_app(args.port, env, log_path=log_path)
+    try:
+        base_url = f"http://127.0.0.1:{args.port}"
+        probe = AppSession(base_url)
+        if env.get("METRICS_TOKEN"):
+            probe.opener.addheaders.append(("Authorization", f"Bearer {env['METRICS_TOKEN']}"))
+        deadline = time.perf_counter() + args.ready_timeout
+        while probe.request("GET", "/readyz", timeout=30)[0] != 200:
+            if time.perf_counter() > deadline:
+                raise RuntimeError(f"{mode}: /readyz không trả 200 sau {args.ready_timeout}s")
+            time.sleep(0.5)
+
+        sampler = ResourceSampler(proc.pid)
+        stages_before = {}
+
+        def on_measure_start():
+            stages_before.update(scrape_stages(probe))
+            sampler.start()
+
+        result = run_workload(base_url, manifest, audio, args, weights, on_measure_start)
+        result["resources"] = sampler.stop()
+        result["stages"] = stage_delta(stages_before, scrape_stages(probe))
+        result["mode"] = mode
+        return result
+    finally:
+        stop_app(proc)
+
+# ==================== REPORT ====================
+
+def print_result(result):
+    total = result["total"]
+    resources = result.get("resources", {})
+    print(f"[{result['mode']}] {total.get('throughput_rps', 0)} req/s, p50 {total['p50_ms']} ms, "
+          f"p99 {total['p99_ms']} ms, lỗi {total['errors']} | RSS max {resources.get('rss_max_mb', '-')} MB, "
+          f"CPU {resources.get('cpu_cores_avg', '-')} core")
+    for op, summary in result["operations"].items():
+        extra = f", ttft p95 {summary['ttft']['p95_ms']} ms" if "ttft" in summary else ""
+        print(f"    {op:<8} {summary.get('throughput_rps', 0):>8} req/s  p50 {summary['p50_ms']:>9} ms  "
+              f"p95 {summary['p95_ms']:>9} ms  p99 {summary['p99_ms']:>9} ms  lỗi {summary['errors']}{extra}")
+    for name, stage in result.get("stages", {}).get("stage", {}).items():
+        print(f"    bước {name:<20} {stage['count']:>6} lần  trung bình {stage['avg_ms']} ms")
+
+def compare(baseline, results, threshold):
+    """In chênh lệch so với baseline, trả về danh sách các thao tác bị chậm đi"""
+    regressions = []
+    old_runs = {run["mode"]: run for run in baseline["runs"]}
+    for run in results:
+        old = old_runs.get(run["mode"])
+        if not old:
+            continue
+        for op, summary in run["operations"].items():
+            before = old["operations"].get(op)
+            if not before or not before["count"] or not summary["count"]:
+                continue
+            p95_change = (summary["p95_ms"] - before["p95_ms"]) / before["p95_ms"] * 100 if before["p95_ms"] else 0
+            rps_before = before.get("throughput_rps", 0)
+            rps_change = (summary.get("throughput_rps", 0) - rps_before) / rps_before * 100 if rps_before else 0
+            flag = ""
+            if p95_change > threshold or rps_change < -threshold:
+                flag = "  <-- chậm đi"
+                regressions.append(f"{run['mode']}/{op}")
+            print(f"  {run['mode']}/{op:<8} p95 {before['p95_ms']} -> {summary['p95_ms']} ms ({p95_change:+.1f}%), "
+                  f"throughput {rps_before} -> {summary.get('throughput_rps', 0)} req/s ({rps_change:+.1f}%){flag}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modes", default="wsgi", help="Chế độ server, cách nhau bằng dấu phẩy (wsgi, asgi)")
+    parser.add_argument("--mix", default="text=4,stream=2,audio=1,list=2,history=1")
+    parser.add_argument("--concurrency", type=int, default=16, help="Số user ảo đồng thời")
+    parser.add_argument("--duration", type=float, default=60, help="Thời gian đo (giây)")
+    parser.add_argument("--warmup", type=float, default=10, help="Thời gian chạy trước khi đo (giây)")
+    parser.add_argument("--think-time", type=float, default=0, help="Thời gian nghỉ trung bình giữa hai thao tác (giây)")
+    parser.add_argument("--manifest", default="benchmarks/seed_manifest.json", help="Manifest của seed_data.py")
+    parser.add_argument("--audio", help="Tệp âm thanh cho thao tác audio (mặc định: clip tổng hợp 3 giây)")
+    parser.add_argument("--whisper-model", default="tiny", help="WHISPER_MODEL_PATH của server")
+    parser.add_argument("--latency", type=float, default=1.0, help="Độ trễ của mock OpenAI (giây)")
+    parser.add_argument("--tokens", type=int, default=50, help="Số token mỗi phản hồi của mock OpenAI")
+    parser.add_argument("--token-interval", type=float, default=0.02, help="Khoảng cách giữa các token khi stream")
+    parser.add_argument("--cache", action="store_true", help="Bật response cache của server (mặc định tắt)")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="Biến môi trường thêm cho server (lặp lại được)")
+    parser.add_argument("--random-seed", type=int, default=1)
+    parser.add_argument("--ready-timeout", type=float, default=600)
+    parser.add_argument("--port", type=int, default=5055)
+    parser.add_argument("--mock-port", type=int, default=8055)
+    parser.add_argument("--log-dir", help="Ghi log của server vào thư mục này")
+    parser.add_argument("--output", help="Ghi kết quả JSON ra file")
+    parser.add_argument("--compare", help="File kết quả cũ để so sánh")
+    parser.add_argument("--threshold", type=float, default=10, help="Ngưỡng chậm đi khi so sánh (%%)")
+    args = parser.parse_args()
+
+    weights = parse_mix(args.mix)
+    with open(args.manifest) as f:
+        manifest = json.load(f)
+    audio_path = args.audio or synthetic_clip()
+    with open(audio_path, "rb") as f:
+        audio = f.read()
+    if args.log_dir:
+        os.makedirs(args.log_dir, exist_ok=True)
+
+    mock = mock_openai.start_in_background(port=args.mock_port, latency=args.latency, tokens=args.tokens,
+                                           token_interval=args.token_interval)
+    if not wait_for_port("127.0.0.1", args.mock_port, timeout=10):
+        sys.exit("Mock OpenAI không khởi động được")
+    results = []
+    try:
+        for mode in args.modes.split(","):
+            result = run_mode(mode.strip(), manifest, audio, args, weights)
+            print_result(result)
+            results.append(result)
+    finally:
+        mock.shutdown()
+
+    config = {key: value for key, value in vars(args).items() if key not in ("output", "compare")}
+    report = {"environment": environment_info(), "config": config, "runs": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print(f"So với {args.compare} (commit {baseline.get('environment', {}).get('commit')}):")
+        regressions = compare(baseline, results, args.threshold)
+        if regressions:
+            print(f"Chậm đi quá {args.threshold}%: {', '.join(regressions)}")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+"""Seed MySQL với khối lượng hội thoại giống thực tế cho benchmark tải.
+
+Tạo --users tài khoản local (cùng mật khẩu, email có tiền tố --prefix), mỗi
+user --conversations conversations, mỗi conversation trung bình --messages
+messages xen kẽ user/assistant. Độ dài nội dung và số messages dao động
+ngẫu nhiên (cố định theo --random-seed) nên mỗi lần seed cho cùng dữ liệu;
+câu trả lời dài và có khối code như phản hồi thật. Ghi manifest JSON (email,
+mật khẩu, id conversations) để run_load.py dùng lại.
+
+Cần schema trong database.sql và các biến DB_* như khi chạy server (ví dụ
+MySQL từ benchmarks/docker-compose.yml). Chạy từ thư mục backend/:
+    python benchmarks/seed_data.py --users 20 --conversations 200 --messages 20
+    python benchmarks/seed_data.py --cleanup
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+import passwords
+
+PASSWORD = "bench-password"
+
+QUESTIONS = [
+    "Làm sao tối ưu truy vấn MySQL có JOIN trên bảng lớn?",
+    "Giải thích sự khác nhau giữa list và tuple trong Python",
+    "Viết hàm đảo ngược chuỗi bằng JavaScript",
+    "Tại sao Flask báo lỗi 'Working outside of application context'?",
+    "Cách dùng async/await để gọi nhiều API cùng lúc?",
+    "Index covering là gì và khi nào nên dùng?",
+    "Sửa giúp mình lỗi IndexError: list index out of range trong vòng lặp này",
+    "So sánh thuật toán quicksort và mergesort về độ phức tạp",
+    "Làm sao viết unit test cho hàm có gọi HTTP?",
+    "Docker compose khác gì Dockerfile?"
+]
+
+# Chủ đề và mã lỗi làm câu hỏi đa dạng hơn, để tìm kiếm có cả từ hiếm lẫn từ phổ biến
+TOPICS = ["Django", "Flask", "FastAPI", "React", "Vue", "Kubernetes", "Redis", "PostgreSQL", "MongoDB",
+          "Kafka", "RabbitMQ", "Celery", "pandas", "NumPy", "PyTorch", "TensorFlow", "Spring Boot", "Golang",
+          "Rust", "TypeScript", "GraphQL", "WebSocket", "OAuth", "JWT", "Nginx", "Terraform", "Ansible",
+          "Elasticsearch", "SQLite", "Laravel"]
+
+CODE = """```python
+def process(items):
+    result = []
+    for index, item in enumerate(items):
+        if item is None:
+            continue
+        result.append((index, item.strip().lower()))
+    return result
+```"""
+
+SENTENCE = ("Đầu tiên cần xác định phần nào đang chậm bằng cách đo thời gian từng bước, "
+            "sau đó mới tối ưu đúng chỗ thay vì đoán. ")
+
+def timestamp(seconds):
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(seconds))
+
+def make_question(rng):
+    question = f"{rng.choice(QUESTIONS)} (dùng {rng.choice(TOPICS)})"
+    if rng.random() < 0.2:
+        question += f", gặp mã lỗi ERR{rng.randint(10000, 99999)}"
+    # Một phần câu hỏi kèm đoạn code hoặc log lỗi dài
+    if rng.random() < 0.3:
+        question += "\n" + CODE
+    return question
+
+def make_answer(rng):
+    parts = [SENTENCE * rng.randint(1, 6)]
+    for _ in range(rng.randint(0, 2)):
+        parts.append(CODE)
+        parts.append(SENTENCE * rng.randint(1, 4))
+    return "\n\n".join(parts)
+
+def seed(args):
+    """Tạo users/conversations/messages, trả về manifest"""
+    rng = random.Random(args.random_seed)
+    password_hash = passwords.PasswordHasher(rounds=args.rounds, workers=0).hash(PASSWORD)
+    now = int(time.time())
+    manifest = {"prefix": args.prefix, "password": PASSWORD, "users": []}
+
+    conn = database.get_connection()
+    cursor = conn.cursor()
+    try:
+        for u in range(args.users):
+            email = f"{args.prefix}{u}@codemate.local"
+            cursor.execute("INSERT INTO users (email, password_hash, full_name, auth_provider) "
+                           "VALUES (%s, %s, %s, 'local')", (email, password_hash, f"Benchmark {u}"))
+            user_id = cursor.lastrowid
+
+            conversations = []
+            messages = []
+            for c in range(args.conversations):
+                count = max(2, int(rng.expovariate(1 / args.messages)) // 2 * 2)
+                turns = [(make_question(rng), make_answer(rng)) for _ in range(count // 2)]
+                # Conversations trải đều trong --days ngày gần nhất
+                updated = now - int(rng.random() * args.days * 86400)
+                created = updated - count * 60
+                conversations.append((user_id, f"Hội thoại {c}", turns[0][0][:database.PREVIEW_LENGTH],
+                                      timestamp(created), timestamp(updated), turns, created))
+
+            cursor.executemany(
+                "INSERT INTO conversations (user_id, title, first_message, created_at, updated_at) "
+                "VALUES (%s, %s, %s, %s, %s)", [row[:5] for row in conversations])
+            cursor.execute("SELECT id FROM conversations WHERE user_id = %s ORDER BY id", (user_id,))
+            conversation_ids = [row[0] for row in cursor.fetchall()]
+
+            for conversation_id, row in zip(conversation_ids, conversations):
+                # Mỗi message cách nhau một phút, message cuối trùng updated_at
+                for i, (question, answer) in enumerate(row[5]):
+                    messages.append((conversation_id, "user", question, timestamp(row[6] + (2 * i + 1) * 60)))
+                    messages.append((conversation_id, "assistant", answer, timestamp(row[6] + (2 * i + 2) * 60)))
+            for start in range(0, len(messages), args.batch_size):
+                cursor.executemany("INSERT INTO messages (conversation_id, role, content, created_at) "
+                                   "VALUES (%s, %s, %s, %s)", messages[start:start + args.batch_size])
+            conn.commit()
+
+            manifest["users"].append({"email": email, "user_id": user_id, "conversation_ids": conversation_ids})
+            print(f"  user {u + 1}/{args.users}: {len(conversation_ids)} conversations, "
+                  f"{len(messages)} messages", end="\r")
+        print()
+        return manifest
+    finally:
+        cursor.close()
+        conn.close()
+
+def cleanup(prefix):
+    """Xóa mọi user benchmark có tiền tố email (conversations/messages xóa theo ON DELETE CASCADE)"""
+    conn = database.get_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("DELETE FROM users WHERE email LIKE %s", (prefix.replace("%", r"\%") + "%",))
+        conn.commit()
+        return cursor.rowcount
+    finally:
+        cursor.close()
+        conn.close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--conversations", type=int, default=200, help="Số conversations mỗi user")
+    parser.add_argument("--messages", type=int, default=20, help="Số messages trung bình mỗi conversation")
+    parser.add_argument("--days", type=int, default=180, help="Khoảng thời gian trải updated_at (ngày)")
+    parser.add_argument("--prefix", default="bench-load-", help="Tiền tố email của user benchmark")
+    parser.add_argument("--rounds", type=int, default=int(os.getenv("BCRYPT_ROUNDS", str(passwords.DEFAULT_ROUNDS))),
+                        help="Cost bcrypt của mật khẩu (nên bằng BCRYPT_ROUNDS của server để tránh rehash)")
+    parser.add_argument("--random-seed", type=int, default=42)
+    parser.add_argument("--batch-size", type=int, default=2000)
+    parser.add_argument("--manifest", default="benchmarks/seed_manifest.json", help="File manifest JSON")
+    parser.add_argument("--cleanup", action="store_true", help="Xóa dữ liệu đã seed (theo --prefix) rồi thoát")
+    args = parser.parse_args()
+
+    removed = cleanup(args.prefix)
+    if removed:
+        print(f"Đã xóa {removed} user benchmark cũ ({args.prefix}*)")
+    if args.cleanup:
+        return
+
+    start = time.perf_counter()
+    print(f"Seed {args.users} users x {args.conversations} conversations x ~{args.messages} messages...")
+    manifest = seed(args)
+    print(f"Xong sau {time.perf_counter() - start:.1f}s, manifest: {args.manifest}")
+    with open(args.manifest, "w") as f:
+        json.dump(manifest, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,387 @@
+"""Export/import hàng loạt lịch sử chat (users, conversations, messages) cho job lưu trữ và phân tích.
+
+Export đọc từng bảng theo thứ tự id bằng cursor không buffer (server gửi
+dần từng dòng, client chỉ giữ --batch-size dòng), ghi ra các part nén
+(JSONL gzip hoặc Parquet nếu có pyarrow), mỗi part tối đa --part-rows dòng.
+manifest.json trong thư mục export ghi các part đã xong và id cuối cùng của
+mỗi bảng: chạy lại cùng lệnh sẽ tiếp tục từ checkpoint đó thay vì làm lại.
+
+Bảng con chỉ lấy các dòng thuộc bảng cha đã export (conversation_id <= id
+conversation cuối cùng đã export...), nên dữ liệu mới phát sinh giữa hai lần
+chạy không tạo ra message mồ côi. Thời gian được ghi theo UTC.
+
+Import đọc lại các part theo thứ tự và ghi bằng INSERT nhiều dòng, commit
+theo batch; import-checkpoint.json giữ id cuối cùng đã ghi của mỗi bảng để
+tiếp tục khi bị ngắt. Giữ nguyên id gốc nên dùng để khôi phục vào database
+trống (hoặc chính database đó: dòng đã có được bỏ qua).
+
+Chạy từ thư mục backend/ (cần các biến DB_* như khi chạy server):
+    python bulk_history.py export /data/codemate-history --format jsonl
+    python bulk_history.py import /data/codemate-history
+"""
+import os
+import sys
+import json
+import gzip
+import time
+import logging
+import argparse
+from datetime import datetime, timezone
+import mysql.connector
+import database
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+MANIFEST = "manifest.json"
+IMPORT_CHECKPOINT = "import-checkpoint.json"
+MANIFEST_VERSION = 1
+FORMATS = {"jsonl": ".jsonl.gz", "parquet": ".parquet"}
+
+# Thứ tự export/import theo khóa ngoại: bảng cha trước.
+# parent: (cột khóa ngoại, bảng cha) để chỉ lấy dòng thuộc phần bảng cha đã export.
+TABLES = {
+    "users": {
+        "columns": ["id", "email", "full_name", "avatar_url", "auth_provider", "google_id",
+                    "created_at", "last_login"],
+        "datetimes": {"created_at", "last_login"},
+        "integers": {"id"},
+        "parent": None
+    },
+    "conversations": {
+        "columns": ["id", "user_id", "title", "first_message", "created_at", "updated_at"],
+        "datetimes": {"created_at", "updated_at"},
+        "integers": {"id", "user_id"},
+        "parent": ("user_id", "users")
+    },
+    "messages": {
+        "columns": ["id", "conversation_id", "role", "content", "created_at"],
+        "datetimes": {"created_at"},
+        "integers": {"id", "conversation_id"},
+        "parent": ("conversation_id", "conversations")
+    }
+}
+
+def connect():
+    """Connection riêng (không lấy từ pool của server) cho các truy vấn chạy lâu"""
+    conn = mysql.connector.connect(**database.db_config)
+    cursor = conn.cursor()
+    # Thời gian theo UTC ở cả hai phía; server không ngắt khi client ghi file chậm hơn tốc độ đọc
+    cursor.execute("SET SESSION time_zone = '+00:00', net_write_timeout = 3600, net_read_timeout = 3600")
+    cursor.close()
+    return conn
+
+def _columns(table, include_password_hash=False):
+    columns = list(TABLES[table]["columns"])
+    if table == "users" and include_password_hash:
+        columns.insert(2, "password_hash")
+    return columns
+
+def _save_json(path, data):
+    """Ghi file JSON nguyên tử (ghi file tạm rồi đổi tên)"""
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp, path)
+
+def _load_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def _rate(rows, seconds):
+    return round(rows / seconds) if seconds > 0 else 0
+
+# ==================== PART FILES ====================
+
+class JsonlPartWriter:
+    """Một part JSONL nén gzip: mỗi dòng là một object {cột: giá trị}"""
+
+    def __init__(self, path, columns, spec):
+        self.columns = columns
+        self.datetimes = [i for i, column in enumerate(columns) if column in spec["datetimes"]]
+        self.file = gzip.open(path, "wt", encoding="utf-8", compresslevel=6)
+
+    def write(self, rows):
+        lines = []
+        for row in rows:
+            row = list(row)
+            for i in self.datetimes:
+                if row[i] is not None:
+                    row[i] = row[i].isoformat()
+            lines.append(json.dumps(dict(zip(self.columns, row)), ensure_ascii=False))
+        self.file.write("\n".join(lines) + "\n")
+
+    def close(self):
+        self.file.close()
+
+class ParquetPartWriter:
+    """Một part Parquet (nén zstd), mỗi batch là một row group"""
+
+    def __init__(self, path, columns, spec):
+        self.columns = columns
+        self.schema = pyarrow.schema([
+            (column, pyarrow.timestamp("us") if column in spec["datetimes"]
+             else pyarrow.int64() if column in spec["integers"]
+             else pyarrow.string())
+            for column in columns])
+        self.writer = pyarrow.parquet.ParquetWriter(path, self.schema, compression="zstd")
+
+    def write(self, rows):
+        data = {column: [row[i] for row in rows] for i, column in enumerate(self.columns)}
+        self.writer.write_table(pyarrow.Table.from_pydict(data, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+def read_part(path, fmt, columns, datetimes, batch_size):
+    """Đọc một part theo từng batch danh sách tuple (theo thứ tự columns), bộ nhớ giới hạn theo batch_size"""
+    if fmt == "parquet":
+        parquet_file = pyarrow.parquet.ParquetFile(path)
+        for batch in parquet_file.iter_batches(batch_size=batch_size, columns=columns):
+            data = batch.to_pydict()
+            yield list(zip(*(data[column] for column in columns)))
+        return
+
+    batch = []
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            item = json.loads(line)
+            for column in datetimes:
+                if item.get(column):
+                    item[column] = datetime.fromisoformat(item[column])
+            batch.append(tuple(item.get(column) for column in columns))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+# ==================== EXPORT ====================
+
+def export_table(conn, out_dir, manifest, table, batch_size, part_rows):
+    """Export một bảng từ checkpoint trong manifest, cập nhật manifest sau mỗi part"""
+    state = manifest["tables"][table]
+    if state["complete"]:
+        return {"rows": 0, "seconds": 0.0}
+    fmt = manifest["format"]
+    columns = state["columns"]
+    spec = TABLES[table]
+
+    query = f"SELECT {', '.join(columns)} FROM {table} WHERE id > %s"
+    params = [state["last_id"]]
+    if spec["parent"]:
+        column, parent = spec["parent"]
+        query += f" AND {column} <= %s"
+        params.append(manifest["tables"][parent]["last_id"])
+    query += " ORDER BY id"
+
+    start = time.perf_counter()
+    exported = 0
+    writer = None
+    part = None
+    # Cursor không buffer: dòng được đọc dần từ server, không nạp cả bảng vào bộ nhớ
+    cursor = conn.cursor(buffered=False)
+    try:
+        cursor.execute(query, params)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if rows:
+                if writer is None:
+                    name = f"{table}-{len(state['parts']) + 1:05d}{FORMATS[fmt]}"
+                    part = {"file": name, "rows": 0, "first_id": rows[0][0], "last_id": None}
+                    writer_class = ParquetPartWriter if fmt == "parquet" else JsonlPartWriter
+                    writer = writer_class(os.path.join(out_dir, name + ".tmp"), columns, spec)
+                writer.write(rows)
+                part["rows"] += len(rows)
+                part["last_id"] = rows[-1][0]
+                exported += len(rows)
+
+            if writer is not None and (not rows or part["rows"] >= part_rows):
+                writer.close()
+                os.replace(os.path.join(out_dir, part["file"] + ".tmp"), os.path.join(out_dir, part["file"]))
+                state["parts"].append(part)
+                state["rows"] += part["rows"]
+                state["last_id"] = part["last_id"]
+                _save_json(os.path.join(out_dir, MANIFEST), manifest)
+                elapsed = time.perf_counter() - start
+                logging.info(f"Export {table}: xong {part['file']} ({part['rows']} dòng), "
+                             f"{exported} dòng trong {elapsed:.1f}s ({_rate(exported, elapsed)} dòng/s)")
+                writer = None
+            if not rows:
+                break
+    finally:
+        if writer is not None:
+            writer.close()
+        cursor.close()
+
+    state["complete"] = True
+    _save_json(os.path.join(out_dir, MANIFEST), manifest)
+    return {"rows": exported, "seconds": time.perf_counter() - start}
+
+def export_history(out_dir, fmt="jsonl", batch_size=5000, part_rows=500000, include_password_hash=False):
+    """Export users/conversations/messages vào out_dir, tiếp tục từ manifest nếu đã có; trả về thống kê theo bảng"""
+    if fmt == "parquet" and pyarrow is None:
+        raise RuntimeError("Chưa cài pyarrow: dùng --format jsonl hoặc pip install pyarrow")
+    os.makedirs(out_dir, exist_ok=True)
+    manifest_path = os.path.join(out_dir, MANIFEST)
+    manifest = _load_json(manifest_path)
+    if manifest is None:
+        manifest = {
+            "version": MANIFEST_VERSION,
+            "format": fmt,
+            "time_zone": "+00:00",
+            "started_at": datetime.now(timezone.utc).isoformat(),
+            "tables": {table: {"columns": _columns(table, include_password_hash), "parts": [], "rows": 0,
+                               "last_id": 0, "complete": False} for table in TABLES}
+        }
+        _save_json(manifest_path, manifest)
+    elif manifest.get("version") != MANIFEST_VERSION or manifest.get("format") != fmt:
+        raise RuntimeError(f"{out_dir} chứa bản export khác phiên bản hoặc định dạng ({manifest.get('format')})")
+    else:
+        logging.info("Tiếp tục export từ checkpoint: " + ", ".join(
+            f"{table} id > {state['last_id']}" for table, state in manifest["tables"].items()))
+
+    # Part đang ghi dở của lần chạy bị ngắt
+    for name in os.listdir(out_dir):
+        if name.endswith(".tmp"):
+            os.remove(os.path.join(out_dir, name))
+
+    stats = {}
+    conn = connect()
+    try:
+        for table in TABLES:
+            stats[table] = export_table(conn, out_dir, manifest, table, batch_size, part_rows)
+    finally:
+        conn.close()
+    return stats
+
+# ==================== IMPORT ====================
+
+def insert_batch(cursor, table, columns, rows):
+    """Một câu INSERT nhiều dòng; dòng có id đã tồn tại được bỏ qua (import lại sau khi bị ngắt)"""
+    placeholders = "(" + ", ".join(["%s"] * len(columns)) + ")"
+    query = (f"INSERT INTO {table} ({', '.join(columns)}) VALUES "
+             + ", ".join([placeholders] * len(rows))
+             + " ON DUPLICATE KEY UPDATE id = id")
+    cursor.execute(query, [value for row in rows for value in row])
+
+def _row_bytes(row):
+    return sum(len(value) if isinstance(value, str) else 8 for value in row)
+
+def import_table(conn, in_dir, manifest, checkpoint, table, batch_size, max_batch_bytes):
+    """Import các part của một bảng, bỏ qua các dòng có id <= checkpoint"""
+    state = manifest["tables"][table]
+    columns = state["columns"]
+    datetimes = TABLES[table]["datetimes"]
+    checkpoint_path = os.path.join(in_dir, IMPORT_CHECKPOINT)
+    last_id = checkpoint.get(table, 0)
+
+    start = time.perf_counter()
+    imported = 0
+    cursor = conn.cursor()
+
+    def flush(rows):
+        nonlocal imported
+        insert_batch(cursor, table, columns, rows)
+        conn.commit()
+        imported += len(rows)
+        checkpoint[table] = rows[-1][0]
+        _save_json(checkpoint_path, checkpoint)
+
+    try:
+        for part in state["parts"]:
+            if part["last_id"] <= last_id:
+                continue
+            path = os.path.join(in_dir, part["file"])
+            pending, pending_bytes = [], 0
+            for rows in read_part(path, manifest["format"], columns, datetimes, batch_size):
+                for row in rows:
+                    if row[0] <= last_id:
+                        continue
+                    pending.append(row)
+                    pending_bytes += _row_bytes(row)
+                    # Giới hạn cả số byte để câu INSERT không vượt max_allowed_packet khi message dài
+                    if len(pending) >= batch_size or pending_bytes >= max_batch_bytes:
+                        flush(pending)
+                        pending, pending_bytes = [], 0
+            if pending:
+                flush(pending)
+            elapsed = time.perf_counter() - start
+            logging.info(f"Import {table}: xong {part['file']}, {imported} dòng trong {elapsed:.1f}s "
+                         f"({_rate(imported, elapsed)} dòng/s)")
+    finally:
+        cursor.close()
+    return {"rows": imported, "seconds": time.perf_counter() - start}
+
+def import_history(in_dir, batch_size=1000, max_batch_bytes=4 * 1024 * 1024):
+    """Import bản export trong in_dir, tiếp tục từ import-checkpoint.json nếu có; trả về thống kê theo bảng"""
+    manifest = _load_json(os.path.join(in_dir, MANIFEST))
+    if manifest is None or manifest.get("version") != MANIFEST_VERSION:
+        raise RuntimeError(f"Không tìm thấy bản export hợp lệ trong {in_dir}")
+    if manifest["format"] == "parquet" and pyarrow is None:
+        raise RuntimeError("Bản export dạng Parquet cần pyarrow: pip install pyarrow")
+    incomplete = [table for table, state in manifest["tables"].items() if not state["complete"]]
+    if incomplete:
+        logging.warning(f"Bản export chưa xong ({', '.join(incomplete)}): chỉ import các part đã có")
+
+    checkpoint = _load_json(os.path.join(in_dir, IMPORT_CHECKPOINT)) or {}
+    stats = {}
+    conn = connect()
+    try:
+        conn.autocommit = False
+        for table in TABLES:
+            stats[table] = import_table(conn, in_dir, manifest, checkpoint, table, batch_size, max_batch_bytes)
+    finally:
+        conn.close()
+    return stats
+
+def print_stats(action, stats):
+    total_rows = sum(item["rows"] for item in stats.values())
+    total_seconds = sum(item["seconds"] for item in stats.values())
+    for table, item in stats.items():
+        print(f"{action} {table:<14} {item['rows']:>12} dòng  {item['seconds']:>9.1f}s  "
+              f"{_rate(item['rows'], item['seconds']):>10} dòng/s")
+    print(f"{action} {'tổng':<14} {total_rows:>12} dòng  {total_seconds:>9.1f}s  "
+          f"{_rate(total_rows, total_seconds):>10} dòng/s")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = commands.add_parser("export", help="Export lịch sử ra thư mục")
+    export_parser.add_argument("directory")
+    export_parser.add_argument("--format", choices=sorted(FORMATS), default="jsonl")
+    export_parser.add_argument("--batch-size", type=int, default=5000, help="Số dòng đọc từ MySQL mỗi lần")
+    export_parser.add_argument("--part-rows", type=int, default=500000,
+                               help="Số dòng tối đa mỗi part (cũng là bước checkpoint)")
+    export_parser.add_argument("--include-password-hash", action="store_true",
+                               help="Export cả password_hash (để khôi phục đăng nhập local)")
+
+    import_parser = commands.add_parser("import", help="Import thư mục export vào database")
+    import_parser.add_argument("directory")
+    import_parser.add_argument("--batch-size", type=int, default=1000, help="Số dòng mỗi câu INSERT")
+    import_parser.add_argument("--max-batch-bytes", type=int, default=4 * 1024 * 1024,
+                               help="Kích thước dữ liệu tối đa mỗi câu INSERT")
+    args = parser.parse_args()
+
+    try:
+        if args.command == "export":
+            stats = export_history(args.directory, args.format, args.batch_size, args.part_rows,
+                                   args.include_password_hash)
+        else:
+            stats = import_history(args.directory, args.batch_size, args.max_batch_bytes)
+    except (RuntimeError, mysql.connector.Error) as err:
+        logging.error(f"{args.command} thất bại (chạy lại để tiếp tục từ checkpoint): {err}")
+        sys.exit(1)
+    print_stats(args.command, stats)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+import os
+import time
+import pickle
+import logging
+import threading
+from collections import OrderedDict
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+_MISSING = object()
+
+class TTLCache:
+    """Cache trong tiến trình với thời hạn (TTL) và loại bỏ theo LRU khi đầy"""
+
+    def __init__(self, max_size=1024, ttl=300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING:
+                return default
+            value, expires_at = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + (ttl if ttl is not None else self.ttl)
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+class NullCache:
+    """Cache rỗng (tắt cache) với cùng interface"""
+
+    def get(self, key, default=None):
+        return default
+
+    def set(self, key, value, ttl=None):
+        pass
+
+    def delete(self, key):
+        pass
+
+    def clear(self):
+        pass
+
+class RedisCache:
+    """Cache dùng chung giữa các worker qua Redis, cùng interface với TTLCache
+
+    Giá trị được pickle; việc loại bỏ khi đầy do cấu hình maxmemory-policy
+    của Redis (ví dụ allkeys-lru) đảm nhận.
+    """
+
+    def __init__(self, client, prefix, ttl=300):
+        self.client = client
+        self.prefix = prefix
+        self.ttl = ttl
+
+    def _key(self, key):
+        return f"{self.prefix}:{key}"
+
+    def get(self, key, default=None):
+        try:
+            raw = self.client.get(self._key(key))
+        except redis.RedisError as err:
+            logging.error(f"Lỗi đọc Redis cache: {err}")
+            return default
+        return default if raw is None else pickle.loads(raw)
+
+    def set(self, key, value, ttl=None):
+        try:
+            self.client.set(self._key(key), pickle.dumps(value), ex=int(ttl if ttl is not None else self.ttl))
+        except redis.RedisError as err:
+            logging.error(f"Lỗi ghi Redis cache: {err}")
+
+    def delete(self, key):
+        try:
+            self.client.delete(self._key(key))
+        except redis.RedisError as err:
+            logging.error(f"Lỗi xóa Redis cache: {err}")
+
+    def clear(self):
+        try:
+            for key in self.client.scan_iter(f"{self.prefix}:*"):
+                self.client.delete(key)
+        except redis.RedisError as err:
+            logging.error(f"Lỗi xóa Redis cache: {err}")
+
+_redis_client = None
+
+def get_redis_client():
+    """Redis client dùng chung trong tiến trình (cấu hình qua REDIS_URL)"""
+    global _redis_client
+    if redis is None:
+        raise Exception("Thư viện redis chưa được cài đặt")
+    if _redis_client is None:
+        _redis_client = redis.Redis.from_url(os.getenv("REDIS_URL", "redis://localhost:6379/0"))
+    return _redis_client
@@ -0,0 +1,264 @@
+import os
+import logging
+import threading
+import cache
+import database
+import metrics
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Số token cộng thêm cho mỗi message (role, ký tự phân tách) trong định dạng chat của OpenAI
+MESSAGE_OVERHEAD_TOKENS = 4
+# Giới hạn phần lịch sử đưa vào một lần tóm tắt (phần cũ hơn bị bỏ qua)
+SUMMARY_INPUT_MAX_TOKENS = 16000
+
+SUMMARY_PROMPT = """
+Bạn tóm tắt lịch sử một cuộc hội thoại giữa người dùng và trợ lý lập trình CodeMate.
+Gộp bản tóm tắt trước đó (nếu có) với các lượt mới thành MỘT bản tóm tắt ngắn gọn bằng tiếng Việt.
+Giữ lại: mục tiêu của người dùng, ngôn ngữ/thư viện/phiên bản đang dùng, các quyết định và kết luận đã đưa ra,
+tên hàm/biến/lỗi quan trọng. Bỏ qua lời chào và các chi tiết không còn cần thiết.
+"""
+
+class TokenCounter:
+    """Đếm token cục bộ bằng tiktoken; nếu chưa cài tiktoken thì ước lượng theo số ký tự
+
+    Bảng mã được nạp lười ở lần đếm đầu tiên (hoặc khi warm-up gọi load()),
+    vì lần đầu tiktoken có thể phải tải file BPE từ mạng.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self._encoding = None
+        self._loaded = False
+        self._lock = threading.Lock()
+        if not tiktoken:
+            logging.warning("Chưa cài tiktoken, số token của context chỉ là ước lượng")
+
+    def load(self):
+        """Nạp bảng mã tiktoken (idempotent), None nếu không dùng được"""
+        if self._loaded or not tiktoken:
+            return self._encoding
+        with self._lock:
+            if not self._loaded:
+                try:
+                    try:
+                        self._encoding = tiktoken.encoding_for_model(self.model)
+                    except KeyError:
+                        self._encoding = tiktoken.get_encoding("o200k_base")
+                except Exception as e:
+                    logging.error(f"Lỗi nạp bảng mã tiktoken, chuyển sang ước lượng: {e}")
+                self._loaded = True
+        return self._encoding
+
+    def count(self, text):
+        encoding = self.load()
+        if encoding:
+            return len(encoding.encode(text, disallowed_special=()))
+        # Khoảng 3 ký tự/token (tiếng Việt có dấu tốn token hơn tiếng Anh)
+        return len(text) // 3 + 1
+
+    def message(self, content):
+        return self.count(content) + MESSAGE_OVERHEAD_TOKENS
+
+class ConversationState:
+    """Lịch sử đã nạp của một conversation: bản tóm tắt + các messages sau nó"""
+
+    def __init__(self, summary="", summary_upto=0):
+        self.summary = summary
+        self.summary_upto = summary_upto
+        self.summary_tokens = 0
+        self.messages = []
+        self.last_id = summary_upto
+        self.summarizing = False
+        self.lock = threading.Lock()
+
+    def extend(self, rows, counter):
+        """Thêm các messages mới (bỏ qua những message đã có)"""
+        for row in rows:
+            if row["id"] > self.last_id:
+                self.messages.append({
+                    "id": row["id"],
+                    "role": row["role"],
+                    "content": row["content"],
+                    "tokens": counter.message(row["content"])
+                })
+                self.last_id = row["id"]
+
+class ContextBuilder:
+    """Ghép lịch sử hội thoại vào prompt trong một ngân sách token cố định
+
+    Lịch sử của mỗi conversation được giữ trong bộ nhớ, mỗi lượt chỉ nạp thêm
+    các messages mới (id lớn hơn message cuối đã thấy). Khi lịch sử vượt ngân
+    sách, các lượt cũ nhất được gộp vào một bản tóm tắt cuốn chiếu (lưu ở bảng
+    conversation_summaries), nên kích thước prompt luôn bị chặn trên dù cuộc
+    hội thoại dài đến đâu. Mỗi lần gộp chỉ giữ lại keep_ratio ngân sách cho các
+    lượt gần nhất để không phải tóm tắt lại ở mọi lượt.
+    """
+
+    def __init__(self, model, max_tokens=6000, summary_model="gpt-4o-mini", summary_max_tokens=400,
+                 keep_ratio=0.5, max_conversations=1000, ttl=1800):
+        self.counter = TokenCounter(model)
+        self.max_tokens = max_tokens
+        self.summary_model = summary_model
+        self.summary_max_tokens = summary_max_tokens
+        self.keep_ratio = keep_ratio
+        self.states = cache.TTLCache(max_conversations, ttl)
+
+    @classmethod
+    def from_env(cls, model):
+        """Tạo builder từ các biến môi trường CONTEXT_*"""
+        return cls(
+            model,
+            max_tokens=int(os.getenv("CONTEXT_MAX_TOKENS", "6000")),
+            summary_model=os.getenv("CONTEXT_SUMMARY_MODEL", "gpt-4o-mini"),
+            summary_max_tokens=int(os.getenv("CONTEXT_SUMMARY_MAX_TOKENS", "400")),
+            keep_ratio=float(os.getenv("CONTEXT_KEEP_RATIO", "0.5"))
+        )
+
+    # ==================== LẬP KẾ HOẠCH ====================
+
+    def _plan(self, state, system_prompt, user_input):
+        """Chọn các messages gần nhất vừa ngân sách; trả về (history, folded)
+
+        folded là các messages cũ cần gộp vào bản tóm tắt (rỗng nếu vẫn vừa).
+        Luôn chừa chỗ cho bản tóm tắt ở kích thước tối đa của nó.
+        """
+        budget = self.max_tokens - self.counter.message(system_prompt) - self.counter.message(user_input) \
+            - (self.summary_max_tokens + MESSAGE_OVERHEAD_TOKENS)
+        messages = state.messages
+        if sum(m["tokens"] for m in messages) <= budget:
+            return list(messages), []
+
+        target = max(0, budget) * self.keep_ratio
+        kept = 0
+        start = len(messages)
+        while start > 0 and kept + messages[start - 1]["tokens"] <= target:
+            kept += messages[start - 1]["tokens"]
+            start -= 1
+        # Cắt ở ranh giới lượt: phần giữ lại không bắt đầu bằng câu trả lời của trợ lý
+        while start < len(messages) and messages[start]["role"] == "assistant":
+            start += 1
+        return messages[start:], messages[:start]
+
+    def _begin(self, state, system_prompt, user_input):
+        with state.lock:
+            history, folded = self._plan(state, system_prompt, user_input)
+            if folded and state.summarizing:
+                # Request khác đang tóm tắt: lượt này chỉ cắt bớt lịch sử
+                return history, []
+            state.summarizing = bool(folded)
+            return history, folded
+
+    def _summary_messages(self, previous, folded):
+        selected = []
+        total = 0
+        for m in reversed(folded):
+            total += m["tokens"]
+            if total > SUMMARY_INPUT_MAX_TOKENS:
+                break
+            selected.append(m)
+        transcript = "\n\n".join(
+            f"{'Người dùng' if m['role'] == 'user' else 'Trợ lý'}: {m['content']}" for m in reversed(selected)
+        )
+        content = f"Tóm tắt trước đó:\n{previous}\n\nCác lượt mới:\n{transcript}" if previous else transcript
+        return [
+            {"role": "system", "content": SUMMARY_PROMPT},
+            {"role": "user", "content": content}
+        ]
+
+    def _apply_summary(self, state, folded, summary):
+        with state.lock:
+            state.summary = summary
+            state.summary_tokens = self.counter.message(summary)
+            state.summary_upto = folded[-1]["id"]
+            state.messages = [m for m in state.messages if m["id"] > state.summary_upto]
+
+    def _compose(self, state, history, system_prompt, user_input):
+        messages = [{"role": "system", "content": system_prompt}]
+        if state.summary:
+            messages.append({"role": "system", "content": f"Tóm tắt phần đầu cuộc hội thoại:\n{state.summary}"})
+        messages.extend({"role": m["role"], "content": m["content"]} for m in history)
+        messages.append({"role": "user", "content": user_input})
+        return messages
+
+    def _new_state(self, row):
+        state = ConversationState(row["summary"], row["last_message_id"]) if row else ConversationState()
+        if state.summary:
+            state.summary_tokens = self.counter.message(state.summary)
+        return state
+
+    # ==================== ĐỒNG BỘ (WSGI) ====================
+
+    def _load(self, conversation_id):
+        state = self.states.get(conversation_id)
+        if state is None:
+            state = self._new_state(database.get_conversation_summary(conversation_id))
+            self.states.set(conversation_id, state)
+        rows = database.get_messages_after(conversation_id, state.last_id)
+        with state.lock:
+            state.extend(rows, self.counter)
+        return state
+
+    def build(self, conversation_id, system_prompt, user_input, client):
+        """Danh sách messages gửi OpenAI: system, tóm tắt (nếu có), lịch sử gần nhất, câu hỏi mới"""
+        state = self._load(conversation_id)
+        history, folded = self._begin(state, system_prompt, user_input)
+        if folded:
+            try:
+                completion = client.create(
+                    model=self.summary_model,
+                    messages=self._summary_messages(state.summary, folded),
+                    max_tokens=self.summary_max_tokens
+                )
+                metrics.record_usage(self.summary_model, completion.usage)
+                summary = completion.choices[0].message.content.strip()
+                database.save_conversation_summary(conversation_id, summary, folded[-1]["id"])
+                self._apply_summary(state, folded, summary)
+                logging.info(f"Gộp {len(folded)} messages cũ của conversation {conversation_id} vào tóm tắt")
+            except Exception as e:
+                # Không tóm tắt được: lượt này chỉ dùng phần lịch sử vừa ngân sách
+                logging.error(f"Lỗi khi tóm tắt conversation {conversation_id}: {e}")
+            finally:
+                state.summarizing = False
+        return self._compose(state, history, system_prompt, user_input)
+
+    # ==================== BẤT ĐỒNG BỘ (ASGI) ====================
+
+    async def _aload(self, conversation_id):
+        import async_database
+        state = self.states.get(conversation_id)
+        if state is None:
+            state = self._new_state(await async_database.get_conversation_summary(conversation_id))
+            self.states.set(conversation_id, state)
+        rows = await async_database.get_messages_after(conversation_id, state.last_id)
+        with state.lock:
+            state.extend(rows, self.counter)
+        return state
+
+    async def abuild(self, conversation_id, system_prompt, user_input, async_client):
+        """Phiên bản async của build() dùng async_database và AsyncOpenAI"""
+        import async_database
+        state = await self._aload(conversation_id)
+        history, folded = self._begin(state, system_prompt, user_input)
+        if folded:
+            try:
+                completion = await async_client.create(
+                    model=self.summary_model,
+                    messages=self._summary_messages(state.summary, folded),
+                    max_tokens=self.summary_max_tokens
+                )
+                metrics.record_usage(self.summary_model, completion.usage)
+                summary = completion.choices[0].message.content.strip()
+                await async_database.save_conversation_summary(conversation_id, summary, folded[-1]["id"])
+                self._apply_summary(state, folded, summary)
+                logging.info(f"Gộp {len(folded)} messages cũ của conversation {conversation_id} vào tóm tắt")
+            except Exception as e:
+                logging.error(f"Lỗi khi tóm tắt conversation {conversation_id}: {e}")
+            finally:
+                state.summarizing = False
+        return self._compose(state, history, system_prompt, user_input)
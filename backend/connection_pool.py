@@ -0,0 +1,174 @@
+import time
+import logging
+import threading
+from collections import deque
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Mốc của histogram thời gian chờ checkout (ms)
+WAIT_BUCKETS_MS = (1, 5, 10, 50, 100, 500, 1000, 5000)
+
+class PoolTimeout(Exception):
+    """Không lấy được connection trong thời gian chờ cho phép"""
+
+    def __init__(self, timeout):
+        super().__init__(f"Hết thời gian chờ connection ({timeout}s)")
+        self.timeout = timeout
+
+class PooledConnection:
+    """Connection mượn từ pool: close() trả connection về pool thay vì đóng hẳn"""
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def close(self):
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            self._pool._release(conn)
+
+class ConnectionPool:
+    """Pool connection có hàng chờ giới hạn thời gian, connection tràn và kiểm tra liveness
+
+    - Tối đa size connection được giữ lại khi rảnh; khi tất cả đang bận, pool
+      mở thêm tối đa max_overflow connection tạm (đóng ngay khi trả về).
+    - Khi đã đạt size + max_overflow, get_connection() chờ tối đa timeout giây
+      rồi raise PoolTimeout (thay vì báo lỗi ngay như MySQLConnectionPool).
+    - Connection đã rảnh quá ping_after giây được ping trước khi giao; nếu
+      chết thì được mở lại.
+    """
+
+    def __init__(self, connect, size=5, max_overflow=5, timeout=10.0, ping_after=30.0, ping=None):
+        self._connect = connect
+        self._ping = ping or (lambda conn: conn.ping(reconnect=False))
+        self.size = size
+        self.max_overflow = max_overflow
+        self.timeout = timeout
+        self.ping_after = ping_after
+        self._idle = deque()
+        self._cond = threading.Condition()
+        self._open = 0
+        self._checked_out = 0
+        self._waiting = 0
+        self._stats = {"timeouts": 0, "overflow_opened": 0, "reconnects": 0, "connect_errors": 0}
+        self._wait_histogram = [0] * (len(WAIT_BUCKETS_MS) + 1)
+        self._wait_total = 0.0
+
+    def get_connection(self):
+        """Mượn một connection (nhớ gọi close() để trả lại)"""
+        start = time.monotonic()
+        deadline = start + self.timeout
+        with self._cond:
+            while True:
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                    break
+                if self._open < self.size + self.max_overflow:
+                    if self._open >= self.size:
+                        self._stats["overflow_opened"] += 1
+                    self._open += 1
+                    conn, last_used = None, None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats["timeouts"] += 1
+                    raise PoolTimeout(self.timeout)
+                self._waiting += 1
+                self._cond.wait(remaining)
+                self._waiting -= 1
+            self._checked_out += 1
+            self._record_wait(time.monotonic() - start)
+
+        try:
+            if conn is None:
+                conn = self._open_connection()
+            elif time.monotonic() - last_used > self.ping_after and not self._alive(conn):
+                self._close_quietly(conn)
+                conn = self._open_connection()
+                with self._cond:
+                    self._stats["reconnects"] += 1
+        except Exception:
+            with self._cond:
+                self._open -= 1
+                self._checked_out -= 1
+                self._cond.notify()
+            raise
+        return PooledConnection(self, conn)
+
+    def _open_connection(self):
+        try:
+            return self._connect()
+        except Exception:
+            with self._cond:
+                self._stats["connect_errors"] += 1
+            raise
+
+    def _alive(self, conn):
+        try:
+            self._ping(conn)
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _release(self, conn):
+        # Bỏ transaction dở dang để connection sạch khi giao cho request khác
+        try:
+            if getattr(conn, "in_transaction", True):
+                conn.rollback()
+        except Exception:
+            self._close_quietly(conn)
+            conn = None
+        with self._cond:
+            self._checked_out -= 1
+            if conn is not None and len(self._idle) < self.size:
+                self._idle.append((conn, time.monotonic()))
+            else:
+                self._open -= 1
+                if conn is not None:
+                    self._close_quietly(conn)
+            self._cond.notify()
+
+    def _record_wait(self, seconds):
+        self._wait_total += seconds
+        ms = seconds * 1000
+        for i, bound in enumerate(WAIT_BUCKETS_MS):
+            if ms <= bound:
+                self._wait_histogram[i] += 1
+                return
+        self._wait_histogram[-1] += 1
+
+    def stats(self):
+        """Số liệu của pool: connection đang mượn/rảnh, số lần chờ quá hạn, histogram thời gian chờ"""
+        with self._cond:
+            checkouts = sum(self._wait_histogram)
+            labels = [f"<={b}ms" for b in WAIT_BUCKETS_MS] + [f">{WAIT_BUCKETS_MS[-1]}ms"]
+            return {
+                "checkouts": checkouts,
+                **self._stats,
+                "size": self.size,
+                "max_overflow": self.max_overflow,
+                "open": self._open,
+                "checked_out": self._checked_out,
+                "idle": len(self._idle),
+                "waiting": self._waiting,
+                "avg_wait_ms": round(self._wait_total / checkouts * 1000, 3) if checkouts else 0.0,
+                "wait_histogram": dict(zip(labels, self._wait_histogram))
+            }
+
+    def close(self):
+        """Đóng các connection đang rảnh"""
+        with self._cond:
+            while self._idle:
+                conn, _ = self._idle.pop()
+                self._open -= 1
+                self._close_quietly(conn)
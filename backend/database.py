@@ -1,55 +1,116 @@
 import os
+import base64
+from datetime import datetime
 import mysql.connector
-from mysql.connector import pooling
 import logging
+import connection_pool
+import cache
+import metrics
+import passwords
 from dotenv import load_dotenv
-import bcrypt
 
 load_dotenv()
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 # Tạo connection pool
-try:
-    db_config = {
-        "pool_name": "codemate_pool",
-        "pool_size": 5,
-        "host": os.getenv("DB_HOST", "localhost"),
-        "port": int(os.getenv("DB_PORT", "3306")),
-        "user": os.getenv("DB_USER", "root"),
-        "password": os.getenv("DB_PASSWORD", ""),
-        "database": os.getenv("DB_NAME", "codemate_db")
-    }
-    
-    unix_socket = os.getenv("DB_SOCKET")
-    if unix_socket:
-        db_config["unix_socket"] = unix_socket
-    
-    db_pool = pooling.MySQLConnectionPool(**db_config)
-    logging.info("Khởi tạo MySQL connection pool thành công.")
-except mysql.connector.Error as err:
-    logging.error(f"Lỗi khi khởi tạo connection pool: {err}")
-    db_pool = None
+db_config = {
+    "host": os.getenv("DB_HOST", "localhost"),
+    "port": int(os.getenv("DB_PORT", "3306")),
+    "user": os.getenv("DB_USER", "root"),
+    "password": os.getenv("DB_PASSWORD", ""),
+    "database": os.getenv("DB_NAME", "codemate_db")
+}
+
+unix_socket = os.getenv("DB_SOCKET")
+if unix_socket:
+    db_config["unix_socket"] = unix_socket
+
+# Connection được mở khi cần; khi pool hết chỗ, request chờ tối đa DB_POOL_TIMEOUT giây
+# rồi nhận PoolTimeout (route trả 503) thay vì lỗi ngay lập tức
+db_pool = connection_pool.ConnectionPool(
+    lambda: mysql.connector.connect(**db_config),
+    size=int(os.getenv("DB_POOL_SIZE", "5")),
+    max_overflow=int(os.getenv("DB_POOL_MAX_OVERFLOW", "5")),
+    timeout=float(os.getenv("DB_POOL_TIMEOUT", "10")),
+    ping_after=float(os.getenv("DB_POOL_PING_AFTER", "30"))
+)
+logging.info(f"Khởi tạo MySQL connection pool (size={db_pool.size}, overflow={db_pool.max_overflow}).")
+
+# Hash/kiểm tra bcrypt chạy trong process pool riêng (BCRYPT_ROUNDS, PASSWORD_HASH_WORKERS)
+password_hasher = passwords.PasswordHasher.from_env()
+
+# Số ký tự đầu của message đầu tiên được lưu làm preview của conversation
+PREVIEW_LENGTH = 100
+
+# Thời gian mỗi hàm truy vấn (kể cả chờ connection), xuất ở /metrics
+timed_query = metrics.timed(metrics.DB_QUERY_SECONDS)
 
 def get_connection():
-    """Lấy connection từ pool"""
-    if not db_pool:
-        raise Exception("Connection pool không khả dụng")
+    """Lấy connection từ pool (raise connection_pool.PoolTimeout nếu chờ quá lâu)"""
     return db_pool.get_connection()
 
+def ping():
+    """Kiểm tra kết nối MySQL (SELECT 1), dùng cho /readyz"""
+    conn = None
+    cursor = None
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT 1")
+        cursor.fetchall()
+        return True
+    except mysql.connector.Error as err:
+        logging.warning(f"MySQL chưa sẵn sàng: {err}")
+        return False
+    finally:
+        if cursor:
+            cursor.close()
+        if conn:
+            conn.close()
+
+# ==================== CACHE ====================
+
+def _make_cache(name, max_size, ttl):
+    """Cache đọc xuyên (read-through) cho dữ liệu ít thay đổi, chọn qua DB_CACHE_BACKEND
+
+    memory: TTL + LRU trong tiến trình; redis: dùng chung giữa các worker (REDIS_URL); off: tắt.
+    """
+    backend = os.getenv("DB_CACHE_BACKEND", "memory").lower()
+    if backend == "off":
+        return cache.NullCache()
+    if backend == "redis":
+        try:
+            return cache.RedisCache(cache.get_redis_client(), f"codemate:{name}", ttl)
+        except Exception as e:
+            logging.error(f"Không dùng được Redis cho cache {name}, chuyển sang bộ nhớ: {e}")
+    return cache.TTLCache(max_size, ttl)
+
+DB_CACHE_TTL = int(os.getenv("DB_CACHE_TTL", "300"))
+# user_id -> thông tin user (không gồm password_hash)
+user_cache = _make_cache("user", 10000, DB_CACHE_TTL)
+# conversation_id -> user_id sở hữu
+ownership_cache = _make_cache("conversation-owner", 100000, DB_CACHE_TTL)
+
 # ==================== USER MANAGEMENT ====================
 
+@timed_query
 def create_user(email, password, full_name, auth_provider='local', google_id=None):
     """Tạo user mới"""
+    # Hash trước khi mượn connection: không giữ connection trong lúc chờ bcrypt
+    password_hash = None
+    if password:
+        try:
+            password_hash = password_hasher.hash(password)
+        except Exception as e:
+            logging.error(f"Lỗi hash mật khẩu: {e}")
+            return None
+    
     conn = None
     cursor = None
     try:
         conn = get_connection()
         cursor = conn.cursor()
         
-        password_hash = None
-        if password:
-            password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
-        
         query = """
             INSERT INTO users (email, password_hash, full_name, auth_provider, google_id)
             VALUES (%s, %s, %s, %s, %s)
@@ -69,8 +130,9 @@ def create_user(email, password, full_name, auth_provider='local', google_id=Non
         if conn:
             conn.close()
 
-def verify_user(email, password):
-    """Xác thực user với email và password"""
+@timed_query
+def get_local_user_by_email(email):
+    """Lấy user đăng ký bằng email/password (kèm password_hash)"""
     conn = None
     cursor = None
     try:
@@ -79,16 +141,9 @@ def verify_user(email, password):
         
         query = "SELECT * FROM users WHERE email = %s AND auth_provider = 'local'"
         cursor.execute(query, (email,))
-        user = cursor.fetchone()
-        
-        if user and user['password_hash']:
-            if bcrypt.checkpw(password.encode('utf-8'), user['password_hash'].encode('utf-8')):
-                logging.info(f"Đăng nhập thành công: {email}")
-                return user
-        
-        return None
+        return cursor.fetchone()
     except mysql.connector.Error as err:
-        logging.error(f"Lỗi xác thực user: {err}")
+        logging.error(f"Lỗi lấy user: {err}")
         return None
     finally:
         if cursor:
@@ -96,6 +151,58 @@ def verify_user(email, password):
         if conn:
             conn.close()
 
+@timed_query
+def update_password_hash(user_id, password_hash):
+    """Ghi hash mật khẩu mới (rehash khi BCRYPT_ROUNDS thay đổi)"""
+    conn = None
+    cursor = None
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+        
+        query = "UPDATE users SET password_hash = %s WHERE id = %s"
+        cursor.execute(query, (password_hash, user_id))
+        conn.commit()
+        return True
+    except mysql.connector.Error as err:
+        logging.error(f"Lỗi cập nhật password hash: {err}")
+        return False
+    finally:
+        if cursor:
+            cursor.close()
+        if conn:
+            conn.close()
+
+def verify_user(email, password):
+    """Xác thực user với email và password"""
+    # Connection được trả về pool ngay sau SELECT, trước khi kiểm tra bcrypt
+    user = get_local_user_by_email(email)
+    if not user or not user['password_hash']:
+        return None
+    
+    try:
+        if not password_hasher.check(password, user['password_hash']):
+            return None
+    except Exception as e:
+        logging.error(f"Lỗi xác thực user: {e}")
+        return None
+    
+    # Hash cũ được tạo với cost khác: hash lại ngay khi đang có mật khẩu gốc
+    if password_hasher.needs_rehash(user['password_hash']):
+        try:
+            new_hash = password_hasher.hash(password)
+            if update_password_hash(user['id'], new_hash):
+                password_hasher.count_rehash()
+                user['password_hash'] = new_hash
+                logging.info(f"Đã rehash mật khẩu của {email} với cost {password_hasher.rounds}")
+        except Exception as e:
+            # Đăng nhập vẫn thành công, lần sau sẽ thử rehash lại
+            logging.error(f"Lỗi rehash mật khẩu: {e}")
+    
+    logging.info(f"Đăng nhập thành công: {email}")
+    return user
+
+@timed_query
 def get_or_create_google_user(google_id, email, full_name, avatar_url):
     """Lấy hoặc tạo user từ Google OAuth"""
     conn = None
@@ -118,6 +225,7 @@ def get_or_create_google_user(google_id, email, full_name, avatar_url):
             """
             cursor.execute(update_query, (full_name, avatar_url, google_id))
             conn.commit()
+            user_cache.delete(user['id'])
             logging.info(f"Cập nhật user Google: {email}")
             return user
         else:
@@ -144,17 +252,29 @@ def get_or_create_google_user(google_id, email, full_name, avatar_url):
         if conn:
             conn.close()
 
+@timed_query
 def get_user_by_id(user_id):
-    """Lấy thông tin user theo ID"""
+    """Lấy thông tin user theo ID (qua user_cache)"""
+    user = user_cache.get(user_id)
+    if user is not None:
+        return dict(user)
+    
     conn = None
     cursor = None
     try:
         conn = get_connection()
         cursor = conn.cursor(dictionary=True)
         
-        query = "SELECT * FROM users WHERE id = %s"
+        query = """
+            SELECT id, email, full_name, avatar_url, auth_provider, google_id, created_at, last_login
+            FROM users WHERE id = %s
+        """
         cursor.execute(query, (user_id,))
-        return cursor.fetchone()
+        user = cursor.fetchone()
+        if user:
+            user_cache.set(user_id, user)
+            return dict(user)
+        return None
     except mysql.connector.Error as err:
         logging.error(f"Lỗi lấy user: {err}")
         return None
@@ -166,6 +286,7 @@ def get_user_by_id(user_id):
 
 # ==================== CONVERSATION MANAGEMENT ====================
 
+@timed_query
 def create_conversation(user_id, title="Cuộc hội thoại mới"):
     """Tạo cuộc hội thoại mới"""
     conn = None
@@ -179,6 +300,7 @@ def create_conversation(user_id, title="Cuộc hội thoại mới"):
         conn.commit()
         
         conversation_id = cursor.lastrowid
+        ownership_cache.set(conversation_id, user_id)
         logging.info(f"Tạo conversation {conversation_id} cho user {user_id}")
         return conversation_id
     except mysql.connector.Error as err:
@@ -190,37 +312,153 @@ def create_conversation(user_id, title="Cuộc hội thoại mới"):
         if conn:
             conn.close()
 
-def get_user_conversations(user_id):
-    """Lấy danh sách conversations của user"""
+@timed_query
+def get_conversation_owner(conversation_id):
+    """user_id sở hữu conversation (qua ownership_cache), None nếu không tồn tại"""
+    owner = ownership_cache.get(conversation_id)
+    if owner is not None:
+        return owner
+    
+    conn = None
+    cursor = None
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute("SELECT user_id FROM conversations WHERE id = %s", (conversation_id,))
+        row = cursor.fetchone()
+        if not row:
+            # Không cache kết quả rỗng: id này có thể được tạo sau
+            return None
+        ownership_cache.set(conversation_id, row[0])
+        return row[0]
+    except mysql.connector.Error as err:
+        logging.error(f"Lỗi lấy chủ sở hữu conversation: {err}")
+        return None
+    finally:
+        if cursor:
+            cursor.close()
+        if conn:
+            conn.close()
+
+def user_owns_conversation(conversation_id, user_id):
+    """Conversation có thuộc user không"""
+    return get_conversation_owner(conversation_id) == user_id
+
+@timed_query
+def get_user_conversations(user_id, before=None, limit=30):
+    """Lấy một trang conversations của user, mới cập nhật trước (keyset theo updated_at, id)
+
+    Preview (first_message) là cột được ghi sẵn bởi save_message, và mọi cột
+    cần thiết đều nằm trong index idx_user_updated_cover nên truy vấn không
+    phải đọc bảng. Trả về (conversations, has_more).
+    """
     conn = None
     cursor = None
     try:
         conn = get_connection()
         cursor = conn.cursor(dictionary=True)
         
+        if before:
+            updated_at, conversation_id = decode_cursor(before)
+            query = """
+                SELECT id, title, created_at, updated_at, first_message
+                FROM conversations
+                WHERE user_id = %s
+                  AND (updated_at < %s OR (updated_at = %s AND id < %s))
+                ORDER BY updated_at DESC, id DESC
+                LIMIT %s
+            """
+            cursor.execute(query, (user_id, updated_at, updated_at, conversation_id, limit + 1))
+        else:
+            query = """
+                SELECT id, title, created_at, updated_at, first_message
+                FROM conversations
+                WHERE user_id = %s
+                ORDER BY updated_at DESC, id DESC
+                LIMIT %s
+            """
+            cursor.execute(query, (user_id, limit + 1))
+        conversations = cursor.fetchall()
+        
+        has_more = len(conversations) > limit
+        logging.info(f"Lấy {min(len(conversations), limit)} conversations cho user {user_id}")
+        return conversations[:limit], has_more
+    except mysql.connector.Error as err:
+        logging.error(f"Lỗi lấy conversations: {err}")
+        return [], False
+    finally:
+        if cursor:
+            cursor.close()
+        if conn:
+            conn.close()
+
+@timed_query
+def get_conversations_version(user_id):
+    """Phiên bản danh sách conversations của user: {count, updated_at, max_id}, None nếu lỗi
+
+    Mọi thay đổi (message mới, đổi tiêu đề) đều đẩy updated_at của conversation
+    lên lớn nhất, thêm/xóa thì đổi count/max_id, nên bộ ba này đổi khi và chỉ
+    khi danh sách đổi. Chỉ quét index idx_user_updated_cover, không đọc bảng.
+    """
+    conn = None
+    cursor = None
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+        
         query = """
-            SELECT c.id, c.title, c.created_at, c.updated_at,
-                   (SELECT content FROM messages
-                    WHERE conversation_id = c.id AND role = 'user'
-                    ORDER BY created_at ASC LIMIT 1) as first_message
-            FROM conversations c
-            WHERE c.user_id = %s
-            ORDER BY c.updated_at DESC
+            SELECT COUNT(*), MAX(updated_at), COALESCE(MAX(id), 0)
+            FROM conversations
+            WHERE user_id = %s
         """
         cursor.execute(query, (user_id,))
+        count, updated_at, max_id = cursor.fetchone()
+        return {"count": count, "updated_at": updated_at, "max_id": max_id}
+    except mysql.connector.Error as err:
+        logging.error(f"Lỗi lấy phiên bản conversations: {err}")
+        return None
+    finally:
+        if cursor:
+            cursor.close()
+        if conn:
+            conn.close()
+
+@timed_query
+def get_conversations_since(user_id, since=None, limit=100):
+    """Các conversations có updated_at >= since (mới cập nhật trước), trả về (conversations, has_more)
+
+    since=None lấy từ đầu. So sánh >= nên dòng cập nhật cùng thời điểm với
+    since được gửi lại, client ghi đè theo id.
+    """
+    conn = None
+    cursor = None
+    try:
+        conn = get_connection()
+        cursor = conn.cursor(dictionary=True)
+        
+        query = """
+            SELECT id, title, created_at, updated_at, first_message
+            FROM conversations
+            WHERE user_id = %s AND updated_at >= %s
+            ORDER BY updated_at DESC, id DESC
+            LIMIT %s
+        """
+        cursor.execute(query, (user_id, since or datetime.min, limit + 1))
         conversations = cursor.fetchall()
         
-        logging.info(f"Lấy {len(conversations)} conversations cho user {user_id}")
-        return conversations
+        has_more = len(conversations) > limit
+        return conversations[:limit], has_more
     except mysql.connector.Error as err:
-        logging.error(f"Lỗi lấy conversations: {err}")
-        return []
+        logging.error(f"Lỗi lấy conversations thay đổi: {err}")
+        return [], False
     finally:
         if cursor:
             cursor.close()
         if conn:
             conn.close()
 
+@timed_query
 def get_conversation_messages(conversation_id):
     """Lấy tất cả messages trong conversation"""
     conn = None
@@ -250,6 +488,243 @@ def get_conversation_messages(conversation_id):
         if conn:
             conn.close()
 
+# Giới hạn thời gian của một truy vấn tìm kiếm (ms), để câu tìm quá rộng không giữ connection lâu
+SEARCH_TIMEOUT_MS = int(os.getenv("SEARCH_TIMEOUT_MS", "2000"))
+
+@timed_query
+def search_messages(user_id, match_query, limit=20, offset=0):
+    """Tìm messages của user theo FULLTEXT index ft_messages_content (ngram parser)
+
+    match_query là biểu thức BOOLEAN MODE (search.boolean_query). Kết quả xếp
+    theo độ liên quan rồi mới nhất trước. Trả về (messages, has_more), hoặc
+    (None, False) nếu truy vấn lỗi/quá SEARCH_TIMEOUT_MS.
+    """
+    conn = None
+    cursor = None
+    try:
+        conn = get_connection()
+        cursor = conn.cursor(dictionary=True)
+        
+        query = f"""
+            SELECT /*+ MAX_EXECUTION_TIME({SEARCH_TIMEOUT_MS}) */
+                   m.id, m.conversation_id, m.role, m.content, m.created_at, c.title,
+                   MATCH(m.content) AGAINST (%s IN BOOLEAN MODE) AS score
+            FROM messages m
+            JOIN conversations c ON c.id = m.conversation_id
+            WHERE MATCH(m.content) AGAINST (%s IN BOOLEAN MODE) AND c.user_id = %s
+            ORDER BY score DESC, m.id DESC
+            LIMIT %s OFFSET %s
+        """
+        cursor.execute(query, (match_query, match_query, user_id, limit + 1, offset))
+        messages = cursor.fetchall()
+        
+        has_more = len(messages) > limit
+        return messages[:limit], has_more
+    except mysql.connector.Error as err:
+        logging.error(f"Lỗi tìm kiếm messages: {err}")
+        return None, False
+    finally:
+        if cursor:
+            cursor.close()
+        if conn:
+            conn.close()
+
+def encode_cursor(row, field="created_at"):
+    """Cursor phân trang (keyset) từ (row[field], id), ví dụ (created_at, id) của một message"""
+    raw = f"{row[field].isoformat()}|{row['id']}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+def decode_cursor(cursor):
+    """Giải mã cursor thành (created_at, id); ValueError nếu cursor không hợp lệ"""
+    try:
+        created_at, message_id = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8").split("|")
+        return datetime.fromisoformat(created_at), int(message_id)
+    except Exception as err:
+        raise ValueError(f"Cursor không hợp lệ: {cursor}") from err
+
+@timed_query
+def get_messages_page(conversation_id, before=None, limit=50):
+    """Lấy một trang messages cũ hơn cursor before (keyset theo created_at, id)
+
+    Dùng index idx_conversation_time (conversation_id, created_at [, id]) nên
+    chi phí không phụ thuộc vào vị trí trang. Trả về (messages theo thứ tự thời
+    gian tăng dần, has_more).
+    """
+    conn = None
+    cursor = None
+    try:
+        conn = get_connection()
+        cursor = conn.cursor(dictionary=True)
+        
+        if before:
+            created_at, message_id = decode_cursor(before)
+            query = """
+                SELECT id, role, content, created_at
+                FROM messages
+                WHERE conversation_id = %s
+                  AND (created_at < %s OR (created_at = %s AND id < %s))
+                ORDER BY created_at DESC, id DESC
+                LIMIT %s
+            """
+            cursor.execute(query, (conversation_id, created_at, created_at, message_id, limit + 1))
+        else:
+            query = """
+                SELECT id, role, content, created_at
+                FROM messages
+                WHERE conversation_id = %s
+                ORDER BY created_at DESC, id DESC
+                LIMIT %s
+            """
+            cursor.execute(query, (conversation_id, limit + 1))
+        messages = cursor.fetchall()
+        
+        has_more = len(messages) > limit
+        messages = messages[:limit]
+        messages.reverse()
+        return messages, has_more
+    except mysql.connector.Error as err:
+        logging.error(f"Lỗi lấy trang messages: {err}")
+        return [], False
+    finally:
+        if cursor:
+            cursor.close()
+        if conn:
+            conn.close()
+
+@timed_query
+def get_messages_version(conversation_id):
+    """Phiên bản messages của conversation: (count, max_id), None nếu lỗi
+
+    Messages chỉ được thêm (không sửa), nên (count, max_id) đổi khi và chỉ khi
+    có message mới. Chỉ quét index idx_conversation_time.
+    """
+    conn = None
+    cursor = None
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+        
+        query = """
+            SELECT COUNT(*), COALESCE(MAX(id), 0)
+            FROM messages
+            WHERE conversation_id = %s
+        """
+        cursor.execute(query, (conversation_id,))
+        count, max_id = cursor.fetchone()
+        return count, max_id
+    except mysql.connector.Error as err:
+        logging.error(f"Lỗi lấy phiên bản messages: {err}")
+        return None
+    finally:
+        if cursor:
+            cursor.close()
+        if conn:
+            conn.close()
+
+@timed_query
+def get_messages_since(conversation_id, after_id, limit=50):
+    """Các messages có id lớn hơn after_id theo thứ tự tăng dần, trả về (messages, has_more)"""
+    conn = None
+    cursor = None
+    try:
+        conn = get_connection()
+        cursor = conn.cursor(dictionary=True)
+        
+        query = """
+            SELECT id, role, content, created_at
+            FROM messages
+            WHERE conversation_id = %s AND id > %s
+            ORDER BY id ASC
+            LIMIT %s
+        """
+        cursor.execute(query, (conversation_id, after_id, limit + 1))
+        messages = cursor.fetchall()
+        
+        has_more = len(messages) > limit
+        return messages[:limit], has_more
+    except mysql.connector.Error as err:
+        logging.error(f"Lỗi lấy messages mới: {err}")
+        return [], False
+    finally:
+        if cursor:
+            cursor.close()
+        if conn:
+            conn.close()
+
+@timed_query
+def get_messages_after(conversation_id, after_id=0):
+    """Lấy các messages có id lớn hơn after_id (dùng để nạp lịch sử tăng dần)"""
+    conn = None
+    cursor = None
+    try:
+        conn = get_connection()
+        cursor = conn.cursor(dictionary=True)
+        
+        query = """
+            SELECT id, role, content
+            FROM messages
+            WHERE conversation_id = %s AND id > %s
+            ORDER BY id ASC
+        """
+        cursor.execute(query, (conversation_id, after_id))
+        return cursor.fetchall()
+    except mysql.connector.Error as err:
+        logging.error(f"Lỗi lấy messages mới: {err}")
+        return []
+    finally:
+        if cursor:
+            cursor.close()
+        if conn:
+            conn.close()
+
+@timed_query
+def get_conversation_summary(conversation_id):
+    """Lấy bản tóm tắt lịch sử (summary, last_message_id) của conversation, None nếu chưa có"""
+    conn = None
+    cursor = None
+    try:
+        conn = get_connection()
+        cursor = conn.cursor(dictionary=True)
+        
+        query = "SELECT summary, last_message_id FROM conversation_summaries WHERE conversation_id = %s"
+        cursor.execute(query, (conversation_id,))
+        return cursor.fetchone()
+    except mysql.connector.Error as err:
+        logging.error(f"Lỗi lấy tóm tắt conversation: {err}")
+        return None
+    finally:
+        if cursor:
+            cursor.close()
+        if conn:
+            conn.close()
+
+@timed_query
+def save_conversation_summary(conversation_id, summary, last_message_id):
+    """Lưu bản tóm tắt các messages có id <= last_message_id"""
+    conn = None
+    cursor = None
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+        
+        query = """
+            INSERT INTO conversation_summaries (conversation_id, summary, last_message_id)
+            VALUES (%s, %s, %s)
+            ON DUPLICATE KEY UPDATE summary = VALUES(summary), last_message_id = VALUES(last_message_id)
+        """
+        cursor.execute(query, (conversation_id, summary, last_message_id))
+        conn.commit()
+        return True
+    except mysql.connector.Error as err:
+        logging.error(f"Lỗi lưu tóm tắt conversation: {err}")
+        return False
+    finally:
+        if cursor:
+            cursor.close()
+        if conn:
+            conn.close()
+
+@timed_query
 def save_message(conversation_id, role, content):
     """Lưu message vào conversation"""
     conn = None
@@ -262,13 +737,23 @@ def save_message(conversation_id, role, content):
         cursor.execute(query, (conversation_id, role, content))
         conn.commit()
         
-        # Cập nhật updated_at của conversation
-        update_query = "UPDATE conversations SET updated_at = CURRENT_TIMESTAMP WHERE id = %s"
-        cursor.execute(update_query, (conversation_id,))
+        message_id = cursor.lastrowid
+        
+        # Cập nhật updated_at của conversation (và preview nếu đây là message đầu tiên của user)
+        if role == 'user':
+            update_query = """
+                UPDATE conversations
+                SET updated_at = CURRENT_TIMESTAMP(6), first_message = COALESCE(first_message, %s)
+                WHERE id = %s
+            """
+            cursor.execute(update_query, (content[:PREVIEW_LENGTH], conversation_id))
+        else:
+            update_query = "UPDATE conversations SET updated_at = CURRENT_TIMESTAMP(6) WHERE id = %s"
+            cursor.execute(update_query, (conversation_id,))
         conn.commit()
         
         logging.info(f"Lưu message vào conversation {conversation_id}")
-        return cursor.lastrowid
+        return message_id
     except mysql.connector.Error as err:
         logging.error(f"Lỗi lưu message: {err}")
         return None
@@ -278,6 +763,54 @@ def save_message(conversation_id, role, content):
         if conn:
             conn.close()
 
+@timed_query
+def save_turns(turns):
+    """Lưu các lượt chat [(conversation_id, user_input, ai_response), ...] trong một transaction
+
+    Một INSERT nhiều dòng cho tất cả messages, cập nhật updated_at/preview của
+    mỗi conversation, rồi commit một lần.
+    """
+    conn = None
+    cursor = None
+    try:
+        conn = get_connection()
+        cursor = conn.cursor()
+        
+        values = []
+        previews = {}
+        for conversation_id, user_input, ai_response in turns:
+            values.extend((conversation_id, 'user', user_input, conversation_id, 'assistant', ai_response))
+            previews.setdefault(conversation_id, user_input[:PREVIEW_LENGTH])
+        
+        placeholders = ", ".join(["(%s, %s, %s)"] * (2 * len(turns)))
+        cursor.execute(f"INSERT INTO messages (conversation_id, role, content) VALUES {placeholders}", values)
+        
+        update_query = """
+            UPDATE conversations
+            SET updated_at = CURRENT_TIMESTAMP(6), first_message = COALESCE(first_message, %s)
+            WHERE id = %s
+        """
+        cursor.executemany(update_query, [(preview, conversation_id) for conversation_id, preview in previews.items()])
+        conn.commit()
+        
+        logging.info(f"Lưu {len(turns)} lượt chat vào {len(previews)} conversation")
+        return True
+    except mysql.connector.Error as err:
+        logging.error(f"Lỗi lưu lượt chat: {err}")
+        if conn:
+            conn.rollback()
+        return False
+    finally:
+        if cursor:
+            cursor.close()
+        if conn:
+            conn.close()
+
+def save_turn(conversation_id, user_input, ai_response):
+    """Lưu câu hỏi và câu trả lời của một lượt chat trong một transaction"""
+    return save_turns([(conversation_id, user_input, ai_response)])
+
+@timed_query
 def update_conversation_title(conversation_id, title):
     """Cập nhật tiêu đề conversation"""
     conn = None
@@ -301,6 +834,7 @@ def update_conversation_title(conversation_id, title):
         if conn:
             conn.close()
 
+@timed_query
 def delete_conversation(conversation_id, user_id):
     """Xóa conversation (chỉ cho phép user sở hữu)"""
     conn = None
@@ -313,8 +847,11 @@ def delete_conversation(conversation_id, user_id):
         cursor.execute(query, (conversation_id, user_id))
         conn.commit()
         
+        deleted = cursor.rowcount > 0
+        if deleted:
+            ownership_cache.delete(conversation_id)
         logging.info(f"Xóa conversation {conversation_id}")
-        return cursor.rowcount > 0
+        return deleted
     except mysql.connector.Error as err:
         logging.error(f"Lỗi xóa conversation: {err}")
         return False
@@ -20,12 +20,19 @@ CREATE TABLE conversations (
     id INT AUTO_INCREMENT PRIMARY KEY,
     user_id INT NOT NULL,
     title VARCHAR(255) DEFAULT 'Cuộc hội thoại mới',
+    first_message VARCHAR(100),  -- Preview: phần đầu message đầu tiên của user (ghi bởi save_message)
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    -- Độ chính xác micro giây: ETag/sync token của danh sách conversations dựa trên MAX(updated_at)
+    updated_at TIMESTAMP(6) DEFAULT CURRENT_TIMESTAMP(6) ON UPDATE CURRENT_TIMESTAMP(6),
     FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
-    INDEX idx_user_updated (user_id, updated_at DESC)
+    -- Covering index cho danh sách conversations (phân trang theo updated_at, id)
+    INDEX idx_user_updated_cover (user_id, updated_at DESC, id DESC, title, first_message, created_at)
 );
 
+-- Stopword mặc định của InnoDB có "a", "i"...: với ngram parser mọi bigram chứa chúng
+-- bị bỏ khỏi index, nên tắt stopword cho FULLTEXT index tạo trong phiên này
+SET SESSION innodb_ft_enable_stopword = 0;
+
 -- Bảng tin nhắn
 CREATE TABLE messages (
     id INT AUTO_INCREMENT PRIMARY KEY,
@@ -34,7 +41,18 @@ CREATE TABLE messages (
     content TEXT NOT NULL,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     FOREIGN KEY (conversation_id) REFERENCES conversations(id) ON DELETE CASCADE,
-    INDEX idx_conversation_time (conversation_id, created_at)
+    INDEX idx_conversation_time (conversation_id, created_at),
+    -- Tìm kiếm lịch sử chat (/api/search); ngram tách cả âm tiết 2 ký tự của tiếng Việt
+    FULLTEXT INDEX ft_messages_content (content) WITH PARSER ngram
+);
+
+-- Bảng tóm tắt lịch sử hội thoại (các messages có id <= last_message_id đã được gộp vào summary)
+CREATE TABLE conversation_summaries (
+    conversation_id INT PRIMARY KEY,
+    summary TEXT NOT NULL,
+    last_message_id INT NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    FOREIGN KEY (conversation_id) REFERENCES conversations(id) ON DELETE CASCADE
 );
 
 -- Thêm user mẫu cho testing (password: "123456")
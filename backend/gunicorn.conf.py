@@ -0,0 +1,34 @@
+"""Cấu hình gunicorn cho production (Linux/macOS):
+
+    gunicorn -c gunicorn.conf.py nlp_main:app
+
+Với preload (GUNICORN_PRELOAD=1, mặc định), app được import một lần trong
+master và master chạy warmup.preload() trước khi fork: tải file mô hình
+Whisper về cache Hugging Face và nạp bảng mã tokenizer, để các worker dùng
+chung (copy-on-write) thay vì mỗi worker tự tải. Trọng số Whisper vẫn được nạp
+trong worker process phiên mã (CTranslate2/OpenMP không an toàn khi fork sau
+khi đã nạp), ở background ngay khi worker bắt đầu nhận request.
+"""
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+workers = int(os.getenv("GUNICORN_WORKERS", "2"))
+worker_class = "gthread"
+threads = int(os.getenv("GUNICORN_THREADS", "4"))
+# Request chat/phiên mã có thể kéo dài hàng chục giây
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+preload_app = os.getenv("GUNICORN_PRELOAD", "1") == "1"
+
+def when_ready(server):
+    # Master: socket đã bind, worker chưa được fork
+    if server.cfg.preload_app:
+        import nlp_main
+        nlp_main.warmup.preload()
+
+def post_worker_init(worker):
+    import nlp_main
+    nlp_main.warmup.start()
+
+def worker_exit(server, worker):
+    import nlp_main
+    nlp_main.transcription_service.shutdown()
@@ -0,0 +1,99 @@
+"""ETag, delta (?since=) và nén gzip cho các API JSON đọc nhiều (danh sách conversations, messages).
+
+ETag được tính từ "phiên bản" dữ liệu lấy bằng một truy vấn gộp chỉ đọc
+index (số dòng, updated_at/id lớn nhất), không cần đọc các dòng: client gửi
+lại If-None-Match khi dữ liệu chưa đổi thì nhận 304 không có body. ETag là
+ETag yếu vì cùng một nội dung có thể được gửi nén hoặc không nén.
+
+Sync token (trả trong trường "sync") cho phép client chỉ hỏi phần đã thay
+đổi kể từ lần tải trước (?since=<token>).
+"""
+import os
+import zlib
+import gzip
+import base64
+import hashlib
+from datetime import datetime
+import static_assets
+
+# Mức nén gzip (1-9) và kích thước tối thiểu (byte) để nén payload JSON
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL") or "6")
+GZIP_MIN_BYTES = int(os.getenv("GZIP_MIN_BYTES") or "1024")
+
+# Dữ liệu riêng của user (theo cookie session): chỉ trình duyệt được cache, luôn hỏi lại server
+CACHE_CONTROL = "private, no-cache"
+
+def make_etag(*parts):
+    """ETag từ các thành phần phiên bản dữ liệu và tham số request"""
+    raw = "|".join("" if part is None else str(part) for part in parts)
+    return hashlib.blake2b(raw.encode("utf-8"), digest_size=12).hexdigest()
+
+def etag_matches(if_none_match, etag):
+    """Header If-None-Match có khớp etag không (so sánh yếu, theo RFC 9110)"""
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate.strip('"') == etag:
+            return True
+    return False
+
+def cache_headers(etag):
+    """Header đi kèm mọi response có ETag (kể cả 304)"""
+    return {
+        "ETag": f'W/"{etag}"',
+        "Cache-Control": CACHE_CONTROL,
+        "Vary": "Accept-Encoding"
+    }
+
+def encode_sync_token(version):
+    """Sync token từ phiên bản danh sách conversations {count, updated_at, max_id}"""
+    updated_at = version["updated_at"].isoformat() if version["updated_at"] else ""
+    raw = f"{updated_at}|{version['count']}|{version['max_id']}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+def decode_sync_token(token):
+    """Giải mã sync token thành {count, updated_at, max_id}; ValueError nếu không hợp lệ"""
+    try:
+        updated_at, count, max_id = base64.urlsafe_b64decode(token.encode("ascii")).decode("utf-8").split("|")
+        return {
+            "count": int(count),
+            "updated_at": datetime.fromisoformat(updated_at) if updated_at else None,
+            "max_id": int(max_id)
+        }
+    except Exception as err:
+        raise ValueError(f"Sync token không hợp lệ: {token}") from err
+
+def accepts_gzip(accept_encoding):
+    return "gzip" in static_assets.accepted_encodings(accept_encoding)
+
+def compress_body(body, accept_encoding):
+    """(body, header bổ sung): nén gzip nếu client nhận gzip và body >= GZIP_MIN_BYTES"""
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+    if len(body) < GZIP_MIN_BYTES:
+        return body, {}
+    if not accepts_gzip(accept_encoding):
+        return body, {"Vary": "Accept-Encoding"}
+    return gzip.compress(body, compresslevel=GZIP_LEVEL), {"Content-Encoding": "gzip", "Vary": "Accept-Encoding"}
+
+def compress_stream(chunks, size_hint, accept_encoding):
+    """Như compress_body cho body được sinh theo từng đoạn (size_hint: kích thước ước lượng)"""
+    if size_hint < GZIP_MIN_BYTES:
+        return chunks, {}
+    if not accepts_gzip(accept_encoding):
+        return chunks, {"Vary": "Accept-Encoding"}
+    return _gzip_chunks(chunks), {"Content-Encoding": "gzip", "Vary": "Accept-Encoding"}
+
+def _gzip_chunks(chunks):
+    # wbits=31: định dạng gzip (header + CRC32), nén dần không giữ cả body trong bộ nhớ
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode("utf-8") if isinstance(chunk, str) else chunk)
+        if data:
+            yield data
+    yield compressor.flush()
@@ -0,0 +1,315 @@
+import os
+import time
+import uuid
+import logging
+import threading
+import numpy as np
+import audio
+import rate_limit
+import transcription
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Khoảng lặng tối thiểu để coi một đoạn nói là đã kết thúc (giây)
+MIN_SILENCE_SECONDS = 0.6
+# Phần đệm giữ lại quanh mỗi đoạn nói khi cắt (giây)
+SPEECH_PAD_SECONDS = 0.2
+# Demuxer đọc bản ghi đang được gửi lên: chỉ dò định dạng trên vài KB đầu thay vì chờ tới 5 MB
+LIVE_DEMUXER_OPTIONS = {"probesize": "4096", "analyzeduration": "100000"}
+
+def speech_timestamps(samples):
+    """Các đoạn có tiếng nói [{start, end}] (đơn vị sample) theo Silero VAD"""
+    from faster_whisper.vad import VadOptions, get_speech_timestamps
+    options = VadOptions(min_silence_duration_ms=int(MIN_SILENCE_SECONDS * 1000),
+                         speech_pad_ms=int(SPEECH_PAD_SECONDS * 1000))
+    return get_speech_timestamps(samples, options)
+
+class _ChunkPipe:
+    """File-like chỉ đọc cho PyAV: read() chặn tới khi có thêm chunk hoặc pipe được đóng
+
+    Cho phép một container PyAV duy nhất đọc bản ghi khi nó đang được gửi lên,
+    thay vì giải mã lại toàn bộ bytes ở mỗi chunk. Không nhận chunk nào trong
+    idle_timeout giây thì pipe tự đóng (read trả về EOF) để thread giải mã của
+    một phiên bị bỏ dở kết thúc.
+    """
+
+    def __init__(self, idle_timeout=None):
+        self.idle_timeout = idle_timeout
+        self._chunks = []
+        self._closed = False
+        self.size = 0
+        # Đang chờ dữ liệu: mọi bytes đã nhận đều đã được giải mã
+        self.starved = False
+        self._cond = threading.Condition()
+
+    def write(self, data):
+        with self._cond:
+            if data:
+                self._chunks.append(bytes(data))
+                self.size += len(data)
+                self.starved = False
+            self._cond.notify_all()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def read(self, n=-1):
+        with self._cond:
+            while not self._chunks and not self._closed:
+                self.starved = True
+                self._cond.notify_all()
+                if not self._cond.wait(self.idle_timeout):
+                    self._closed = True
+            if not self._chunks:
+                return b""
+            data = self._chunks.pop(0)
+            if 0 <= n < len(data):
+                self._chunks.insert(0, data[n:])
+                data = data[:n]
+            return data
+
+    def seekable(self):
+        return False
+
+    def wait_starved(self, timeout):
+        """Chờ bộ giải mã đọc hết dữ liệu đã nhận (hoặc hết timeout)"""
+        with self._cond:
+            return self._cond.wait_for(lambda: self.starved or self._closed, timeout)
+
+class LiveTranscription:
+    """Phiên mã tăng dần cho một bản ghi âm đang được gửi lên theo từng chunk
+
+    Chunk của MediaRecorder chỉ giải mã được khi nối liền từ đầu, nên mỗi
+    phiên có một thread giải mã đọc bản ghi qua _ChunkPipe: mỗi byte chỉ được
+    giải mã một lần, PCM được giữ lại từ điểm đã "chốt" trở đi. Mỗi chunk chạy
+    VAD đúng một lần trên phần PCM mới (kèm một đoạn chồng lấn dài bằng khoảng
+    lặng tối thiểu): những đoạn nói đã kết thúc bởi một khoảng lặng được gửi
+    vào pool phiên mã mà không chờ kết quả, nên request thread không phải giải
+    mã lại hay chờ Whisper, và khi người dùng dừng ghi chỉ còn câu cuối cần xử lý.
+    """
+
+    # Thời gian tối đa request chờ thread giải mã đọc hết chunk vừa nhận (giây)
+    DECODE_WAIT = 1.0
+
+    def __init__(self, user_id, service, idle_timeout=None):
+        self.user_id = user_id
+        self.service = service
+        self.pipe = _ChunkPipe(idle_timeout)
+        # PCM từ sample `pcm_offset` trở đi (phần trước đó đã chốt và được bỏ)
+        self.pcm = []
+        self.pcm_offset = 0
+        self.total_samples = 0
+        self.committed_samples = 0
+        # Số sample đã tính vào ngân sách giây âm thanh của user
+        self.charged_samples = 0
+        # VAD đã chạy tới sample này; các đoạn nói [start, end) chưa chốt (vị trí tuyệt đối)
+        self.scanned_samples = 0
+        self.segments = []
+        # Transcript theo thứ tự: chuỗi hoặc Future của pool phiên mã
+        self.parts = []
+        self.error = None
+        self.updated_at = time.time()
+        self.lock = threading.Lock()
+        self._pcm_lock = threading.Lock()
+        self._decoder = threading.Thread(target=self._decode_loop, name="live-decode", daemon=True)
+        self._decoder.start()
+
+    def _decode_loop(self):
+        try:
+            for samples in audio.iter_pcm(self.pipe, allow_truncated=True, options=LIVE_DEMUXER_OPTIONS):
+                with self._pcm_lock:
+                    self.pcm.append(samples)
+                    self.total_samples += len(samples)
+        except Exception as e:
+            self.error = e
+        finally:
+            # Dừng nhận dữ liệu (kể cả khi lỗi) để request đang chờ không bị treo
+            self.pipe.close()
+
+    def _pending(self):
+        """PCM chưa chốt (từ committed_samples tới hết phần đã giải mã)"""
+        with self._pcm_lock:
+            if len(self.pcm) > 1:
+                self.pcm = [np.concatenate(self.pcm)]
+            samples = self.pcm[0] if self.pcm else np.zeros(0, dtype=np.float32)
+            return samples[self.committed_samples - self.pcm_offset:]
+
+    def _commit(self, count):
+        """Chốt thêm count sample và bỏ phần PCM tương ứng khỏi bộ nhớ"""
+        self.committed_samples += count
+        self.scanned_samples = max(self.scanned_samples, self.committed_samples)
+        self.segments = [s for s in self.segments if s[1] > self.committed_samples]
+        with self._pcm_lock:
+            if self.pcm:
+                self.pcm = [self.pcm[0][self.committed_samples - self.pcm_offset:]] + self.pcm[1:]
+            self.pcm_offset = self.committed_samples
+
+    def _raise_error(self):
+        if self.error is not None:
+            if isinstance(self.error, audio.AudioTooLarge):
+                raise self.error
+            raise RuntimeError(f"Lỗi giải mã âm thanh: {self.error}")
+
+    def text(self):
+        """Transcript của các đoạn đã phiên mã xong (theo thứ tự, dừng ở đoạn đầu tiên chưa xong)"""
+        texts = []
+        for part in self.parts:
+            if isinstance(part, str):
+                texts.append(part)
+            elif part.done():
+                texts.append(part.result()["text"] if not part.exception() else "")
+            else:
+                break
+        return " ".join(t for t in texts if t).strip()
+
+    def _scan(self, pending):
+        """Chạy VAD một lần trên phần chưa quét (kèm đoạn chồng lấn), cập nhật segments"""
+        overlap = int((MIN_SILENCE_SECONDS + SPEECH_PAD_SECONDS) * audio.SAMPLE_RATE)
+        start = max(self.committed_samples, self.scanned_samples - overlap)
+        region = pending[start - self.committed_samples:]
+        for segment in speech_timestamps(region):
+            seg_start, seg_end = start + segment["start"], start + segment["end"]
+            if self.segments and seg_start <= self.segments[-1][1]:
+                # Đoạn nằm trong vùng chồng lấn: nối vào đoạn đã thấy ở lần quét trước
+                self.segments[-1][1] = max(self.segments[-1][1], seg_end)
+            else:
+                self.segments.append([seg_start, seg_end])
+        self.scanned_samples = self.committed_samples + len(pending)
+
+    def _utterance_end(self, total, min_silence):
+        """Cuối đoạn nói đầu tiên đã được theo sau bởi đủ khoảng lặng (None: chưa có)"""
+        segments = self.segments
+        while segments:
+            next_start = segments[1][0] if len(segments) > 1 else total
+            if next_start - segments[0][1] >= min_silence:
+                return segments[0][1]
+            if len(segments) == 1:
+                return None
+            # Khoảng lặng quá ngắn: hai đoạn thuộc cùng một câu
+            segments[0:2] = [[segments[0][0], segments[1][1]]]
+        return None
+
+    def append(self, chunk):
+        """Thêm một chunk, gửi các đoạn nói đã xong đi phiên mã; trả về transcript tạm thời"""
+        with self.lock:
+            self.updated_at = time.time()
+            if self.pipe.size + len(chunk) > audio.MAX_AUDIO_BYTES:
+                raise audio.AudioTooLarge(f"Tệp âm thanh vượt quá {audio.MAX_AUDIO_BYTES // (1024 * 1024)} MB")
+            self.pipe.write(chunk)
+            self.pipe.wait_starved(self.DECODE_WAIT)
+            self._raise_error()
+
+            pending = self._pending()
+            min_silence = int(MIN_SILENCE_SECONDS * audio.SAMPLE_RATE)
+            if len(pending) <= min_silence:
+                return self.text()
+
+            self._scan(pending)
+            total = self.committed_samples + len(pending)
+            if not self.segments:
+                if len(pending) > 2 * min_silence:
+                    # Toàn bộ phần chờ là im lặng: bỏ qua, chỉ giữ lại đuôi
+                    self._commit(len(pending) - min_silence)
+                return self.text()
+
+            # Một chunk có thể chứa nhiều câu đã nói xong: gửi lần lượt từng câu
+            while (speech_end := self._utterance_end(total, min_silence)) is not None:
+                end = min(len(pending), speech_end - self.committed_samples +
+                          int(SPEECH_PAD_SECONDS * audio.SAMPLE_RATE))
+                try:
+                    self.parts.append(self.service.submit(pending[:end].copy()))
+                except transcription.TranscriptionQueueFull:
+                    # Hàng đợi bận: để lại, đoạn này sẽ được xử lý ở chunk sau hoặc khi kết thúc
+                    logging.info("Hàng đợi phiên mã đầy, hoãn chốt đoạn nói")
+                    break
+                pending = pending[end:]
+                self._commit(end)
+            return self.text()
+
+    def finish(self, chunk=b""):
+        """Nhận chunk cuối (nếu có), phiên mã phần còn lại và trả về transcript đầy đủ"""
+        with self.lock:
+            self.pipe.write(chunk)
+            self.pipe.close()
+            self._decoder.join()
+            self._raise_error()
+            pending = self._pending()
+            if len(pending) and speech_timestamps(pending):
+                self.parts.append(self.service.submit(pending.copy()))
+            self._commit(len(pending))
+            for i, part in enumerate(self.parts):
+                if not isinstance(part, str):
+                    self.parts[i] = part.result(timeout=self.service.timeout)["text"]
+            return self.text()
+
+    def uncharged_seconds(self):
+        """Số giây âm thanh đã giải mã nhưng chưa tính vào ngân sách (và đánh dấu là đã tính)"""
+        with self._pcm_lock:
+            seconds = (self.total_samples - self.charged_samples) / audio.SAMPLE_RATE
+            self.charged_samples = self.total_samples
+        return seconds
+
+    def close(self):
+        """Dừng thread giải mã (phiên bị hủy hoặc hết hạn)"""
+        self.pipe.close()
+
+class LiveTranscriptionRegistry:
+    """Lưu các phiên phiên mã đang mở trong bộ nhớ tiến trình
+
+    Phiên chỉ tồn tại trong worker đã tạo ra nó, nên khi chạy nhiều worker
+    cần sticky session ở reverse proxy. Mỗi phiên giữ một thread giải mã và
+    bộ đệm PCM, nên mỗi user chỉ được mở tối đa max_per_user phiên; phiên
+    không nhận chunk nào trong ttl giây bị dọn ở lần create/get kế tiếp.
+    """
+
+    def __init__(self, service, ttl=300, max_per_user=2):
+        self.service = service
+        self.ttl = ttl
+        self.max_per_user = max_per_user
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, service):
+        return cls(service,
+                   ttl=float(os.getenv("LIVE_TRANSCRIPTION_TTL", "300")),
+                   max_per_user=int(os.getenv("LIVE_TRANSCRIPTION_MAX_PER_USER", "2")))
+
+    def _sweep(self):
+        """Đóng và bỏ các phiên hết hạn (gọi khi đang giữ _lock)"""
+        now = time.time()
+        expired = [k for k, live in self._sessions.items() if now - live.updated_at > self.ttl]
+        for k in expired:
+            self._sessions.pop(k).close()
+        if expired:
+            logging.info(f"Đã dọn {len(expired)} phiên phiên mã tăng dần hết hạn")
+
+    def create(self, user_id):
+        """Mở phiên mới; ném rate_limit.RateLimited (429) nếu user đã mở đủ max_per_user phiên"""
+        stream_id = uuid.uuid4().hex
+        with self._lock:
+            self._sweep()
+            open_sessions = [live for live in self._sessions.values() if live.user_id == user_id]
+            if len(open_sessions) >= self.max_per_user:
+                # Phiên cũ nhất sẽ hết hạn sau chừng này giây nếu không được dùng tiếp
+                oldest = min(live.updated_at for live in open_sessions)
+                raise rate_limit.RateLimited("live_sessions", max(1, int(oldest + self.ttl - time.time())))
+            self._sessions[stream_id] = LiveTranscription(user_id, self.service, idle_timeout=self.ttl)
+        return stream_id
+
+    def get(self, stream_id, user_id):
+        """Lấy phiên theo id (chỉ trả về nếu đúng user sở hữu)"""
+        with self._lock:
+            self._sweep()
+            live = self._sessions.get(stream_id)
+        if live and live.user_id == user_id:
+            return live
+        return None
+
+    def remove(self, stream_id):
+        with self._lock:
+            live = self._sessions.pop(stream_id, None)
+        if live:
+            live.close()
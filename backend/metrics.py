@@ -0,0 +1,263 @@
+"""Số liệu dạng Prometheus (counter/gauge/histogram) và trace id theo request.
+
+Cài đặt tối giản, không cần prometheus_client: mỗi metric giữ giá trị trong
+bộ nhớ của tiến trình (một lock, observe là O(log số bucket)), /metrics render
+theo text exposition format 0.0.4. Với nhiều worker gunicorn, mỗi worker có
+số liệu riêng của nó.
+"""
+import os
+import re
+import time
+import uuid
+import bisect
+import logging
+import inspect
+import functools
+import threading
+import contextvars
+from contextlib import contextmanager
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Bucket (giây) đủ rộng cho cả truy vấn DB (ms) lẫn phiên mã/OpenAI (hàng chục giây)
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_registry = []
+_collectors = []
+
+# ==================== METRIC TYPES ====================
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(labels):
+    labels = list(labels)
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} cần các nhãn {self.labelnames}, nhận {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _samples(self):
+        with self._lock:
+            return [("", key, value) for key, value in self._values.items()]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for suffix, key, value in self._samples():
+            names = self.labelnames + (("le",) if suffix == "_bucket" else ())
+            lines.append(f"{self.name}{suffix}{_format_labels(zip(names, key))} {_format_value(value)}")
+        return "\n".join(lines)
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set_total(self, value, **labels):
+        """Ghi tổng đã được đếm ở nơi khác (ví dụ số liệu của connection pool)"""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Đo thời gian của khối with (kể cả khi raise)"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _samples(self):
+        with self._lock:
+            items = [(key, list(state[0]), state[1], state[2]) for key, state in self._values.items()]
+        samples = []
+        for key, counts, total, count in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                samples.append(("_bucket", key + (_format_value(bound),), cumulative))
+            samples.append(("_sum", key, total))
+            samples.append(("_count", key, count))
+        return samples
+
+def timed(histogram):
+    """Decorator đo thời gian chạy của hàm (sync hoặc async), nhãn module + function"""
+    def decorator(fn):
+        labels = {"module": fn.__module__, "function": fn.__name__}
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await fn(*args, **kwargs)
+                finally:
+                    histogram.observe(time.perf_counter() - start, **labels)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start, **labels)
+        return wrapper
+    return decorator
+
+def register_collector(collect):
+    """Đăng ký hàm cập nhật gauge ngay trước mỗi lần render (số liệu lấy từ nơi khác)"""
+    _collectors.append(collect)
+
+def render():
+    """Toàn bộ metric theo text exposition format của Prometheus"""
+    for collect in _collectors:
+        try:
+            collect()
+        except Exception as e:
+            logging.error(f"Lỗi thu thập metrics: {e}")
+    return "\n".join(metric.render() for metric in _registry) + "\n"
+
+# ==================== METRICS ====================
+
+HTTP_REQUESTS = Counter("codemate_http_requests_total", "Số request HTTP theo route và mã trạng thái",
+                        ["method", "route", "status"])
+HTTP_REQUEST_SECONDS = Histogram("codemate_http_request_duration_seconds",
+                                 "Thời gian xử lý request (tới khi gửi xong body, kể cả stream)", ["route"])
+HTTP_IN_FLIGHT = Gauge("codemate_http_requests_in_flight", "Số request đang được xử lý")
+
+CHAT_STAGE_SECONDS = Histogram("codemate_chat_stage_duration_seconds",
+                               "Thời gian từng bước của một lượt chat "
+                               "(upload, transcription, context, cache_lookup, openai, openai_first_token, save)",
+                               ["stage"])
+DB_QUERY_SECONDS = Histogram("codemate_db_query_duration_seconds",
+                             "Thời gian của từng hàm truy vấn DB (kể cả chờ connection)", ["module", "function"])
+DB_POOL_CONNECTIONS = Gauge("codemate_db_pool_connections", "Connection của pool theo trạng thái",
+                            ["pool", "state"])
+DB_POOL_WAITING = Gauge("codemate_db_pool_waiting", "Số request đang chờ connection", ["pool"])
+DB_POOL_TIMEOUTS = Counter("codemate_db_pool_timeouts_total", "Số lần chờ connection quá DB_POOL_TIMEOUT",
+                           ["pool"])
+OPENAI_TOKENS = Counter("codemate_openai_tokens_total", "Token OpenAI theo completion.usage",
+                        ["model", "kind"])
+OPENAI_CALLS = Counter("codemate_openai_calls_total",
+                       "Lượt gọi OpenAI theo kết quả cuối cùng sau retry (ok, busy, rate_limited, timeout, "
+                       "upstream, rejected)", ["outcome"])
+OPENAI_RETRIES = Counter("codemate_openai_retries_total", "Số lần gửi lại request OpenAI theo lý do", ["reason"])
+OPENAI_HEDGES = Counter("codemate_openai_hedges_total", "Request dự phòng (hedge) đã gửi / về trước", ["result"])
+OPENAI_IN_FLIGHT = Gauge("codemate_openai_requests_in_flight", "Request OpenAI đang giữ slot đồng thời")
+CHAT_COALESCED = Counter("codemate_chat_coalesced_total",
+                         "Lượt chat theo vai trò khi gộp request trùng prompt: leader (gọi OpenAI), follower "
+                         "(chờ leader cùng tiến trình), remote_follower (chờ leader ở worker khác)", ["role"])
+ADMISSION_REJECTED = Counter("codemate_admission_rejected_total",
+                             "Request bị từ chối khi tiếp nhận: hết ngân sách của user (budget) hoặc bước "
+                             "nặng đủ request đồng thời (stage)", ["kind", "name"])
+AUDIO_SECONDS = Counter("codemate_audio_seconds_total", "Tổng số giây âm thanh đã phiên mã")
+TRANSCRIPTION_IN_FLIGHT = Gauge("codemate_transcription_jobs_in_flight", "Job phiên mã đang chờ hoặc đang chạy")
+TRANSCRIPTION_CLIPS = Counter("codemate_transcription_clips_total",
+                              "Clip đã phiên mã theo nhánh tiền xử lý: empty (không có tiếng nói, bỏ qua), "
+                              "short (mô hình nhỏ/greedy), long (mô hình chính, beam search)", ["route"])
+
+def stage(name):
+    """with metrics.stage("openai"): ... - đo một bước của lượt chat"""
+    return CHAT_STAGE_SECONDS.time(stage=name)
+
+def record_usage(model, usage):
+    """Cộng số token từ completion.usage (bỏ qua nếu API không trả usage)"""
+    if usage is None:
+        return
+    OPENAI_TOKENS.inc(usage.prompt_tokens or 0, model=model, kind="prompt")
+    OPENAI_TOKENS.inc(usage.completion_tokens or 0, model=model, kind="completion")
+
+# ==================== TRACE ====================
+
+# Header mang trace id; client gửi kèm thì dùng lại, không thì server tự sinh. Rỗng = tắt
+TRACE_HEADER = os.getenv("TRACE_HEADER", "X-Request-ID")
+
+_trace_id = contextvars.ContextVar("trace_id", default=None)
+_TRACE_UNSAFE = re.compile(r"[^A-Za-z0-9._-]")
+
+def start_trace(incoming=None):
+    """Gắn trace id cho context hiện tại, trả về (trace_id, token để end_trace)"""
+    trace_id = _TRACE_UNSAFE.sub("", incoming or "")[:64] or uuid.uuid4().hex[:16]
+    return trace_id, _trace_id.set(trace_id)
+
+def end_trace(token):
+    try:
+        _trace_id.reset(token)
+    except ValueError:
+        # Token tạo trong context khác (ví dụ callback đóng response chạy ở thread khác)
+        _trace_id.set(None)
+
+def current_trace():
+    return _trace_id.get()
+
+class TraceLogFilter(logging.Filter):
+    """Thêm [trace id] vào đầu mọi dòng log phát ra trong khi xử lý request"""
+
+    def filter(self, record):
+        trace_id = _trace_id.get()
+        if trace_id:
+            record.msg = f"[{trace_id}] {record.msg}"
+        return True
+
+if TRACE_HEADER:
+    logging.getLogger().addFilter(TraceLogFilter())
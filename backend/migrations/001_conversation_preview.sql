@@ -0,0 +1,33 @@
+-- Nâng cấp database đã có: preview của conversation được lưu sẵn thay vì
+-- tính bằng subquery cho mỗi dòng, và covering index cho danh sách conversations.
+-- Chạy: mysql -u [ten_user] -p codemate_db < migrations/001_conversation_preview.sql
+USE codemate_db;
+
+ALTER TABLE conversations
+    ADD COLUMN first_message VARCHAR(100) AFTER title,
+    ADD INDEX idx_user_updated_cover (user_id, updated_at DESC, id DESC, title, first_message, created_at);
+
+ALTER TABLE conversations DROP INDEX idx_user_updated;
+
+-- Điền preview cho các conversation cũ (giữ nguyên updated_at)
+UPDATE conversations c
+JOIN (
+    SELECT m.conversation_id, LEFT(m.content, 100) AS preview
+    FROM messages m
+    JOIN (
+        SELECT conversation_id, MIN(id) AS first_id
+        FROM messages
+        WHERE role = 'user'
+        GROUP BY conversation_id
+    ) f ON f.first_id = m.id
+) p ON p.conversation_id = c.id
+SET c.first_message = p.preview, c.updated_at = c.updated_at;
+
+-- Bảng tóm tắt lịch sử hội thoại (thêm cùng chat_context.py)
+CREATE TABLE IF NOT EXISTS conversation_summaries (
+    conversation_id INT PRIMARY KEY,
+    summary TEXT NOT NULL,
+    last_message_id INT NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    FOREIGN KEY (conversation_id) REFERENCES conversations(id) ON DELETE CASCADE
+);
@@ -0,0 +1,12 @@
+-- Nâng cấp database đã có: FULLTEXT index (ngram parser) trên messages.content cho /api/search.
+-- Lần thêm FULLTEXT index đầu tiên phải dựng lại bảng messages (thêm cột ẩn FTS_DOC_ID),
+-- nên chạy lúc ít tải. Sau nhiều lần xóa conversation, dọn index bằng:
+--   SET GLOBAL innodb_optimize_fulltext_only = ON; OPTIMIZE TABLE messages;
+-- Chạy: mysql -u [ten_user] -p codemate_db < migrations/002_message_search.sql
+USE codemate_db;
+
+-- Stopword mặc định của InnoDB có "a", "i"...: với ngram parser mọi bigram chứa chúng
+-- bị bỏ khỏi index, nên tắt stopword cho index tạo trong phiên này
+SET SESSION innodb_ft_enable_stopword = 0;
+
+ALTER TABLE messages ADD FULLTEXT INDEX ft_messages_content (content) WITH PARSER ngram;
@@ -0,0 +1,10 @@
+-- Nâng cấp database đã có: conversations.updated_at lưu tới micro giây.
+-- ETag và sync token (?since=) của GET /api/conversations dựa trên MAX(updated_at);
+-- với độ chính xác giây, hai thay đổi trong cùng một giây (lưu message rồi đổi
+-- tiêu đề) cho cùng một ETag và client có thể giữ bản cũ.
+-- Câu lệnh dựng lại bảng conversations (kể cả idx_user_updated_cover), nên chạy lúc ít tải.
+-- Chạy: mysql -u [ten_user] -p codemate_db < migrations/003_conversation_updated_precision.sql
+USE codemate_db;
+
+ALTER TABLE conversations
+    MODIFY updated_at TIMESTAMP(6) DEFAULT CURRENT_TIMESTAMP(6) ON UPDATE CURRENT_TIMESTAMP(6);
@@ -1,14 +1,29 @@
 import os
+import json
 import time
 import logging
-from flask import Flask, request, jsonify, send_from_directory, session
+import contextlib
+from flask import Flask, Response, request, jsonify, send_file, send_from_directory, session, g
 from flask_cors import CORS
 from dotenv import load_dotenv
-from openai import OpenAI
-from faster_whisper import WhisperModel
 from google.oauth2 import id_token
 from google.auth.transport import requests as google_requests
 import database
+import connection_pool
+import audio
+import transcription
+import live_transcription
+import response_cache
+import single_flight
+import chat_context
+import write_behind
+import startup
+import metrics
+import search
+import ai_client
+import rate_limit
+import static_assets
+import http_cache
 
 load_dotenv()
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -20,12 +35,17 @@ CORS(app, supports_credentials=True, origins=["http://localhost:5000", "http://1
 FRONTEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'frontend')
 IMAGE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'images')
 
+# File tĩnh có hash trong tên + nén sẵn (static_assets.py); None = phục vụ thẳng từ frontend/
+static_files = static_assets.StaticAssets.from_env()
+# Để reverse proxy (nginx/Apache) gửi file bằng sendfile thay cho worker Python
+app.config["USE_X_SENDFILE"] = os.getenv("STATIC_X_SENDFILE", "0") == "1"
+
 # Google OAuth Config
 GOOGLE_CLIENT_ID = os.getenv("GOOGLE_CLIENT_ID")
 
-# OpenAI Client
+# OpenAI Client (pool keep-alive, deadline, retry, giới hạn đồng thời: ai_client.py)
 try:
-    client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+    client = ai_client.ResilientOpenAI.from_env()
     logging.info("Khởi tạo OpenAI client thành công.")
 except Exception as e:
     logging.error(f"Lỗi khi khởi tạo OpenAI client: {e}")
@@ -34,15 +54,41 @@ except Exception as e:
 os.environ["KMP_DUPLICATE_LIB_OK"] = "TRUE"
 
 # Whisper Model
-# Tự động tải mô hình từ Hugging Face Hub (nếu chưa có)
-MODEL_PATH = "Duke03/Whisper-medium-vi-ct2-int8" 
-logging.info(f"Bắt đầu tải mô hình Whisper từ: {MODEL_PATH}")
-try:
-    whisper_model = WhisperModel(MODEL_PATH, device="cpu", compute_type="int8", local_files_only=False)
-    logging.info("Tải mô hình Whisper thành công.")
-except Exception as e:
-    logging.error(f"Lỗi khi tải mô hình Whisper: {e}")
-    whisper_model = None
+# Mỗi worker process phiên mã tự tải mô hình riêng (xem transcription.py)
+transcription_service = transcription.TranscriptionService.from_env()
+live_transcriptions = live_transcription.LiveTranscriptionRegistry.from_env(transcription_service)
+
+MODEL_NAME = "gpt-4o"
+
+# Cache phản hồi cho các câu hỏi lặp lại (None nếu RESPONSE_CACHE_BACKEND=off)
+chat_cache = response_cache.ResponseCache.from_env()
+
+# Gộp các request trùng prompt đang gọi OpenAI cùng lúc (None nếu COALESCE_BACKEND=off)
+coalescer = single_flight.SingleFlight.from_env()
+
+# Ghép lịch sử hội thoại vào prompt trong giới hạn token (CONTEXT_*)
+context_builder = chat_context.ContextBuilder.from_env(MODEL_NAME)
+
+# Ghi lượt chat ở background khi WRITE_BEHIND=1 (None = ghi ngay trong request)
+turn_writer = write_behind.TurnWriter.from_env(database.save_turns)
+
+# Ngân sách theo user (lượt chat, giây âm thanh, token) và giới hạn đồng thời cho bước nặng
+# (RATE_LIMIT_*); None nếu RATE_LIMIT_BACKEND=off
+admission = rate_limit.AdmissionControl.from_env()
+# Chi phí tiếp nhận một lượt chat: trừ một lượt, token của các lượt trước phải chưa vượt ngân sách
+CHAT_COST = {"turns": 1, "tokens": 0}
+# Âm thanh: chỉ kiểm tra ngân sách giây âm thanh chưa âm, số giây thực tế được trừ sau khi phiên mã
+# (phiên mã tăng dần: trừ theo số giây đã giải mã sau mỗi chunk)
+AUDIO_COST = {"audio_seconds": 0}
+
+# Các thành phần nặng được nạp song song ở background sau khi server bind port (WARMUP_MODE);
+# preload chỉ gồm bước an toàn khi chạy trong gunicorn master trước fork (xem gunicorn.conf.py)
+warmup = startup.Warmup.from_env()
+warmup.add("whisper", transcription_service.warm_up,
+           preload=transcription_service.download_models)
+warmup.add("tokenizer", context_builder.counter.load, preload=context_builder.counter.load)
+if chat_cache and chat_cache.semantic and hasattr(chat_cache.embedder, "load"):
+    warmup.add("embedding", chat_cache.embedder.load)
 
 SYSTEM_PROMPT = """
 Bạn là một trợ lý AI lập trình tên là CodeMate. Nhiệm vụ của bạn là cung cấp các câu trả lời hữu ích, rõ ràng và có cấu trúc cho các câu hỏi của người dùng, chủ yếu liên quan đến lập trình, công nghệ và khoa học máy tính.
@@ -59,24 +105,152 @@ QUY TẮC ĐỊNH DẠNG PHẢN HỒI:
 
 # ==================== MIDDLEWARE ====================
 
-def login_required(f):
-    """Decorator để kiểm tra đăng nhập"""
+def login_required(f=None, *, admit=None):
+    """Decorator để kiểm tra đăng nhập
+
+    admit: chi phí {ngân sách: số đơn vị} trừ vào ngân sách của user trước khi
+    vào route (@login_required(admit=CHAT_COST)); hết ngân sách trả 429.
+    """
     from functools import wraps
+    if f is None:
+        return lambda f: login_required(f, admit=admit)
     @wraps(f)
     def decorated_function(*args, **kwargs):
         if 'user_id' not in session:
             return jsonify({"error": "Unauthorized", "message": "Vui lòng đăng nhập"}), 401
+        if admit and admission:
+            admission.admit(session['user_id'], admit)
         return f(*args, **kwargs)
     return decorated_function
 
+@app.errorhandler(rate_limit.RateLimited)
+def handle_rate_limited(e):
+    """User dùng hết ngân sách: 429 + Retry-After (số giây cho tới khi đủ lại)"""
+    logging.info(f"Từ chối request {request.path} của user {session.get('user_id')}: {e}")
+    return jsonify({"error": "Bạn đã gửi quá nhiều yêu cầu, vui lòng thử lại sau", "budget": e.budget,
+                    "retry_after": e.retry_after}), 429, {"Retry-After": str(e.retry_after)}
+
+@app.errorhandler(rate_limit.StageBusy)
+def handle_stage_busy(e):
+    """Bước nặng (phiên mã, OpenAI) đã đủ request đồng thời trên mọi user: 503 + Retry-After"""
+    logging.warning(f"Từ chối request {request.path}: {e}")
+    return jsonify({"error": "Hệ thống đang quá tải, vui lòng thử lại sau"}), 503, {"Retry-After": str(e.retry_after)}
+
+def admission_stage(name):
+    """Giữ một slot của bước nặng `name` (ném StageBusy nếu đã đủ)"""
+    return admission.stage(name) if admission else contextlib.nullcontext()
+
+def charge_budget(user_id, budget, amount):
+    """Trừ chi phí thực tế (giây âm thanh, token) vào ngân sách của user sau khi xử lý"""
+    if admission:
+        admission.charge(user_id, budget, amount)
+
+def charge_usage(user_id, usage):
+    if usage:
+        charge_budget(user_id, "tokens", usage.total_tokens or 0)
+
+@app.errorhandler(connection_pool.PoolTimeout)
+def handle_pool_timeout(e):
+    """Pool DB hết connection quá lâu: trả 503 để client thử lại thay vì dữ liệu rỗng"""
+    logging.warning(f"Từ chối request {request.path}: {e}")
+    return jsonify({"error": "Hệ thống đang quá tải, vui lòng thử lại sau"}), 503, {"Retry-After": "1"}
+
+def require_conversation_owner(conversation_id):
+    """Trả về response 404 nếu conversation không thuộc user đang đăng nhập, ngược lại None"""
+    if not database.user_owns_conversation(conversation_id, session.get('user_id')):
+        return jsonify({"error": "Không tìm thấy conversation"}), 404
+    return None
+
+@app.before_request
+def start_request_metrics():
+    """Bắt đầu đo request; gắn trace id (lấy từ header TRACE_HEADER hoặc tự sinh) vào log"""
+    g.request_start = time.perf_counter()
+    g.trace = None
+    metrics.HTTP_IN_FLIGHT.inc()
+    # Chế độ ASGI: middleware của async_main đã đặt sẵn trace id vào header của request
+    if metrics.TRACE_HEADER:
+        g.trace = metrics.start_trace(request.headers.get(metrics.TRACE_HEADER))
+
+@app.after_request
+def finish_request_metrics(response):
+    """Ghi số liệu khi response đã gửi xong (với stream là lúc stream kết thúc)
+
+    Response gửi file (send_file, direct_passthrough) được server gửi thẳng
+    qua wsgi.file_wrapper và Werkzeug không gọi các hàm call_on_close của nó,
+    nên số liệu được ghi ở teardown_request (khi Flask trả response cho server).
+    """
+    start = g.get('request_start')
+    if start is None:
+        return response
+    trace = g.get('trace')
+    if trace:
+        response.headers[metrics.TRACE_HEADER] = trace[0]
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    method = request.method
+    
+    def finish():
+        metrics.HTTP_IN_FLIGHT.dec()
+        metrics.HTTP_REQUESTS.inc(method=method, route=route, status=response.status_code)
+        metrics.HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start, route=route)
+        if trace:
+            metrics.end_trace(trace[1])
+    
+    if response.direct_passthrough:
+        g.finish_request_metrics = finish
+    else:
+        response.call_on_close(finish)
+    return response
+
+@app.teardown_request
+def finish_passthrough_metrics(exc):
+    finish = g.pop('finish_request_metrics', None)
+    if finish:
+        finish()
+
+def collect_runtime_metrics():
+    """Cập nhật gauge từ số liệu của connection pool và pool phiên mã trước mỗi lần scrape"""
+    stats = database.db_pool.stats()
+    for state in ("open", "idle", "checked_out"):
+        metrics.DB_POOL_CONNECTIONS.set(stats[state], pool="mysql", state=state)
+    metrics.DB_POOL_WAITING.set(stats["waiting"], pool="mysql")
+    metrics.DB_POOL_TIMEOUTS.set_total(stats["timeouts"], pool="mysql")
+    metrics.TRANSCRIPTION_IN_FLIGHT.set(transcription_service.stats()["in_flight"])
+
+metrics.register_collector(collect_runtime_metrics)
+
 # ==================== ROUTES - FRONTEND ====================
 
+def static_response(path):
+    """Gửi file tĩnh từ bản build: chọn bản nén theo Accept-Encoding, ETag mạnh, 304 khi client còn bản mới nhất
+
+    Trả về None nếu không có file trong bản build.
+    """
+    asset = static_files.resolve(path, request.headers.get("Accept-Encoding"))
+    if asset is None:
+        return None
+    if request.if_none_match.contains(asset["etag"]):
+        response = Response(status=304)
+    else:
+        response = send_file(asset["path"], mimetype=asset["content_type"], etag=False, conditional=False)
+        if asset["encoding"]:
+            response.headers["Content-Encoding"] = asset["encoding"]
+    response.set_etag(asset["etag"])
+    response.headers["Cache-Control"] = asset["cache_control"]
+    if asset["vary"]:
+        response.vary.add("Accept-Encoding")
+    return response
+
 @app.route('/')
 def index():
+    if static_files:
+        return static_response('index.html')
     return send_from_directory(FRONTEND_DIR, 'index.html')
 
 @app.route('/<path:path>')
 def serve_static(path):
+    response = static_response(path) if static_files else None
+    if response is not None:
+        return response
     try:
         return send_from_directory(FRONTEND_DIR, path)
     except:
@@ -84,6 +258,8 @@ def serve_static(path):
 
 @app.route('/CodeMate_AI.png')
 def serve_favicon():
+    if static_files:
+        return static_response('CodeMate_AI.png') or (jsonify({"error": "Favicon not found"}), 404)
     try:
         return send_from_directory(IMAGE_DIR, 'CodeMate_AI.png', mimetype='image/png')
     except FileNotFoundError:
@@ -210,13 +386,113 @@ def get_current_user():
 
 # ==================== ROUTES - CONVERSATIONS ====================
 
+# Kích thước trang mặc định / tối đa khi tải danh sách conversations và lịch sử messages
+CONVERSATION_PAGE_SIZE = 30
+CONVERSATION_PAGE_MAX = 100
+MESSAGE_PAGE_SIZE = 50
+MESSAGE_PAGE_MAX = 200
+
+def parse_page_args(args, default=MESSAGE_PAGE_SIZE, maximum=MESSAGE_PAGE_MAX):
+    """Đọc before/limit của request phân trang; trả về (before, limit) hoặc raise ValueError"""
+    before = args.get('before') or None
+    if before:
+        database.decode_cursor(before)
+    limit = int(args.get('limit', default))
+    if limit < 1:
+        raise ValueError("limit phải lớn hơn 0")
+    return before, min(limit, maximum)
+
+def parse_since_id(args):
+    """Đọc ?since=<message id> của request lấy messages mới; None nếu không có"""
+    since = args.get('since')
+    if not since:
+        return None
+    since = int(since)
+    if since < 0:
+        raise ValueError("since không hợp lệ")
+    return since
+
+def dumps_compact(obj):
+    """JSON gọn cho các API danh sách: không có khoảng trắng thừa, tiếng Việt giữ nguyên UTF-8 thay vì \\uXXXX"""
+    return app.json.dumps(obj, separators=(",", ":"), ensure_ascii=False)
+
+def conversations_page(conversations, has_more, version=None):
+    """Body JSON của một trang conversations (sync: token cho ?since= ở lần tải sau)"""
+    return {
+        "conversations": conversations,
+        "has_more": has_more,
+        "next_before": database.encode_cursor(conversations[-1], "updated_at") if has_more else None,
+        "sync": http_cache.encode_sync_token(version) if version else None
+    }
+
+def conversations_delta(since, version, changed, has_more):
+    """Body JSON cho ?since=<sync token>: chỉ các conversations đã thay đổi, mới nhất trước
+
+    Trả về None khi client phải tải lại từ đầu: quá nhiều thay đổi, hoặc số
+    conversations không khớp với số được tạo thêm (có conversation bị xóa).
+    """
+    if has_more:
+        return None
+    created = sum(1 for conversation in changed if conversation["id"] > since["max_id"])
+    if version["count"] != since["count"] + created:
+        return None
+    return {
+        "conversations": changed,
+        "has_more": False,
+        "next_before": None,
+        "sync": http_cache.encode_sync_token(version),
+        "reset": False
+    }
+
+def cached_json(body, etag):
+    """Response JSON có ETag (nếu có), nén gzip khi đủ lớn"""
+    payload, headers = http_cache.compress_body(dumps_compact(body), request.headers.get('Accept-Encoding'))
+    if etag:
+        headers.update(http_cache.cache_headers(etag))
+    return Response(payload, mimetype='application/json', headers=headers)
+
+def not_modified(etag):
+    """304 nếu If-None-Match khớp etag, ngược lại None"""
+    if etag and http_cache.etag_matches(request.headers.get('If-None-Match'), etag):
+        return Response(status=304, headers=http_cache.cache_headers(etag))
+    return None
+
 @app.route('/api/conversations', methods=['GET'])
 @login_required
 def get_conversations():
-    """Lấy danh sách conversations của user"""
+    """Lấy một trang conversations của user (?before=<cursor>&limit=N)
+
+    ?since=<sync token> chỉ trả các conversations thay đổi kể từ token (kèm
+    "reset": true và trang đầu đầy đủ nếu không tính được delta). Có ETag:
+    If-None-Match khớp thì trả 304 mà không đọc các dòng.
+    """
     user_id = session.get('user_id')
-    conversations = database.get_user_conversations(user_id)
-    return jsonify(conversations), 200
+    token = request.args.get('since')
+    try:
+        before, limit = parse_page_args(request.args, CONVERSATION_PAGE_SIZE, CONVERSATION_PAGE_MAX)
+        since = http_cache.decode_sync_token(token) if token else None
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    version = database.get_conversations_version(user_id)
+    etag = None
+    if version:
+        etag = http_cache.make_etag(user_id, version["count"], version["updated_at"], version["max_id"],
+                                    before, limit, token)
+        response = not_modified(etag)
+        if response:
+            return response
+    
+    page = None
+    if since and version:
+        changed, has_more = database.get_conversations_since(user_id, since["updated_at"], CONVERSATION_PAGE_MAX)
+        page = conversations_delta(since, version, changed, has_more)
+    if page is None:
+        conversations, has_more = database.get_user_conversations(user_id, None if since else before, limit)
+        page = conversations_page(conversations, has_more, version)
+        if since:
+            page["reset"] = True
+    return cached_json(page, etag)
 
 @app.route('/api/conversations', methods=['POST'])
 @login_required
@@ -233,12 +509,56 @@ def create_new_conversation():
     else:
         return jsonify({"error": "Lỗi khi tạo conversation"}), 500
 
+def iter_messages_page(messages, has_more, dumps, delta=False):
+    """Mã hóa JSON của một trang messages theo từng message (không dựng cả chuỗi lớn trong bộ nhớ)
+
+    Kết quả: {"messages": [...], "has_more": bool, "next_before": cursor | null}.
+    Với delta (?since=) has_more nghĩa là còn messages mới hơn message cuối.
+    """
+    yield '{"messages":['
+    for i, message in enumerate(messages):
+        yield ("," if i else "") + dumps(message)
+    next_before = database.encode_cursor(messages[0]) if has_more and messages and not delta else None
+    yield f'],"has_more":{dumps(has_more)},"next_before":{dumps(next_before)}}}'
+
+def messages_size_hint(messages):
+    """Ước lượng kích thước JSON của một trang messages (để quyết định có nén không)"""
+    return sum(len(message["content"]) + 100 for message in messages)
+
 @app.route('/api/conversations/<int:conversation_id>', methods=['GET'])
 @login_required
 def get_conversation(conversation_id):
-    """Lấy messages của một conversation"""
-    messages = database.get_conversation_messages(conversation_id)
-    return jsonify(messages), 200
+    """Lấy một trang messages của conversation (mới nhất trước, ?before=<cursor>&limit=N)
+
+    ?since=<message id> chỉ trả các messages mới hơn id đó. Có ETag theo số
+    messages và id lớn nhất: If-None-Match khớp thì trả 304.
+    """
+    error = require_conversation_owner(conversation_id)
+    if error:
+        return error
+    
+    try:
+        before, limit = parse_page_args(request.args)
+        since = parse_since_id(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    version = database.get_messages_version(conversation_id)
+    etag = http_cache.make_etag(conversation_id, *version, before, limit, since) if version else None
+    response = not_modified(etag)
+    if response:
+        return response
+    
+    if since is not None:
+        messages, has_more = database.get_messages_since(conversation_id, since, limit)
+    else:
+        messages, has_more = database.get_messages_page(conversation_id, before, limit)
+    body, headers = http_cache.compress_stream(
+        iter_messages_page(messages, has_more, dumps_compact, delta=since is not None),
+        messages_size_hint(messages), request.headers.get('Accept-Encoding'))
+    if etag:
+        headers.update(http_cache.cache_headers(etag))
+    return Response(body, mimetype='application/json', headers=headers)
 
 @app.route('/api/conversations/<int:conversation_id>', methods=['DELETE'])
 @login_required
@@ -262,6 +582,10 @@ def update_conversation_title_route(conversation_id):
     if not title:
         return jsonify({"error": "Title không được để trống"}), 400
     
+    error = require_conversation_owner(conversation_id)
+    if error:
+        return error
+    
     success = database.update_conversation_title(conversation_id, title)
     
     if success:
@@ -269,89 +593,529 @@ def update_conversation_title_route(conversation_id):
     else:
         return jsonify({"error": "Lỗi khi cập nhật title"}), 500
 
-# ==================== ROUTES - CHAT ====================
+# ==================== ROUTES - SEARCH ====================
 
-@app.route('/api/chat', methods=['POST'])
+# Kích thước trang kết quả tìm kiếm và độ sâu tối đa (offset) được phép duyệt
+SEARCH_PAGE_SIZE = 20
+SEARCH_PAGE_MAX = 50
+SEARCH_MAX_OFFSET = 500
+
+@app.route('/api/search', methods=['GET'])
 @login_required
-def handle_chat():
-    """Endpoint xử lý chat"""
+def search_history():
+    """Tìm trong lịch sử chat của user (?q=...&limit=N&offset=M), kết quả xếp theo độ liên quan"""
     user_id = session.get('user_id')
-    conversation_id = request.form.get('conversation_id') or request.args.get('conversation_id')
+    words = search.terms(request.args.get('q', '')[:200])
+    if not words:
+        return jsonify({"error": f"Từ khóa tìm kiếm phải có ít nhất {search.MIN_TERM_LENGTH} ký tự"}), 400
+    try:
+        limit = min(int(request.args.get('limit', SEARCH_PAGE_SIZE)), SEARCH_PAGE_MAX)
+        offset = int(request.args.get('offset', 0))
+    except ValueError:
+        return jsonify({"error": "limit/offset phải là số nguyên"}), 400
+    if limit < 1 or offset < 0 or offset > SEARCH_MAX_OFFSET:
+        return jsonify({"error": f"limit phải lớn hơn 0, offset trong khoảng 0-{SEARCH_MAX_OFFSET}"}), 400
     
-    if not conversation_id:
-        return jsonify({"error": "conversation_id là bắt buộc"}), 400
+    messages, has_more = database.search_messages(user_id, search.boolean_query(words), limit, offset)
+    if messages is None:
+        return jsonify({"error": "Lỗi khi tìm kiếm, vui lòng thử từ khóa cụ thể hơn"}), 503
     
-    conversation_id = int(conversation_id)
+    results = []
+    for message in messages:
+        snippet, highlights = search.snippet(message['content'], words)
+        results.append({
+            "message_id": message['id'],
+            "conversation_id": message['conversation_id'],
+            "conversation_title": message['title'],
+            "role": message['role'],
+            "created_at": message['created_at'],
+            "snippet": snippet,
+            "highlights": highlights,
+            "score": round(float(message['score']), 4)
+        })
+    has_more = has_more and offset + limit <= SEARCH_MAX_OFFSET
+    return jsonify({
+        "results": results,
+        "terms": words,
+        "has_more": has_more,
+        "next_offset": offset + limit if has_more else None
+    }), 200
+
+# ==================== ROUTES - CHAT ====================
+
+def extract_user_input():
+    """Lấy đầu vào của user từ request (văn bản hoặc tệp âm thanh)
+
+    Trả về (user_input, None) nếu thành công, hoặc (None, response lỗi).
+    """
     user_input = ""
-    temp_path = None
     
     # Xử lý đầu vào
     if 'audioFile' in request.files:
         audio_file = request.files['audioFile']
         if audio_file.filename == '':
-            return jsonify({"error": "Tệp không có tên"}), 400
+            return None, (jsonify({"error": "Tệp không có tên"}), 400)
+        if admission:
+            admission.admit(session['user_id'], AUDIO_COST)
         
-        temp_dir = "temp_audio"
-        os.makedirs(temp_dir, exist_ok=True)
-        temp_path = os.path.join(temp_dir, f"{int(time.time())}_{audio_file.filename}")
-        audio_file.save(temp_path)
-        logging.info(f"Đã nhận tệp âm thanh: {temp_path}")
-        
-        if not whisper_model:
-            return jsonify({"error": "Mô hình Whisper không khả dụng"}), 500
+        # Đọc thẳng vào bộ nhớ (không ghi tệp tạm), có giới hạn kích thước
+        try:
+            with metrics.stage("upload"):
+                audio_bytes = audio.read_upload(audio_file.stream)
+        except audio.AudioTooLarge as e:
+            return None, (jsonify({"error": str(e)}), 413)
+        logging.info(f"Đã nhận tệp âm thanh: {audio_file.filename} ({len(audio_bytes)} bytes)")
         
         try:
-            logging.info("Bắt đầu phiên mã...")
-            start_time = time.time()
-            segments, _ = whisper_model.transcribe(temp_path, beam_size=5, language="vi")
-            user_input = "".join(segment.text for segment in segments).strip()
-            processing_time = time.time() - start_time
-            logging.info(f"Phiên mã thành công sau {processing_time:.2f}s: '{user_input}'")
+            with metrics.stage("transcription"), admission_stage("transcription"):
+                result = transcription_service.submit(audio_bytes).result(timeout=transcription_service.timeout)
+            user_input = result["text"]
+            charge_budget(session['user_id'], "audio_seconds", result["audio_duration"])
+            if result["route"] == transcription.ROUTE_EMPTY:
+                return None, (jsonify({"error": "Không phát hiện giọng nói trong tệp âm thanh"}), 400)
+            logging.info(f"Phiên mã thành công: '{user_input}'")
+        except transcription.TranscriptionQueueFull as e:
+            logging.warning(f"Từ chối phiên mã, hàng đợi đầy (Retry-After {e.retry_after}s)")
+            return None, (jsonify({"error": "Hệ thống đang bận xử lý âm thanh, vui lòng thử lại sau"}), 503,
+                          {"Retry-After": str(e.retry_after)})
+        except audio.AudioTooLarge as e:
+            return None, (jsonify({"error": str(e)}), 413)
+        except rate_limit.StageBusy:
+            raise
         except Exception as e:
             logging.error(f"Lỗi khi phiên mã: {e}")
-            return jsonify({"error": "Lỗi xử lý âm thanh"}), 500
-        finally:
-            if temp_path and os.path.exists(temp_path):
-                os.remove(temp_path)
+            return None, (jsonify({"error": "Lỗi xử lý âm thanh"}), 500)
     
     elif 'text' in request.form:
         user_input = request.form['text']
         logging.info(f"Đã nhận yêu cầu văn bản: '{user_input}'")
     else:
-        return jsonify({"error": "Yêu cầu phải chứa 'audioFile' hoặc 'text'"}), 400
+        return None, (jsonify({"error": "Yêu cầu phải chứa 'audioFile' hoặc 'text'"}), 400)
     
     if not user_input:
-        return jsonify({"error": "Đầu vào rỗng sau khi xử lý"}), 400
+        return None, (jsonify({"error": "Đầu vào rỗng sau khi xử lý"}), 400)
+    
+    return user_input, None
+
+def sse_event(event, data):
+    """Định dạng một sự kiện Server-Sent Events"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def sse_response(events):
+    return Response(events, mimetype='text/event-stream', headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"
+    })
+
+def ai_error_response(error):
+    """Response cho AIServiceError: 503 + Retry-After khi quá tải, 504 khi quá chậm, 502 khi lỗi upstream"""
+    return jsonify({"error": error.message}), error.status, error.headers()
+
+def join_flight(messages):
+    """(flight, leader) cho lời gọi OpenAI với messages; (None, True) nếu tắt gộp request"""
+    if not coalescer:
+        return None, True
+    return coalescer.join(single_flight.flight_key(MODEL_NAME, messages))
+
+def follow_flight(flight, conversation_id, user_input):
+    """SSE cho request trùng prompt với một lời gọi OpenAI đang chạy
+
+    Phát lại các đoạn leader đã nhận rồi nhận tiếp cùng lúc với leader;
+    lượt chat được lưu vào conversation của chính request này.
+    """
+    chunks = []
+    deltas = flight.follow(coalescer.wait_timeout)
+    try:
+        yield sse_event("user_input", {"user_input": user_input})
+        for delta in deltas:
+            chunks.append(delta)
+            yield sse_event("delta", {"content": delta})
+        yield sse_event("done", {"ai_response": "".join(chunks)})
+    except GeneratorExit:
+        logging.info(f"Client ngắt kết nối khỏi stream của conversation {conversation_id}")
+        raise
+    except Exception as e:
+        logging.error(f"Lỗi khi chờ request trùng prompt: {e}")
+        yield sse_event("error", {"error": getattr(e, "message", "Lỗi kết nối đến AI service")})
+    finally:
+        deltas.close()
+        flight.detach()
+        ai_response = "".join(chunks)
+        if ai_response:
+            persist_turn(conversation_id, user_input, ai_response)
+
+def persist_turn(conversation_id, user_input, ai_response):
+    """Lưu một lượt chat: qua write-behind nếu bật và còn chỗ, ngược lại ghi ngay (một transaction)"""
+    with metrics.stage("save"):
+        if turn_writer and turn_writer.submit(conversation_id, user_input, ai_response):
+            return
+        database.save_turn(conversation_id, user_input, ai_response)
+
+def use_response_cache():
+    """Request có dùng response cache không (opt-out: no_cache=1 hoặc Cache-Control: no-cache)"""
+    if not chat_cache:
+        return False
+    opted_out = request.form.get('no_cache') in ('1', 'true') or \
+        'no-cache' in request.headers.get('Cache-Control', '')
+    if opted_out:
+        chat_cache.record_bypass()
+    return not opted_out
+
+@app.route('/api/chat', methods=['POST'])
+@login_required(admit=CHAT_COST)
+def handle_chat():
+    """Endpoint xử lý chat"""
+    conversation_id = request.form.get('conversation_id') or request.args.get('conversation_id')
+    
+    if not conversation_id:
+        return jsonify({"error": "conversation_id là bắt buộc"}), 400
+    
+    conversation_id = int(conversation_id)
+    error = require_conversation_owner(conversation_id)
+    if error:
+        return error
+    
+    user_input, error = extract_user_input()
+    if error:
+        return error
     
-    # Gọi OpenAI
     if not client:
         return jsonify({"error": "OpenAI client không khả dụng"}), 500
     
-    try:
-        logging.info("Gửi yêu cầu đến OpenAI...")
-        completion = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": SYSTEM_PROMPT},
-                {"role": "user", "content": user_input}
-            ]
-        )
-        ai_response = completion.choices[0].message.content
-    except Exception as e:
-        logging.error(f"Lỗi khi gọi OpenAI API: {e}")
-        return jsonify({"error": "Lỗi kết nối đến AI service"}), 500
+    with metrics.stage("context"):
+        messages = context_builder.build(conversation_id, SYSTEM_PROMPT, user_input, client)
+    # Key của cache gồm cả phần lịch sử (bỏ system prompt đầu và câu hỏi cuối)
+    context = messages[1:-1]
+    
+    use_cache = use_response_cache()
+    with metrics.stage("cache_lookup"):
+        ai_response = chat_cache.get(user_input, SYSTEM_PROMPT, MODEL_NAME, context) if use_cache else None
+    cached = ai_response is not None
+    
+    if not cached:
+        # Request trùng prompt đang gọi OpenAI thì chờ kết quả của nó thay vì gọi lại
+        flight, leader = join_flight(messages)
+        try:
+            if leader:
+                logging.info(f"Gửi yêu cầu đến OpenAI ({len(messages)} messages)...")
+                with flight.leading() if flight else contextlib.nullcontext():
+                    with metrics.stage("openai"), admission_stage("openai"):
+                        completion = client.create(
+                            model=MODEL_NAME,
+                            messages=messages
+                        )
+                    metrics.record_usage(MODEL_NAME, completion.usage)
+                    charge_usage(session['user_id'], completion.usage)
+                    ai_response = completion.choices[0].message.content
+                    if flight:
+                        flight.publish(ai_response)
+                        flight.finish()
+            else:
+                logging.info("Chờ phản hồi của request trùng prompt đang gọi OpenAI...")
+                with metrics.stage("coalesced"):
+                    ai_response = flight.result(coalescer.wait_timeout)
+        except ai_client.AIServiceError as e:
+            logging.error(f"Lỗi khi gọi OpenAI API: {e}")
+            return ai_error_response(e)
+        
+        if use_cache and leader:
+            chat_cache.set(user_input, SYSTEM_PROMPT, MODEL_NAME, ai_response, context)
     
     # Lưu messages vào database
-    database.save_message(conversation_id, 'user', user_input)
-    database.save_message(conversation_id, 'assistant', ai_response)
+    persist_turn(conversation_id, user_input, ai_response)
     
     return jsonify({
         "user_input": user_input,
-        "ai_response": ai_response
+        "ai_response": ai_response,
+        "cached": cached
     })
 
+@app.route('/api/chat/stream', methods=['POST'])
+@login_required(admit=CHAT_COST)
+def handle_chat_stream():
+    """Endpoint chat dạng streaming (Server-Sent Events)
+
+    Gửi từng đoạn phản hồi của OpenAI về trình duyệt ngay khi nhận được.
+    Messages được lưu khi stream kết thúc hoặc khi client ngắt kết nối.
+    """
+    conversation_id = request.form.get('conversation_id') or request.args.get('conversation_id')
+    
+    if not conversation_id:
+        return jsonify({"error": "conversation_id là bắt buộc"}), 400
+    
+    conversation_id = int(conversation_id)
+    error = require_conversation_owner(conversation_id)
+    if error:
+        return error
+    
+    user_input, error = extract_user_input()
+    if error:
+        return error
+    
+    if not client:
+        return jsonify({"error": "OpenAI client không khả dụng"}), 500
+    
+    with metrics.stage("context"):
+        messages = context_builder.build(conversation_id, SYSTEM_PROMPT, user_input, client)
+    context = messages[1:-1]
+    
+    use_cache = use_response_cache()
+    with metrics.stage("cache_lookup"):
+        cached_response = chat_cache.get(user_input, SYSTEM_PROMPT, MODEL_NAME, context) if use_cache else None
+    if cached_response is not None:
+        persist_turn(conversation_id, user_input, cached_response)
+        return sse_response([
+            sse_event("user_input", {"user_input": user_input}),
+            sse_event("delta", {"content": cached_response}),
+            sse_event("done", {"ai_response": cached_response, "cached": True})
+        ])
+    
+    # Request trùng prompt đang stream từ OpenAI: nhận cùng luồng token thay vì gọi lại
+    flight, leader = join_flight(messages)
+    if not leader:
+        logging.info(f"Nhận chung stream với request trùng prompt (conversation {conversation_id})")
+        return sse_response(follow_flight(flight, conversation_id, user_input))
+    
+    user_id = session['user_id']
+    # Slot OpenAI được giữ tới khi stream kết thúc (trả lại trong generate)
+    try:
+        lease = admission.acquire("openai") if admission else None
+    except BaseException as e:
+        if flight:
+            flight.fail(e)
+        raise
+    try:
+        logging.info(f"Gửi yêu cầu streaming đến OpenAI ({len(messages)} messages)...")
+        openai_start = time.perf_counter()
+        stream = client.create(
+            model=MODEL_NAME,
+            messages=messages,
+            stream=True,
+            # Chunk cuối mang usage (choices rỗng) để đếm token
+            stream_options={"include_usage": True}
+        )
+    except BaseException as e:
+        # Mọi lỗi phải trả slot và báo cho các request đang chờ cùng flight, không chỉ AIServiceError
+        logging.error(f"Lỗi khi gọi OpenAI API: {e!r}")
+        if flight:
+            flight.fail(e)
+        if admission:
+            admission.release("openai", lease)
+        if isinstance(e, ai_client.AIServiceError):
+            return ai_error_response(e)
+        raise
+    
+    def upstream(chunks):
+        """Các đoạn phản hồi từ stream OpenAI, đồng thời phát cho các request trùng prompt đang chờ"""
+        for chunk in stream:
+            metrics.record_usage(MODEL_NAME, chunk.usage)
+            charge_usage(user_id, chunk.usage)
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                if not chunks:
+                    metrics.CHAT_STAGE_SECONDS.observe(time.perf_counter() - openai_start,
+                                                       stage="openai_first_token")
+                chunks.append(delta)
+                if flight:
+                    flight.publish(delta)
+                yield delta
+        if flight:
+            flight.finish()
+        if use_cache:
+            chat_cache.set(user_input, SYSTEM_PROMPT, MODEL_NAME, "".join(chunks), context)
+    
+    def generate():
+        chunks = []
+        deltas = upstream(chunks)
+        try:
+            yield sse_event("user_input", {"user_input": user_input})
+            for delta in deltas:
+                yield sse_event("delta", {"content": delta})
+            yield sse_event("done", {"ai_response": "".join(chunks)})
+        except GeneratorExit:
+            logging.info(f"Client ngắt kết nối khỏi stream của conversation {conversation_id}")
+            if flight and flight.subscribers:
+                # Còn request trùng prompt đang nhận chung stream: đọc nốt cho họ
+                try:
+                    for _ in deltas:
+                        pass
+                except Exception as e:
+                    logging.error(f"Lỗi trong khi streaming từ OpenAI: {e}")
+                    flight.fail(e)
+            raise
+        except Exception as e:
+            logging.error(f"Lỗi trong khi streaming từ OpenAI: {e}")
+            if flight:
+                flight.fail(e)
+            yield sse_event("error", {"error": "Lỗi kết nối đến AI service"})
+        finally:
+            if flight and not flight.done:
+                flight.fail(ai_client.AIServiceError("upstream", "stream của leader bị dừng"))
+            stream.close()
+            if admission:
+                admission.release("openai", lease)
+            metrics.CHAT_STAGE_SECONDS.observe(time.perf_counter() - openai_start, stage="openai")
+            # Lưu messages (kể cả phản hồi dở dang khi client ngắt kết nối)
+            ai_response = "".join(chunks)
+            if ai_response:
+                persist_turn(conversation_id, user_input, ai_response)
+    
+    return sse_response(generate())
+
+@app.route('/api/transcription/stats', methods=['GET'])
+@login_required
+def transcription_stats():
+    """Số liệu của pool phiên mã (số job, thời gian chờ/xử lý)"""
+    return jsonify(transcription_service.stats()), 200
+
+@app.route('/api/cache/stats', methods=['GET'])
+@login_required
+def response_cache_stats():
+    """Số liệu hit/miss của response cache"""
+    if not chat_cache:
+        return jsonify({"enabled": False}), 200
+    return jsonify({"enabled": True, **chat_cache.stats()}), 200
+
+@app.route('/api/db/stats', methods=['GET'])
+@login_required
+def db_pool_stats():
+    """Số liệu của MySQL connection pool (connection đang mượn, thời gian chờ, timeout)"""
+    return jsonify(database.db_pool.stats()), 200
+
+@app.route('/api/auth/stats', methods=['GET'])
+@login_required
+def password_hasher_stats():
+    """Số liệu của pool hash mật khẩu (số lần hash/kiểm tra, rehash, thời gian trung bình)"""
+    return jsonify(database.password_hasher.stats()), 200
+
+@app.route('/api/ai/stats', methods=['GET'])
+@login_required
+def ai_client_stats():
+    """Số liệu gọi OpenAI (thành công/thất bại, retry, hedge, request bị từ chối vì quá tải, request được gộp)"""
+    if not client:
+        return jsonify({"error": "OpenAI client không khả dụng"}), 500
+    return jsonify({**client.stats(), "coalescing": coalescer.stats() if coalescer else {"enabled": False}}), 200
+
+@app.route('/api/limits', methods=['GET'])
+@login_required
+def rate_limits():
+    """Ngân sách còn lại của user đang đăng nhập và giới hạn đồng thời của các bước nặng"""
+    if not admission:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, "budgets": admission.remaining(session['user_id']),
+                    "stages": admission.stats()["stages"]})
+
+# ==================== ROUTES - HEALTH ====================
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Số liệu dạng Prometheus; nếu đặt METRICS_TOKEN thì cần header Authorization: Bearer <token>"""
+    token = os.getenv("METRICS_TOKEN")
+    if token and request.headers.get('Authorization') != f"Bearer {token}":
+        return jsonify({"error": "Unauthorized"}), 401
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    """Liveness: process còn nhận request (không kiểm tra phụ thuộc)"""
+    return jsonify({"status": "ok"}), 200
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    """Readiness: MySQL kết nối được và warm-up không còn thành phần nào đang nạp
+
+    Pool Whisper bị hỏng (worker chết) không chặn readiness nhưng được báo là degraded.
+    """
+    components = warmup.status()
+    checks = {"database": database.ping(), "openai": client is not None,
+              "transcription": transcription_service.healthy()}
+    ready = checks["database"] and warmup.ready()
+    degraded = not checks["openai"] or not checks["transcription"] or \
+        any(c["state"] == "failed" for c in components.values())
+    return jsonify({
+        "status": "ready" if ready else "starting",
+        "degraded": degraded,
+        "checks": checks,
+        "components": components
+    }), 200 if ready else 503
+
+# ==================== ROUTES - LIVE TRANSCRIPTION ====================
+
+@app.route('/api/transcribe/stream', methods=['POST'])
+@login_required(admit=AUDIO_COST)
+def start_live_transcription():
+    """Mở một phiên phiên mã tăng dần cho bản ghi âm đang ghi"""
+    stream_id = live_transcriptions.create(session.get('user_id'))
+    return jsonify({"stream_id": stream_id}), 201
+
+@app.route('/api/transcribe/stream/<stream_id>', methods=['POST'])
+@login_required(admit=AUDIO_COST)
+def append_live_transcription(stream_id):
+    """Nhận một chunk âm thanh (body nhị phân), trả về transcript tạm thời"""
+    live = live_transcriptions.get(stream_id, session.get('user_id'))
+    if not live:
+        return jsonify({"error": "Phiên ghi âm không tồn tại"}), 404
+    
+    try:
+        partial = live.append(request.get_data())
+    except audio.AudioTooLarge as e:
+        live_transcriptions.remove(stream_id)
+        return jsonify({"error": str(e)}), 413
+    except Exception as e:
+        logging.error(f"Lỗi khi phiên mã tăng dần: {e}")
+        return jsonify({"error": "Lỗi xử lý âm thanh"}), 500
+    finally:
+        # Trừ ngay phần âm thanh vừa giải mã để chunk tiếp theo bị chặn (429) khi hết ngân sách
+        charge_budget(session['user_id'], "audio_seconds", live.uncharged_seconds())
+    
+    return jsonify({"partial": partial}), 200
+
+@app.route('/api/transcribe/stream/<stream_id>/finish', methods=['POST'])
+@login_required
+def finish_live_transcription(stream_id):
+    """Kết thúc phiên: phiên mã phần còn lại và trả về transcript cuối cùng"""
+    live = live_transcriptions.get(stream_id, session.get('user_id'))
+    if not live:
+        return jsonify({"error": "Phiên ghi âm không tồn tại"}), 404
+    
+    try:
+        with admission_stage("transcription"):
+            text = live.finish(request.get_data())
+    except transcription.TranscriptionQueueFull as e:
+        return jsonify({"error": "Hệ thống đang bận xử lý âm thanh, vui lòng thử lại sau"}), 503, \
+            {"Retry-After": str(e.retry_after)}
+    except audio.AudioTooLarge as e:
+        live_transcriptions.remove(stream_id)
+        return jsonify({"error": str(e)}), 413
+    except rate_limit.StageBusy:
+        raise
+    except Exception as e:
+        logging.error(f"Lỗi khi phiên mã tăng dần: {e}")
+        return jsonify({"error": "Lỗi xử lý âm thanh"}), 500
+    
+    live_transcriptions.remove(stream_id)
+    charge_budget(session['user_id'], "audio_seconds", live.uncharged_seconds())
+    logging.info(f"Phiên mã tăng dần hoàn tất: '{text}'")
+    return jsonify({"text": text}), 200
+
 # ==================== RUN SERVER ====================
 
 if __name__ == '__main__':
-    from waitress import serve
-    serve(app, host="0.0.0.0", port=5000)
\ No newline at end of file
+    # SERVER_MODE=wsgi (mặc định): Flask + waitress
+    # SERVER_MODE=asgi: async_main (Starlette + uvicorn) cho các route chat/conversations
+    server_mode = os.getenv("SERVER_MODE", "wsgi").lower()
+    port = int(os.getenv("PORT", "5000"))
+    
+    if server_mode == "asgi":
+        import sys
+        import uvicorn
+        # Tránh import (và tải Whisper) lần thứ hai khi async_main import nlp_main
+        sys.modules.setdefault("nlp_main", sys.modules[__name__])
+        from async_main import application
+        uvicorn.run(application, host="0.0.0.0", port=port)
+    else:
+        from waitress import serve
+        warmup.start()
+        serve(app, host="0.0.0.0", port=port, threads=int(os.getenv("WAITRESS_THREADS", "4")))
\ No newline at end of file
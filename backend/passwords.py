@@ -0,0 +1,122 @@
+import os
+import re
+import time
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import bcrypt
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Cost mặc định của bcrypt (2^12 vòng, ~250 ms CPU mỗi lần hash/kiểm tra)
+DEFAULT_ROUNDS = 12
+
+_COST_PATTERN = re.compile(r"^\$2[abxy]?\$(\d{2})\$")
+
+# ==================== WORKER PROCESS ====================
+
+def _hash_job(password, rounds):
+    """Chạy trong worker process: bytes mật khẩu -> hash bcrypt (str)"""
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds)).decode('utf-8')
+
+def _check_job(password, password_hash):
+    """Chạy trong worker process: so khớp mật khẩu với hash"""
+    return bcrypt.checkpw(password, password_hash)
+
+# ==================== HASHER ====================
+
+def hash_rounds(password_hash):
+    """Đọc cost factor từ chuỗi hash ($2b$12$...), None nếu không đọc được"""
+    match = _COST_PATTERN.match(password_hash or "")
+    return int(match.group(1)) if match else None
+
+class PasswordHasher:
+    """Hash/kiểm tra mật khẩu bcrypt trong một process pool riêng
+
+    bcrypt tốn CPU và giữ GIL, nên chạy inline trên thread của waitress sẽ
+    làm mọi request khác (kể cả stream chat) chậm theo trong lúc có đợt đăng
+    nhập. Ở đây thread request chỉ chờ future; worker process làm phần nặng.
+    workers=0 chạy inline như trước (dùng khi debug hoặc để so sánh).
+    Pool được khởi tạo lười ở lần hash đầu tiên.
+    """
+
+    def __init__(self, rounds=DEFAULT_ROUNDS, workers=2, timeout=30):
+        self.rounds = rounds
+        self.workers = workers
+        self.timeout = timeout
+
+        self._executor = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {"hashed": 0, "checked": 0, "rehashed": 0, "failed": 0, "total_time": 0.0}
+
+    @classmethod
+    def from_env(cls):
+        """Tạo hasher từ biến môi trường BCRYPT_* / PASSWORD_HASH_*"""
+        return cls(
+            rounds=int(os.getenv("BCRYPT_ROUNDS", str(DEFAULT_ROUNDS))),
+            workers=int(os.getenv("PASSWORD_HASH_WORKERS", "2")),
+            timeout=float(os.getenv("PASSWORD_HASH_TIMEOUT", "30"))
+        )
+
+    def start(self):
+        """Khởi động pool worker (idempotent), None nếu chạy inline"""
+        if self.workers <= 0:
+            return None
+        with self._start_lock:
+            if self._executor is None:
+                # spawn: an toàn với thread của web server và chạy được trên Windows
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn")
+                )
+                logging.info(f"Khởi động {self.workers} worker hash mật khẩu (bcrypt cost={self.rounds})")
+        return self._executor
+
+    def shutdown(self):
+        with self._start_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+    def _run(self, counter, fn, *args):
+        start = time.perf_counter()
+        try:
+            executor = self.start()
+            if executor is None:
+                result = fn(*args)
+            else:
+                result = executor.submit(fn, *args).result(timeout=self.timeout)
+        except Exception:
+            with self._stats_lock:
+                self._stats["failed"] += 1
+            raise
+        with self._stats_lock:
+            self._stats[counter] += 1
+            self._stats["total_time"] += time.perf_counter() - start
+        return result
+
+    def hash(self, password):
+        """Hash mật khẩu với cost hiện tại"""
+        return self._run("hashed", _hash_job, password.encode('utf-8'), self.rounds)
+
+    def check(self, password, password_hash):
+        """True nếu mật khẩu khớp hash"""
+        return self._run("checked", _check_job, password.encode('utf-8'), password_hash.encode('utf-8'))
+
+    def needs_rehash(self, password_hash):
+        """True nếu hash được tạo với cost khác BCRYPT_ROUNDS hiện tại"""
+        return hash_rounds(password_hash) != self.rounds
+
+    def count_rehash(self):
+        with self._stats_lock:
+            self._stats["rehashed"] += 1
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        done = stats["hashed"] + stats["checked"]
+        stats["avg_time"] = round(stats.pop("total_time") / done, 4) if done else 0.0
+        stats.update(rounds=self.rounds, workers=self.workers)
+        return stats
@@ -0,0 +1,355 @@
+import os
+import math
+import time
+import uuid
+import logging
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+import cache
+import metrics
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+class TokenBucket:
+    """Token bucket: trung bình `rate` lượt/giây, cho phép dồn tối đa `burst` lượt
+
+    reserve() giữ chỗ cho lượt tiếp theo và trả về số giây cần chờ (0 nếu có
+    sẵn token), nên dùng được cho cả code đồng bộ (time.sleep) lẫn async
+    (asyncio.sleep) mà không phải giữ lock trong lúc chờ. Token có thể âm:
+    đó là các lượt đã được hẹn giờ trong tương lai, hoặc chi phí đã trừ sau
+    (charge) vượt quá số token còn lại.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(1.0, rate))
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _wait(self, amount):
+        return max(0.0, (amount - self._tokens) / self.rate)
+
+    def reserve(self, max_wait=0.0, amount=1.0):
+        """Lấy `amount` token; trả về số giây phải chờ trước khi dùng, hoặc None nếu phải chờ quá max_wait
+
+        amount=0 chỉ kiểm tra bucket không bị âm (chi phí trừ sau đã được bù lại).
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            wait = self._wait(amount)
+            if wait > max_wait:
+                return None
+            self._tokens -= amount
+            return wait
+
+    def try_acquire(self):
+        """Lấy một token nếu có ngay, không chờ"""
+        return self.reserve(0.0) is not None
+
+    def wait_time(self, amount=1.0):
+        """Số giây cho tới khi có đủ `amount` token (không lấy token)"""
+        with self._lock:
+            self._refill(time.monotonic())
+            return self._wait(amount)
+
+    def charge(self, amount):
+        """Trừ chi phí đã phát sinh (có thể làm bucket âm); amount âm để hoàn lại"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens -= amount
+
+    def available(self):
+        with self._lock:
+            self._refill(time.monotonic())
+            return self._tokens
+
+# ==================== ADMISSION CONTROL ====================
+
+class RateLimited(Exception):
+    """User đã dùng hết ngân sách `budget`, thử lại sau retry_after giây (429)"""
+
+    def __init__(self, budget, retry_after):
+        super().__init__(f"Vượt giới hạn {budget}")
+        self.budget = budget
+        self.retry_after = retry_after
+
+class StageBusy(Exception):
+    """Đã đủ số request đồng thời cho bước `stage`, thử lại sau retry_after giây (503)"""
+
+    def __init__(self, stage, retry_after=1):
+        super().__init__(f"Bước {stage} đang quá tải")
+        self.stage = stage
+        self.retry_after = retry_after
+
+# rate: đơn vị/giây, burst: số đơn vị tối đa dồn lại được
+Budget = namedtuple("Budget", "name rate burst")
+
+class MemoryBackend:
+    """Bucket và slot trong tiến trình: mỗi worker gunicorn có giới hạn riêng"""
+
+    def __init__(self, max_keys=100000):
+        # Bucket không được dùng tới khi đã đầy lại sẽ hết hạn: tạo lại bucket đầy là tương đương
+        self._buckets = cache.TTLCache(max_keys)
+        self._slots = {}
+        self._lock = threading.Lock()
+
+    def _bucket(self, key, budget):
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = TokenBucket(budget.rate, budget.burst)
+                self._buckets.set(key, bucket)
+            return bucket
+
+    def _touch(self, key, bucket):
+        self._buckets.set(key, bucket, ttl=(bucket.burst - bucket.available()) / bucket.rate + 1)
+
+    def take(self, key, budget, amount):
+        """Lấy `amount` đơn vị; trả về 0 nếu được nhận, ngược lại số giây cần chờ"""
+        bucket = self._bucket(key, budget)
+        wait = 0.0 if bucket.reserve(0.0, amount) is not None else bucket.wait_time(amount)
+        self._touch(key, bucket)
+        return wait
+
+    def charge(self, key, budget, amount):
+        bucket = self._bucket(key, budget)
+        bucket.charge(amount)
+        self._touch(key, bucket)
+
+    def peek(self, key, budget):
+        bucket = self._buckets.get(key)
+        return bucket.available() if bucket else budget.burst
+
+    def acquire(self, stage, limit, ttl):
+        with self._lock:
+            if self._slots.get(stage, 0) >= limit:
+                return None
+            self._slots[stage] = self._slots.get(stage, 0) + 1
+        return stage
+
+    def release(self, stage, lease):
+        with self._lock:
+            self._slots[stage] -= 1
+
+    def in_flight(self, stage):
+        with self._lock:
+            return self._slots.get(stage, 0)
+
+# Token bucket nguyên tử trong Redis (thời gian lấy từ server Redis để mọi worker dùng chung một đồng hồ)
+# KEYS[1]: key; ARGV: rate, burst, amount, mode ("take": chỉ trừ khi đủ, "charge": luôn trừ, "peek")
+_BUCKET_SCRIPT = """
+redis.replicate_commands()
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local rate, burst, amount = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+if ARGV[4] == 'peek' then
+    return tostring(tokens)
+end
+local wait = 0
+if ARGV[4] == 'take' and tokens < amount then
+    wait = (amount - tokens) / rate
+else
+    tokens = tokens - amount
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil((burst - tokens) / rate * 1000) + 1000)
+return tostring(wait)
+"""
+
+# Semaphore dùng chung: mỗi slot là một lease có hạn (worker chết giữa chừng không giữ slot mãi)
+# KEYS[1]: key; ARGV: limit, lease id, ttl (giây)
+_ACQUIRE_SCRIPT = """
+redis.replicate_commands()
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+if redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[1]) then
+    return 0
+end
+redis.call('ZADD', KEYS[1], now + tonumber(ARGV[3]), ARGV[2])
+redis.call('EXPIRE', KEYS[1], math.ceil(tonumber(ARGV[3])) + 1)
+return 1
+"""
+
+class RedisBackend:
+    """Bucket và slot trong Redis: giới hạn giữ nguyên qua mọi worker/tiến trình dùng chung REDIS_URL
+
+    Redis lỗi thì request được cho qua (fail-open) và lỗi được ghi log, giống
+    các cache Redis khác: giới hạn tốc độ không được làm sập chức năng chat.
+    """
+
+    def __init__(self, client, prefix="codemate:limit"):
+        self.client = client
+        self.prefix = prefix
+        self._bucket = client.register_script(_BUCKET_SCRIPT)
+        self._acquire = client.register_script(_ACQUIRE_SCRIPT)
+
+    def _run_bucket(self, key, budget, amount, mode):
+        try:
+            return float(self._bucket(keys=[f"{self.prefix}:{key}"],
+                                      args=[budget.rate, budget.burst, amount, mode]))
+        except redis.RedisError as err:
+            logging.error(f"Lỗi Redis khi kiểm tra giới hạn {key}: {err}")
+            return None
+
+    def take(self, key, budget, amount):
+        return self._run_bucket(key, budget, amount, "take") or 0.0
+
+    def charge(self, key, budget, amount):
+        self._run_bucket(key, budget, amount, "charge")
+
+    def peek(self, key, budget):
+        tokens = self._run_bucket(key, budget, 0, "peek")
+        return budget.burst if tokens is None else tokens
+
+    def acquire(self, stage, limit, ttl):
+        lease = uuid.uuid4().hex
+        try:
+            acquired = self._acquire(keys=[f"{self.prefix}:stage:{stage}"], args=[limit, lease, ttl])
+        except redis.RedisError as err:
+            logging.error(f"Lỗi Redis khi lấy slot {stage}: {err}")
+            return lease
+        return lease if acquired else None
+
+    def release(self, stage, lease):
+        try:
+            self.client.zrem(f"{self.prefix}:stage:{stage}", lease)
+        except redis.RedisError as err:
+            logging.error(f"Lỗi Redis khi trả slot {stage}: {err}")
+
+    def in_flight(self, stage):
+        try:
+            return self.client.zcount(f"{self.prefix}:stage:{stage}", time.time(), "+inf")
+        except redis.RedisError:
+            return 0
+
+class AdmissionControl:
+    """Kiểm soát tiếp nhận request: ngân sách theo user và giới hạn đồng thời theo bước
+
+    - Ngân sách (token bucket theo user_id): số lượt chat, số giây âm thanh
+      và số token OpenAI. Lượt chat được trừ khi tiếp nhận; giây âm thanh và
+      token chỉ biết sau khi xử lý nên được trừ sau (charge) — lúc tiếp nhận
+      chỉ kiểm tra user không còn "nợ" từ các request trước.
+    - Giới hạn đồng thời cho các bước nặng (phiên mã, OpenAI) tính trên mọi
+      user; với backend redis là trên mọi worker.
+    """
+
+    def __init__(self, backend, budgets, stage_limits=None, lease_ttl=300):
+        self.backend = backend
+        self.budgets = {budget.name: budget for budget in budgets if budget.rate > 0}
+        self.stage_limits = {stage: limit for stage, limit in (stage_limits or {}).items() if limit > 0}
+        self.lease_ttl = lease_ttl
+
+    @classmethod
+    def from_env(cls):
+        """Tạo từ RATE_LIMIT_* (None nếu RATE_LIMIT_BACKEND=off)"""
+        backend_name = os.getenv("RATE_LIMIT_BACKEND", "memory").lower()
+        if backend_name == "off":
+            return None
+
+        turns = float(os.getenv("RATE_LIMIT_TURNS_PER_MINUTE", "20"))
+        audio_seconds = float(os.getenv("RATE_LIMIT_AUDIO_SECONDS_PER_HOUR", "1800"))
+        tokens = float(os.getenv("RATE_LIMIT_TOKENS_PER_HOUR", "200000"))
+        budgets = [
+            Budget("turns", turns / 60, float(os.getenv("RATE_LIMIT_TURNS_BURST", str(max(1.0, turns / 2))))),
+            Budget("audio_seconds", audio_seconds / 3600,
+                   float(os.getenv("RATE_LIMIT_AUDIO_SECONDS_BURST", str(audio_seconds / 3)))),
+            Budget("tokens", tokens / 3600, float(os.getenv("RATE_LIMIT_TOKENS_BURST", str(tokens / 4))))
+        ]
+        stage_limits = {
+            "transcription": int(os.getenv("RATE_LIMIT_TRANSCRIPTION_CONCURRENCY", "0")),
+            "openai": int(os.getenv("RATE_LIMIT_OPENAI_CONCURRENCY", "0"))
+        }
+        lease_ttl = float(os.getenv("RATE_LIMIT_LEASE_TTL", "300"))
+
+        backend = None
+        if backend_name == "redis":
+            try:
+                backend = RedisBackend(cache.get_redis_client())
+            except Exception as e:
+                logging.error(f"Không dùng được Redis cho rate limit, chuyển sang bộ nhớ: {e}")
+        return cls(backend or MemoryBackend(), budgets, stage_limits, lease_ttl)
+
+    def admit(self, user_id, costs):
+        """Tiếp nhận request với chi phí {budget: số đơn vị}, ném RateLimited nếu vượt ngân sách
+
+        Ngân sách không được cấu hình bị bỏ qua. Nếu một ngân sách bị từ chối,
+        các ngân sách đã trừ trước đó được hoàn lại.
+        """
+        taken = []
+        for name, amount in costs.items():
+            budget = self.budgets.get(name)
+            if not budget:
+                continue
+            wait = self.backend.take(f"{name}:{user_id}", budget, amount)
+            if wait > 0:
+                for done, done_amount in taken:
+                    self.backend.charge(f"{done.name}:{user_id}", done, -done_amount)
+                metrics.ADMISSION_REJECTED.inc(kind="budget", name=name)
+                raise RateLimited(name, max(1, math.ceil(wait)))
+            if amount:
+                taken.append((budget, amount))
+
+    def charge(self, user_id, name, amount):
+        """Trừ chi phí thực tế sau khi xử lý (giây âm thanh, token)"""
+        budget = self.budgets.get(name)
+        if budget and amount > 0:
+            self.backend.charge(f"{name}:{user_id}", budget, amount)
+
+    def remaining(self, user_id):
+        """Ngân sách còn lại của user: {budget: {remaining, limit, per_second}}"""
+        return {
+            name: {
+                "remaining": max(0.0, round(self.backend.peek(f"{name}:{user_id}", budget), 1)),
+                "limit": budget.burst,
+                "per_second": round(budget.rate, 4)
+            }
+            for name, budget in self.budgets.items()
+        }
+
+    def acquire(self, stage):
+        """Lấy một slot của bước `stage` (không chờ), trả về lease; ném StageBusy nếu đã đủ"""
+        limit = self.stage_limits.get(stage)
+        if not limit:
+            return None
+        lease = self.backend.acquire(stage, limit, self.lease_ttl)
+        if lease is None:
+            metrics.ADMISSION_REJECTED.inc(kind="stage", name=stage)
+            raise StageBusy(stage)
+        return lease
+
+    def release(self, stage, lease):
+        if lease is not None:
+            self.backend.release(stage, lease)
+
+    @contextmanager
+    def stage(self, name):
+        """Giữ một slot của bước `name` trong khối with"""
+        lease = self.acquire(name)
+        try:
+            yield
+        finally:
+            self.release(name, lease)
+
+    def stats(self):
+        return {
+            "budgets": {name: {"per_second": budget.rate, "burst": budget.burst}
+                        for name, budget in self.budgets.items()},
+            "stages": {stage: {"limit": limit, "in_flight": self.backend.in_flight(stage)}
+                       for stage, limit in self.stage_limits.items()}
+        }
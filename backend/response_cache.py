@@ -0,0 +1,351 @@
+import os
+import re
+import json
+import time
+import hashlib
+import logging
+import threading
+import unicodedata
+import numpy as np
+import cache
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+EMBEDDING_DIM = 512
+# Câu hỏi tối đa chừng này từ dùng nguyên ngưỡng RESPONSE_CACHE_SIMILARITY; câu dài hơn cần ngưỡng chặt
+# hơn theo tỉ lệ, vì đổi một từ trong câu dài gần như không làm vector thay đổi
+SIMILARITY_REFERENCE_WORDS = 8
+
+# Dấu hiệu của code: backtick, ngoặc nhọn/vuông, ;, =, <, > hoặc lời gọi hàm `ten(`
+_CODE = re.compile(r"[`{}\[\];=<>]|\w\(")
+
+def normalize_prompt(text):
+    """Chuẩn hóa câu hỏi: Unicode NFC, chữ thường, gộp khoảng trắng, bỏ dấu câu cuối"""
+    text = unicodedata.normalize("NFC", text).lower()
+    text = re.sub(r"\s+", " ", text).strip()
+    return text.rstrip("?!. ")
+
+def looks_like_code(text):
+    """Câu hỏi có chứa code: chỉ khớp chính xác, vì khác một ký tự (i/0 so với i[0]) đã là câu hỏi khác"""
+    return bool(_CODE.search(text)) or "\n " in text or "\n\t" in text
+
+def required_similarity(normalized, threshold):
+    """Ngưỡng cosine cho câu hỏi đã chuẩn hóa: threshold với câu ngắn, chặt dần theo số từ"""
+    words = max(1, len(normalized.split()))
+    if words <= SIMILARITY_REFERENCE_WORDS:
+        return threshold
+    return 1.0 - (1.0 - threshold) * SIMILARITY_REFERENCE_WORDS / words
+
+def embed(text, dim=EMBEDDING_DIM):
+    """Embedding tính cục bộ: hashed bag-of-features (trigram ký tự + từ), chuẩn hóa L2
+
+    Không cần mô hình ngôn ngữ nhưng đủ để nhận ra các câu hỏi gần như trùng
+    nhau (lỗi gõ nhỏ, thêm/bớt một từ, khác dấu câu).
+    """
+    vector = np.zeros(dim, dtype=np.float32)
+    padded = f" {text} "
+    features = [padded[i:i + 3] for i in range(len(padded) - 2)] + text.split()
+    for feature in features:
+        h = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+        vector[h % dim] += 1.0 if h >> 63 else -1.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+class TransformerEmbedder:
+    """Embedding bằng mô hình Hugging Face (mean pooling), bật qua RESPONSE_CACHE_EMBEDDING_MODEL
+
+    Bắt được các câu hỏi diễn đạt khác nhau tốt hơn embedding băm, đổi lại tốn
+    thêm một mô hình nhỏ trong mỗi worker. Khi khởi tạo chỉ đọc config (để biết
+    số chiều); trọng số được nạp ở lần embed đầu tiên hoặc khi warm-up gọi load().
+    """
+
+    def __init__(self, model_name):
+        from transformers import AutoConfig
+        self.model_name = model_name
+        self.dim = AutoConfig.from_pretrained(model_name).hidden_size
+        self.torch = None
+        self.tokenizer = None
+        self.model = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Nạp tokenizer và trọng số mô hình (idempotent)"""
+        with self._lock:
+            if self.model is None:
+                import torch
+                from transformers import AutoModel, AutoTokenizer
+                self.torch = torch
+                self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+                self.model = AutoModel.from_pretrained(self.model_name).eval()
+        return self.model
+
+    def __call__(self, text):
+        if self.model is None:
+            self.load()
+        inputs = self.tokenizer(text, return_tensors="pt", truncation=True, max_length=256)
+        with self.torch.no_grad():
+            hidden = self.model(**inputs).last_hidden_state[0]
+        mask = inputs["attention_mask"][0].unsqueeze(-1).float()
+        vector = ((hidden * mask).sum(0) / mask.sum()).numpy().astype(np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+class VectorIndex:
+    """Chỉ mục láng giềng gần nhất (cosine, brute-force trên ma trận numpy)
+
+    Ma trận được cấp phát sẵn max_size dòng và dùng như bộ đệm vòng: khi đầy,
+    vector mới ghi đè dòng cũ nhất, không chép lại cả ma trận. Mỗi dòng mang
+    id của namespace để search() chỉ so với các dòng cùng namespace.
+    """
+
+    def __init__(self, max_size=5000, dim=EMBEDDING_DIM):
+        self.max_size = max_size
+        self.vectors = np.zeros((max_size, dim), dtype=np.float32)
+        # Id namespace của từng dòng (-1 = dòng trống)
+        self.spaces = np.full(max_size, -1, dtype=np.int64)
+        self.keys = [None] * max_size
+        self._rows = {}
+        self._space_ids = {}
+        self._space_rows = {}
+        self._next_space = 0
+        self._next = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def namespace_of(key):
+        return key.split(":", 1)[0]
+
+    def _clear_row(self, row):
+        # Gọi khi đang giữ self._lock
+        key = self.keys[row]
+        if key is None:
+            return
+        del self._rows[key]
+        self.keys[row] = None
+        space = self.namespace_of(key)
+        self._space_rows[space] -= 1
+        if not self._space_rows[space]:
+            del self._space_rows[space]
+            del self._space_ids[space]
+        self.spaces[row] = -1
+
+    def add(self, key, vector):
+        with self._lock:
+            if key in self._rows:
+                return
+            row = self._next
+            self._next = (row + 1) % self.max_size
+            self._clear_row(row)
+            space = self.namespace_of(key)
+            if space not in self._space_ids:
+                self._space_ids[space] = self._next_space
+                self._next_space += 1
+            self._space_rows[space] = self._space_rows.get(space, 0) + 1
+            self.vectors[row] = vector
+            self.spaces[row] = self._space_ids[space]
+            self.keys[row] = key
+            self._rows[key] = row
+
+    def remove(self, key):
+        with self._lock:
+            row = self._rows.get(key)
+            if row is not None:
+                self._clear_row(row)
+
+    def search(self, vector, namespace):
+        """Trả về (key, similarity) gần nhất trong cùng namespace, hoặc (None, 0)"""
+        with self._lock:
+            space = self._space_ids.get(namespace)
+            if space is None:
+                return None, 0.0
+            rows = np.flatnonzero(self.spaces == space)
+            scores = self.vectors[rows] @ vector
+            best = int(np.argmax(scores))
+            return self.keys[rows[best]], float(scores[best])
+
+    def __len__(self):
+        return len(self._rows)
+
+class RedisVectorLog:
+    """Nhật ký vector dùng chung trên Redis để các worker đồng bộ chỉ mục tăng dần"""
+
+    def __init__(self, client, prefix, max_size=5000):
+        self.client = client
+        self.prefix = prefix
+        self.max_size = max_size
+
+    def append(self, key, vector):
+        seq = self.client.incr(f"{self.prefix}:seq")
+        pipe = self.client.pipeline()
+        pipe.zadd(f"{self.prefix}:log", {key: seq})
+        pipe.hset(f"{self.prefix}:vectors", key, vector.astype(np.float32).tobytes())
+        pipe.execute()
+        if seq % 100 == 0:
+            stale = self.client.zrange(f"{self.prefix}:log", 0, -(self.max_size + 1))
+            if stale:
+                self.client.zrem(f"{self.prefix}:log", *stale)
+                self.client.hdel(f"{self.prefix}:vectors", *stale)
+
+    def since(self, cursor):
+        """Các (key, vector) được thêm sau cursor; trả về (cursor mới, items)"""
+        items = self.client.zrangebyscore(f"{self.prefix}:log", f"({cursor}", "+inf", withscores=True)
+        if not items:
+            return cursor, []
+        keys = [key for key, _ in items]
+        vectors = self.client.hmget(f"{self.prefix}:vectors", keys)
+        return int(items[-1][1]), [
+            (key.decode("utf-8"), np.frombuffer(raw, dtype=np.float32))
+            for key, raw in zip(keys, vectors) if raw
+        ]
+
+class ResponseCache:
+    """Cache phản hồi của LLM: khớp chính xác, và (khi bật semantic) khớp gần đúng theo embedding
+
+    Key gồm câu hỏi đã chuẩn hóa + system prompt + model + context (lịch sử hội
+    thoại đi kèm câu hỏi, nếu có), nên chỉ khớp khi cả lịch sử giống hệt; câu hỏi
+    mở đầu một cuộc hội thoại mới là trường hợp hit chủ yếu. Các phản hồi nằm trong
+    `entries` (cache.TTLCache trong tiến trình hoặc cache.RedisCache dùng chung);
+    với Redis, vector được ghi vào RedisVectorLog để worker khác cũng tìm thấy.
+
+    Khớp gần đúng mặc định tắt (semantic=False): embedding gần như không đổi
+    khi chỉ một từ thay đổi ("số chẵn" so với "số lẻ"), nên có thể trả phản hồi
+    của một câu hỏi khác. Khi bật, ngưỡng chặt dần theo độ dài câu hỏi và câu
+    hỏi chứa code luôn chỉ khớp chính xác.
+    """
+
+    def __init__(self, entries, vector_log=None, similarity_threshold=0.97, max_index_size=5000,
+                 sync_interval=1.0, embedder=embed, dim=EMBEDDING_DIM, semantic=False):
+        self.entries = entries
+        self.vector_log = vector_log
+        self.semantic = semantic
+        self.similarity_threshold = similarity_threshold
+        self.embedder = embedder
+        self.index = VectorIndex(max_index_size, dim)
+        self.sync_interval = sync_interval
+        self._cursor = 0
+        self._last_sync = 0.0
+        self._lock = threading.Lock()
+        self._counters = {"exact_hits": 0, "semantic_hits": 0, "misses": 0, "stores": 0, "bypassed": 0}
+
+    @classmethod
+    def from_env(cls):
+        """Tạo cache từ RESPONSE_CACHE_* (trả về None nếu tắt)"""
+        backend = os.getenv("RESPONSE_CACHE_BACKEND", "memory").lower()
+        if backend == "off":
+            return None
+
+        ttl = int(os.getenv("RESPONSE_CACHE_TTL", str(24 * 3600)))
+        max_entries = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "5000"))
+        # Khớp gần đúng phải bật tường minh; mặc định chỉ khớp câu hỏi đã chuẩn hóa giống hệt
+        semantic = os.getenv("RESPONSE_CACHE_SEMANTIC", "0") == "1"
+        # Ngưỡng cho câu hỏi ngắn (câu dài hơn cần ngưỡng chặt hơn, xem required_similarity)
+        threshold = float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0.97"))
+
+        embedder, dim = embed, EMBEDDING_DIM
+        model_name = os.getenv("RESPONSE_CACHE_EMBEDDING_MODEL")
+        if model_name and semantic:
+            try:
+                embedder = TransformerEmbedder(model_name)
+                dim = embedder.dim
+            except Exception as e:
+                logging.error(f"Lỗi tải mô hình embedding {model_name}, dùng embedding băm: {e}")
+
+        if backend == "redis":
+            try:
+                client = cache.get_redis_client()
+                return cls(cache.RedisCache(client, "codemate:response", ttl),
+                           RedisVectorLog(client, "codemate:response-index", max_entries) if semantic else None,
+                           threshold, max_entries, embedder=embedder, dim=dim, semantic=semantic)
+            except Exception as e:
+                logging.error(f"Không dùng được Redis cho response cache, chuyển sang bộ nhớ: {e}")
+
+        return cls(cache.TTLCache(max_entries, ttl), None, threshold, max_entries, embedder=embedder, dim=dim,
+                   semantic=semantic)
+
+    @staticmethod
+    def make_key(user_input, system_prompt, model, context=None):
+        """Trả về (namespace, key, câu hỏi đã chuẩn hóa)
+
+        context: các messages nằm giữa system prompt và câu hỏi (tóm tắt, lịch sử).
+        """
+        normalized = normalize_prompt(user_input)
+        scope = f"{model}\n{system_prompt}"
+        if context:
+            scope += "\n" + json.dumps(context, ensure_ascii=False, sort_keys=True)
+        namespace = hashlib.sha256(scope.encode("utf-8")).hexdigest()[:16]
+        key = f"{namespace}:{hashlib.sha256(normalized.encode('utf-8')).hexdigest()}"
+        return namespace, key, normalized
+
+    def fuzzy_allowed(self, user_input):
+        """Câu hỏi có được khớp gần đúng không (semantic bật và không chứa code)"""
+        return self.semantic and self.similarity_threshold < 1.0 and not looks_like_code(user_input)
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    def _sync_index(self):
+        """Kéo các vector mới do worker khác thêm vào (tối đa mỗi sync_interval giây)"""
+        if not self.vector_log or time.monotonic() - self._last_sync < self.sync_interval:
+            return
+        self._last_sync = time.monotonic()
+        try:
+            self._cursor, items = self.vector_log.since(self._cursor)
+        except Exception as e:
+            logging.error(f"Lỗi đồng bộ chỉ mục response cache: {e}")
+            return
+        for key, vector in items:
+            self.index.add(key, vector)
+
+    def get(self, user_input, system_prompt, model, context=None):
+        """Tìm phản hồi đã cache, trả về None nếu không có"""
+        namespace, key, normalized = self.make_key(user_input, system_prompt, model, context)
+
+        entry = self.entries.get(key)
+        if entry is not None:
+            self._count("exact_hits")
+            return entry["response"]
+
+        if self.fuzzy_allowed(user_input):
+            self._sync_index()
+            match_key, similarity = self.index.search(self.embedder(normalized), namespace)
+            if match_key and similarity >= required_similarity(normalized, self.similarity_threshold):
+                entry = self.entries.get(match_key)
+                if entry is not None:
+                    logging.info(f"Response cache khớp gần đúng ({similarity:.3f}): '{entry['prompt']}'")
+                    self._count("semantic_hits")
+                    return entry["response"]
+                # Bản ghi đã hết hạn hoặc bị loại bỏ
+                self.index.remove(match_key)
+
+        self._count("misses")
+        return None
+
+    def set(self, user_input, system_prompt, model, response, context=None):
+        """Lưu phản hồi vào cache"""
+        _, key, normalized = self.make_key(user_input, system_prompt, model, context)
+        self.entries.set(key, {"response": response, "prompt": normalized, "created_at": time.time()})
+        if self.fuzzy_allowed(user_input):
+            vector = self.embedder(normalized)
+            self.index.add(key, vector)
+            if self.vector_log:
+                try:
+                    self.vector_log.append(key, vector)
+                except Exception as e:
+                    logging.error(f"Lỗi ghi chỉ mục response cache: {e}")
+        self._count("stores")
+
+    def record_bypass(self):
+        self._count("bypassed")
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+        lookups = counters["exact_hits"] + counters["semantic_hits"] + counters["misses"]
+        hits = counters["exact_hits"] + counters["semantic_hits"]
+        return {
+            **counters,
+            "hit_ratio": hits / lookups if lookups else 0.0,
+            "semantic": self.semantic,
+            "indexed": len(self.index)
+        }
@@ -0,0 +1,80 @@
+import re
+import unicodedata
+
+# Độ dài token của ngram parser (ngram_token_size của MySQL, mặc định 2):
+# từ ngắn hơn không tìm được qua FULLTEXT nên bị bỏ khỏi truy vấn
+MIN_TERM_LENGTH = 2
+MAX_TERMS = 8
+
+# Ký tự có nghĩa đặc biệt trong BOOLEAN MODE
+_OPERATORS = re.compile(r'[+\-<>()~*"@]')
+
+def fold(text):
+    """Chữ thường, bỏ dấu (kể cả đ -> d), giữ nguyên số ký tự để vị trí khớp với text gốc"""
+    return "".join(_fold_char(c) for c in text)
+
+def _fold_char(c):
+    if c in "đĐ":
+        return "d"
+    base = unicodedata.normalize("NFD", c)[0].lower()
+    return base if len(base) == 1 else c
+
+def terms(query):
+    """Tách câu tìm kiếm thành các từ (bỏ ký tự toán tử, từ quá ngắn, từ trùng)"""
+    result = []
+    for word in _OPERATORS.sub(" ", query).split():
+        if len(word) >= MIN_TERM_LENGTH and fold(word) not in (fold(t) for t in result):
+            result.append(word)
+    return result[:MAX_TERMS]
+
+def boolean_query(words):
+    """Biểu thức MATCH ... AGAINST (... IN BOOLEAN MODE): mọi từ đều bắt buộc
+
+    Với ngram parser, mỗi từ trong dấu nháy được tìm như một cụm n-gram liên
+    tiếp, nên "tối ưu" chỉ khớp đúng chuỗi đó thay vì mọi dòng chứa "tố".
+    """
+    return " ".join(f'+"{word}"' for word in words)
+
+def snippet(content, words, width=160):
+    """Đoạn trích quanh lần khớp đầu tiên, trả về (snippet, [[start, end], ...] vị trí khớp trong snippet)
+
+    So khớp không phân biệt hoa thường và dấu, giống collation utf8mb4 *_ai_ci
+    mà MySQL dùng khi tìm.
+    """
+    folded = fold(content)
+    needles = [fold(word) for word in words]
+    positions = [folded.find(needle) for needle in needles]
+    positions = [p for p in positions if p >= 0]
+    first = min(positions) if positions else 0
+
+    start = max(0, first - width // 3)
+    if start > 0:
+        # Bắt đầu ở đầu một từ
+        space = content.rfind(" ", 0, start + 1)
+        start = space + 1 if space >= 0 and first - space < width // 2 else start
+    end = min(len(content), start + width)
+    if end < len(content):
+        space = content.rfind(" ", start, end)
+        end = space if space > first else end
+
+    prefix = "…" if start > 0 else ""
+    text = prefix + content[start:end].replace("\n", " ") + ("…" if end < len(content) else "")
+
+    highlights = []
+    window = folded[start:end]
+    for needle in needles:
+        index = window.find(needle)
+        while index >= 0:
+            highlights.append([index + len(prefix), index + len(prefix) + len(needle)])
+            index = window.find(needle, index + len(needle))
+    highlights.sort()
+    return text, _merge(highlights)
+
+def _merge(ranges):
+    merged = []
+    for start, end in ranges:
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
@@ -0,0 +1,452 @@
+"""Gộp các lời gọi OpenAI trùng prompt đang chạy cùng lúc (single-flight).
+
+Key của một flight là hash của model và toàn bộ messages gửi đi (system
+prompt + lịch sử đã ghép + câu hỏi), nên chỉ các request có prompt giống hệt
+nhau mới được gộp. Request đầu tiên (leader) gọi OpenAI; các request trùng đến
+trong lúc đó (follower) không gọi lại mà chờ kết quả của leader: ở chế độ
+streaming, follower nhận lại các đoạn đã có rồi nhận tiếp từng đoạn mới cùng
+lúc với leader. Mỗi request vẫn tự lưu lượt chat vào conversation của mình.
+
+Token chỉ bị trừ vào ngân sách của leader (chỉ leader gây ra lời gọi OpenAI).
+Flight bị xóa khỏi bảng ngay khi kết thúc: request đến sau đó dùng response
+cache (nếu bật) hoặc gọi OpenAI như bình thường.
+
+COALESCE_BACKEND=redis gộp cả giữa các worker: leader giữ một lock trong
+Redis (SET NX, gia hạn theo mỗi lần ghi) và ghi các đoạn phản hồi vào một
+Redis Stream; worker khác có request trùng đọc stream đó thay vì gọi OpenAI.
+"""
+import os
+import json
+import time
+import uuid
+import queue
+import asyncio
+import hashlib
+import logging
+import threading
+import contextlib
+import ai_client
+import cache
+import metrics
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+def flight_key(model, messages):
+    """Key của flight: hash của model + messages (đúng thứ tự, đúng nội dung gửi tới OpenAI)"""
+    raw = json.dumps({"model": model, "messages": messages}, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+class Flight:
+    """Một lời gọi upstream đang chạy, chia sẻ cho mọi request cùng key
+
+    Leader ghi từng đoạn phản hồi bằng publish() rồi kết thúc bằng finish()
+    hoặc fail(). Follower đọc bằng follow() (thread) hoặc afollow() (asyncio):
+    luôn bắt đầu từ đoạn đầu tiên nên follower đến muộn vẫn nhận đủ phản hồi.
+    Lỗi của leader được ném lại nguyên vẹn cho mọi follower (như
+    concurrent.futures.Future).
+    """
+
+    def __init__(self, key=None, on_close=None, writer=None):
+        self.key = key
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.subscribers = 0
+        self._on_close = on_close
+        self._writer = writer
+        self._cond = threading.Condition()
+        self._async_waiters = set()
+
+    @property
+    def text(self):
+        return "".join(self.chunks)
+
+    def attach(self):
+        """Đăng ký một request đang chờ flight (join() gọi sẵn cho follower); gọi detach() khi request xong"""
+        with self._cond:
+            self.subscribers += 1
+
+    def detach(self):
+        with self._cond:
+            self.subscribers -= 1
+
+    def publish(self, delta):
+        with self._cond:
+            if self.done:
+                return
+            self.chunks.append(delta)
+            self._notify()
+        if self._writer:
+            self._writer.write(delta)
+
+    def finish(self):
+        self._close(None)
+
+    def fail(self, error):
+        self._close(error)
+
+    def _close(self, error):
+        with self._cond:
+            if self.done:
+                return
+            self.done = True
+            self.error = error
+            self._notify()
+        if self._writer:
+            self._writer.close(error)
+        if self._on_close:
+            self._on_close(self)
+
+    @contextlib.contextmanager
+    def leading(self):
+        """Khối code của leader: lỗi được chuyển cho follower, thoát mà chưa finish() thì flight bị hủy"""
+        try:
+            yield self
+        except Exception as e:
+            self.fail(e)
+            raise
+        finally:
+            if not self.done:
+                self.fail(ai_client.AIServiceError("upstream", "leader dừng trước khi có kết quả"))
+
+    def _notify(self):
+        # Gọi khi đang giữ self._cond
+        self._cond.notify_all()
+        for loop, event in list(self._async_waiters):
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                self._async_waiters.discard((loop, event))
+
+    def _pending(self, index):
+        """(các đoạn mới từ index, đã kết thúc, lỗi) - gọi khi đang giữ self._cond"""
+        return self.chunks[index:], self.done, self.error
+
+    def follow(self, timeout=None):
+        """Các đoạn phản hồi (từ đầu), chặn tới khi có đoạn mới
+
+        Ném AIServiceError("timeout") nếu leader chưa xong sau timeout giây
+        (None: chờ tới khi leader xong, ví dụ khi chính request là leader).
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        index = 0
+        while True:
+            with self._cond:
+                new, done, error = self._pending(index)
+                while not new and not done:
+                    remaining = deadline - time.monotonic() if deadline is not None else None
+                    if remaining is not None and remaining <= 0:
+                        raise ai_client.AIServiceError("timeout", "chờ request trùng prompt quá lâu")
+                    self._cond.wait(remaining)
+                    new, done, error = self._pending(index)
+            index += len(new)
+            yield from new
+            if done:
+                if error:
+                    raise error
+                return
+
+    async def afollow(self, timeout=None):
+        """Như follow() cho asyncio: chờ bằng asyncio.Event, không giữ thread"""
+        loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+        waiter = (loop, event)
+        deadline = loop.time() + timeout if timeout is not None else None
+        index = 0
+        with self._cond:
+            self._async_waiters.add(waiter)
+        try:
+            while True:
+                with self._cond:
+                    # Xóa event trước khi đọc: publish() sau đó sẽ set lại, không mất thông báo
+                    event.clear()
+                    new, done, error = self._pending(index)
+                index += len(new)
+                for delta in new:
+                    yield delta
+                if done:
+                    if error:
+                        raise error
+                    return
+                if new:
+                    continue
+                try:
+                    await asyncio.wait_for(event.wait(),
+                                           max(0.0, deadline - loop.time()) if deadline is not None else None)
+                except asyncio.TimeoutError:
+                    raise ai_client.AIServiceError("timeout", "chờ request trùng prompt quá lâu") from None
+        finally:
+            with self._cond:
+                self._async_waiters.discard(waiter)
+
+    def result(self, timeout=None):
+        """Toàn bộ phản hồi (chặn tới khi leader xong), rồi hủy đăng ký request"""
+        try:
+            return "".join(self.follow(timeout))
+        finally:
+            self.detach()
+
+    async def aresult(self, timeout=None):
+        try:
+            return "".join([delta async for delta in self.afollow(timeout)])
+        finally:
+            self.detach()
+
+# ==================== REDIS ====================
+
+# Xóa lock chỉ khi vẫn là của flight này (lock có thể đã hết hạn và thuộc leader khác)
+_RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+class RedisFlightStore:
+    """Lock + Redis Stream để gộp request trùng prompt giữa các worker
+
+    - Lock `{prefix}:{key}` (SET NX PX) giữ id của flight đang chạy, được gia
+      hạn mỗi lần leader ghi; leader chết thì lock hết hạn sau lock_ttl.
+    - Stream `{prefix}:{key}:{flight id}` chứa các đoạn phản hồi ({"d": ...})
+      và bản ghi kết thúc ({"end": "ok"} hoặc {"end": "error", "reason": ...}).
+      Mỗi flight một stream riêng nên follower không đọc nhầm phản hồi cũ.
+
+    Việc ghi chạy trên một thread nền (gộp các đoạn liên tiếp thành một XADD
+    mỗi lượt pipeline), nên leader không phải chờ Redis giữa các token. Redis
+    lỗi thì request tự gọi OpenAI (fail-open) như các backend Redis khác.
+    """
+
+    def __init__(self, client, prefix="codemate:flight", lock_ttl=90.0, block_ms=1000):
+        self.client = client
+        self.prefix = prefix
+        self.lock_ttl_ms = int(lock_ttl * 1000)
+        self.block_ms = block_ms
+        self._release = client.register_script(_RELEASE_SCRIPT)
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+
+    def _lock_key(self, key):
+        return f"{self.prefix}:{key}"
+
+    def _stream_key(self, key, flight_id):
+        return f"{self.prefix}:{key}:{flight_id}"
+
+    def acquire(self, key):
+        """(True, writer) nếu giành được quyền leader, (False, flight id của leader) nếu worker khác đang chạy
+
+        Redis lỗi trả về (True, None): request tự gọi OpenAI, không ghi Redis.
+        """
+        flight_id = uuid.uuid4().hex
+        try:
+            for _ in range(3):
+                if self.client.set(self._lock_key(key), flight_id, nx=True, px=self.lock_ttl_ms):
+                    return True, RedisFlightWriter(self, key, flight_id)
+                owner = self.client.get(self._lock_key(key))
+                if owner is not None:
+                    return False, owner.decode() if isinstance(owner, bytes) else owner
+                # Leader vừa xong và xóa lock giữa SET và GET: thử giành lại
+        except redis.RedisError as err:
+            logging.error(f"Lỗi Redis khi lấy lock flight {key[:12]}: {err}")
+        return True, None
+
+    def _enqueue(self, item):
+        if self._thread is None:
+            # Khởi động lười: thread không sống qua fork của gunicorn
+            with self._thread_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._write_loop, name="flight-writer", daemon=True)
+                    self._thread.start()
+        self._queue.put(item)
+
+    def _write_loop(self):
+        while True:
+            items = [self._queue.get()]
+            while True:
+                try:
+                    items.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            pipe = self.client.pipeline(transaction=False)
+            pending = {}
+            for writer, fields in items:
+                if "d" in fields:
+                    # Gộp các đoạn liên tiếp của cùng flight thành một bản ghi
+                    pending.setdefault(writer, []).append(fields["d"])
+                    continue
+                self._flush(pipe, writer, pending.pop(writer, None))
+                stream = self._stream_key(writer.key, writer.flight_id)
+                pipe.xadd(stream, fields)
+                pipe.pexpire(stream, self.lock_ttl_ms)
+                # Xóa lock sau bản ghi kết thúc (chỉ khi lock vẫn là của flight này)
+                self._release(keys=[self._lock_key(writer.key)], args=[writer.flight_id], client=pipe)
+            for writer, deltas in pending.items():
+                self._flush(pipe, writer, deltas)
+            try:
+                pipe.execute()
+            except redis.RedisError as err:
+                logging.error(f"Lỗi ghi flight vào Redis: {err}")
+
+    def _flush(self, pipe, writer, deltas):
+        if not deltas:
+            return
+        stream = self._stream_key(writer.key, writer.flight_id)
+        pipe.xadd(stream, {"d": "".join(deltas)})
+        pipe.pexpire(stream, self.lock_ttl_ms)
+        pipe.pexpire(self._lock_key(writer.key), self.lock_ttl_ms)
+
+    def read(self, key, flight_id, timeout):
+        """Đọc flight của worker khác: các đoạn phản hồi (str), kết thúc bằng return hoặc AIServiceError"""
+        stream = self._stream_key(key, flight_id)
+        deadline = time.monotonic() + timeout
+        last_id = "0-0"
+        while True:
+            entries = self._xread(stream, last_id, self.block_ms)
+            if not entries:
+                if not self.client.exists(self._lock_key(key)):
+                    # Lock mất: đọc lần cuối phòng bản ghi kết thúc vừa được ghi ngay trước khi xóa lock
+                    entries = self._xread(stream, last_id, None)
+                    if not entries:
+                        raise ai_client.AIServiceError("upstream", "leader ở worker khác dừng giữa chừng")
+                elif time.monotonic() > deadline:
+                    raise ai_client.AIServiceError("timeout", "chờ request trùng prompt quá lâu")
+            for entry_id, fields in entries:
+                last_id = entry_id
+                fields = {k.decode() if isinstance(k, bytes) else k: v.decode() if isinstance(v, bytes) else v
+                          for k, v in fields.items()}
+                if "d" in fields:
+                    yield fields["d"]
+                elif fields.get("end") == "ok":
+                    return
+                else:
+                    reason = fields.get("reason")
+                    raise ai_client.AIServiceError(reason if reason in ai_client.AIServiceError.STATUS
+                                                   else "upstream", "lỗi từ leader ở worker khác")
+
+    def _xread(self, stream, last_id, block_ms):
+        response = self.client.xread({stream: last_id}, count=256, block=block_ms)
+        return response[0][1] if response else []
+
+class RedisFlightWriter:
+    """Ghi một flight do worker này làm leader vào Redis (qua thread nền của store)"""
+
+    def __init__(self, store, key, flight_id):
+        self.store = store
+        self.key = key
+        self.flight_id = flight_id
+
+    def write(self, delta):
+        self.store._enqueue((self, {"d": delta}))
+
+    def close(self, error):
+        if error is None:
+            self.store._enqueue((self, {"end": "ok"}))
+        else:
+            self.store._enqueue((self, {"end": "error", "reason": getattr(error, "reason", "upstream")}))
+
+# ==================== SINGLE FLIGHT ====================
+
+class SingleFlight:
+    """Bảng các flight đang chạy trong tiến trình (dùng chung cho thread Flask và event loop ASGI)"""
+
+    def __init__(self, store=None, wait_timeout=120.0):
+        self.store = store
+        self.wait_timeout = wait_timeout
+        self._flights = {}
+        self._lock = threading.Lock()
+        self._stats = {"leaders": 0, "followers": 0, "remote_followers": 0}
+
+    @classmethod
+    def from_env(cls):
+        """Tạo từ COALESCE_* (None nếu COALESCE_BACKEND=off)
+
+        memory (mặc định): gộp trong một tiến trình; redis: gộp cả giữa các
+        worker dùng chung REDIS_URL.
+        """
+        backend = os.getenv("COALESCE_BACKEND", "memory").lower()
+        if backend == "off":
+            return None
+        wait_timeout = float(os.getenv("COALESCE_WAIT_TIMEOUT", "120"))
+        store = None
+        if backend == "redis":
+            try:
+                # Lock phải sống qua lúc chờ token đầu tiên: mặc định bằng deadline của lời gọi OpenAI
+                lock_ttl = float(os.getenv("COALESCE_LOCK_TTL") or os.getenv("OPENAI_DEADLINE", "90"))
+                store = RedisFlightStore(cache.get_redis_client(), lock_ttl=lock_ttl)
+            except Exception as e:
+                logging.error(f"Không dùng được Redis để gộp request, chỉ gộp trong tiến trình: {e}")
+        return cls(store, wait_timeout)
+
+    def join(self, key):
+        """(flight, leader): leader=True thì request phải tự gọi OpenAI và ghi kết quả vào flight
+
+        Với backend redis, hàm có I/O chặn (SET NX): từ event loop hãy gọi qua
+        asyncio.to_thread.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                flight.attach()
+                self._stats["followers"] += 1
+                metrics.CHAT_COALESCED.inc(role="follower")
+                return flight, False
+            flight = Flight(key, on_close=self._remove)
+            self._flights[key] = flight
+
+        if self.store:
+            leader, owner = self.store.acquire(key)
+            if not leader:
+                # Một thread đọc flight từ Redis cho mọi request trùng trong tiến trình này
+                flight.attach()
+                threading.Thread(target=self._relay, args=(flight, owner), name="flight-relay",
+                                 daemon=True).start()
+                with self._lock:
+                    self._stats["remote_followers"] += 1
+                metrics.CHAT_COALESCED.inc(role="remote_follower")
+                return flight, False
+            flight._writer = owner
+
+        with self._lock:
+            self._stats["leaders"] += 1
+        metrics.CHAT_COALESCED.inc(role="leader")
+        return flight, True
+
+    async def ajoin(self, key):
+        """join() cho asyncio (backend redis chạy ngoài event loop)"""
+        if self.store:
+            return await asyncio.to_thread(self.join, key)
+        return self.join(key)
+
+    def _relay(self, flight, flight_id):
+        try:
+            for delta in self.store.read(flight.key, flight_id, self.wait_timeout):
+                flight.publish(delta)
+                if not flight.subscribers:
+                    # Mọi request chờ đã ngắt kết nối
+                    flight.fail(ai_client.AIServiceError("upstream", "không còn request nào chờ flight"))
+                    return
+            flight.finish()
+        except ai_client.AIServiceError as e:
+            flight.fail(e)
+        except Exception as e:
+            logging.error(f"Lỗi khi đọc flight {flight.key[:12]} từ Redis: {e}")
+            flight.fail(ai_client.AIServiceError("upstream", str(e)))
+
+    def _remove(self, flight):
+        with self._lock:
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["in_flight"] = len(self._flights)
+        stats["backend"] = "redis" if self.store else "memory"
+        total = stats["leaders"] + stats["followers"] + stats["remote_followers"]
+        stats["coalesced_ratio"] = round((total - stats["leaders"]) / total, 4) if total else 0.0
+        return stats
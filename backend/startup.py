@@ -0,0 +1,81 @@
+import os
+import time
+import logging
+import threading
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+class Warmup:
+    """Nạp song song các thành phần nặng (mô hình Whisper, bảng mã tokenizer...) ở background
+
+    Server bind port ngay; start() nạp mỗi thành phần trong một thread riêng
+    và /readyz báo trạng thái từng thành phần. Thành phần chưa nạp xong vẫn
+    dùng được: lần dùng đầu tiên tự nạp (chậm hơn). mode="lazy" bỏ qua
+    warm-up, mọi thứ được nạp ở lần dùng đầu tiên.
+
+    preload() chỉ chạy các bước an toàn trước khi fork (tải file về cache, dữ
+    liệu thuần Python), dùng trong gunicorn master với --preload.
+    """
+
+    def __init__(self, mode="background"):
+        self.mode = mode
+        self._tasks = {}
+        self._status = {}
+        self._lock = threading.Lock()
+        self._started_at = None
+
+    @classmethod
+    def from_env(cls):
+        """Tạo từ WARMUP_MODE: background (mặc định) hoặc lazy"""
+        return cls(os.getenv("WARMUP_MODE", "background").lower())
+
+    def add(self, name, load, preload=None):
+        """Đăng ký thành phần: load() chạy trong worker, preload() (tùy chọn) trong master"""
+        self._tasks[name] = (load, preload)
+        self._status[name] = {"state": "lazy" if self.mode == "lazy" else "pending"}
+
+    def _set(self, name, **status):
+        with self._lock:
+            self._status[name] = status
+
+    def preload(self):
+        """Chạy các bước preload tuần tự trong tiến trình hiện tại (không tạo thread)"""
+        for name, (_, preload) in self._tasks.items():
+            if preload is None:
+                continue
+            start = time.perf_counter()
+            try:
+                preload()
+                logging.info(f"Preload {name} xong sau {time.perf_counter() - start:.2f}s")
+            except Exception as e:
+                logging.error(f"Lỗi preload {name}: {e}")
+
+    def _run(self, name, load):
+        self._set(name, state="loading")
+        start = time.perf_counter()
+        try:
+            load()
+        except Exception as e:
+            # Thành phần lỗi không chặn readiness: request dùng tới nó sẽ tự báo lỗi
+            self._set(name, state="failed", error=str(e), seconds=round(time.perf_counter() - start, 2))
+            logging.error(f"Warm-up {name} thất bại: {e}")
+            return
+        self._set(name, state="ready", seconds=round(time.perf_counter() - start, 2))
+        logging.info(f"Warm-up {name} xong sau {time.perf_counter() - start:.2f}s")
+
+    def start(self):
+        """Bắt đầu nạp mọi thành phần song song ở background (idempotent)"""
+        with self._lock:
+            if self._started_at is not None or self.mode == "lazy":
+                return
+            self._started_at = time.time()
+        for name, (load, _) in self._tasks.items():
+            threading.Thread(target=self._run, args=(name, load), name=f"warmup-{name}", daemon=True).start()
+
+    def status(self):
+        with self._lock:
+            return {name: dict(status) for name, status in self._status.items()}
+
+    def ready(self):
+        """True khi không còn thành phần nào chờ nạp hoặc đang nạp"""
+        return all(status["state"] not in ("pending", "loading") for status in self.status().values())
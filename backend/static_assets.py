@@ -0,0 +1,243 @@
+"""Build và phục vụ file tĩnh của frontend (HTML, CSS, JS, ảnh).
+
+Bước build tạo trong STATIC_BUILD_DIR:
+  - bản sao có hash nội dung trong tên (script.3f2a9c1b7d4e.js) cho CSS/JS/ảnh,
+    được cache vĩnh viễn ở trình duyệt (Cache-Control: immutable);
+  - HTML giữ nguyên tên nhưng các tham chiếu tới CSS/JS/ảnh được đổi sang tên
+    có hash, và luôn được kiểm tra lại (no-cache + ETag -> 304);
+  - bản nén sẵn .gz (và .br nếu có thư viện brotli) cho file dạng văn bản;
+  - manifest.json: tên gốc -> file, hash, các bản nén, content type.
+
+Server chỉ đọc manifest vào bộ nhớ lúc khởi động và chọn bản nén theo
+Accept-Encoding, không nén lại theo từng request.
+
+Chạy trước khi deploy (server cũng tự build khi thiếu hoặc file nguồn đã đổi):
+    python static_assets.py
+"""
+import os
+import re
+import sys
+import json
+import gzip
+import shutil
+import hashlib
+import logging
+import mimetypes
+import tempfile
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+FRONTEND_DIR = os.path.join(BASE_DIR, '..', 'frontend')
+IMAGE_DIR = os.path.join(BASE_DIR, '..', 'images')
+BUILD_DIR = os.getenv("STATIC_BUILD_DIR") or os.path.join(BASE_DIR, '..', 'build', 'static')
+
+MANIFEST = "manifest.json"
+# Tăng khi đổi định dạng bản build để bản build cũ được tạo lại
+MANIFEST_VERSION = 1
+HASH_LENGTH = 12
+# Ảnh PNG/JPG đã nén sẵn: gzip/brotli không giảm thêm được
+COMPRESSIBLE = {".html", ".css", ".js", ".svg", ".json", ".txt"}
+MIN_COMPRESS_SIZE = 512
+
+CACHE_IMMUTABLE = "public, max-age=31536000, immutable"
+CACHE_REVALIDATE = "no-cache"
+
+# Thứ tự ưu tiên khi client nhận nhiều kiểu nén: (tên trong Accept-Encoding, đuôi file)
+ENCODINGS = [("br", ".br"), ("gzip", ".gz")]
+
+# href="style.css", src="script.js", href="/CodeMate_AI.png" (bỏ qua URL tuyệt đối, #anchor)
+_REFERENCE = re.compile(r'((?:href|src)=")(/?)([^"#?:/]+)(")')
+
+def sources():
+    """Tên gốc (đường dẫn URL) -> đường dẫn file nguồn"""
+    files = {name: os.path.join(FRONTEND_DIR, name) for name in sorted(os.listdir(FRONTEND_DIR))
+             if os.path.isfile(os.path.join(FRONTEND_DIR, name))}
+    # Ảnh logo/favicon được phục vụ ở /CodeMate_AI.png
+    files["CodeMate_AI.png"] = os.path.join(IMAGE_DIR, "CodeMate_AI.png")
+    return files
+
+def _source_state(files):
+    state = {}
+    for name, path in files.items():
+        stat = os.stat(path)
+        state[name] = [stat.st_mtime_ns, stat.st_size]
+    return state
+
+def fingerprinted_name(name, digest):
+    root, ext = os.path.splitext(name)
+    return f"{root}.{digest}{ext}"
+
+def _rewrite_references(html, assets):
+    """Đổi tham chiếu tới file tĩnh trong HTML sang tên có hash"""
+    def replace(match):
+        entry = assets.get(match.group(3))
+        if not entry or not entry["fingerprinted"]:
+            return match.group(0)
+        return f'{match.group(1)}{match.group(2)}{entry["file"]}{match.group(4)}'
+    return _REFERENCE.sub(replace, html.decode("utf-8")).encode("utf-8")
+
+def _compress(data):
+    """Các bản nén nhỏ hơn bản gốc: {đuôi file: bytes}"""
+    variants = {".gz": gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli:
+        variants[".br"] = brotli.compress(data, quality=11)
+    return {ext: blob for ext, blob in variants.items() if len(blob) < len(data)}
+
+def build(output_dir=BUILD_DIR, files=None):
+    """Build toàn bộ file tĩnh vào output_dir, trả về manifest
+
+    Ghi vào thư mục tạm rồi đổi tên, nên tiến trình khác không bao giờ thấy
+    một bản build dở dang.
+    """
+    files = files or sources()
+    output_dir = os.path.abspath(output_dir)
+    parent = os.path.dirname(output_dir)
+    os.makedirs(parent, exist_ok=True)
+    staging = tempfile.mkdtemp(prefix=".static-", dir=parent)
+
+    assets = {}
+    # File không phải HTML trước để HTML tham chiếu được tên có hash
+    for name in sorted(files, key=lambda name: name.endswith(".html")):
+        with open(files[name], "rb") as f:
+            data = f.read()
+        html = name.endswith(".html")
+        if html:
+            data = _rewrite_references(data, assets)
+        digest = hashlib.sha256(data).hexdigest()[:HASH_LENGTH]
+        served = name if html else fingerprinted_name(name, digest)
+
+        with open(os.path.join(staging, served), "wb") as f:
+            f.write(data)
+        encodings = {}
+        if os.path.splitext(name)[1] in COMPRESSIBLE and len(data) >= MIN_COMPRESS_SIZE:
+            for ext, blob in _compress(data).items():
+                with open(os.path.join(staging, served + ext), "wb") as f:
+                    f.write(blob)
+                encodings[ext] = len(blob)
+
+        assets[name] = {
+            "file": served,
+            "hash": digest,
+            "size": len(data),
+            "content_type": mimetypes.guess_type(name)[0] or "application/octet-stream",
+            "fingerprinted": not html,
+            "encodings": encodings
+        }
+
+    manifest = {"version": MANIFEST_VERSION, "sources": _source_state(files), "assets": assets}
+    with open(os.path.join(staging, MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    previous = None
+    if os.path.exists(output_dir):
+        previous = tempfile.mkdtemp(prefix=".static-old-", dir=parent)
+        os.rename(output_dir, os.path.join(previous, "build"))
+    os.rename(staging, output_dir)
+    if previous:
+        shutil.rmtree(previous, ignore_errors=True)
+    return manifest
+
+def load_manifest(directory=BUILD_DIR):
+    try:
+        with open(os.path.join(directory, MANIFEST)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def is_stale(manifest, files=None):
+    """Bản build thiếu, khác phiên bản hoặc file nguồn đã thay đổi (thêm/xóa/sửa) kể từ lần build"""
+    if not manifest or manifest.get("version") != MANIFEST_VERSION:
+        return True
+    try:
+        return manifest.get("sources") != _source_state(files or sources())
+    except OSError:
+        return True
+
+def accepted_encodings(header):
+    """Các encoding client chấp nhận (q > 0) từ header Accept-Encoding"""
+    accepted = set()
+    for part in (header or "").split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if name and q > 0:
+            accepted.add(name.strip().lower())
+    return accepted
+
+class StaticAssets:
+    """Manifest của bản build trong bộ nhớ, chọn file và header cho từng request"""
+
+    def __init__(self, directory, manifest):
+        self.directory = os.path.abspath(directory)
+        self.assets = manifest["assets"]
+        self._fingerprinted = {entry["file"]: name for name, entry in self.assets.items()
+                               if entry["fingerprinted"]}
+
+    @classmethod
+    def from_env(cls):
+        """Dùng bản build ở STATIC_BUILD_DIR (build lại nếu thiếu hoặc cũ); None nếu STATIC_ASSETS=off
+
+        Không build được (ví dụ thư mục chỉ đọc) thì trả về None để server
+        phục vụ thẳng từ frontend/ như trước.
+        """
+        if os.getenv("STATIC_ASSETS", "build").lower() == "off":
+            return None
+        manifest = load_manifest(BUILD_DIR)
+        if is_stale(manifest):
+            try:
+                manifest = build(BUILD_DIR)
+                logging.info(f"Đã build file tĩnh vào {os.path.abspath(BUILD_DIR)} ({len(manifest['assets'])} file)")
+            except OSError as e:
+                logging.error(f"Không build được file tĩnh, phục vụ trực tiếp từ frontend/: {e}")
+                return None
+        return cls(BUILD_DIR, manifest)
+
+    def resolve(self, path, accept_encoding=None):
+        """Chọn file cho URL `path`
+
+        Trả về None nếu không có, ngược lại dict {path, content_type, encoding,
+        etag, vary, cache_control}. ETag khác nhau cho từng bản nén vì nội dung gửi đi
+        khác nhau (ETag mạnh).
+        """
+        name = self._fingerprinted.get(path)
+        immutable = name is not None
+        entry = self.assets.get(name or path)
+        if entry is None:
+            return None
+
+        filename, encoding, etag = entry["file"], None, entry["hash"]
+        accepted = accepted_encodings(accept_encoding)
+        for candidate, ext in ENCODINGS:
+            if candidate in accepted and ext in entry["encodings"]:
+                filename, encoding, etag = filename + ext, candidate, f"{etag}-{candidate}"
+                break
+
+        return {
+            "path": os.path.join(self.directory, filename),
+            "content_type": entry["content_type"],
+            "encoding": encoding,
+            "etag": etag,
+            "vary": bool(entry["encodings"]),
+            "cache_control": CACHE_IMMUTABLE if immutable else CACHE_REVALIDATE
+        }
+
+if __name__ == '__main__':
+    output = sys.argv[1] if len(sys.argv) > 1 else BUILD_DIR
+    result = build(output)
+    for asset_name, asset in result["assets"].items():
+        sizes = ", ".join(f"{ext} {size}" for ext, size in asset["encodings"].items())
+        print(f"{asset_name:<20} -> {asset['file']:<32} {asset['size']:>8} bytes  {sizes}")
+    if not brotli:
+        print("Chưa cài brotli: chỉ tạo bản nén gzip")
@@ -0,0 +1,535 @@
+import os
+import time
+import math
+import logging
+import threading
+import multiprocessing
+import queue
+from collections import Counter, deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import audio
+import metrics
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Tự động tải mô hình từ Hugging Face Hub (nếu chưa có)
+MODEL_PATH = os.getenv("WHISPER_MODEL_PATH", "Duke03/Whisper-medium-vi-ct2-int8")
+
+SAMPLE_RATE = audio.SAMPLE_RATE
+# Clip ngắn hơn một cửa sổ Whisper (30s) có thể gộp batch trong một lần decode
+BATCH_MAX_SECONDS = 30
+# Biên độ lớn nhất dưới mức này coi như im lặng hoàn toàn (bỏ qua cả VAD)
+SILENCE_PEAK = 1e-3
+
+# Các nhánh của RoutingPolicy.route
+ROUTE_EMPTY = "empty"
+ROUTE_SHORT = "short"
+ROUTE_LONG = "long"
+
+class TranscriptionQueueFull(Exception):
+    """Hàng đợi phiên mã đã đầy, client nên thử lại sau retry_after giây"""
+
+    def __init__(self, retry_after):
+        super().__init__("Hàng đợi phiên mã đã đầy")
+        self.retry_after = retry_after
+
+# ==================== ROUTING ====================
+
+class RoutingPolicy:
+    """Tiền xử lý và chọn cách decode cho từng clip theo lượng tiếng nói thực có
+
+    - vad: cắt các khoảng lặng dài hơn vad_min_silence_ms (Silero VAD) trước khi decode
+    - clip có ít hơn min_speech_seconds giây tiếng nói bị bỏ qua (text rỗng, không decode)
+    - clip có tối đa short_seconds giây tiếng nói: short_model_path (nếu có, không
+      thì mô hình chính) với short_beam_size (1 = greedy)
+    - clip dài hơn: mô hình chính với beam_size
+    """
+
+    def __init__(self, vad=True, vad_min_silence_ms=500, vad_pad_ms=200, min_speech_seconds=0.3,
+                 short_seconds=8.0, short_model_path=None, short_beam_size=1, beam_size=5):
+        self.vad = vad
+        self.vad_min_silence_ms = vad_min_silence_ms
+        self.vad_pad_ms = vad_pad_ms
+        self.min_speech_seconds = min_speech_seconds
+        self.short_seconds = short_seconds
+        self.short_model_path = short_model_path
+        self.short_beam_size = short_beam_size
+        self.beam_size = beam_size
+
+    @classmethod
+    def from_env(cls):
+        """Tạo policy từ biến môi trường WHISPER_VAD*, WHISPER_SHORT_*, WHISPER_BEAM_SIZE"""
+        return cls(
+            vad=os.getenv("WHISPER_VAD", "1") == "1",
+            vad_min_silence_ms=int(os.getenv("WHISPER_VAD_MIN_SILENCE_MS", "500")),
+            vad_pad_ms=int(os.getenv("WHISPER_VAD_PAD_MS", "200")),
+            min_speech_seconds=float(os.getenv("WHISPER_MIN_SPEECH_SECONDS", "0.3")),
+            short_seconds=float(os.getenv("WHISPER_SHORT_SECONDS", "8")),
+            short_model_path=os.getenv("WHISPER_SHORT_MODEL_PATH") or None,
+            short_beam_size=int(os.getenv("WHISPER_SHORT_BEAM_SIZE", "1")),
+            beam_size=int(os.getenv("WHISPER_BEAM_SIZE", "5"))
+        )
+
+    def route(self, speech_seconds):
+        if speech_seconds < self.min_speech_seconds:
+            return ROUTE_EMPTY
+        return ROUTE_SHORT if speech_seconds <= self.short_seconds else ROUTE_LONG
+
+    def beam_size_for(self, route):
+        return self.short_beam_size if route == ROUTE_SHORT else self.beam_size
+
+def preprocess(samples, policy):
+    """Bỏ khoảng lặng bằng VAD: trả về (mảng chỉ còn các đoạn nói, số giây tiếng nói)"""
+    import numpy as np
+
+    if len(samples) == 0 or np.abs(samples).max() < SILENCE_PEAK:
+        return samples[:0], 0.0
+    if not policy.vad:
+        return samples, len(samples) / SAMPLE_RATE
+
+    from faster_whisper.vad import VadOptions, collect_chunks, get_speech_timestamps
+    options = VadOptions(min_silence_duration_ms=policy.vad_min_silence_ms, speech_pad_ms=policy.vad_pad_ms)
+    speech = collect_chunks(samples, get_speech_timestamps(samples, options))
+    return speech, len(speech) / SAMPLE_RATE
+
+# ==================== WORKER PROCESS ====================
+
+# Mỗi worker process giữ một bản WhisperModel riêng (và mô hình nhỏ cho clip ngắn nếu có)
+_worker_model = None
+_worker_short_model = None
+_worker_policy = RoutingPolicy()
+
+def _load_model(model_path, cpu_threads, num_workers):
+    from faster_whisper import WhisperModel
+    return WhisperModel(model_path, device="cpu", compute_type="int8",
+                        cpu_threads=cpu_threads, num_workers=num_workers,
+                        local_files_only=False)
+
+def _init_worker(model_path, cpu_threads, num_workers, policy=None):
+    """Tải mô hình Whisper một lần khi worker process khởi động"""
+    global _worker_model, _worker_short_model, _worker_policy
+    _worker_policy = policy or RoutingPolicy()
+    logging.info(f"[pid {os.getpid()}] Bắt đầu tải mô hình Whisper từ: {model_path}")
+    try:
+        _worker_model = _load_model(model_path, cpu_threads, num_workers)
+        logging.info(f"[pid {os.getpid()}] Tải mô hình Whisper thành công.")
+    except Exception as e:
+        logging.error(f"[pid {os.getpid()}] Lỗi khi tải mô hình Whisper: {e}")
+        _worker_model = None
+
+    if _worker_policy.short_model_path:
+        try:
+            _worker_short_model = _load_model(_worker_policy.short_model_path, cpu_threads, num_workers)
+            logging.info(f"[pid {os.getpid()}] Tải mô hình cho clip ngắn thành công: "
+                         f"{_worker_policy.short_model_path}")
+        except Exception as e:
+            # Vẫn phục vụ được: clip ngắn dùng mô hình chính
+            logging.error(f"[pid {os.getpid()}] Lỗi khi tải mô hình cho clip ngắn: {e}")
+            _worker_short_model = None
+
+def _model_for(route):
+    """(mô hình, beam size) cho một nhánh của RoutingPolicy"""
+    if route == ROUTE_SHORT and _worker_policy.short_model_path and _worker_short_model is not None:
+        return _worker_short_model, _worker_policy.short_beam_size
+    return _worker_model, _worker_policy.beam_size_for(route)
+
+def _worker_ready():
+    """Chạy trong worker process: True nếu mô hình đã tải xong (dùng cho warm-up)"""
+    return _worker_model is not None
+
+def download_model(model_path=MODEL_PATH):
+    """Tải file mô hình về cache Hugging Face mà không nạp vào bộ nhớ
+
+    Không tạo thread hay process nên gọi được trong gunicorn master trước khi
+    fork (--preload): worker process phiên mã sau đó chỉ đọc từ cache.
+    """
+    if os.path.isdir(model_path):
+        return model_path
+    from faster_whisper.utils import download_model as hf_download_model
+    return hf_download_model(model_path)
+
+def _load_audio(data):
+    """Bytes tải lên -> mảng PCM float32 16 kHz (mảng numpy được giữ nguyên)"""
+    if isinstance(data, (bytes, bytearray)):
+        return audio.decode_pcm(data)
+    return data
+
+def _transcribe_job(audio_data, submitted_at):
+    """Chạy trong worker process: phiên mã và trả về kết quả kèm thời gian"""
+    if _worker_model is None:
+        raise RuntimeError("Mô hình Whisper không khả dụng")
+
+    started_at = time.time()
+    samples = _load_audio(audio_data)
+    speech, speech_duration = preprocess(samples, _worker_policy)
+    route = _worker_policy.route(speech_duration)
+    text = ""
+    # Không có tiếng nói: trả về ngay, không decode
+    if route != ROUTE_EMPTY:
+        model, beam_size = _model_for(route)
+        segments, _ = model.transcribe(speech, beam_size=beam_size, language="vi")
+        text = "".join(segment.text for segment in segments).strip()
+    finished_at = time.time()
+
+    return {
+        "text": text,
+        "queue_wait": started_at - submitted_at,
+        "processing_time": finished_at - started_at,
+        "audio_duration": len(samples) / SAMPLE_RATE,
+        "speech_duration": speech_duration,
+        "route": route,
+        "batch_size": 1
+    }
+
+def _generate_batch(model, audios, beam_size):
+    """Decode nhiều clip ngắn (<= 30s) trong một lần gọi CTranslate2 generate
+
+    Tương đương batched pipeline: mỗi clip là đúng một cửa sổ 30s nên có thể
+    xếp chồng mel features thành một batch [N, n_mels, 3000].
+    """
+    import numpy as np
+    import ctranslate2
+    from faster_whisper.tokenizer import Tokenizer
+
+    extractor = model.feature_extractor
+    features = []
+    for samples in audios:
+        mel = extractor(samples)[:, :extractor.nb_max_frames]
+        if mel.shape[1] < extractor.nb_max_frames:
+            mel = np.pad(mel, ((0, 0), (0, extractor.nb_max_frames - mel.shape[1])))
+        features.append(mel)
+    batch = ctranslate2.StorageView.from_array(np.ascontiguousarray(np.stack(features), dtype=np.float32))
+
+    tokenizer = Tokenizer(model.hf_tokenizer, model.model.is_multilingual,
+                          task="transcribe", language="vi")
+    prompt = list(tokenizer.sot_sequence) + [tokenizer.no_timestamps]
+    results = model.model.generate(batch, [prompt] * len(audios), beam_size=beam_size,
+                                           max_length=448, suppress_blank=True, suppress_tokens=[-1])
+    return [tokenizer.decode(result.sequences_ids[0]).strip() for result in results]
+
+def _transcribe_batch_job(audio_items, submitted_ats):
+    """Chạy trong worker process: phiên mã một batch clip, trả về list kết quả
+
+    Clip lỗi được trả về dạng {"error": exception} để không làm hỏng cả batch.
+    """
+    if _worker_model is None:
+        raise RuntimeError("Mô hình Whisper không khả dụng")
+
+    started_at = time.time()
+    texts = [None] * len(audio_items)
+    durations = [0.0] * len(audio_items)
+    speech_durations = [0.0] * len(audio_items)
+    routes = [ROUTE_EMPTY] * len(audio_items)
+    # Clip vừa một cửa sổ được gom theo nhánh (mô hình + beam size) để decode chung
+    groups = {}
+
+    for i, audio_data in enumerate(audio_items):
+        try:
+            samples = _load_audio(audio_data)
+            durations[i] = len(samples) / SAMPLE_RATE
+            speech, speech_durations[i] = preprocess(samples, _worker_policy)
+            routes[i] = _worker_policy.route(speech_durations[i])
+            if routes[i] == ROUTE_EMPTY:
+                texts[i] = ""
+            elif speech_durations[i] <= BATCH_MAX_SECONDS:
+                groups.setdefault(routes[i], []).append((i, speech))
+            else:
+                # Clip dài cần nhiều cửa sổ: dùng pipeline đầy đủ
+                model, beam_size = _model_for(routes[i])
+                segments, _ = model.transcribe(speech, beam_size=beam_size, language="vi")
+                texts[i] = "".join(segment.text for segment in segments).strip()
+        except Exception as e:
+            texts[i] = e
+
+    for route, clips in groups.items():
+        model, beam_size = _model_for(route)
+        try:
+            for (i, _), text in zip(clips, _generate_batch(model, [speech for _, speech in clips], beam_size)):
+                texts[i] = text
+        except Exception as e:
+            # Decode lại từng clip để chỉ clip gây lỗi thất bại, không kéo theo clip của request khác
+            logging.warning(f"Decode batch {len(clips)} clip ({route}) lỗi, thử lại từng clip: {e}")
+            for i, speech in clips:
+                try:
+                    texts[i] = _generate_batch(model, [speech], beam_size)[0]
+                except Exception as clip_error:
+                    texts[i] = clip_error
+
+    finished_at = time.time()
+    results = []
+    for i, submitted_at in enumerate(submitted_ats):
+        if isinstance(texts[i], Exception):
+            results.append({"error": texts[i]})
+            continue
+        results.append({
+            "text": texts[i],
+            "queue_wait": started_at - submitted_at,
+            "processing_time": finished_at - started_at,
+            "audio_duration": durations[i],
+            "speech_duration": speech_durations[i],
+            "route": routes[i],
+            "batch_size": len(audio_items)
+        })
+    return results
+
+# ==================== SERVICE ====================
+
+class TranscriptionService:
+    """Pool worker process cho Whisper với hàng đợi giới hạn (backpressure)
+
+    Tối đa `max_batch_size * workers + queue_size` job được nhận cùng lúc (mỗi
+    worker đang chạy giữ được một batch đầy); job vượt quá sẽ bị từ chối ngay
+    bằng TranscriptionQueueFull thay vì làm nghẽn request thread.
+    Pool được khởi tạo lười ở job đầu tiên (hoặc khi gọi start()).
+
+    Khi max_batch_size > 1, job được gom bởi một thread scheduler: mỗi khi có
+    worker rảnh, scheduler lấy job đầu tiên rồi chờ thêm tối đa max_batch_wait
+    giây (hoặc tới khi đủ max_batch_size) và gửi cả batch cho worker đó.
+
+    Nếu một worker chết (OOM, segfault trong CTranslate2) pool chuyển sang
+    BrokenProcessPool: các job đang chạy thất bại, pool hỏng bị bỏ và job kế
+    tiếp tạo pool mới; /readyz báo lỗi cho tới khi có job phiên mã thành công.
+    """
+
+    def __init__(self, model_path=MODEL_PATH, workers=1, cpu_threads=0, num_workers=1,
+                 queue_size=8, timeout=120, max_batch_size=1, max_batch_wait=0.05, policy=None):
+        self.model_path = model_path
+        self.policy = policy or RoutingPolicy()
+        self.workers = workers
+        self.cpu_threads = cpu_threads
+        self.num_workers = num_workers
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.max_batch_size = max_batch_size
+        self.max_batch_wait = max_batch_wait
+
+        self._executor = None
+        # Lỗi của pool gần nhất bị hỏng (None khi pool hiện tại đang chạy bình thường)
+        self._pool_error = None
+        self._batch_queue = queue.Queue()
+        self._batch_thread = None
+        self._idle_workers = threading.Semaphore(workers)
+        self._start_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_batch_size * workers + queue_size)
+        self._stats_lock = threading.Lock()
+        self._recent = deque(maxlen=200)
+        self._counters = {"submitted": 0, "completed": 0, "failed": 0, "rejected": 0, "in_flight": 0,
+                          "batches": 0, "pool_restarts": 0}
+        self._totals = {"queue_wait": 0.0, "processing_time": 0.0, "audio_duration": 0.0, "speech_duration": 0.0,
+                        "batch_size": 0}
+        self._routes = Counter()
+
+    @classmethod
+    def from_env(cls):
+        """Tạo service từ biến môi trường WHISPER_*"""
+        return cls(
+            workers=int(os.getenv("WHISPER_WORKERS", "1")),
+            cpu_threads=int(os.getenv("WHISPER_CPU_THREADS", "0")),
+            num_workers=int(os.getenv("WHISPER_NUM_WORKERS", "1")),
+            queue_size=int(os.getenv("WHISPER_QUEUE_SIZE", "8")),
+            timeout=float(os.getenv("WHISPER_TIMEOUT", "120")),
+            max_batch_size=int(os.getenv("WHISPER_BATCH_SIZE", "1")),
+            max_batch_wait=float(os.getenv("WHISPER_BATCH_WAIT_MS", "50")) / 1000,
+            policy=RoutingPolicy.from_env()
+        )
+
+    def start(self):
+        """Khởi động pool worker (idempotent)"""
+        with self._start_lock:
+            if self._executor is None:
+                # spawn: an toàn với thread của web server và chạy được trên Windows
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker,
+                    initargs=(self.model_path, self.cpu_threads, self.num_workers, self.policy)
+                )
+                logging.info(f"Khởi động {self.workers} worker phiên mã (queue_size={self.queue_size}, "
+                             f"batch={self.max_batch_size})")
+            if self.max_batch_size > 1 and self._batch_thread is None:
+                self._batch_thread = threading.Thread(target=self._batch_loop, name="whisper-batcher", daemon=True)
+                self._batch_thread.start()
+        return self._executor
+
+    def download_models(self):
+        """Tải trước mô hình chính và mô hình cho clip ngắn (nếu có), xem download_model"""
+        download_model(self.model_path)
+        if self.policy.short_model_path:
+            download_model(self.policy.short_model_path)
+
+    def warm_up(self):
+        """Khởi động pool và chờ worker tải xong mô hình (chặn; gọi từ thread warm-up)"""
+        futures = [self._submit_job(_worker_ready) for _ in range(self.workers)]
+        if not all(future.result() for future in futures):
+            raise RuntimeError("Mô hình Whisper không khả dụng")
+        self._pool_error = None
+
+    def _replace_broken(self, executor, error):
+        """Bỏ pool đã hỏng để lần gửi job tiếp theo tạo pool mới (chỉ một lần cho mỗi pool)"""
+        with self._start_lock:
+            if self._executor is not executor:
+                return
+            self._executor = None
+            self._pool_error = f"{type(error).__name__}: {error}"
+        with self._stats_lock:
+            self._counters["pool_restarts"] += 1
+        logging.error(f"Pool phiên mã bị hỏng (worker đã chết), tạo lại pool: {error}")
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def _submit_job(self, fn, *args):
+        """Gửi job vào pool; nếu pool đã hỏng thì thay pool mới và gửi lại một lần"""
+        executor = self.start()
+        try:
+            future = executor.submit(fn, *args)
+        except BrokenProcessPool as e:
+            self._replace_broken(executor, e)
+            executor = self.start()
+            future = executor.submit(fn, *args)
+
+        def check_broken(f):
+            if not f.cancelled() and isinstance(f.exception(), BrokenProcessPool):
+                self._replace_broken(executor, f.exception())
+        future.add_done_callback(check_broken)
+        return future
+
+    def healthy(self):
+        """False nếu pool gần nhất bị hỏng và chưa có job nào chạy thành công trên pool mới"""
+        return self._pool_error is None
+
+    def shutdown(self):
+        with self._start_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+    def retry_after(self):
+        """Ước lượng số giây client nên chờ trước khi thử lại"""
+        with self._stats_lock:
+            completed = self._counters["completed"]
+            avg = self._totals["processing_time"] / completed if completed else 5.0
+            backlog = self._counters["in_flight"]
+        return max(1, math.ceil(avg * backlog / self.workers))
+
+    def submit(self, audio_data):
+        """Đưa một job vào hàng đợi, trả về concurrent.futures.Future
+
+        audio_data là bytes của tệp tải lên (giải mã trong worker) hoặc mảng
+        PCM float32 16 kHz. Kết quả của future là dict {text, queue_wait, processing_time, audio_duration}.
+        """
+        if not self._slots.acquire(blocking=False):
+            with self._stats_lock:
+                self._counters["rejected"] += 1
+            raise TranscriptionQueueFull(self.retry_after())
+
+        try:
+            if self.max_batch_size > 1:
+                self.start()
+                future = Future()
+                self._batch_queue.put((audio_data, time.time(), future))
+            else:
+                future = self._submit_job(_transcribe_job, audio_data, time.time())
+        except Exception:
+            self._slots.release()
+            raise
+
+        with self._stats_lock:
+            self._counters["submitted"] += 1
+            self._counters["in_flight"] += 1
+        future.add_done_callback(self._on_done)
+        return future
+
+    def transcribe(self, audio_data):
+        """Phiên mã đồng bộ (chặn tới khi có kết quả hoặc hết timeout)"""
+        return self.submit(audio_data).result(timeout=self.timeout)["text"]
+
+    def _batch_loop(self):
+        """Thread scheduler: gom job thành batch mỗi khi có worker rảnh"""
+        while True:
+            self._idle_workers.acquire()
+            batch = [self._batch_queue.get()]
+            deadline = time.monotonic() + self.max_batch_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._batch_queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            try:
+                batch_future = self._submit_job(_transcribe_batch_job,
+                                                [item[0] for item in batch],
+                                                [item[1] for item in batch])
+            except Exception as e:
+                self._idle_workers.release()
+                for _, _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            with self._stats_lock:
+                self._counters["batches"] += 1
+            batch_future.add_done_callback(lambda f, batch=batch: self._on_batch_done(f, batch))
+
+    def _on_batch_done(self, batch_future, batch):
+        """Trả kết quả của batch về future riêng của từng request"""
+        self._idle_workers.release()
+        if batch_future.exception() is not None:
+            for _, _, future in batch:
+                future.set_exception(batch_future.exception())
+            return
+        for (_, _, future), result in zip(batch, batch_future.result()):
+            if "error" in result:
+                future.set_exception(result["error"])
+            else:
+                future.set_result(result)
+
+    def _on_done(self, future):
+        self._slots.release()
+        with self._stats_lock:
+            self._counters["in_flight"] -= 1
+            if future.cancelled() or future.exception() is not None:
+                self._counters["failed"] += 1
+                return
+            result = future.result()
+            self._pool_error = None
+            self._counters["completed"] += 1
+            metrics.AUDIO_SECONDS.inc(result["audio_duration"])
+            metrics.TRANSCRIPTION_CLIPS.inc(route=result["route"])
+            self._routes[result["route"]] += 1
+            for key in self._totals:
+                self._totals[key] += result[key]
+            self._recent.append((result["queue_wait"], result["processing_time"], result["audio_duration"]))
+
+        logging.info(
+            f"Phiên mã xong: chờ {result['queue_wait']:.2f}s, xử lý {result['processing_time']:.2f}s, "
+            f"audio {result['audio_duration']:.1f}s (tiếng nói {result['speech_duration']:.1f}s, "
+            f"nhánh {result['route']}), batch {result['batch_size']}"
+        )
+
+    def stats(self):
+        """Số liệu tổng hợp của pool (đếm job và thời gian trung bình)"""
+        with self._stats_lock:
+            counters = dict(self._counters)
+            totals = dict(self._totals)
+            recent = list(self._recent)
+            routes = dict(self._routes)
+
+        completed = counters["completed"]
+        processing = sorted(r[1] for r in recent)
+        return {
+            **counters,
+            "pool_error": self._pool_error,
+            "workers": self.workers,
+            "queue_size": self.queue_size,
+            "max_batch_size": self.max_batch_size,
+            "avg_batch_size": totals["batch_size"] / completed if completed else 0.0,
+            "avg_queue_wait": totals["queue_wait"] / completed if completed else 0.0,
+            "avg_processing_time": totals["processing_time"] / completed if completed else 0.0,
+            "p95_processing_time": processing[int(len(processing) * 0.95) - 1] if processing else 0.0,
+            "audio_seconds": totals["audio_duration"],
+            "speech_seconds": totals["speech_duration"],
+            "routes": routes,
+            "real_time_factor": totals["processing_time"] / totals["audio_duration"] if totals["audio_duration"] else 0.0
+        }
@@ -0,0 +1,149 @@
+import os
+import time
+import queue
+import atexit
+import logging
+import threading
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+_STOP = object()
+
+class TurnWriter:
+    """Ghi các lượt chat xuống DB ở background (write-behind)
+
+    Route chỉ xếp lượt chat vào một hàng đợi giới hạn rồi trả lời ngay; một
+    thread gom các lượt đến trong khoảng `interval` giây (tối đa batch_size
+    lượt) và ghi chúng bằng save_turns trong một transaction. Khi hàng đợi đầy
+    hoặc writer đã đóng, submit() trả về False để caller tự ghi đồng bộ.
+    Hàng đợi được xả hết khi tiến trình thoát (atexit) hoặc khi gọi close().
+
+    Đánh đổi: lượt chat chỉ xuất hiện trong DB sau tối đa `interval` giây, và
+    sẽ mất nếu tiến trình bị kill đột ngột (SIGKILL) trước khi kịp xả.
+
+    Thread ghi được tạo ở lần submit() đầu tiên: với gunicorn --preload, writer
+    được tạo trong master và thread của master không sống sót qua fork.
+    """
+
+    def __init__(self, save_turns, max_queue=1000, batch_size=100, interval=0.1):
+        self.save_turns = save_turns
+        self.batch_size = batch_size
+        self.interval = interval
+        self.queue = queue.Queue(max_queue)
+        self._closed = False
+        self._lock = threading.Lock()
+        self._stats = {"queued": 0, "written": 0, "batches": 0, "rejected": 0, "failed": 0}
+        self._thread = None
+        atexit.register(self.close)
+
+    @classmethod
+    def from_env(cls, save_turns):
+        """Tạo writer nếu WRITE_BEHIND=1, ngược lại trả về None (ghi đồng bộ)"""
+        if os.getenv("WRITE_BEHIND", "0") != "1":
+            return None
+        writer = cls(
+            save_turns,
+            max_queue=int(os.getenv("WRITE_BEHIND_QUEUE_SIZE", "1000")),
+            batch_size=int(os.getenv("WRITE_BEHIND_BATCH_SIZE", "100")),
+            interval=int(os.getenv("WRITE_BEHIND_INTERVAL_MS", "100")) / 1000
+        )
+        logging.info("Bật write-behind cho lượt chat")
+        return writer
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self._stats[name] += n
+
+    def submit(self, conversation_id, user_input, ai_response):
+        """Xếp một lượt chat vào hàng đợi; False nếu hàng đợi đầy hoặc writer đã đóng"""
+        if self._closed:
+            return False
+        self._start()
+        try:
+            self.queue.put_nowait((conversation_id, user_input, ai_response))
+        except queue.Full:
+            self._count("rejected")
+            logging.warning("Hàng đợi write-behind đầy, ghi đồng bộ")
+            return False
+        self._count("queued")
+        return True
+
+    def _start(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="turn-writer", daemon=True)
+                    self._thread.start()
+
+    def _save(self, turns):
+        try:
+            return self.save_turns(turns)
+        except Exception as e:
+            # Ví dụ pool chưa khởi tạo được: không để thread ghi bị dừng
+            logging.error(f"Lỗi ghi write-behind: {e}")
+            return False
+
+    def _flush(self, batch):
+        if self._save(batch):
+            self._count("written", len(batch))
+            self._count("batches")
+            return
+        # Ghi lại từng lượt để một lượt lỗi không kéo theo cả batch
+        for turn in batch:
+            if self._save([turn]):
+                self._count("written")
+            else:
+                self._count("failed")
+                logging.error(f"Không lưu được lượt chat của conversation {turn[0]}")
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self.queue.get()
+            if item is _STOP:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._flush(batch)
+
+        # Các lượt được xếp hàng cùng lúc với close()
+        remaining = []
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP:
+                remaining.append(item)
+        if remaining:
+            self._flush(remaining)
+
+    def close(self, timeout=30):
+        """Dừng nhận lượt mới và chờ ghi hết hàng đợi"""
+        if self._closed:
+            return
+        self._closed = True
+        if self._thread is None:
+            return
+        self.queue.put(_STOP)
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logging.error(f"Write-behind chưa xả xong sau {timeout}s, còn {self.queue.qsize()} lượt")
+        else:
+            logging.info("Đã xả hết hàng đợi write-behind")
+
+    def stats(self):
+        with self._lock:
+            return {**self._stats, "pending": self.queue.qsize()}
@@ -4,6 +4,16 @@ let currentUser = null;
 let isRecording = false;
 let mediaRecorder = null;
 let audioChunks = [];
+// Phân trang lịch sử messages (cursor của trang cũ hơn tiếp theo)
+let olderMessagesCursor = null;
+let isLoadingOlderMessages = false;
+const MESSAGE_PAGE_SIZE = 50;
+// Phân trang danh sách conversations ở sidebar
+let olderConversationsCursor = null;
+let isLoadingOlderConversations = false;
+const CONVERSATION_PAGE_SIZE = 30;
+// Sync token của lần tải danh sách gần nhất: lần sau chỉ hỏi các conversation đã thay đổi
+let conversationsSync = null;
 
 // ==================== DOM ELEMENTS ====================
 const elements = {
@@ -97,15 +107,25 @@ function updateUserUI(user) {
 }
 
 // ==================== CONVERSATIONS ====================
+async function fetchConversationsPage(before = null, since = null) {
+    const params = new URLSearchParams({ limit: CONVERSATION_PAGE_SIZE });
+    if (before) params.set('before', before);
+    if (since) params.set('since', since);
+    
+    const response = await fetch(`${API_URL}/api/conversations?${params}`, {
+        credentials: 'include'
+    });
+    
+    if (!response.ok) throw new Error('Không thể tải conversations');
+    return response.json();
+}
+
 async function loadConversations() {
     try {
-        const response = await fetch(`${API_URL}/api/conversations`, {
-            credentials: 'include'
-        });
-        
-        if (!response.ok) throw new Error('Không thể tải conversations');
-        
-        const conversations = await response.json();
+        const page = await fetchConversationsPage();
+        const conversations = page.conversations;
+        olderConversationsCursor = page.next_before;
+        conversationsSync = page.sync;
         renderConversations(conversations);
         
         // Load conversation đầu tiên nếu có
@@ -118,6 +138,50 @@ async function loadConversations() {
     }
 }
 
+// Cập nhật sidebar sau mỗi lượt chat: chỉ tải các conversation đã thay đổi (?since=)
+async function refreshConversations() {
+    if (!conversationsSync) return loadConversations();
+    
+    try {
+        const page = await fetchConversationsPage(null, conversationsSync);
+        conversationsSync = page.sync;
+        if (page.reset) {
+            // Server không tính được delta (ví dụ có conversation bị xóa): thay cả danh sách
+            olderConversationsCursor = page.next_before;
+            renderConversations(page.conversations);
+            return;
+        }
+        
+        const emptyState = elements.conversationsList.querySelector('.empty-state');
+        if (emptyState && page.conversations.length > 0) emptyState.remove();
+        // page.conversations mới nhất trước: chèn từ cũ đến mới lên đầu danh sách
+        page.conversations.slice().reverse().forEach(conv => {
+            const existing = elements.conversationsList.querySelector(`.conversation-item[data-id="${conv.id}"]`);
+            if (existing) existing.remove();
+            elements.conversationsList.insertAdjacentHTML('afterbegin', conversationItemHtml(conv));
+        });
+    } catch (error) {
+        console.error('Error refreshing conversations:', error);
+        await loadConversations();
+    }
+}
+
+async function loadOlderConversations() {
+    if (!olderConversationsCursor || isLoadingOlderConversations) return;
+    
+    isLoadingOlderConversations = true;
+    try {
+        const page = await fetchConversationsPage(olderConversationsCursor);
+        elements.conversationsList.insertAdjacentHTML('beforeend', page.conversations.map(conversationItemHtml).join(''));
+        olderConversationsCursor = page.next_before;
+    } catch (error) {
+        console.error('Error loading older conversations:', error);
+        showError('Không thể tải thêm lịch sử hội thoại');
+    } finally {
+        isLoadingOlderConversations = false;
+    }
+}
+
 function renderConversations(conversations) {
     if (conversations.length === 0) {
         elements.conversationsList.innerHTML = `
@@ -129,41 +193,33 @@ function renderConversations(conversations) {
         return;
     }
     
-    elements.conversationsList.innerHTML = conversations.map(conv => {
-        const preview = conv.first_message 
-            ? (conv.first_message.length > 60 
-                ? conv.first_message.substring(0, 60) + '...' 
-                : conv.first_message)
-            : 'Không có tin nhắn';
-        
-        const timeAgo = getTimeAgo(new Date(conv.updated_at));
-        const isActive = conv.id === currentConversationId ? 'active' : '';
-        
-        return `
-            <div class="conversation-item ${isActive}" data-id="${conv.id}">
-                <div class="conversation-content">
-                    <div class="conversation-title">${escapeHtml(conv.title)}</div>
-                    <div class="conversation-preview">${escapeHtml(preview)}</div>
-                    <div class="conversation-time">${timeAgo}</div>
-                </div>
-                <div class="conversation-actions">
-                    <button class="conversation-action-btn delete" onclick="deleteConversation(${conv.id}, event)">
-                        <i class="fas fa-trash"></i>
-                    </button>
-                </div>
+    elements.conversationsList.innerHTML = conversations.map(conversationItemHtml).join('');
+}
+
+function conversationItemHtml(conv) {
+    const preview = conv.first_message 
+        ? (conv.first_message.length > 60 
+            ? conv.first_message.substring(0, 60) + '...' 
+            : conv.first_message)
+        : 'Không có tin nhắn';
+    
+    const timeAgo = getTimeAgo(new Date(conv.updated_at));
+    const isActive = conv.id === currentConversationId ? 'active' : '';
+    
+    return `
+        <div class="conversation-item ${isActive}" data-id="${conv.id}">
+            <div class="conversation-content">
+                <div class="conversation-title">${escapeHtml(conv.title)}</div>
+                <div class="conversation-preview">${escapeHtml(preview)}</div>
+                <div class="conversation-time">${timeAgo}</div>
             </div>
-        `;
-    }).join('');
-    
-    // Add click listeners
-    document.querySelectorAll('.conversation-item').forEach(item => {
-        item.addEventListener('click', (e) => {
-            if (!e.target.closest('.conversation-actions')) {
-                const id = parseInt(item.dataset.id);
-                loadConversation(id);
-            }
-        });
-    });
+            <div class="conversation-actions">
+                <button class="conversation-action-btn delete" onclick="deleteConversation(${conv.id}, event)">
+                    <i class="fas fa-trash"></i>
+                </button>
+            </div>
+        </div>
+    `;
 }
 
 async function createNewConversation() {
@@ -179,9 +235,10 @@ async function createNewConversation() {
         
         const data = await response.json();
         currentConversationId = data.conversation_id;
+        olderMessagesCursor = null;
         
-        // Reload conversations list
-        await loadConversations();
+        // Cập nhật danh sách conversations
+        await refreshConversations();
         
         // Clear chat
         elements.chatLog.innerHTML = '';
@@ -203,26 +260,23 @@ async function loadConversation(conversationId) {
             item.classList.toggle('active', parseInt(item.dataset.id) === conversationId);
         });
         
-        // Load messages
-        const response = await fetch(`${API_URL}/api/conversations/${conversationId}`, {
-            credentials: 'include'
-        });
-        
-        if (!response.ok) throw new Error('Không thể tải messages');
-        
-        const messages = await response.json();
+        // Load trang messages mới nhất, các trang cũ hơn được tải khi cuộn lên
+        olderMessagesCursor = null;
+        const page = await fetchMessagesPage(conversationId);
+        if (currentConversationId !== conversationId) return;
         
         // Clear chat log
         elements.chatLog.innerHTML = '';
         
         // Render messages
-        if (messages.length === 0) {
+        if (page.messages.length === 0) {
             showWelcomeScreen();
         } else {
-            messages.forEach(msg => {
+            page.messages.forEach(msg => {
                 addMessageToChatLog(msg.role, msg.content, msg.role === 'assistant');
             });
         }
+        olderMessagesCursor = page.next_before;
         
         // Update title
         const convItem = document.querySelector(`.conversation-item[data-id="${conversationId}"]`);
@@ -236,6 +290,45 @@ async function loadConversation(conversationId) {
     }
 }
 
+async function fetchMessagesPage(conversationId, before = null) {
+    const params = new URLSearchParams({ limit: MESSAGE_PAGE_SIZE });
+    if (before) params.set('before', before);
+    
+    const response = await fetch(`${API_URL}/api/conversations/${conversationId}?${params}`, {
+        credentials: 'include'
+    });
+    
+    if (!response.ok) throw new Error('Không thể tải messages');
+    return response.json();
+}
+
+async function loadOlderMessages() {
+    if (!olderMessagesCursor || isLoadingOlderMessages) return;
+    
+    const conversationId = currentConversationId;
+    isLoadingOlderMessages = true;
+    try {
+        const page = await fetchMessagesPage(conversationId, olderMessagesCursor);
+        if (currentConversationId !== conversationId) return;
+        
+        // Chèn lên đầu và giữ nguyên vị trí đang xem
+        const previousHeight = elements.chatLog.scrollHeight;
+        const fragment = document.createDocumentFragment();
+        page.messages.forEach(msg => {
+            fragment.appendChild(createMessageElement(msg.role, msg.content, msg.role === 'assistant'));
+        });
+        elements.chatLog.insertBefore(fragment, elements.chatLog.firstChild);
+        elements.chatLog.scrollTop += elements.chatLog.scrollHeight - previousHeight;
+        
+        olderMessagesCursor = page.next_before;
+    } catch (error) {
+        console.error('Error loading older messages:', error);
+        showError('Không thể tải thêm tin nhắn cũ');
+    } finally {
+        isLoadingOlderMessages = false;
+    }
+}
+
 async function deleteConversation(conversationId, event) {
     event.stopPropagation();
     
@@ -283,7 +376,7 @@ async function sendMessage(formData) {
         // Add conversation_id to formData
         formData.append('conversation_id', currentConversationId);
         
-        const response = await fetch(`${API_URL}/api/chat`, {
+        const response = await fetch(`${API_URL}/api/chat/stream`, {
             method: 'POST',
             body: formData,
             credentials: 'include'
@@ -294,21 +387,14 @@ async function sendMessage(formData) {
             throw new Error(errData.error || 'Có lỗi xảy ra từ server');
         }
         
-        const data = await response.json();
-        
-        // Nếu là audio, hiển thị transcribed text
-        if (formData.has('audioFile')) {
-            addMessageToChatLog('user', data.user_input);
-        }
-        
-        // Hiển thị AI response
-        addMessageToChatLog('assistant', data.ai_response, true);
+        // Hiển thị AI response theo từng đoạn khi stream về
+        const data = await readChatStream(response, formData.has('audioFile'));
         
         // Update conversation title nếu là tin nhắn đầu tiên
         await updateConversationTitleIfNeeded(data.user_input);
         
-        // Reload conversations để cập nhật preview
-        await loadConversations();
+        // Cập nhật preview/tiêu đề của conversation vừa chat
+        await refreshConversations();
         
     } catch (error) {
         console.error('Send message error:', error);
@@ -328,6 +414,59 @@ async function sendMessage(formData) {
     }
 }
 
+async function readChatStream(response, isAudio) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let userInput = '';
+    let aiResponse = '';
+    let contentDiv = null;
+    
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        
+        // Mỗi sự kiện SSE kết thúc bằng một dòng trống
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const rawEvent = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+            
+            let eventName = 'message';
+            let dataText = '';
+            rawEvent.split('\n').forEach(line => {
+                if (line.startsWith('event:')) eventName = line.slice(6).trim();
+                else if (line.startsWith('data:')) dataText += line.slice(5).trim();
+            });
+            if (!dataText) continue;
+            const payload = JSON.parse(dataText);
+            
+            if (eventName === 'user_input') {
+                userInput = payload.user_input;
+                // Nếu là audio, hiển thị transcribed text
+                if (isAudio) {
+                    addMessageToChatLog('user', userInput);
+                }
+            } else if (eventName === 'delta') {
+                if (!contentDiv) {
+                    showTypingIndicator(false);
+                    contentDiv = addMessageToChatLog('assistant', '', true);
+                }
+                aiResponse += payload.content;
+                contentDiv.innerHTML = marked.parse(aiResponse);
+                elements.chatLog.scrollTop = elements.chatLog.scrollHeight;
+            } else if (eventName === 'done') {
+                aiResponse = payload.ai_response;
+            } else if (eventName === 'error') {
+                throw new Error(payload.error);
+            }
+        }
+    }
+    
+    return { user_input: userInput, ai_response: aiResponse };
+}
+
 async function updateConversationTitleIfNeeded(userInput) {
     try {
         // Chỉ update nếu title vẫn là mặc định
@@ -378,24 +517,51 @@ async function handleVoiceInput() {
             mediaRecorder = new MediaRecorder(stream);
             
             audioChunks = [];
+            // Mở phiên phiên mã tăng dần; nếu lỗi sẽ gửi cả tệp khi dừng ghi
+            const streamId = await startLiveTranscription();
+            let uploadChain = Promise.resolve();
             
             mediaRecorder.ondataavailable = event => {
                 audioChunks.push(event.data);
+                if (streamId) {
+                    // Gửi tuần tự để server nhận các chunk đúng thứ tự
+                    uploadChain = uploadChain.then(() => sendAudioChunk(streamId, event.data));
+                }
             };
             
-            mediaRecorder.onstop = () => {
-                const audioBlob = new Blob(audioChunks, { type: 'audio/wav' });
-                const audioFile = new File([audioBlob], "recording.wav", { type: "audio/wav" });
+            mediaRecorder.onstop = async () => {
+                // Stop all tracks
+                stream.getTracks().forEach(track => track.stop());
+                
+                if (streamId) {
+                    try {
+                        await uploadChain;
+                        const text = await finishLiveTranscription(streamId);
+                        elements.textInput.value = '';
+                        if (!text) {
+                            showError('Không nhận diện được giọng nói');
+                            return;
+                        }
+                        const formData = new FormData();
+                        formData.append('text', text);
+                        sendMessage(formData);
+                        return;
+                    } catch (error) {
+                        console.error('Live transcription error:', error);
+                        elements.textInput.value = '';
+                    }
+                }
+                
+                const audioBlob = new Blob(audioChunks, { type: mediaRecorder.mimeType || 'audio/webm' });
+                const audioFile = new File([audioBlob], "recording.webm", { type: audioBlob.type });
                 
                 const formData = new FormData();
                 formData.append('audioFile', audioFile);
                 sendMessage(formData);
-                
-                // Stop all tracks
-                stream.getTracks().forEach(track => track.stop());
             };
             
-            mediaRecorder.start();
+            // Chia bản ghi thành chunk mỗi giây để phiên mã trong lúc đang nói
+            mediaRecorder.start(1000);
             isRecording = true;
             elements.micButton.classList.add('recording');
             elements.micButton.innerHTML = '<i class="fas fa-stop"></i>';
@@ -407,14 +573,54 @@ async function handleVoiceInput() {
     }
 }
 
-// ==================== UI HELPERS ====================
-function addMessageToChatLog(role, content, isMarkdown = false) {
-    // Remove welcome screen if exists
-    const welcomeScreen = elements.chatLog.querySelector('.welcome-screen');
-    if (welcomeScreen) {
-        welcomeScreen.remove();
+async function startLiveTranscription() {
+    try {
+        const response = await fetch(`${API_URL}/api/transcribe/stream`, {
+            method: 'POST',
+            credentials: 'include'
+        });
+        if (!response.ok) return null;
+        const data = await response.json();
+        return data.stream_id;
+    } catch (error) {
+        console.error('Error starting live transcription:', error);
+        return null;
+    }
+}
+
+async function sendAudioChunk(streamId, chunk) {
+    const response = await fetch(`${API_URL}/api/transcribe/stream/${streamId}`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/octet-stream' },
+        credentials: 'include',
+        body: chunk
+    });
+    if (!response.ok) {
+        const errData = await response.json();
+        throw new Error(errData.error || 'Lỗi xử lý âm thanh');
     }
     
+    // Hiển thị transcript tạm thời trong ô nhập
+    const data = await response.json();
+    if (data.partial) {
+        elements.textInput.value = data.partial;
+    }
+}
+
+async function finishLiveTranscription(streamId) {
+    const response = await fetch(`${API_URL}/api/transcribe/stream/${streamId}/finish`, {
+        method: 'POST',
+        credentials: 'include'
+    });
+    const data = await response.json();
+    if (!response.ok) {
+        throw new Error(data.error || 'Lỗi xử lý âm thanh');
+    }
+    return data.text;
+}
+
+// ==================== UI HELPERS ====================
+function createMessageElement(role, content, isMarkdown = false) {
     const messageDiv = document.createElement('div');
     messageDiv.classList.add('message', `${role}-message`);
     
@@ -445,10 +651,23 @@ function addMessageToChatLog(role, content, isMarkdown = false) {
     
     messageDiv.appendChild(avatar);
     messageDiv.appendChild(contentDiv);
+    return messageDiv;
+}
+
+function addMessageToChatLog(role, content, isMarkdown = false) {
+    // Remove welcome screen if exists
+    const welcomeScreen = elements.chatLog.querySelector('.welcome-screen');
+    if (welcomeScreen) {
+        welcomeScreen.remove();
+    }
+    
+    const messageDiv = createMessageElement(role, content, isMarkdown);
     elements.chatLog.appendChild(messageDiv);
     
     // Scroll to bottom
     elements.chatLog.scrollTop = elements.chatLog.scrollHeight;
+    
+    return messageDiv.querySelector('.message-content');
 }
 
 function showTypingIndicator(show) {
@@ -515,6 +734,22 @@ function setupEventListeners() {
     elements.newChatBtn.addEventListener('click', createNewConversation);
     elements.logoutBtn.addEventListener('click', logout);
     
+    // Click vào conversation (kể cả các trang được tải thêm sau)
+    elements.conversationsList.addEventListener('click', (e) => {
+        const item = e.target.closest('.conversation-item');
+        if (item && !e.target.closest('.conversation-actions')) {
+            loadConversation(parseInt(item.dataset.id));
+        }
+    });
+    
+    // Tải thêm conversations khi cuộn gần cuối sidebar
+    elements.conversationsList.addEventListener('scroll', () => {
+        const list = elements.conversationsList;
+        if (list.scrollHeight - list.scrollTop - list.clientHeight < 200) {
+            loadOlderConversations();
+        }
+    });
+    
     // Chat input
     elements.sendButton.addEventListener('click', handleSendMessage);
     elements.micButton.addEventListener('click', handleVoiceInput);
@@ -526,6 +761,13 @@ function setupEventListeners() {
         }
     });
     
+    // Tải tin nhắn cũ hơn khi cuộn gần đầu khung chat
+    elements.chatLog.addEventListener('scroll', () => {
+        if (elements.chatLog.scrollTop < 200) {
+            loadOlderMessages();
+        }
+    });
+    
     // Auto-resize textarea
     elements.textInput.addEventListener('input', () => {
         elements.textInput.style.height = 'auto';